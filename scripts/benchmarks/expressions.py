@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Measures the time and the memory allocated to run the entity and storage
+processing stages (every logical and physical query processor, the
+translation mappers and the storage selection) on representative errors,
+transactions and metrics queries. The plan cache is disabled, so each query
+goes through the whole processor chain.
+
+    SNUBA_SETTINGS=test python -m scripts.benchmarks.expressions --queries 500
+"""
+
+import time
+import tracemalloc
+import uuid
+from typing import Sequence, Tuple
+
+import click
+
+from snuba import state
+from snuba.attribution import get_app_id
+from snuba.attribution.attribution_info import AttributionInfo
+from snuba.datasets.factory import get_dataset
+from snuba.pipeline.query_pipeline import QueryPipelineResult
+from snuba.pipeline.stages.query_processing import (
+    EntityProcessingStage,
+    StorageProcessingStage,
+)
+from snuba.query.query_settings import HTTPQuerySettings
+from snuba.query.snql.parser import parse_snql_query
+from snuba.request import Request
+from snuba.utils.metrics.timer import Timer
+
+QUERIES = [
+    (
+        "errors",
+        "events",
+        "MATCH (events) SELECT count() AS `count`, uniq(user) AS `users`, "
+        "max(timestamp) AS `last_seen` BY group_id WHERE project_id IN "
+        "tuple(1, 2) AND group_id IN tuple(10, 11, 12) AND timestamp >= "
+        "toDateTime('2024-01-01T00:00:00') AND timestamp < "
+        "toDateTime('2024-01-02T00:00:00') AND tags[sentry:release] = '1.0' "
+        "AND environment IN tuple('prod', 'staging') ORDER BY count DESC "
+        "LIMIT 100",
+    ),
+    (
+        "transactions",
+        "transactions",
+        "MATCH (transactions) SELECT divide(countIf(equals(transaction_status, "
+        "0)), count()) AS `success_rate`, quantile(0.95)(duration) AS `p95`, "
+        "tags[http.method] BY transaction WHERE project_id = 1 AND finish_ts "
+        ">= toDateTime('2024-01-01T00:00:00') AND finish_ts < "
+        "toDateTime('2024-01-02T00:00:00') AND transaction_op = 'http.server' "
+        "ORDER BY p95 DESC LIMIT 50",
+    ),
+    (
+        "metrics",
+        "generic_metrics",
+        "MATCH (generic_metrics_distributions) SELECT "
+        "quantiles(0.5, 0.9, 0.95, 0.99)(value) AS `quants`, avg(value) AS "
+        "`avg` BY project_id, org_id, tags_raw[9223372036854776010] WHERE "
+        "org_id = 1 AND project_id = 1 AND metric_id = 1000 AND timestamp >= "
+        "toDateTime('2024-01-01T00:00:00') AND timestamp < "
+        "toDateTime('2024-01-02T00:00:00') AND tags_raw[9223372036854776010] "
+        "= 'production' GRANULARITY 60",
+    ),
+]
+
+
+def build_request(dataset: str, body: str) -> Request:
+    query_settings = HTTPQuerySettings(referrer="benchmark")
+    return Request(
+        id=uuid.uuid4().hex,
+        original_body={"query": body},
+        query=parse_snql_query(body, get_dataset(dataset)),
+        query_settings=query_settings,
+        attribution_info=AttributionInfo(
+            app_id=get_app_id("default"),
+            tenant_ids={"referrer": "benchmark", "organization_id": 1},
+            referrer="benchmark",
+            team=None,
+            feature=None,
+            parent_api=None,
+        ),
+    )
+
+
+def process(request: Request) -> None:
+    result = StorageProcessingStage().execute(
+        EntityProcessingStage().execute(
+            QueryPipelineResult(
+                data=request,
+                query_settings=request.query_settings,
+                timer=Timer("benchmark"),
+                error=None,
+            )
+        )
+    )
+    if result.error is not None:
+        raise result.error
+
+
+def measure(
+    dataset: str, body: str, queries: int
+) -> Tuple[Sequence[float], Sequence[int]]:
+    # Queries are processed in place, each run needs its own request. The
+    # time and the allocations are measured separately as tracing
+    # allocations slows everything down.
+    timings = []
+    for request in [build_request(dataset, body) for _ in range(queries)]:
+        start = time.perf_counter()
+        process(request)
+        timings.append(time.perf_counter() - start)
+
+    peaks = []
+    tracemalloc.start()
+    for request in [build_request(dataset, body) for _ in range(queries)]:
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        process(request)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    return sorted(timings), sorted(peaks)
+
+
+@click.command()
+@click.option("--queries", type=int, default=500, help="Queries per kind.")
+def main(queries: int) -> None:
+    state.set_config("plan_cache_enabled", 0)
+    click.echo(
+        f"{'query':<14}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak KiB':>10}"
+    )
+    for name, dataset, body in QUERIES:
+        # Warms up the lazily built entities, storages and configs.
+        process(build_request(dataset, body))
+        timings, peaks = measure(dataset, body, queries)
+        mean = sum(timings) / len(timings)
+        p50 = timings[len(timings) // 2]
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        peak = peaks[len(peaks) // 2]
+        click.echo(
+            f"{name:<14}{mean * 1000:>10.3f}{p50 * 1000:>10.3f}"
+            f"{p99 * 1000:>10.3f}{peak / 1024:>10.1f}"
+        )
+    state.set_config("plan_cache_enabled", 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Compares the JSONEachRow and RowBinary encodings of the rows inserted by the
+consumers: rows encoded per second and bytes sent to ClickHouse. The rows are
+generated from the writable schema of a storage configuration.
+
+    SNUBA_SETTINGS=test python -m scripts.benchmarks.insert_encoding \
+        --storage snuba/datasets/configuration/events/storages/errors.yaml
+"""
+
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, List, Mapping, MutableMapping, Sequence
+
+import click
+
+from snuba.clickhouse.columns import (
+    UUID,
+    Array,
+    ColumnSet,
+    ColumnType,
+    Date,
+    DateTime,
+    DateTime64,
+    Enum,
+    FixedString,
+    FlattenedColumn,
+    Float,
+    Int,
+    IPv4,
+    IPv6,
+    Map,
+    Nullable,
+    ReadOnly,
+    SimpleAggregateFunction,
+    String,
+    UInt,
+)
+from snuba.clickhouse.http import JSONRowEncoder
+from snuba.clickhouse.row_binary import RowBinaryEncoder
+from snuba.datasets.configuration.json_schema import STORAGE_VALIDATORS
+from snuba.datasets.configuration.loader import load_configuration_data
+from snuba.datasets.configuration.utils import parse_columns
+from snuba.utils.codecs import Encoder
+from snuba.writer import WriterTableRow
+
+WORDS = ["error", "transaction", "release", "production", "python", "javascript"]
+
+
+def generate_value(column_type: ColumnType[Any], length: int) -> Any:
+    if column_type.has_modifier(Nullable) and random.random() < 0.3:
+        return None
+    if isinstance(column_type, String):
+        return " ".join(random.choices(WORDS, k=random.randint(1, 4)))
+    if isinstance(column_type, (UInt, Int)):
+        return random.randint(0, 2 ** min(column_type.size - 1, 31))
+    if isinstance(column_type, Float):
+        return random.random() * 1000
+    if isinstance(column_type, FixedString):
+        return "x" * column_type.length
+    if isinstance(column_type, UUID):
+        return uuid.uuid4().hex
+    if isinstance(column_type, IPv4):
+        return f"10.0.{random.randint(0, 255)}.{random.randint(0, 255)}"
+    if isinstance(column_type, IPv6):
+        return f"2001:db8::{random.randint(0, 65535):x}"
+    if isinstance(column_type, (Date, DateTime, DateTime64)):
+        return datetime(2024, 1, 1) + timedelta(seconds=random.randint(0, 10**6))
+    if isinstance(column_type, Enum):
+        return random.choice(column_type.values)[0]
+    if isinstance(column_type, Array):
+        return [generate_value(column_type.inner_type, 0) for _ in range(length)]
+    if isinstance(column_type, Map):
+        return {
+            generate_value(column_type.key, 0): generate_value(column_type.value, 0)
+            for _ in range(length)
+        }
+    if isinstance(column_type, SimpleAggregateFunction):
+        return generate_value(column_type.arg_types[0], length)
+    raise TypeError("unsupported column type", column_type.for_schema())
+
+
+def generate_rows(
+    columns: Sequence[FlattenedColumn], count: int
+) -> Sequence[WriterTableRow]:
+    rows = []
+    for _ in range(count):
+        # The arrays of a nested column have the same length.
+        lengths: MutableMapping[str, int] = {}
+        row = {}
+        for column in columns:
+            length = lengths.setdefault(
+                column.base_name or column.flattened, random.randint(0, 10)
+            )
+            row[column.flattened] = generate_value(column.type, length)
+        rows.append(row)
+    return rows
+
+
+def measure(
+    encoder: Encoder[bytes, WriterTableRow], rows: Sequence[WriterTableRow]
+) -> Mapping[str, float]:
+    start = time.perf_counter()
+    encoded: List[bytes] = [encoder.encode(row) for row in rows]
+    duration = time.perf_counter() - start
+    size = sum(len(row) for row in encoded)
+    return {
+        "rows_per_sec": len(rows) / duration,
+        "bytes": size,
+        "bytes_per_row": size / len(rows),
+    }
+
+
+@click.command()
+@click.option(
+    "--storage",
+    default="snuba/datasets/configuration/events/storages/errors.yaml",
+    help="Path of the configuration of a writable storage.",
+)
+@click.option("--rows", type=int, default=20000)
+def main(storage: str, rows: int) -> None:
+    config = load_configuration_data(storage, STORAGE_VALIDATORS)
+    columns = [
+        column
+        for column in ColumnSet(parse_columns(config["schema"]["columns"]))
+        if not column.type.has_modifier(ReadOnly)
+    ]
+    data = generate_rows(columns, rows)
+
+    encoders: Mapping[str, Callable[[], Encoder[bytes, WriterTableRow]]] = {
+        "JSONEachRow": JSONRowEncoder,
+        "RowBinary": lambda: RowBinaryEncoder(columns),
+    }
+    click.echo(f"{len(columns)} columns, {rows} rows")
+    click.echo(f"{'format':<14}{'rows/s':>12}{'bytes':>14}{'bytes/row':>12}")
+    for name, build in encoders.items():
+        result = measure(build(), data)
+        click.echo(
+            f"{name:<14}{result['rows_per_sec']:>12.0f}"
+            f"{result['bytes']:>14.0f}{result['bytes_per_row']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Measures the time spent per counter and gauge call by the Datadog backend,
+which sends a DogStatsd packet on every call, compared to the aggregating
+backend in front of it. Timings are not aggregated, so they are not
+measured. The packets are sent over UDP to a port nothing has to listen
+on. The time spent flushing the aggregated metrics is reported separately,
+it is spent on the background thread.
+
+    SNUBA_SETTINGS=test python -m scripts.benchmarks.metrics --calls 100000
+"""
+
+import time
+from functools import partial
+from typing import Callable, Sequence
+
+import click
+from datadog import DogStatsd
+
+from snuba.utils.metrics.backends.abstract import MetricsBackend
+from snuba.utils.metrics.backends.aggregating import AggregatingMetricsBackend
+from snuba.utils.metrics.backends.datadog import DatadogMetricsBackend
+
+TAGS = [
+    {"referrer": f"referrer_{i}", "dataset": "events", "status": "success"}
+    for i in range(10)
+]
+
+# Calls are timed in chunks, timing each of them would cost as much as the
+# call.
+CHUNK = 100
+
+
+def calls(backend: MetricsBackend) -> Sequence[Callable[[int], None]]:
+    return [
+        lambda i: backend.increment("benchmark.count", tags=TAGS[i % len(TAGS)]),
+        lambda i: backend.gauge("benchmark.size", i, tags=TAGS[i % len(TAGS)]),
+        lambda i: backend.increment("benchmark.bytes", i, tags=TAGS[i % 10]),
+    ]
+
+
+def measure(backend: MetricsBackend, count: int) -> Sequence[float]:
+    timings = []
+    functions = calls(backend)
+    for start in range(0, count, CHUNK):
+        begin = time.perf_counter()
+        for i in range(start, start + CHUNK):
+            functions[i % len(functions)](i)
+        timings.append((time.perf_counter() - begin) / CHUNK)
+    return sorted(timings)
+
+
+@click.command()
+@click.option("--calls", "count", type=int, default=100000, help="Metric calls.")
+@click.option("--port", type=int, default=8125, help="DogStatsd UDP port.")
+def main(count: int, port: int) -> None:
+    datadog = DatadogMetricsBackend(
+        partial(DogStatsd, host="127.0.0.1", port=port, namespace="benchmark")
+    )
+    # The interval is long enough for the flusher to stay out of the way,
+    # the flush is measured on its own.
+    aggregating = AggregatingMetricsBackend(datadog, flush_interval_sec=3600)
+
+    click.echo(f"{'backend':<14}{'mean us':>10}{'p50 us':>10}{'p99 us':>10}")
+    for name, backend in (("datadog", datadog), ("aggregating", aggregating)):
+        timings = measure(backend, count)
+        mean = sum(timings) / len(timings)
+        p50 = timings[len(timings) // 2]
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        click.echo(
+            f"{name:<14}{mean * 10**6:>10.3f}{p50 * 10**6:>10.3f}{p99 * 10**6:>10.3f}"
+        )
+
+    start = time.perf_counter()
+    aggregating.flush()
+    duration = time.perf_counter() - start
+    click.echo(f"flush of the aggregated metrics: {duration * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Measures the time spent parsing SnQL and MQL bodies with and without the
+parse cache, over a corpus of query shapes modelled after the queries Sentry
+sends (issue search, discover, alerts, metrics). Every query gets random
+literals, so queries only share their shape.
+
+    SNUBA_SETTINGS=test python -m scripts.benchmarks.parse_cache --queries 5000
+"""
+
+import random
+import time
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Callable, Sequence, Tuple
+
+import click
+
+from snuba import state
+from snuba.datasets.factory import get_dataset
+from snuba.query.mql.parser import mql_parse_cache, parse_mql_query_body
+from snuba.query.snql.parser import parse_snql_query_initial, snql_parse_cache
+
+SNQL_SHAPES = [
+    "MATCH (events) SELECT count() AS `count`, uniq(user) AS `users` "
+    "BY group_id WHERE project_id IN tuple({p}, {p}) AND group_id IN "
+    "tuple({n}, {n}, {n}) AND timestamp >= toDateTime('{t}') AND "
+    "timestamp < toDateTime('{t}') ORDER BY count DESC LIMIT 100",
+    "MATCH (events) SELECT max(timestamp) AS `last_seen`, min(timestamp) AS "
+    "`first_seen` BY group_id WHERE project_id = {p} AND environment IN "
+    "tuple('{s}', '{s}') AND timestamp >= toDateTime('{t}') AND timestamp < "
+    "toDateTime('{t}') AND tags[sentry:release] = '{s}' LIMIT 1000",
+    "MATCH (discover) SELECT transaction, count() AS `count`, "
+    "quantile(0.95)(duration) AS `p95` BY transaction WHERE project_id IN "
+    "tuple({p}) AND type = 'transaction' AND timestamp >= toDateTime('{t}') "
+    "AND timestamp < toDateTime('{t}') AND transaction LIKE '%{s}%' "
+    "ORDER BY count DESC LIMIT 50 OFFSET 0",
+    "MATCH (transactions) SELECT divide(countIf(equals(transaction_status, "
+    "0)), count()) AS `success_rate`, avg(duration) AS `avg` BY "
+    "toStartOfInterval(finish_ts, toIntervalSecond(3600), 'Universal') AS "
+    "`time` WHERE project_id = {p} AND finish_ts >= toDateTime('{t}') AND "
+    "finish_ts < toDateTime('{t}') AND http_method = '{s}' LIMIT 10000",
+    "MATCH (events) SELECT count() AS `count` WHERE project_id = {p} AND "
+    "timestamp >= toDateTime('{t}') AND timestamp < toDateTime('{t}') AND "
+    "(platform = '{s}' OR tags[level] = '{s}') AND group_id = {n}",
+]
+
+MQL_SHAPES = [
+    'sum(`d:transactions/duration@millisecond`){{status_code:"{s}"}} by transaction',
+    'avg(`d:transactions/duration@millisecond`){{transaction:["{s}", '
+    '"{s}"], environment:"{s}"}}',
+    'count(`c:transactions/count_per_root_project@none`){{release:"{s}"}} '
+    "/ count(`c:transactions/count_per_root_project@none`)",
+]
+
+
+def literals(shape: str) -> str:
+    def replace(marker: str, value: Callable[[], str], text: str) -> str:
+        while marker in text:
+            text = text.replace(marker, value(), 1)
+        return text
+
+    start = datetime(2024, 1, 1)
+    text = replace("{p}", lambda: str(random.randint(1, 10**6)), shape)
+    text = replace("{n}", lambda: str(random.randint(1, 10**9)), text)
+    text = replace(
+        "{t}",
+        lambda: (start + timedelta(seconds=random.randint(0, 10**7))).isoformat(),
+        text,
+    )
+    text = replace("{s}", lambda: f"value-{random.randint(1, 10**6)}", text)
+    return text.replace("{{", "{").replace("}}", "}")
+
+
+def measure(parse: Callable[[str], object], bodies: Sequence[str]) -> Sequence[float]:
+    timings = []
+    for body in bodies:
+        start = time.perf_counter()
+        parse(body)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)
+
+
+@click.command()
+@click.option("--queries", type=int, default=5000, help="Queries per language.")
+def main(queries: int) -> None:
+    dataset = get_dataset("generic_metrics")
+    languages: Sequence[Tuple[str, Sequence[str], Callable[[str], object]]] = [
+        ("snql", SNQL_SHAPES, parse_snql_query_initial),
+        (
+            "mql",
+            MQL_SHAPES,
+            lambda body: mql_parse_cache.parse(
+                body,
+                partial(parse_mql_query_body, dataset=dataset),
+                "generic_metrics",
+            ),
+        ),
+    ]
+    snql_parse_cache.clear()
+    mql_parse_cache.clear()
+
+    click.echo(
+        f"{'language':<10}{'cache':<8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}"
+    )
+    for language, shapes, parse in languages:
+        bodies = [literals(random.choice(shapes)) for _ in range(queries)]
+        for enabled in (0, 1):
+            state.set_config("parse_cache_enabled", enabled)
+            timings = measure(parse, bodies)
+            mean = sum(timings) / len(timings)
+            p50 = timings[len(timings) // 2]
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            click.echo(
+                f"{language:<10}{'on' if enabled else 'off':<8}{mean * 1000:>10.3f}"
+                f"{p50 * 1000:>10.3f}{p99 * 1000:>10.3f}"
+            )
+    state.set_config("parse_cache_enabled", 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Measures the Redis time spent per query by the rate limiter when every rate
+limit is checked with its own round trips compared to the batched checks of
+``RateLimitAggregator``. Requires the rate limiter Redis to be reachable.
+
+    SNUBA_SETTINGS=test python -m scripts.benchmarks.rate_limit --limits 4
+"""
+
+import time
+import uuid
+from contextlib import ExitStack
+from typing import Callable, Sequence
+
+import click
+
+from snuba import state
+from snuba.state.rate_limit import RateLimitAggregator, RateLimitParameters, rate_limit
+
+
+def per_limit(params: Sequence[RateLimitParameters]) -> None:
+    # How RateLimitAggregator used to check the limits: one rate_limit
+    # context (one round trip to start, one to finish) per limit.
+    with ExitStack() as stack:
+        for p in params:
+            stack.enter_context(rate_limit(p))
+
+
+def batched(params: Sequence[RateLimitParameters]) -> None:
+    with RateLimitAggregator(params):
+        pass
+
+
+def measure(
+    function: Callable[[Sequence[RateLimitParameters]], None],
+    params: Sequence[RateLimitParameters],
+    queries: int,
+) -> Sequence[float]:
+    timings = []
+    for _ in range(queries):
+        start = time.perf_counter()
+        function(params)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)
+
+
+@click.command()
+@click.option("--limits", type=int, default=4, help="Rate limits per query.")
+@click.option("--queries", type=int, default=2000)
+@click.option("--shard-factor", type=int, default=1)
+def main(limits: int, queries: int, shard_factor: int) -> None:
+    state.set_config("rate_limit_shard_factor", shard_factor)
+    prefix = uuid.uuid4().hex
+    params = [
+        RateLimitParameters(f"limit-{i}", f"{prefix}-{i}", 10**6, 10**6)
+        for i in range(limits)
+    ]
+
+    click.echo(f"{'mode':<12}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, function in (("per-limit", per_limit), ("batched", batched)):
+        timings = measure(function, params, queries)
+        mean = sum(timings) / len(timings)
+        p50 = timings[len(timings) // 2]
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        click.echo(
+            f"{name:<12}{mean * 1000:>10.3f}{p50 * 1000:>10.3f}{p99 * 1000:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
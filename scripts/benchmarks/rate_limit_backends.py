@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Measures the latency of the rate limit checks and the CPU time they cost to
+Redis with the sorted set backend and with the counter backend, under the
+load of several threads checking the same rate limits. The CPU time is read
+from the INFO command of the rate limiter Redis, which should not be serving
+anything else meanwhile: ``redis cpu`` is the CPU time of the whole server
+and ``commands`` the time spent running the commands sent by the backend,
+which leaves out the reads of the runtime config.
+
+    SNUBA_SETTINGS=test python -m scripts.benchmarks.rate_limit_backends --threads 8
+"""
+
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Sequence, Tuple
+
+import click
+
+from snuba import state
+from snuba.redis import RedisClientKey, get_redis_client
+from snuba.state.rate_limit import (
+    COUNTER_BACKEND,
+    RATE_LIMIT_BACKEND_KEY_PREFIX,
+    ZSET_BACKEND,
+    RateLimitAggregator,
+    RateLimitParameters,
+)
+
+# The commands sent by each backend. Redis also counts the commands run by a
+# script (or by EXEC) on their own, they are not added again.
+BACKEND_COMMANDS = {
+    ZSET_BACKEND: ["zremrangebyscore", "zadd", "expire", "zcount", "zincrby", "zrem"],
+    COUNTER_BACKEND: ["evalsha"],
+}
+
+
+def redis_cpu(backend: str) -> Tuple[float, float]:
+    """
+    Returns the CPU time used by Redis and the time it spent running the
+    commands of the backend, in seconds.
+    """
+    rds = get_redis_client(RedisClientKey.RATE_LIMITER)
+    cpu = rds.info("cpu")
+    commands = rds.info("commandstats")
+    return (
+        float(cpu["used_cpu_sys"]) + float(cpu["used_cpu_user"]),
+        sum(
+            commands.get(f"cmdstat_{command}", {}).get("usec", 0)
+            for command in BACKEND_COMMANDS[backend]
+        )
+        / 10**6,
+    )
+
+
+def run(params: Sequence[RateLimitParameters], queries: int) -> Sequence[float]:
+    timings = []
+    for _ in range(queries):
+        start = time.perf_counter()
+        with RateLimitAggregator(params):
+            pass
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def measure(
+    backend: str, params: Sequence[RateLimitParameters], threads: int, queries: int
+) -> Tuple[Sequence[float], float, float, float]:
+    for p in params:
+        state.set_config(f"{RATE_LIMIT_BACKEND_KEY_PREFIX}{p.rate_limit_name}", backend)
+
+    cpu, commands = redis_cpu(backend)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(lambda _: run(params, queries), range(threads)))
+    duration = time.perf_counter() - start
+    end_cpu, end_commands = redis_cpu(backend)
+    return (
+        sorted(t for timings in results for t in timings),
+        end_cpu - cpu,
+        end_commands - commands,
+        duration,
+    )
+
+
+@click.command()
+@click.option("--limits", type=int, default=4, help="Rate limits per query.")
+@click.option("--threads", type=int, default=8, help="Threads sending queries.")
+@click.option("--queries", type=int, default=2000, help="Queries per thread.")
+@click.option("--shard-factor", type=int, default=1)
+def main(limits: int, threads: int, queries: int, shard_factor: int) -> None:
+    state.set_config("rate_limit_shard_factor", shard_factor)
+    prefix = uuid.uuid4().hex
+    params = [
+        RateLimitParameters(f"{prefix}-{i}", f"{prefix}-{i}", 10**6, 10**6)
+        for i in range(limits)
+    ]
+
+    click.echo(
+        f"{'backend':<10}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}"
+        f"{'queries/s':>12}{'redis cpu us':>14}{'commands us':>14}"
+    )
+    for backend in (ZSET_BACKEND, COUNTER_BACKEND):
+        timings, cpu, commands, duration = measure(backend, params, threads, queries)
+        mean = sum(timings) / len(timings)
+        p50 = timings[len(timings) // 2]
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        click.echo(
+            f"{backend:<10}{mean * 1000:>10.3f}{p50 * 1000:>10.3f}{p99 * 1000:>10.3f}"
+            f"{len(timings) / duration:>12.0f}"
+            f"{cpu / len(timings) * 10**6:>14.1f}"
+            f"{commands / len(timings) * 10**6:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Compares the legacy JSON encoding of cached query results with the columnar
+encoding of ``snuba.web.result_cache_codec``.
+
+    SNUBA_SETTINGS=test python -m scripts.benchmarks.result_cache_codec --rows 10000
+"""
+
+import random
+import timeit
+import uuid
+from typing import Callable, Optional
+
+import click
+
+from snuba.reader import Result
+from snuba.web import result_cache_codec
+from snuba.web.db_query import ResultCacheCodec
+
+
+def build_result(rows: int) -> Result:
+    return {
+        "meta": [
+            {"name": "event_id", "type": "String"},
+            {"name": "project_id", "type": "UInt64"},
+            {"name": "timestamp", "type": "DateTime"},
+            {"name": "count", "type": "UInt64"},
+            {"name": "p95", "type": "Float64"},
+            {"name": "transaction", "type": "String"},
+        ],
+        "data": [
+            {
+                "event_id": uuid.uuid4().hex,
+                "project_id": random.randint(1, 1000),
+                "timestamp": "2024-01-01T00:00:00+00:00",
+                "count": random.randint(1, 10**6),
+                "p95": random.random() * 1000,
+                "transaction": f"/api/{random.randint(1, 200)}/",
+            }
+            for _ in range(rows)
+        ],
+    }
+
+
+def measure(function: Callable[[], object], iterations: int) -> float:
+    return min(timeit.repeat(function, number=iterations, repeat=3)) / iterations
+
+
+@click.command()
+@click.option("--rows", type=int, default=10000)
+@click.option("--iterations", type=int, default=20)
+@click.option("--compression-threshold", type=int, default=16 * 1024)
+def main(rows: int, iterations: int, compression_threshold: int) -> None:
+    result = build_result(rows)
+    legacy_codec = ResultCacheCodec()
+
+    legacy = legacy_codec.encode(result)
+    encoders: dict[str, Callable[[], Optional[bytes]]] = {
+        "json": lambda: legacy_codec.encode(result),
+        "columnar": lambda: result_cache_codec.encode(result),
+        "columnar+zstd": lambda: result_cache_codec.encode(
+            result, compression_threshold
+        ),
+    }
+
+    click.echo(f"{'codec':<16}{'bytes':>12}{'encode ms':>12}{'decode ms':>12}")
+    for name, encoder in encoders.items():
+        encoded = encoder()
+        assert encoded is not None
+        assert legacy_codec.decode(encoded) == legacy_codec.decode(legacy)
+        encode_time = measure(encoder, iterations)
+        decode_time = measure(lambda: legacy_codec.decode(encoded), iterations)
+        click.echo(
+            f"{name:<16}{len(encoded):>12}"
+            f"{encode_time * 1000:>12.2f}{decode_time * 1000:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Measures the time the subscription scheduler spends per tick to find the
+subscriptions due when it goes through every subscription compared to the
+time wheel index of ``SubscriptionScheduler``. Ticks are one second long, as
+they are for the scheduler consumers.
+
+    SNUBA_SETTINGS=test python -m scripts.benchmarks.subscription_scheduler \
+        --subscriptions 1000000
+"""
+
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, MutableMapping, Sequence, Tuple
+from uuid import UUID
+
+import click
+
+from snuba import state
+from snuba.datasets.entities.entity_key import EntityKey
+from snuba.datasets.entities.factory import get_entity
+from snuba.subscriptions.data import (
+    PartitionId,
+    Subscription,
+    SubscriptionData,
+    SubscriptionIdentifier,
+    SubscriptionWithMetadata,
+)
+from snuba.subscriptions.scheduler import JitteredTaskBuilder, SubscriptionScheduler
+from snuba.subscriptions.store import SubscriptionDataStore
+from snuba.subscriptions.types import Interval
+from snuba.subscriptions.utils import Tick
+from snuba.utils.metrics.backends.dummy import DummyMetricsBackend
+
+RESOLUTIONS = [60, 60, 60, 300, 600, 900, 3600]
+
+
+class InMemorySubscriptionDataStore(SubscriptionDataStore):
+    def __init__(self) -> None:
+        self.__data: MutableMapping[UUID, SubscriptionData] = {}
+
+    def create(self, key: UUID, data: SubscriptionData) -> None:
+        self.__data[key] = data
+
+    def delete(self, key: UUID) -> None:
+        self.__data.pop(key, None)
+
+    def all(self) -> Iterable[Tuple[UUID, SubscriptionData]]:
+        return list(self.__data.items())
+
+
+def build_store(count: int) -> InMemorySubscriptionDataStore:
+    entity = get_entity(EntityKey.EVENTS)
+    store = InMemorySubscriptionDataStore()
+    for _ in range(count):
+        store.create(
+            uuid.uuid4(),
+            SubscriptionData(
+                project_id=1,
+                query="MATCH (events) SELECT count() AS count",
+                time_window_sec=60,
+                resolution_sec=random.choice(RESOLUTIONS),
+                entity=entity,
+                metadata={},
+            ),
+        )
+    return store
+
+
+def full_scan(store: InMemorySubscriptionDataStore) -> Callable[[int], int]:
+    # How the scheduler used to find the tasks: every subscription is given
+    # to the task builder at every timestamp of the tick.
+    builder = JitteredTaskBuilder()
+    subscriptions = [
+        Subscription(SubscriptionIdentifier(PartitionId(0), key), data)
+        for key, data in store.all()
+    ]
+
+    def find(timestamp: int) -> int:
+        found = 0
+        for subscription in subscriptions:
+            task = builder.get_task(
+                SubscriptionWithMetadata(EntityKey.EVENTS, subscription, 0),
+                timestamp,
+            )
+            if task is not None:
+                found += 1
+        builder.reset_metrics()
+        return found
+
+    return find
+
+
+def indexed(store: InMemorySubscriptionDataStore) -> Callable[[int], int]:
+    scheduler = SubscriptionScheduler(
+        EntityKey.EVENTS,
+        store,
+        PartitionId(0),
+        timedelta(hours=1),
+        DummyMetricsBackend(),
+    )
+
+    def find(timestamp: int) -> int:
+        tick = Tick(0, Interval(0, 1), Interval(timestamp, timestamp + 1))
+        return sum(1 for _ in scheduler.find(tick))
+
+    # The first call loads the subscriptions and builds the index.
+    start = time.perf_counter()
+    find(0)
+    click.echo(f"index built in {time.perf_counter() - start:.2f}s")
+    return find
+
+
+def measure(find: Callable[[int], int], start: int, ticks: int) -> Sequence[float]:
+    timings = []
+    found = 0
+    for timestamp in range(start, start + ticks):
+        begin = time.perf_counter()
+        found += find(timestamp)
+        timings.append(time.perf_counter() - begin)
+    click.echo(f"  {found} tasks over {ticks} ticks")
+    return sorted(timings)
+
+
+@click.command()
+@click.option("--subscriptions", type=int, default=1_000_000)
+@click.option("--ticks", type=int, default=60, help="Ticks of the indexed run.")
+@click.option("--scan-ticks", type=int, default=5, help="Ticks of the full scan run.")
+def main(subscriptions: int, ticks: int, scan_ticks: int) -> None:
+    state.set_config("subscription_primary_task_builder", "jittered")
+    store = build_store(subscriptions)
+    start = int(datetime.now().timestamp())
+
+    strategies: Sequence[Tuple[str, Callable[[], Callable[[int], int]], int]] = [
+        ("full scan", lambda: full_scan(store), scan_ticks),
+        ("time wheel", lambda: indexed(store), ticks),
+    ]
+    click.echo(f"{subscriptions} subscriptions")
+    for name, build, count in strategies:
+        click.echo(name)
+        timings = measure(build(), start, count)
+        click.echo(
+            f"  p50 {timings[len(timings) // 2] * 1000:.2f}ms"
+            f"  max {timings[-1] * 1000:.2f}ms per tick"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -706,7 +706,7 @@ def configs() -> Response:
     else:
         descriptions = state.get_all_config_descriptions()
 
-        raw_configs: Sequence[Tuple[str, Any]] = state.get_raw_configs().items()
+        raw_configs: Sequence[Tuple[str, Any]] = list(state.get_raw_configs().items())
 
         sorted_configs = sorted(raw_configs, key=lambda c: c[0])
 
@@ -6,7 +6,6 @@ import click
 import progressbar
 
 from snuba import environment, settings
-from snuba.clickhouse.http import JSONRowEncoder
 from snuba.datasets.storages.factory import get_cdc_storage, get_cdc_storage_keys
 from snuba.datasets.storages.storage_key import StorageKey
 from snuba.environment import setup_logging, setup_sentry
@@ -115,7 +114,7 @@ def bulk_load(
                 chunk_size=settings.BULK_CLICKHOUSE_BUFFER,
             ),
             settings.BULK_CLICKHOUSE_BUFFER,
-            JSONRowEncoder(),
+            table_writer.get_row_encoder(),
         )
         loader.load(
             buffer_writer, ignore_existing_data, progress_callback=progress_func
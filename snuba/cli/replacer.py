@@ -56,6 +56,21 @@ from snuba.utils.streams.metrics_adapter import StreamMetricsAdapter
     type=int,
     help="Minimum number of messages per topic+partition librdkafka tries to maintain in the local consumer queue.",
 )
+@click.option(
+    "--max-batch-size",
+    default=1,
+    type=int,
+    help=(
+        "Max number of messages to batch in memory. The compatible "
+        "replacements of a batch are merged and executed together."
+    ),
+)
+@click.option(
+    "--max-batch-time-ms",
+    default=settings.DEFAULT_MAX_BATCH_TIME_MS,
+    type=int,
+    help="Max duration to buffer messages in memory for.",
+)
 @click.option("--log-level", help="Logging level to use.")
 def replacer(
     *,
@@ -67,6 +82,8 @@ def replacer(
     no_strict_offset_reset: bool,
     queued_max_messages_kbytes: int,
     queued_min_messages: int,
+    max_batch_size: int,
+    max_batch_time_ms: int,
     log_level: Optional[str] = None,
 ) -> None:
 
@@ -113,6 +130,8 @@ def replacer(
         Topic(replacements_topic),
         ReplacerStrategyFactory(
             worker=ReplacerWorker(storage, consumer_group, metrics=metrics),
+            max_batch_size=max_batch_size,
+            max_batch_time_ms=max_batch_time_ms,
         ),
         ONCE_PER_SECOND,
     )
@@ -7,7 +7,7 @@ import structlog
 from arroyo import configure_metrics
 from arroyo.backends.kafka import KafkaProducer
 
-from snuba import environment, state
+from snuba import environment, querylog, settings
 from snuba.datasets.entities.entity_key import EntityKey
 from snuba.datasets.entities.factory import get_entity
 from snuba.datasets.factory import get_enabled_dataset_names
@@ -166,4 +166,4 @@ def flush_querylog() -> Iterator[None]:
     try:
         yield
     finally:
-        state.flush_producer()
+        querylog.flush(settings.QUERYLOG_SHUTDOWN_FLUSH_TIMEOUT_SEC)
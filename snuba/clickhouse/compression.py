@@ -0,0 +1,100 @@
+"""
+Streaming compression of the bodies of the inserts sent to ClickHouse.
+
+The body of an insert is streamed to ClickHouse while the batch is being
+written, so it is compressed chunk by chunk: each compressor keeps its state
+between chunks and only returns the bytes that are ready to be sent.
+ClickHouse decompresses the body according to the ``Content-Encoding``
+header of the request.
+
+``zstd`` and ``lz4`` require the ``zstandard`` and ``lz4`` packages, which
+are only imported when a storage is configured to use them.
+"""
+
+from __future__ import annotations
+
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Mapping
+
+
+class StreamCompressor(ABC):
+    """
+    Compresses a stream of chunks. ``compress`` may return an empty string
+    if the compressor buffers the chunk, ``flush`` returns the end of the
+    stream and has to be called exactly once.
+    """
+
+    content_encoding: str
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def flush(self) -> bytes:
+        raise NotImplementedError
+
+
+class GzipCompressor(StreamCompressor):
+    content_encoding = "gzip"
+
+    def __init__(self, level: int = 1) -> None:
+        # wbits=31 produces a gzip container rather than raw zlib.
+        self.__compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.__compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.__compressor.flush()
+
+
+class ZstdCompressor(StreamCompressor):
+    content_encoding = "zstd"
+
+    def __init__(self, level: int = 3) -> None:
+        import zstandard
+
+        self.__compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return bytes(self.__compressor.compress(data))
+
+    def flush(self) -> bytes:
+        return bytes(self.__compressor.flush())
+
+
+class Lz4Compressor(StreamCompressor):
+    content_encoding = "lz4"
+
+    def __init__(self) -> None:
+        import lz4.frame
+
+        self.__compressor: Any = lz4.frame.LZ4FrameCompressor()
+        self.__header: bytes = self.__compressor.begin()
+
+    def compress(self, data: bytes) -> bytes:
+        compressed = self.__compressor.compress(data)
+        if self.__header:
+            compressed, self.__header = self.__header + compressed, b""
+        return bytes(compressed)
+
+    def flush(self) -> bytes:
+        flushed = self.__header + self.__compressor.flush()
+        self.__header = b""
+        return bytes(flushed)
+
+
+COMPRESSORS: Mapping[str, Callable[[], StreamCompressor]] = {
+    "gzip": GzipCompressor,
+    "zstd": ZstdCompressor,
+    "lz4": Lz4Compressor,
+}
+
+
+def get_compressor(name: str) -> StreamCompressor:
+    try:
+        return COMPRESSORS[name]()
+    except KeyError:
+        raise ValueError(f"unknown insert compression: {name}")
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+from threading import Lock
+from typing import MutableMapping, Optional, Sequence, Tuple
+
+from snuba import environment, settings
+from snuba.utils.metrics.wrapper import MetricsWrapper
+
+metrics = MetricsWrapper(environment.metrics, "clickhouse.native")
+
+Host = Tuple[str, int]
+
+# Minimum weight of a host relative to the healthiest one.
+MIN_TRAFFIC_SHARE = 0.01
+
+
+@dataclass
+class _HostStats:
+    # None until the first successful request to the host.
+    latency: Optional[float]
+    error_rate: float
+
+
+class HostHealth:
+    """
+    Tracks the exponentially weighted moving average (EWMA) of the latency
+    and of the error rate of the ClickHouse hosts queried by this process.
+
+    It is used to pick the replica a query is routed to: every candidate
+    gets a weight inversely proportional to its latency, scaled down by its
+    error rate, and the host is drawn at random according to these weights.
+    Hosts that never answered successfully get the best latency seen so far,
+    so that they are tried instead of being starved.
+
+    The state is per process and shared by all the connection pools.
+    """
+
+    def __init__(
+        self,
+        alpha: float = settings.CLICKHOUSE_HOST_HEALTH_EWMA_ALPHA,
+        error_penalty: float = settings.CLICKHOUSE_HOST_HEALTH_ERROR_PENALTY,
+    ) -> None:
+        self.__alpha = alpha
+        self.__error_penalty = error_penalty
+        self.__hosts: MutableMapping[Host, _HostStats] = {}
+        self.__lock = Lock()
+
+    def record(self, host: Host, latency: Optional[float], error: bool) -> None:
+        """
+        Records the outcome of a request to a host. ``latency`` is in seconds
+        and is ignored for failed requests since the time it takes to fail
+        does not tell how fast the host is.
+        """
+        if error:
+            latency = None
+        with self.__lock:
+            stats = self.__hosts.get(host)
+            if stats is None:
+                stats = self.__hosts[host] = _HostStats(
+                    latency=latency,
+                    error_rate=1.0 if error else 0.0,
+                )
+            else:
+                stats.error_rate += self.__alpha * (
+                    (1.0 if error else 0.0) - stats.error_rate
+                )
+                if latency is not None:
+                    stats.latency = (
+                        latency
+                        if stats.latency is None
+                        else stats.latency + self.__alpha * (latency - stats.latency)
+                    )
+            latency_ewma, error_rate = stats.latency, stats.error_rate
+
+        tags = {"host": host[0], "port": str(host[1])}
+        if latency_ewma is not None:
+            metrics.gauge("host_latency_ewma", latency_ewma, tags=tags)
+        metrics.gauge("host_error_rate_ewma", error_rate, tags=tags)
+
+    def get(self, host: Host) -> Optional[Tuple[Optional[float], float]]:
+        """
+        Returns the latency and error rate averages of a host, None if the
+        host was never queried. The latency is None until a request to the
+        host succeeded.
+        """
+        with self.__lock:
+            stats = self.__hosts.get(host)
+            return (stats.latency, stats.error_rate) if stats is not None else None
+
+    def get_weights(self, hosts: Sequence[Host]) -> Sequence[float]:
+        with self.__lock:
+            stats_list = [self.__hosts.get(host) for host in hosts]
+            known = [
+                stats.latency
+                for stats in stats_list
+                if stats is not None and stats.latency is not None
+            ]
+            default_latency = min(known) if known else 0.0
+            weights = []
+            for stats in stats_list:
+                latency = (
+                    stats.latency
+                    if stats is not None and stats.latency is not None
+                    else default_latency
+                )
+                error_rate = stats.error_rate if stats is not None else 0.0
+                # The millisecond floor avoids dividing by zero and keeps
+                # sub-millisecond differences from skewing the traffic.
+                weights.append(
+                    (1.0 - error_rate) ** self.__error_penalty / max(latency, 0.001)
+                )
+        return weights
+
+    def choose(self, hosts: Sequence[Host]) -> Host:
+        assert hosts, "no hosts to choose from"
+        weights = self.get_weights(hosts)
+        if not any(weights):
+            # Every host failed consistently, fall back to an even spread.
+            return random.choice(hosts)
+        # Unhealthy hosts keep getting a trickle of traffic, otherwise they
+        # would never get the chance to prove they recovered.
+        floor = max(weights) * MIN_TRAFFIC_SHARE
+        return random.choices(hosts, weights=[max(w, floor) for w in weights])[0]
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__hosts.clear()
+
+
+host_health = HostHealth()
@@ -25,6 +25,7 @@ from urllib3.exceptions import HTTPError
 
 from snuba import settings, state
 from snuba.clickhouse import DATETIME_FORMAT
+from snuba.clickhouse.compression import StreamCompressor, get_compressor
 from snuba.clickhouse.errors import ClickhouseWriterError
 from snuba.clickhouse.formatter.expression import ClickhouseExpressionFormatter
 from snuba.clickhouse.query import Expression
@@ -150,6 +151,12 @@ class HTTPWriteBatch:
     If the buffer size is higher and the buffer is full, the `append`
     command will block while the value is sent to the server.
 
+    The body can be compressed while it is streamed by providing the name
+    of a compression (see ``snuba.clickhouse.compression``). Chunks are
+    compressed as they are read from the buffer, so compression does not
+    change how the buffer applies backpressure. `encoding` must not be set
+    in this case, it describes a body that is already compressed.
+
     The "debug buffer" is being used to hold a prefix of the data
     stream in memory. If the error returned by clickhouse happens to point to a
     row contained in the first `debug_buffer_size_bytes` bytes of the data
@@ -171,6 +178,7 @@ class HTTPWriteBatch:
         chunk_size: Optional[int] = None,
         buffer_size: int = 0,  # 0 means unbounded
         debug_buffer_size_bytes: Optional[int] = None,  # None means disabled
+        compression: Optional[str] = None,
     ) -> None:
         if chunk_size is None:
             chunk_size = settings.CLICKHOUSE_HTTP_CHUNK_SIZE
@@ -185,6 +193,15 @@ class HTTPWriteBatch:
         elif not chunk_size > 0:
             raise ValueError("chunk size must be greater than zero")
 
+        self.__compression = compression
+        self.__compressed_size = 0
+        if compression is not None:
+            if encoding:
+                raise ValueError("cannot compress a body that is already encoded")
+            compressor = get_compressor(compression)
+            encoding = compressor.content_encoding
+            body = self.__compress(body, compressor)
+
         headers = {
             "X-ClickHouse-User": user,
             "Connection": "keep-alive",
@@ -225,6 +242,21 @@ class HTTPWriteBatch:
 
             yield value
 
+    def __compress(
+        self, body: Iterator[bytes], compressor: StreamCompressor
+    ) -> Iterator[bytes]:
+        for chunk in body:
+            compressed = compressor.compress(chunk)
+            # An empty chunk would end a chunked HTTP body.
+            if compressed:
+                self.__compressed_size += len(compressed)
+                yield compressed
+
+        compressed = compressor.flush()
+        if compressed:
+            self.__compressed_size += len(compressed)
+            yield compressed
+
     def append(self, value: bytes) -> None:
         assert not self.__closed
 
@@ -255,6 +287,22 @@ class HTTPWriteBatch:
             self.__size,
             tags={"table": str(self.__statement.get_qualified_table())},
         )
+        if self.__compression is not None:
+            compression_tags = {
+                "table": str(self.__statement.get_qualified_table()),
+                "compression": self.__compression,
+            }
+            self.__metrics.timing(
+                "http_batch.compressed_size",
+                self.__compressed_size,
+                tags=compression_tags,
+            )
+            if self.__compressed_size:
+                self.__metrics.timing(
+                    "http_batch.compression_ratio",
+                    self.__size / self.__compressed_size,
+                    tags=compression_tags,
+                )
 
         if response.status != 200:
             # XXX: This should be switched to just parse the JSON body after
@@ -301,6 +349,7 @@ class HTTPBatchWriter(BatchWriter[bytes]):
         buffer_size: int = 0,
         max_connections: int = 1,
         block_connections: bool = False,
+        compression: Optional[str] = None,
     ):
         self.__pool = HTTPConnectionPool(
             host, port, maxsize=max_connections, block=block_connections
@@ -312,6 +361,7 @@ class HTTPBatchWriter(BatchWriter[bytes]):
         self.__user = user
         self.__password = password
         self.__encoding = encoding
+        self.__compression = compression
         self.__statement = statement
         self.__buffer_size = buffer_size
         self.__chunk_size = chunk_size
@@ -347,6 +397,7 @@ class HTTPBatchWriter(BatchWriter[bytes]):
             self.__chunk_size,
             self.__buffer_size,
             self.__debug_buffer_size_bytes,
+            self.__compression,
         )
 
         for value in values:
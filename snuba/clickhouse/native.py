@@ -2,19 +2,24 @@ from __future__ import annotations
 
 import logging
 import queue
-import random
 import re
+import threading
 import time
 from contextlib import contextmanager
 from dataclasses import dataclass, field
 from datetime import date, datetime
+from functools import partial
 from io import StringIO
+from itertools import islice
 from typing import (
     Any,
+    Callable,
     Dict,
     Generator,
+    List,
     Mapping,
     Optional,
+    Pattern,
     Sequence,
     Tuple,
     TypedDict,
@@ -22,6 +27,7 @@ from typing import (
     cast,
 )
 from uuid import UUID
+from weakref import WeakKeyDictionary
 
 import sentry_sdk
 from clickhouse_driver import Client, errors
@@ -30,7 +36,16 @@ from dateutil.tz import tz
 from snuba import environment, settings, state
 from snuba.clickhouse.errors import ClickhouseError
 from snuba.clickhouse.formatter.nodes import FormattedQuery
-from snuba.reader import Reader, Result, build_result_transformer
+from snuba.clickhouse.host_health import Host, host_health
+from snuba.reader import (
+    Column,
+    Reader,
+    Result,
+    ResultStream,
+    Row,
+    build_column_transformer,
+    build_result_transformer,
+)
 from snuba.utils.metrics.gauge import ThreadSafeGauge
 from snuba.utils.metrics.wrapper import MetricsWrapper
 
@@ -59,6 +74,33 @@ class ClickhouseResult:
     trace_output: str = ""
 
 
+class ClickhouseStream:
+    """
+    Rows of a query that are streamed from ClickHouse. The connection used
+    by the query is held until the rows are exhausted or the stream is
+    closed, ``profile`` is populated once all the rows were read.
+    """
+
+    def __init__(
+        self,
+        meta: Sequence[Any],
+        rows: Generator[Sequence[Any], None, None],
+        release: Callable[[], None],
+    ) -> None:
+        self.meta = meta
+        self.rows = rows
+        self.profile: ClickhouseProfile | None = None
+        self.__release = release
+
+    def close(self) -> None:
+        """
+        Releases the connection, whether the rows were iterated or not.
+        Closing a generator that never started does not run its ``finally``.
+        """
+        self.rows.close()
+        self.__release()
+
+
 @contextmanager
 def capture_logging() -> Generator[StringIO, None, None]:
     buffer = StringIO()
@@ -71,6 +113,34 @@ def capture_logging() -> Generator[StringIO, None, None]:
     buffer.close()
 
 
+class ConnectionQueue(queue.LifoQueue[Optional[Client]]):
+    """
+    Pool of connections, the connection that was used the most recently is
+    on top. Connections can also be put at the bottom, where the connection
+    that was used the least recently is: getting connections from the top
+    and putting them back at the bottom goes through every connection of
+    the pool while taking a single one out of it at a time.
+    """
+
+    def __init__(self, maxsize: int = 0) -> None:
+        super().__init__(maxsize)
+        # put() calls _put() in the thread that puts the connection.
+        self.__least_recent = threading.local()
+
+    def put_least_recent(self, conn: Optional[Client]) -> None:
+        self.__least_recent.value = True
+        try:
+            self.put(conn, block=False)
+        finally:
+            self.__least_recent.value = False
+
+    def _put(self, item: Optional[Client]) -> None:
+        if getattr(self.__least_recent, "value", False):
+            self.queue.insert(0, item)
+        else:
+            super()._put(item)
+
+
 class ClickhousePool(object):
     FALLBACK_POOL_SIZE = 3
 
@@ -95,11 +165,20 @@ class ClickhousePool(object):
         self.send_receive_timeout = send_receive_timeout
         self.client_settings = client_settings
 
-        self.pool: queue.LifoQueue[Optional[Client]] = queue.LifoQueue(max_pool_size)
+        self.pool = ConnectionQueue(max_pool_size)
         self.fallback_pool: queue.LifoQueue[Optional[Client]] = queue.LifoQueue(
             self.FALLBACK_POOL_SIZE
         )
         self.__gauge = ThreadSafeGauge(metrics, "connections")
+        self.__tags = {"host": host, "port": str(port)}
+        self.__max_pool_size = max_pool_size
+        self.__in_use = 0
+        self.__in_use_lock = threading.Lock()
+        # The host each connection was opened to, used to attribute latencies
+        # and errors to the right replica.
+        self.__conn_hosts: WeakKeyDictionary[Client, Host] = WeakKeyDictionary()
+        self.__closed = threading.Event()
+        self.__health_check_thread: Optional[threading.Thread] = None
 
         # Fill the queue up so that doing get() on it will block properly
         for _ in range(max_pool_size):
@@ -117,14 +196,50 @@ class ClickhousePool(object):
         )
         assert config_hosts_str, f"no fallback hosts found for {self.host}:{self.port}"
 
-        config_hosts = cast(str, config_hosts_str).split(",")
-        selected_host_port = random.choice(config_hosts).split(":")
+        config_hosts = []
+        for config_host in cast(str, config_hosts_str).split(","):
+            host_port = config_host.split(":")
+            assert (
+                len(host_port) == 2
+            ), f"expected host:port format in fallback hosts for {self.host}:{self.port}"
+            config_hosts.append((host_port[0], int(host_port[1])))
+
+        # Replicas are picked according to their recent latency and error
+        # rate rather than uniformly.
+        return host_health.choose(config_hosts)
+
+    def __checkout(self, fallback: bool = False) -> Optional[Client]:
+        start = time.time()
+        conn = (self.fallback_pool if fallback else self.pool).get(block=True)
+        metrics.timing(
+            "connection_wait", (time.time() - start) * 1000, tags=self.__tags
+        )
+        if not fallback:
+            self.__update_in_use(1)
+        return conn
 
-        assert (
-            len(selected_host_port) == 2
-        ), f"expected host:port format in fallback hosts for {self.host}:{self.port}"
+    def __release(self, conn: Optional[Client], fallback: bool = False) -> None:
+        if fallback:
+            self.fallback_pool.put(conn, block=False)
+        else:
+            self.pool.put(conn, block=False)
+            self.__update_in_use(-1)
+
+    def __update_in_use(self, delta: int) -> None:
+        with self.__in_use_lock:
+            self.__in_use += delta
+            in_use = self.__in_use
+        metrics.gauge("connections_in_use", in_use, tags=self.__tags)
+        metrics.gauge(
+            "pool_utilization", in_use / self.__max_pool_size, tags=self.__tags
+        )
 
-        return (selected_host_port[0], int(selected_host_port[1]))
+    def __record_health(
+        self, conn: Client, latency: Optional[float], error: bool
+    ) -> None:
+        host_health.record(
+            self.__conn_hosts.get(conn, (self.host, self.port)), latency, error
+        )
 
     # This will actually return an int if an INSERT query is run, but we never capture the
     # output of INSERT queries so I left this as a Sequence.
@@ -151,7 +266,7 @@ class ClickhousePool(object):
         fallback_mode = False
 
         try:
-            conn = self.pool.get(block=True)
+            conn = self.__checkout()
 
             if retryable:
                 attempts_remaining = 3 + (1 if self.fallback_pool_enabled() else 0)
@@ -166,6 +281,14 @@ class ClickhousePool(object):
                     conn = self._create_conn(fallback_mode)
 
                 try:
+                    if not conn.connection.connected:
+                        # Only the time it takes to connect tells how healthy
+                        # the host is, the time of a query depends on the
+                        # query.
+                        start = time.time()
+                        conn.connection.connect()
+                        self.__record_health(conn, time.time() - start, error=False)
+
                     if capture_trace:
                         settings = (
                             {**settings, "send_logs_level": "trace"}
@@ -198,6 +321,7 @@ class ClickhousePool(object):
                             trace_output = buffer.getvalue()
                     else:
                         result_data = query_execute()
+                    self.__record_health(conn, None, error=False)
 
                     profile_data = ClickhouseProfile(
                         bytes=conn.last_query.profile_info.bytes or 0,
@@ -238,6 +362,7 @@ class ClickhousePool(object):
                         },
                     )
 
+                    self.__record_health(conn, None, error=True)
                     # Force a reconnection next time
                     conn = None
                     self.__gauge.decrement()
@@ -245,12 +370,12 @@ class ClickhousePool(object):
                     # Move to fallback-mode for one last try if it's enabled
                     if attempts_remaining == 1 and self.fallback_pool_enabled():
                         # return a client instance placeholder back to the main connection pool
-                        self.pool.put(None, block=False)
+                        self.__release(None)
                         # turn fallback mode on (so new connections will come from run-time config)
                         fallback_mode = True
                         # try reusing a connection from the fallback connection pool, but if
                         # it's None we'll create the connection on-demand later
-                        conn = self.fallback_pool.get(block=True)
+                        conn = self.__checkout(fallback=True)
                     else:
                         if attempts_remaining == 0:
                             if isinstance(e, errors.Error):
@@ -285,10 +410,7 @@ class ClickhousePool(object):
                     raise ClickhouseError(e.message, code=e.code) from e
         finally:
             # Return finished connection to the appropriate connection pool
-            if not fallback_mode:
-                self.pool.put(conn, block=False)
-            else:
-                self.fallback_pool.put(conn, block=False)
+            self.__release(conn, fallback=fallback_mode)
 
         return ClickhouseResult()
 
@@ -371,12 +493,189 @@ class ClickhousePool(object):
             except errors.Error as e:
                 raise ClickhouseError(e.message, code=e.code) from e
 
+    def execute_iter(
+        self,
+        query: str,
+        query_id: Optional[str] = None,
+        settings: Optional[Mapping[str, Any]] = None,
+    ) -> ClickhouseStream:
+        """
+        Execute a clickhouse query and stream its results. The query is sent
+        and its header is read before returning, so errors raised by
+        ClickHouse before producing any row are raised here.
+
+        There is no retry: once rows are read by the caller the query cannot
+        be transparently restarted.
+        """
+        conn = self.__checkout()
+        try:
+            if conn is None:
+                self.__gauge.increment()
+                conn = self._create_conn()
+            client: Client = conn
+            rows = client.execute_iter(
+                query,
+                with_column_types=True,
+                query_id=query_id,
+                settings=settings,
+            )
+            meta = next(rows)
+        except BaseException as e:
+            self.__discard_conn(conn)
+            if isinstance(e, errors.Error):
+                raise ClickhouseError(e.message, code=e.code) from e
+            raise
+
+        released = False
+
+        def release(completed: bool) -> None:
+            nonlocal released
+            if released:
+                return
+            released = True
+            if completed:
+                self.__release(client)
+            else:
+                # The server may still be sending data for this query,
+                # the connection cannot be reused.
+                self.__discard_conn(client)
+
+        def iterate() -> Generator[Sequence[Any], None, None]:
+            completed = False
+            try:
+                yield from rows
+                completed = True
+                stream.profile = ClickhouseProfile(
+                    bytes=client.last_query.profile_info.bytes or 0,
+                    progress_bytes=client.last_query.progress.bytes or 0,
+                    blocks=client.last_query.profile_info.blocks or 0,
+                    rows=client.last_query.profile_info.rows or 0,
+                    elapsed=client.last_query.elapsed or 0.0,
+                )
+            except errors.Error as e:
+                raise ClickhouseError(e.message, code=e.code) from e
+            finally:
+                release(completed)
+
+        stream = ClickhouseStream(meta, iterate(), partial(release, False))
+        return stream
+
+    def __discard_conn(self, conn: Optional[Client]) -> None:
+        if conn is not None:
+            conn.disconnect()
+            self.__gauge.decrement()
+        self.__release(None)
+
+    def __connect(self, conn: Optional[Client]) -> Optional[Client]:
+        """
+        Makes sure a pooled connection is established and alive, replacing it
+        if it is not. Returns None if no connection could be established.
+        """
+        if conn is None:
+            self.__gauge.increment()
+            conn = self._create_conn()
+
+        start = time.time()
+        try:
+            if conn.connection.connected:
+                alive = conn.connection.ping()
+            else:
+                conn.connection.connect()
+                alive = True
+        except (errors.Error, OSError, EOFError) as e:
+            logger.warning("Could not connect to %s:%s: %s", self.host, self.port, e)
+            alive = False
+
+        if alive:
+            self.__record_health(conn, time.time() - start, error=False)
+            return conn
+
+        self.__record_health(conn, None, error=True)
+        metrics.increment("unhealthy_connection", tags=self.__tags)
+        conn.disconnect()
+        self.__gauge.decrement()
+        return None
+
+    def __check_one_at_a_time(
+        self, check: Callable[[Optional[Client]], Optional[Client]]
+    ) -> None:
+        # Queries only ever wait for the single connection being checked.
+        # Connections are taken from the top of the pool and put back at the
+        # bottom, once every connection went through the pool is in its
+        # original order.
+        for _ in range(self.pool.qsize()):
+            try:
+                conn = self.pool.get(block=False)
+            except queue.Empty:
+                return
+            try:
+                conn = check(conn)
+            finally:
+                self.pool.put_least_recent(conn)
+
+    def warmup(self, connections: int) -> int:
+        """
+        Establishes up to ``connections`` connections so that the first
+        queries do not pay for the connection setup. Returns how many
+        connections are established.
+        """
+        established = 0
+
+        def connect(conn: Optional[Client]) -> Optional[Client]:
+            nonlocal established
+            if established >= connections:
+                return conn
+            conn = self.__connect(conn)
+            if conn is not None:
+                established += 1
+            return conn
+
+        self.__check_one_at_a_time(connect)
+        metrics.gauge("warm_connections", established, tags=self.__tags)
+        return established
+
+    def check_idle_connections(self) -> None:
+        """
+        Pings the connections that are not in use. Connections that are
+        broken are replaced by new ones, which keeps the pool warm.
+        """
+
+        def check(conn: Optional[Client]) -> Optional[Client]:
+            if conn is None or self.__closed.is_set():
+                return conn
+            return self.__connect(conn) or self.__connect(None)
+
+        self.__check_one_at_a_time(check)
+
+    def start_health_checks(self, interval_sec: float) -> None:
+        """
+        Starts a daemon thread checking idle connections every
+        ``interval_sec`` until the pool is closed.
+        """
+        if self.__health_check_thread is not None:
+            return
+
+        def run() -> None:
+            while not self.__closed.wait(interval_sec):
+                try:
+                    self.check_idle_connections()
+                except Exception:
+                    logger.exception("Connection pool health check failed")
+
+        self.__health_check_thread = threading.Thread(
+            target=run,
+            name=f"clickhouse-pool-health-{self.host}:{self.port}",
+            daemon=True,
+        )
+        self.__health_check_thread.start()
+
     def _create_conn(self, use_fallback_host: bool = False) -> Client:
-        if use_fallback_host:
-            (fallback_host, fallback_port) = self.get_fallback_host()
-        return Client(
-            host=(self.host if not use_fallback_host else fallback_host),
-            port=(self.port if not use_fallback_host else fallback_port),
+        host, port = (
+            self.get_fallback_host() if use_fallback_host else (self.host, self.port)
+        )
+        conn = Client(
+            host=host,
+            port=port,
             user=self.user,
             password=self.password,
             database=self.database,
@@ -384,8 +683,11 @@ class ClickhousePool(object):
             send_receive_timeout=self.send_receive_timeout,
             settings=self.client_settings,
         )
+        self.__conn_hosts[conn] = (host, port)
+        return conn
 
     def close(self) -> None:
+        self.__closed.set()
         try:
             while True:
                 conn = self.pool.get(block=False)
@@ -413,10 +715,10 @@ def transform_datetime(value: datetime) -> str:
     and time string representation.
     """
     if value.tzinfo is None:
-        value = value.replace(tzinfo=tz.tzutc())
-    else:
-        value = value.astimezone(tz.tzutc())
-    return value.isoformat()
+        # Same as ``value.replace(tzinfo=tz.tzutc()).isoformat()``, without
+        # building a new datetime.
+        return value.isoformat() + "+00:00"
+    return value.astimezone(tz.tzutc()).isoformat()
 
 
 def transform_uuid(value: UUID) -> str:
@@ -426,13 +728,15 @@ def transform_uuid(value: UUID) -> str:
     return str(value)
 
 
-transform_column_types = build_result_transformer(
-    [
-        (re.compile(r"^Date(\(.+\))?$"), transform_date),
-        (re.compile(r"^DateTime(\(.+\))?$"), transform_datetime),
-        (re.compile(r"^UUID$"), transform_uuid),
-    ]
-)
+COLUMN_TYPE_TRANSFORMATIONS: Sequence[Tuple[Pattern[str], Callable[[Any], Any]]] = [
+    (re.compile(r"^Date(\(.+\))?$"), transform_date),
+    (re.compile(r"^DateTime(\(.+\))?$"), transform_datetime),
+    (re.compile(r"^UUID$"), transform_uuid),
+]
+
+transform_column_types = build_result_transformer(COLUMN_TYPE_TRANSFORMATIONS)
+
+transform_column_values = build_column_transformer(COLUMN_TYPE_TRANSFORMATIONS)
 
 
 class NativeDriverReader(Reader):
@@ -470,6 +774,53 @@ class NativeDriverReader(Reader):
             {"name": m[0], "type": m[1]} for m in [meta[i] for i in columns.values()]
         ]
 
+        new_result = self.__build_result(
+            data, meta, profile, result.trace_output, with_totals
+        )
+        transform_column_types(new_result)
+
+        return new_result
+
+    def __transform_columnar_result(
+        self, result: ClickhouseResult, with_totals: bool
+    ) -> Result:
+        """
+        Same as ``__transform_result`` for a response obtained with
+        ``columnar=True``. Type transformations are applied once per column
+        and rows are only built at the end, in a single pass.
+        """
+        meta = result.meta if result.meta is not None else []
+        profile = cast(Optional[Dict[str, Any]], result.profile)
+        # Duplicated names are discarded, see ``__transform_result``.
+        columns = {c[0]: i for i, c in enumerate(meta)}
+        names = list(columns.keys())
+
+        values = (
+            [
+                transform_column_values(meta[index][1], result.results[index])
+                for index in columns.values()
+            ]
+            if result.results
+            else []
+        )
+        data: list[Row] = [dict(zip(names, row)) for row in zip(*values)]
+
+        meta = [
+            {"name": m[0], "type": m[1]} for m in [meta[i] for i in columns.values()]
+        ]
+
+        return self.__build_result(
+            data, meta, profile, result.trace_output, with_totals
+        )
+
+    def __build_result(
+        self,
+        data: list[Row],
+        meta: list[Any],
+        profile: Optional[Dict[str, Any]],
+        trace_output: str,
+        with_totals: bool,
+    ) -> Result:
         new_result: Result = {}
         if with_totals:
             assert len(data) > 0
@@ -479,18 +830,16 @@ class NativeDriverReader(Reader):
                 "meta": meta,
                 "totals": totals,
                 "profile": profile,
-                "trace_output": result.trace_output,
+                "trace_output": trace_output,
             }
         else:
             new_result = {
                 "data": data,
                 "meta": meta,
                 "profile": profile,
-                "trace_output": result.trace_output,
+                "trace_output": trace_output,
             }
 
-        transform_column_types(new_result)
-
         return new_result
 
     def execute(
@@ -512,6 +861,21 @@ class NativeDriverReader(Reader):
             self.__client.execute_robust if robust is True else self.__client.execute
         )
 
+        # Columnar results skip building a dict per row before the type
+        # transformations are applied.
+        if state.get_config("native_reader_columnar_results", 0):
+            return self.__transform_columnar_result(
+                execute_func(
+                    query.get_sql(),
+                    with_column_types=True,
+                    query_id=query_id,
+                    settings=settings,
+                    columnar=True,
+                    capture_trace=capture_trace,
+                ),
+                with_totals=with_totals,
+            )
+
         return self.__transform_result(
             execute_func(
                 query.get_sql(),
@@ -522,3 +886,53 @@ class NativeDriverReader(Reader):
             ),
             with_totals=with_totals,
         )
+
+    def execute_stream(
+        self,
+        query: FormattedQuery,
+        settings: Optional[Mapping[str, str]] = None,
+    ) -> ResultStream:
+        settings = {**settings} if settings is not None else {}
+
+        query_id = None
+        if "query_id" in settings:
+            query_id = settings.pop("query_id")
+
+        stream = self.__client.execute_iter(
+            query.get_sql(), query_id=query_id, settings=settings
+        )
+
+        # Duplicated names are discarded, see ``__transform_result``.
+        columns = {c[0]: i for i, c in enumerate(stream.meta)}
+        meta: List[Column] = [
+            {"name": m[0], "type": m[1]}
+            for m in [stream.meta[i] for i in columns.values()]
+        ]
+        chunk_size = int(state.get_config("native_reader_stream_chunk_size", 1000) or 1)
+
+        def iterate() -> Generator[Row, None, None]:
+            # Rows are transformed in chunks so that type transformations
+            # are looked up once per chunk instead of once per row.
+            try:
+                while True:
+                    chunk: Result = {
+                        "meta": meta,
+                        "data": [
+                            {column: row[index] for column, index in columns.items()}
+                            for row in islice(stream.rows, chunk_size)
+                        ],
+                    }
+                    if not chunk["data"]:
+                        return
+                    transform_column_types(chunk)
+                    yield from chunk["data"]
+            finally:
+                # Releases the connection if the rows were not all read.
+                stream.close()
+
+        return ResultStream(
+            meta,
+            iterate(),
+            lambda: cast(Optional[Dict[str, Any]], stream.profile),
+            stream.close,
+        )
@@ -0,0 +1,341 @@
+"""
+Encodes rows in the ClickHouse ``RowBinaryWithDefaults`` format.
+
+Contrary to JSONEachRow, the values are sent in the binary representation
+ClickHouse stores them with, so ClickHouse does not have to parse them and
+the payload is smaller. The flip side is that the encoder has to know the
+exact type of every column: it is built from the columns of the writable
+schema of a storage, and those have to match the types of the table.
+
+Every value is preceded by a flag telling whether the value is provided or
+whether ClickHouse should use the default of the column. Columns missing
+from a row and ``None`` values in non nullable columns use the default,
+which is what happens to them with JSONEachRow.
+"""
+
+from __future__ import annotations
+
+import calendar
+import ipaddress
+import struct
+import uuid
+from datetime import date, datetime
+from typing import Any, Callable, Sequence, Tuple
+
+from snuba.clickhouse import DATETIME_FORMAT
+from snuba.clickhouse.columns import (
+    UUID,
+    Array,
+    ColumnType,
+    Date,
+    DateTime,
+    DateTime64,
+    Enum,
+    FixedString,
+    FlattenedColumn,
+    Float,
+    Int,
+    IPv4,
+    IPv6,
+    Map,
+    Nullable,
+    SimpleAggregateFunction,
+    String,
+    UInt,
+)
+from snuba.utils.codecs import Encoder
+from snuba.writer import WriterTableRow
+
+ValueWriter = Callable[[bytearray, Any], None]
+
+_EPOCH_DATE = date(1970, 1, 1)
+
+_UINT_FORMATS = {8: "<B", 16: "<H", 32: "<I", 64: "<Q"}
+_INT_FORMATS = {8: "<b", 16: "<h", 32: "<i", 64: "<q"}
+_FLOAT_FORMATS = {32: "<f", 64: "<d"}
+_UINT64 = struct.Struct("<Q")
+
+_DEFAULT = b"\x01"
+_PROVIDED = b"\x00"
+_NULL = b"\x01"
+_NOT_NULL = b"\x00"
+
+
+def _write_varint(buffer: bytearray, value: int) -> None:
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _to_bytes(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if not isinstance(value, str):
+        value = str(value)
+    return value.encode("utf-8")
+
+
+def _write_string(buffer: bytearray, value: Any) -> None:
+    encoded = value.encode("utf-8") if type(value) is str else _to_bytes(value)
+    length = len(encoded)
+    if length < 0x80:
+        buffer.append(length)
+    else:
+        _write_varint(buffer, length)
+    buffer += encoded
+
+
+def _write_nullable_string(buffer: bytearray, value: Any) -> None:
+    if value is None:
+        buffer += _NULL
+    else:
+        buffer += _NOT_NULL
+        _write_string(buffer, value)
+
+
+def _to_datetime(value: Any) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    try:
+        return datetime.strptime(value, DATETIME_FORMAT)
+    except ValueError:
+        return datetime.fromisoformat(value)
+
+
+def _to_timestamp(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return value
+    parsed = _to_datetime(value)
+    # Naive datetimes are UTC, which is how JSONRowEncoder sends them.
+    return calendar.timegm(parsed.utctimetuple()) + parsed.microsecond / 1e6
+
+
+def _build_fixed_string(length: int) -> ValueWriter:
+    def write(buffer: bytearray, value: Any) -> None:
+        encoded = _to_bytes(value)[:length]
+        buffer += encoded
+        buffer += b"\x00" * (length - len(encoded))
+
+    return write
+
+
+def _build_integer(size: int, signed: bool) -> ValueWriter:
+    formats = _INT_FORMATS if signed else _UINT_FORMATS
+    if size in formats:
+        return _build_struct(formats[size], int)
+    if size not in (128, 256):
+        raise TypeError("integer size cannot be encoded in RowBinary format", size)
+
+    # There is no struct format for the wide integers, they are sent as
+    # little endian two's complement like the others.
+    length = size // 8
+
+    def write(buffer: bytearray, value: Any) -> None:
+        buffer += int(value).to_bytes(length, "little", signed=signed)
+
+    return write
+
+
+def _build_struct(fmt: str, convert: Callable[[Any], Any]) -> ValueWriter:
+    pack = struct.Struct(fmt).pack
+
+    def write(buffer: bytearray, value: Any) -> None:
+        buffer += pack(convert(value))
+
+    return write
+
+
+def _write_uuid(buffer: bytearray, value: Any) -> None:
+    if isinstance(value, uuid.UUID):
+        as_int = value.int
+    else:
+        as_int = int(str(value).replace("-", ""), 16)
+    # Two little endian 64 bits integers, the most significant half first.
+    buffer += _UINT64.pack(as_int >> 64)
+    buffer += _UINT64.pack(as_int & 0xFFFFFFFFFFFFFFFF)
+
+
+def _write_ipv6(buffer: bytearray, value: Any) -> None:
+    address = ipaddress.ip_address(value)
+    if isinstance(address, ipaddress.IPv4Address):
+        address = ipaddress.IPv6Address(f"::ffff:{address}")
+    buffer += address.packed
+
+
+def _build_date_time64(precision: int) -> ValueWriter:
+    pack = struct.Struct("<q").pack
+    scale = 10**precision
+
+    def write(buffer: bytearray, value: Any) -> None:
+        buffer += pack(round(_to_timestamp(value) * scale))
+
+    return write
+
+
+def _build_enum(values: Sequence[Tuple[str, int]]) -> ValueWriter:
+    mapping = dict(values)
+    fits_int8 = all(-128 <= v <= 127 for _, v in values)
+    pack = struct.Struct("<b" if fits_int8 else "<h").pack
+
+    def write(buffer: bytearray, value: Any) -> None:
+        buffer += pack(mapping[value] if isinstance(value, str) else int(value))
+
+    return write
+
+
+def _build_array(inner: ValueWriter) -> ValueWriter:
+    def write(buffer: bytearray, value: Any) -> None:
+        _write_varint(buffer, len(value))
+        for item in value:
+            inner(buffer, item)
+
+    return write
+
+
+def _write_string_array(buffer: bytearray, value: Any) -> None:
+    # Arrays of strings (tags, contexts...) are most of the data of the
+    # events, this avoids a function call per element.
+    _write_varint(buffer, len(value))
+    for item in value:
+        encoded = item.encode("utf-8") if type(item) is str else _to_bytes(item)
+        length = len(encoded)
+        if length < 0x80:
+            buffer.append(length)
+        else:
+            _write_varint(buffer, length)
+        buffer += encoded
+
+
+def _write_nullable_string_array(buffer: bytearray, value: Any) -> None:
+    _write_varint(buffer, len(value))
+    for item in value:
+        if item is None:
+            buffer += _NULL
+            continue
+        buffer += _NOT_NULL
+        encoded = item.encode("utf-8") if type(item) is str else _to_bytes(item)
+        length = len(encoded)
+        if length < 0x80:
+            buffer.append(length)
+        else:
+            _write_varint(buffer, length)
+        buffer += encoded
+
+
+def _build_map(key: ValueWriter, value_writer: ValueWriter) -> ValueWriter:
+    def write(buffer: bytearray, value: Any) -> None:
+        _write_varint(buffer, len(value))
+        for k, v in value.items():
+            key(buffer, k)
+            value_writer(buffer, v)
+
+    return write
+
+
+def _build_nullable(inner: ValueWriter) -> ValueWriter:
+    def write(buffer: bytearray, value: Any) -> None:
+        if value is None:
+            buffer += _NULL
+        else:
+            buffer += _NOT_NULL
+            inner(buffer, value)
+
+    return write
+
+
+def _build_value_writer(column_type: ColumnType[Any]) -> ValueWriter:
+    writer = _build_raw_value_writer(column_type)
+    if column_type.has_modifier(Nullable):
+        if writer is _write_string:
+            return _write_nullable_string
+        return _build_nullable(writer)
+    return writer
+
+
+def _build_raw_value_writer(column_type: ColumnType[Any]) -> ValueWriter:
+    if isinstance(column_type, String):
+        return _write_string
+    if isinstance(column_type, UInt):
+        return _build_integer(column_type.size, signed=False)
+    if isinstance(column_type, Int):
+        return _build_integer(column_type.size, signed=True)
+    if isinstance(column_type, Float):
+        return _build_struct(_FLOAT_FORMATS[column_type.size], float)
+    if isinstance(column_type, FixedString):
+        return _build_fixed_string(column_type.length)
+    if isinstance(column_type, UUID):
+        return _write_uuid
+    if isinstance(column_type, IPv4):
+        return _build_struct("<I", lambda v: int(ipaddress.IPv4Address(v)))
+    if isinstance(column_type, IPv6):
+        return _write_ipv6
+    if isinstance(column_type, Date):
+        return _build_struct(
+            "<H", lambda v: (_to_datetime(v).date() - _EPOCH_DATE).days
+        )
+    if isinstance(column_type, DateTime):
+        return _build_struct("<I", lambda v: int(_to_timestamp(v)))
+    if isinstance(column_type, DateTime64):
+        return _build_date_time64(column_type.precision)
+    if isinstance(column_type, Enum):
+        return _build_enum(column_type.values)
+    if isinstance(column_type, Array):
+        inner = _build_value_writer(column_type.inner_type)
+        if inner is _write_string:
+            return _write_string_array
+        if inner is _write_nullable_string:
+            return _write_nullable_string_array
+        return _build_array(inner)
+    if isinstance(column_type, Map):
+        return _build_map(
+            _build_value_writer(column_type.key),
+            _build_value_writer(column_type.value),
+        )
+    if isinstance(column_type, SimpleAggregateFunction):
+        # Stored as the type of the argument of the function.
+        assert len(column_type.arg_types) == 1
+        return _build_value_writer(column_type.arg_types[0])
+    raise TypeError(
+        "column type cannot be encoded in RowBinary format", column_type.for_schema()
+    )
+
+
+class RowBinaryEncoder(Encoder[bytes, WriterTableRow]):
+    """
+    Encodes a row in the ``RowBinaryWithDefaults`` format. The columns have
+    to be the ones listed, in the same order, in the insert statement.
+    """
+
+    def __init__(self, columns: Sequence[FlattenedColumn]) -> None:
+        self.__columns = columns
+        self.__writers = [
+            (
+                column.flattened,
+                column.type.has_modifier(Nullable),
+                _build_value_writer(column.type),
+            )
+            for column in columns
+        ]
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # The value writers are closures, which cannot be pickled. Consumers
+        # send the encoder to their subprocesses.
+        return (RowBinaryEncoder, (self.__columns,))
+
+    def encode(self, value: WriterTableRow) -> bytes:
+        buffer = bytearray()
+        get = value.get
+        for name, nullable, write in self.__writers:
+            column_value = get(name)
+            if column_value is not None:
+                buffer += _PROVIDED
+                write(buffer, column_value)
+            elif nullable and name in value:
+                buffer += _PROVIDED
+                write(buffer, None)
+            else:
+                buffer += _DEFAULT
+        return bytes(buffer)
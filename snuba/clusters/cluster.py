@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
-from threading import Lock
+from threading import Lock, Thread
 from typing import (
     Any,
     Dict,
@@ -155,6 +155,7 @@ class Cluster(ABC, Generic[TWriterOptions]):
         options: TWriterOptions,
         chunk_size: Optional[int],
         buffer_size: int,
+        compression: Optional[str] = None,
     ) -> BatchWriter[JSONRow]:
         raise NotImplementedError
 
@@ -323,6 +324,7 @@ class ClickhouseCluster(Cluster[ClickhouseWriterOptions]):
         options: ClickhouseWriterOptions,
         chunk_size: Optional[int],
         buffer_size: int,
+        compression: Optional[str] = None,
     ) -> BatchWriter[JSONRow]:
         return HTTPBatchWriter(
             host=self.__query_node.host_name,
@@ -337,6 +339,7 @@ class ClickhouseCluster(Cluster[ClickhouseWriterOptions]):
             options=options,
             chunk_size=chunk_size,
             buffer_size=buffer_size,
+            compression=compression,
         )
 
     def is_single_node(self) -> bool:
@@ -532,3 +535,30 @@ def get_cluster(
                 storage_set_key_not_defined=storage_set_key.value,
             )
     return res
+
+
+def warmup_connection_pools(
+    connections: int = settings.CLICKHOUSE_POOL_WARMUP_CONNECTIONS,
+) -> None:
+    """
+    Establishes connections of the query connection pool of every cluster
+    in a background thread, then starts the health checks of their idle
+    connections. Does nothing if ``connections`` is 0.
+    """
+    if connections <= 0:
+        return
+
+    def warmup() -> None:
+        for cluster in CLUSTERS:
+            pool = cluster.get_query_connection(ClickhouseClientSettings.QUERY)
+            try:
+                established = pool.warmup(connections)
+            except Exception:
+                logger.exception("Failed to warm up connection pool", cluster=cluster)
+                continue
+            logger.info(
+                "Warmed up connection pool", cluster=cluster, connections=established
+            )
+            pool.start_health_checks(settings.CLICKHOUSE_POOL_HEALTH_CHECK_INTERVAL_SEC)
+
+    Thread(target=warmup, name="clickhouse-pool-warmup", daemon=True).start()
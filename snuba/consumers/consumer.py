@@ -38,13 +38,15 @@ from snuba import environment, state
 from snuba.clickhouse.http import JSONRow, JSONRowEncoder, ValuesRowEncoder
 from snuba.consumers.schemas import _NOOP_CODEC, get_json_codec
 from snuba.consumers.types import KafkaMessageMetadata
+from snuba.datasets.processors.rust_compat_processor import RustCompatProcessor
 from snuba.datasets.storages.storage_key import StorageKey
 from snuba.datasets.table_storage import TableWriter
 from snuba.processor import InsertBatch, MessageProcessor, ReplacementBatch
+from snuba.utils.codecs import Encoder
 from snuba.utils.metrics import MetricsBackend
 from snuba.utils.metrics.wrapper import MetricsWrapper
 from snuba.utils.streams.topics import Topic as SnubaTopic
-from snuba.writer import BatchWriter
+from snuba.writer import BatchWriter, WriterTableRow
 
 metrics = MetricsWrapper(environment.metrics, "consumer")
 
@@ -494,6 +496,7 @@ def process_message(
     snuba_logical_topic: SnubaTopic,
     enforce_schema: bool,
     message: Message[KafkaPayload],
+    row_encoder: Encoder[bytes, WriterTableRow] = json_row_encoder,
 ) -> Union[None, BytesInsertBatch, ReplacementBatch]:
     local_metrics = MetricsWrapper(
         metrics,
@@ -508,13 +511,23 @@ def process_message(
         or 0.0
     )
 
+    # The Rust processors can take the payload as it was received and return
+    # rows already encoded as JSON. There is no need to decode the payload
+    # (unless it is validated) nor to decode and encode the rows again.
+    raw_payload = (
+        isinstance(processor, RustCompatProcessor)
+        and isinstance(row_encoder, JSONRowEncoder)
+        and bool(state.get_config("rust_compat_raw_payload_enabled", 1))
+    )
+
     assert isinstance(message.value, BrokerValue)
     try:
         codec = get_json_codec(snuba_logical_topic)
         should_validate = random.random() < validate_sample_rate
         start = time.time()
 
-        decoded = codec.decode(message.payload.value, validate=False)
+        if should_validate or not raw_payload:
+            decoded = codec.decode(message.payload.value, validate=False)
 
         if should_validate:
             with sentry_sdk.push_scope() as scope:
@@ -554,14 +567,19 @@ def process_message(
                 (time.time() - start) * 1000,
             )
 
-        result = processor.process_message(
-            decoded,
-            KafkaMessageMetadata(
-                message.value.offset,
-                message.value.partition.index,
-                message.value.timestamp,
-            ),
+        metadata = KafkaMessageMetadata(
+            message.value.offset,
+            message.value.partition.index,
+            message.value.timestamp,
         )
+        if raw_payload:
+            assert isinstance(processor, RustCompatProcessor)
+            raw_result = processor.process_raw_message(message.payload.value, metadata)
+            if isinstance(raw_result, ReplacementBatch):
+                return raw_result
+            return BytesInsertBatch(raw_result, None, None)
+
+        result = processor.process_message(decoded, metadata)
     except Exception as err:
         local_metrics.increment(
             "invalid_message",
@@ -578,7 +596,7 @@ def process_message(
 
     if isinstance(result, InsertBatch):
         return BytesInsertBatch(
-            [json_row_encoder.encode(row) for row in result.rows],
+            [row_encoder.encode(row) for row in result.rows],
             result.origin_timestamp,
             result.sentry_received_timestamp,
         )
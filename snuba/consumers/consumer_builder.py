@@ -233,6 +233,7 @@ class ConsumerBuilder:
                 self.consumer_group,
                 logical_topic,
                 self.__enforce_schema,
+                row_encoder=table_writer.get_row_encoder(),
             ),
             collector=build_batch_writer(
                 table_writer,
@@ -291,6 +292,7 @@ class ConsumerBuilder:
                 self.consumer_group,
                 logical_topic,
                 self.__enforce_schema,
+                row_encoder=table_writer.get_row_encoder(),
             ),
             collector=build_batch_writer(
                 table_writer,
@@ -37,10 +37,12 @@ from arroyo.processing.strategies.run_task_with_multiprocessing import (
 )
 from arroyo.types import BrokerValue, FilteredPayload, Message, Partition, Topic
 
+from snuba import state
 from snuba.consumers.consumer import json_row_encoder
 from snuba.consumers.types import KafkaMessageMetadata
 from snuba.datasets.processors import DatasetMessageProcessor
-from snuba.processor import InsertBatch
+from snuba.datasets.processors.rust_compat_processor import RustCompatProcessor
+from snuba.processor import InsertBatch, ReplacementBatch
 
 logger = logging.getLogger(__name__)
 
@@ -78,10 +80,20 @@ def process_rust_message(
 ) -> Tuple[Sequence[bytes], Optional[datetime], Optional[datetime]]:
     if processor is None:
         raise RuntimeError("processor not yet initialized")
-    rv = processor.process_message(
-        rapidjson.loads(bytearray(message)),
-        KafkaMessageMetadata(offset=offset, partition=partition, timestamp=timestamp),
+    metadata = KafkaMessageMetadata(
+        offset=offset, partition=partition, timestamp=timestamp
     )
+    if isinstance(processor, RustCompatProcessor) and state.get_config(
+        "rust_compat_raw_payload_enabled", 1
+    ):
+        # The rows come out of the processor already encoded.
+        rows = processor.process_raw_message(message, metadata)
+        assert not isinstance(
+            rows, ReplacementBatch
+        ), "this consumer does not support replacements"
+        return rows, None, None
+
+    rv = processor.process_message(rapidjson.loads(bytearray(message)), metadata)
 
     if rv is None:
         return [], None, None
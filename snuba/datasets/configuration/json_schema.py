@@ -648,6 +648,16 @@ V1_WRITABLE_STORAGE_SCHEMA = {
             "type": "object",
             "description": "Extra Clickhouse fields that are used for consumer writes",
         },
+        "write_format": {
+            "type": "string",
+            "enum": ["json", "values", "row_binary"],
+            "description": "Format of the rows inserted by the consumers, json by default",
+        },
+        "insert_compression": {
+            "type": "string",
+            "enum": ["gzip", "zstd", "lz4"],
+            "description": "Compression of the bodies of the inserts made by the consumers",
+        },
         "required_time_column": {
             "type": ["string", "null"],
             "description": "The name of the required time column specifed in schema",
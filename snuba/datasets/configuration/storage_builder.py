@@ -17,7 +17,7 @@ from snuba.datasets.deletion_settings import DeletionSettings
 from snuba.datasets.message_filters import StreamMessageFilter
 from snuba.datasets.processors import DatasetMessageProcessor
 from snuba.datasets.readiness_state import ReadinessState
-from snuba.datasets.schemas.tables import TableSchema, WritableTableSchema
+from snuba.datasets.schemas.tables import TableSchema, WritableTableSchema, WriteFormat
 from snuba.datasets.storage import ReadableTableStorage, WritableTableStorage
 from snuba.datasets.storages.storage_key import register_storage_key
 from snuba.datasets.table_storage import (
@@ -47,6 +47,8 @@ DELETION_SETTINGS = "deletion_settings"
 DELETION_PROCESSORS = "deletion_processors"
 MANDATORY_CONDITION_CHECKERS = "mandatory_condition_checkers"
 WRITER_OPTIONS = "writer_options"
+WRITE_FORMAT = "write_format"
+INSERT_COMPRESSION = "insert_compression"
 SUBCRIPTION_SCHEDULER_MODE = "subscription_scheduler_mode"
 DLQ_POLICY = "dlq_policy"
 REPLACER_PROCESSOR = "replacer_processor"
@@ -129,6 +131,8 @@ def __build_writable_storage_kwargs(config: dict[str, Any]) -> dict[str, Any]:
     return {
         STREAM_LOADER: build_stream_loader(config[STREAM_LOADER]),
         WRITER_OPTIONS: config[WRITER_OPTIONS] if WRITER_OPTIONS in config else {},
+        WRITE_FORMAT: WriteFormat(config.get(WRITE_FORMAT, WriteFormat.JSON.value)),
+        INSERT_COMPRESSION: config.get(INSERT_COMPRESSION),
         REPLACER_PROCESSOR: (
             ReplacerProcessor.get_from_name(
                 config[REPLACER_PROCESSOR]["processor"]
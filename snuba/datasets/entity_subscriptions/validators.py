@@ -2,7 +2,7 @@ from abc import abstractmethod
 from typing import Optional, Sequence, Type, Union, cast
 
 from snuba.query.composite import CompositeQuery
-from snuba.query.data_source.simple import Entity
+from snuba.query.data_source.simple import LogicalDataSource
 from snuba.query.logical import Query
 from snuba.query.validation.validators import (
     NoTimeBasedConditionValidator,
@@ -25,7 +25,7 @@ class EntitySubscriptionValidator(metaclass=RegisteredClass):
         return cast(Type["EntitySubscriptionValidator"], cls.class_from_name(name))
 
     @abstractmethod
-    def validate(self, query: Union[CompositeQuery[Entity], Query]) -> None:
+    def validate(self, query: Union[CompositeQuery[LogicalDataSource], Query]) -> None:
         raise NotImplementedError
 
 
@@ -40,7 +40,7 @@ class AggregationValidator(EntitySubscriptionValidator):
         self.disallowed_aggregations = disallowed_aggregations
         self.required_time_column = required_time_column
 
-    def validate(self, query: Union[CompositeQuery[Entity], Query]) -> None:
+    def validate(self, query: Union[CompositeQuery[LogicalDataSource], Query]) -> None:
         SubscriptionAllowedClausesValidator(
             self.max_allowed_aggregations, self.disallowed_aggregations
         ).validate(query)
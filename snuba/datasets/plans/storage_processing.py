@@ -5,6 +5,7 @@ from typing import Optional, Sequence, TypeVar, Union
 import sentry_sdk
 
 from snuba import settings as snuba_settings
+from snuba import state
 from snuba.clickhouse.query import Query
 from snuba.clickhouse.translators.snuba.mappers import SubscriptableMapper
 from snuba.clickhouse.translators.snuba.mapping import (
@@ -28,7 +29,7 @@ from snuba.query import Query as AbstractQuery
 from snuba.query.allocation_policies import AllocationPolicy
 from snuba.query.data_source.simple import Table
 from snuba.query.expressions import Expression, SubscriptableReference
-from snuba.query.processors.physical import ClickhouseQueryProcessor
+from snuba.query.processors.physical import ClickhouseQueryProcessor, fuse_processors
 from snuba.query.processors.physical.conditions_enforcer import (
     MandatoryConditionEnforcer,
 )
@@ -146,7 +147,13 @@ def apply_storage_processors(
             )
         )
     assert isinstance(query_plan.query, Query)
-    for processor in query_plan.db_query_processors:
+    processors = query_plan.db_query_processors
+    # Dry runs record the changes made by each processor.
+    if not settings.get_dry_run() and state.get_config(
+        "fused_query_processors_enabled", 1
+    ):
+        processors = fuse_processors(processors)
+    for processor in processors:
         with sentry_sdk.start_span(
             description=type(processor).__name__, op="processor"
         ):
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import logging
 from datetime import timezone
-from typing import Any, Optional
+from typing import Any, Optional, Sequence, Union
 
 import simplejson as json
 
@@ -20,12 +20,18 @@ class RustCompatProcessor(DatasetMessageProcessor):
         self.__process_message = rust_snuba.process_message  # type: ignore
         self.__processor_name = processor_name
 
-    def process_message(
-        self, message: Any, metadata: KafkaMessageMetadata
-    ) -> Optional[ProcessedMessage]:
+    def process_raw_message(
+        self, value: bytes, metadata: KafkaMessageMetadata
+    ) -> Union[Sequence[bytes], ReplacementBatch]:
+        """
+        Processes the payload of a Kafka message as it was received. The rows
+        to insert are returned as they are encoded by the Rust processor, one
+        JSONEachRow line each, and can be written to ClickHouse without being
+        decoded.
+        """
         insert_payload, replacement_payload = self.__process_message(
             self.__processor_name,
-            json.dumps(message).encode("utf8"),
+            value,
             metadata.partition,
             metadata.offset,
             int(metadata.timestamp.replace(tzinfo=timezone.utc).timestamp() * 1000),
@@ -33,18 +39,7 @@ class RustCompatProcessor(DatasetMessageProcessor):
 
         if insert_payload is not None:
             assert replacement_payload is None
-
-            rows = [
-                json.loads(line)
-                for line in insert_payload.rstrip(b"\n").split(b"\n")
-                if line
-            ]
-
-            return InsertBatch(
-                rows=rows,
-                origin_timestamp=None,
-                sentry_received_timestamp=None,
-            )
+            return [line for line in insert_payload.rstrip(b"\n").split(b"\n") if line]
         elif replacement_payload is not None:
             assert insert_payload is None
             key, values_bytes = replacement_payload
@@ -57,3 +52,18 @@ class RustCompatProcessor(DatasetMessageProcessor):
             return ReplacementBatch(key=key.decode("utf8"), values=values)
         else:
             raise ValueError("unsupported return value from snuba_rust")
+
+    def process_message(
+        self, message: Any, metadata: KafkaMessageMetadata
+    ) -> Optional[ProcessedMessage]:
+        processed = self.process_raw_message(
+            json.dumps(message).encode("utf8"), metadata
+        )
+        if isinstance(processed, ReplacementBatch):
+            return processed
+
+        return InsertBatch(
+            rows=[json.loads(line) for line in processed],
+            origin_timestamp=None,
+            sentry_received_timestamp=None,
+        )
@@ -191,6 +191,7 @@ class WritableTableStorage(ReadableTableStorage, WritableStorage):
         deletion_processors: Optional[Sequence[ClickhouseQueryProcessor]] = None,
         writer_options: ClickhouseWriterOptions = None,
         write_format: WriteFormat = WriteFormat.JSON,
+        insert_compression: Optional[str] = None,
         ignore_write_errors: bool = False,
         required_time_column: Optional[str] = None,
     ) -> None:
@@ -216,6 +217,7 @@ class WritableTableStorage(ReadableTableStorage, WritableStorage):
             replacer_processor=replacer_processor,
             writer_options=writer_options,
             write_format=write_format,
+            insert_compression=insert_compression,
         )
         self.__ignore_write_errors = ignore_write_errors
 
@@ -1,9 +1,17 @@
+import logging
 from typing import Any, Mapping, Optional, Sequence
 
 from arroyo.backends.kafka import KafkaPayload
 
-from snuba import settings
-from snuba.clickhouse.http import InsertStatement, JSONRow
+from snuba import settings, state
+from snuba.clickhouse.compression import COMPRESSORS
+from snuba.clickhouse.http import (
+    InsertStatement,
+    JSONRow,
+    JSONRowEncoder,
+    ValuesRowEncoder,
+)
+from snuba.clickhouse.row_binary import RowBinaryEncoder
 from snuba.clusters.cluster import (
     ClickhouseClientSettings,
     ClickhouseWriterOptions,
@@ -20,10 +28,13 @@ from snuba.snapshots import BulkLoadSource
 from snuba.snapshots.loaders import BulkLoader
 from snuba.snapshots.loaders.single_table import SingleTableBulkLoader
 from snuba.subscriptions.utils import SchedulingWatermarkMode
+from snuba.utils.codecs import Encoder
 from snuba.utils.metrics import MetricsBackend
 from snuba.utils.schemas import ReadOnly
 from snuba.utils.streams.topics import Topic, get_topic_creation_config
-from snuba.writer import BatchWriter
+from snuba.writer import BatchWriter, WriterTableRow
+
+logger = logging.getLogger(__name__)
 
 
 class KafkaTopicSpec:
@@ -239,6 +250,7 @@ class TableWriter:
         replacer_processor: Optional[ReplacerProcessor[Any]] = None,
         writer_options: ClickhouseWriterOptions = None,
         write_format: WriteFormat = WriteFormat.JSON,
+        insert_compression: Optional[str] = None,
     ) -> None:
         self.__storage_set = storage_set
         self.__table_schema = write_schema
@@ -246,6 +258,8 @@ class TableWriter:
         self.__replacer_processor = replacer_processor
         self.__writer_options = writer_options
         self.__write_format = write_format
+        self.__insert_compression = insert_compression
+        self.__row_encoder: Optional[Encoder[bytes, WriterTableRow]] = None
 
     def get_schema(self) -> WritableTableSchema:
         return self.__table_schema
@@ -268,6 +282,12 @@ class TableWriter:
                 .with_format("VALUES")
                 .with_columns(column_names)
             )
+        elif self.__write_format == WriteFormat.ROW_BINARY:
+            insert_statement = (
+                InsertStatement(table_name)
+                .with_format("RowBinaryWithDefaults")
+                .with_columns(self.get_writeable_columns())
+            )
         else:
             raise TypeError("unknown table format", self.__write_format)
         options = self.__update_writer_options(options)
@@ -279,8 +299,52 @@ class TableWriter:
             options=options,
             chunk_size=chunk_size,
             buffer_size=0,
+            compression=self.get_insert_compression(table_name),
         )
 
+    def get_insert_compression(self, table_name: str) -> Optional[str]:
+        """
+        Compression of the bodies of the inserts. Configured per storage,
+        the ``insert_compression_<table>`` runtime config overrides it
+        (``none`` disables compression). Unknown compressions are ignored
+        so that a typo in the runtime config does not break the inserts.
+        """
+        compression = state.get_str_config(
+            f"insert_compression_{table_name}", self.__insert_compression
+        )
+        if not compression or compression == "none":
+            return None
+        if compression not in COMPRESSORS:
+            logger.warning(
+                "Unknown insert compression %r for %s, inserting uncompressed",
+                compression,
+                table_name,
+            )
+            return None
+        return compression
+
+    def get_row_encoder(self) -> Encoder[bytes, WriterTableRow]:
+        """
+        Returns the encoder of the rows written by the batch writer, which
+        depends on the write format of the storage.
+        """
+        if self.__row_encoder is None:
+            if self.__write_format == WriteFormat.JSON:
+                self.__row_encoder = JSONRowEncoder()
+            elif self.__write_format == WriteFormat.VALUES:
+                self.__row_encoder = ValuesRowEncoder(self.get_writeable_columns())
+            elif self.__write_format == WriteFormat.ROW_BINARY:
+                self.__row_encoder = RowBinaryEncoder(
+                    [
+                        column
+                        for column in self.get_schema().get_columns()
+                        if not column.type.has_modifier(ReadOnly)
+                    ]
+                )
+            else:
+                raise TypeError("unknown table format", self.__write_format)
+        return self.__row_encoder
+
     def get_writeable_columns(self) -> Sequence[str]:
         return [
             column.flattened
@@ -4,6 +4,7 @@ from typing import Mapping, NamedTuple, Sequence, Union
 
 import sentry_sdk
 
+from snuba import state
 from snuba.clickhouse.query import Query as ClickhouseQuery
 from snuba.clusters.storage_sets import StorageSetKey, is_valid_storage_set_combination
 from snuba.datasets.plans.query_plan import (
@@ -18,7 +19,7 @@ from snuba.query.data_source.join import IndividualNode, JoinClause, JoinVisitor
 from snuba.query.data_source.simple import Table
 from snuba.query.data_source.visitor import DataSourceVisitor
 from snuba.query.joins.semi_joins import SemiJoinOptimizer
-from snuba.query.processors.physical import ClickhouseQueryProcessor
+from snuba.query.processors.physical import ClickhouseQueryProcessor, fuse_processors
 from snuba.query.query_settings import QuerySettings
 from snuba.state import explain_meta
 
@@ -279,6 +280,8 @@ class ProcessorsExecutor(DataSourceVisitor[None, Table], JoinVisitor[None, Table
         clickhouse_query: ClickhouseQuery,
         processors: Sequence[ClickhouseQueryProcessor],
     ) -> None:
+        if state.get_config("fused_query_processors_enabled", 1):
+            processors = fuse_processors(processors)
         for clickhouse_processor in processors:
             with sentry_sdk.start_span(
                 description=type(clickhouse_processor).__name__, op="processor"
@@ -0,0 +1,211 @@
+"""
+Cache of the ClickHouse queries produced by the query processing stages.
+
+Most queries are sent over and over again with the same content, by the
+same referrer (alerts, dashboards refreshing, the same issue page opened by
+many users...). Running the entity processors, the translation mappers and
+the storage processors on each of them rebuilds the same ClickHouse query
+every time. The output of a stage is kept, keyed by its input query, the
+query settings and the content of the runtime configs. An input query equal
+to one processed before gets a copy of the output.
+
+The processing of a query must only depend on these: a storage with a
+processor that reads anything else (see ``plan_cacheable`` on the
+ClickHouse query processors) never gets its queries cached. Dry runs, whose
+processing steps are recorded, are never cached either.
+"""
+
+from __future__ import annotations
+
+import copy
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, Mapping, NamedTuple, Optional, Union
+
+from snuba import environment, settings, state
+from snuba.clickhouse.query import Query as ClickhouseQuery
+from snuba.query import ProcessableQuery
+from snuba.query.data_source.simple import Entity, Table
+from snuba.query.expressions import Literal
+from snuba.query.logical import Query as LogicalQuery
+from snuba.query.query_settings import QuerySettings
+from snuba.state.config_snapshot import ConfigSnapshot
+from snuba.utils.metrics.wrapper import MetricsWrapper
+
+metrics = MetricsWrapper(environment.metrics, "plan_cache")
+
+InputQuery = Union[LogicalQuery, ClickhouseQuery]
+
+
+class _Plan(NamedTuple):
+    query: ClickhouseQuery
+    # The ClickHouse settings once the query was processed, processors can
+    # change them.
+    clickhouse_settings: Mapping[str, Any]
+    # Seconds it took to process the query.
+    duration: float
+
+
+def _copy_query(query: ClickhouseQuery) -> ClickhouseQuery:
+    # Expressions are immutable, but queries are processed in place by
+    # replacing their fields or by modifying their lists. A shallow copy
+    # with its own lists can be processed without changing the original.
+    copied = copy.copy(query)
+    for name, value in vars(copied).items():
+        if isinstance(value, (list, dict)):
+            setattr(copied, name, copy.copy(value))
+    return copied
+
+
+def _source_key(query: ProcessableQuery[Any]) -> Hashable:
+    from_clause = query.get_from_clause()
+    if isinstance(query, LogicalQuery) and isinstance(from_clause, Entity):
+        # Logical queries have no prewhere, the one given to their
+        # constructor is discarded.
+        return (
+            from_clause.key,
+            from_clause.sample,
+            query.get_sample(),
+            query.get_final(),
+        )
+    if isinstance(query, ClickhouseQuery) and isinstance(from_clause, Table):
+        return (
+            from_clause.storage_key,
+            from_clause.table_name,
+            from_clause.final,
+            from_clause.sampling_rate,
+            query.get_prewhere_ast(),
+        )
+    return None
+
+
+def _query_key(query: ProcessableQuery[Any]) -> Optional[Hashable]:
+    source = _source_key(query)
+    if source is None:
+        return None
+    limitby = query.get_limitby()
+    key = (
+        type(query),
+        source,
+        tuple(query.get_selected_columns()),
+        tuple(query.get_arrayjoin() or ()),
+        query.get_condition(),
+        tuple(query.get_groupby()),
+        query.get_having(),
+        tuple(query.get_orderby()),
+        (limitby.limit, tuple(limitby.columns)) if limitby is not None else None,
+        query.get_limit(),
+        query.get_offset(),
+        query.has_totals(),
+        query.get_granularity(),
+        query.get_on_cluster(),
+        tuple(sorted(query.get_experiments().items())),
+        # Literals of different types can be equal (1, 1.0 and True) but
+        # are not formatted the same way.
+        tuple(
+            type(expression.value)
+            for expression in query.get_all_expressions()
+            if isinstance(expression, Literal)
+        ),
+    )
+    try:
+        hash(key)
+    except TypeError:
+        # Some literal values (and experiments) cannot be hashed.
+        return None
+    return key
+
+
+def _settings_key(query_settings: QuerySettings) -> Optional[Hashable]:
+    configs = state.get_raw_configs()
+    if not isinstance(configs, ConfigSnapshot):
+        # The configs could not be loaded, their content is unknown.
+        return None
+    return (
+        type(query_settings),
+        query_settings.referrer,
+        query_settings.get_turbo(),
+        query_settings.get_consistent(),
+        query_settings.get_legacy(),
+        tuple(sorted(query_settings.get_clickhouse_settings().items())),
+        configs.fingerprint,
+    )
+
+
+class PlanCache:
+    """
+    Bounded LRU cache of the ClickHouse queries produced by a processing
+    stage (``stage`` tags the metrics).
+    """
+
+    def __init__(self, stage: str, max_size: Optional[int] = None) -> None:
+        self.__tags = {"stage": stage}
+        self.__max_size = max_size if max_size is not None else settings.PLAN_CACHE_SIZE
+        self.__plans: OrderedDict[Hashable, _Plan] = OrderedDict()
+        self.__lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.__plans)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__plans.clear()
+
+    def process(
+        self,
+        query: InputQuery,
+        query_settings: QuerySettings,
+        process: Callable[[], ClickhouseQuery],
+        cacheable: bool = True,
+    ) -> ClickhouseQuery:
+        """
+        Returns the result of ``process``, which processes ``query`` in
+        place, or a copy of the result of the processing of an equal query.
+        """
+        if (
+            not cacheable
+            or self.__max_size <= 0
+            or query_settings.get_dry_run()
+            or not state.get_config("plan_cache_enabled", 1)
+        ):
+            return process()
+
+        start = time.perf_counter()
+        # The key is computed before the query is processed in place.
+        query_key = _query_key(query)
+        settings_key = _settings_key(query_settings)
+        if query_key is None or settings_key is None:
+            metrics.increment("uncacheable", tags=self.__tags)
+            return process()
+
+        key = (query_key, settings_key)
+        with self.__lock:
+            plan = self.__plans.get(key)
+            if plan is not None:
+                self.__plans.move_to_end(key)
+
+        if plan is not None:
+            if plan.clickhouse_settings != query_settings.get_clickhouse_settings():
+                query_settings.set_clickhouse_settings(dict(plan.clickhouse_settings))
+            processed = _copy_query(plan.query)
+            metrics.increment("hit", tags=self.__tags)
+            metrics.timing(
+                "saved",
+                (plan.duration - (time.perf_counter() - start)) * 1000,
+                tags=self.__tags,
+            )
+            return processed
+
+        metrics.increment("miss", tags=self.__tags)
+        processed = process()
+        plan = _Plan(
+            _copy_query(processed),
+            dict(query_settings.get_clickhouse_settings()),
+            time.perf_counter() - start,
+        )
+        with self.__lock:
+            self.__plans[key] = plan
+            while len(self.__plans) > self.__max_size:
+                self.__plans.popitem(last=False)
+        return processed
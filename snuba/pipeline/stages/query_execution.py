@@ -10,6 +10,7 @@ import sentry_sdk
 
 from snuba import environment
 from snuba import settings as snuba_settings
+from snuba import state
 from snuba.attribution.attribution_info import AttributionInfo
 from snuba.clickhouse.formatter.query import format_query
 from snuba.clickhouse.query import Query as ClickhouseQuery
@@ -39,7 +40,11 @@ from snuba.web import (
     QueryTooLongException,
     transform_column_names,
 )
-from snuba.web.db_query import db_query, update_query_metadata_and_stats
+from snuba.web.db_query import (
+    db_query,
+    db_query_stream,
+    update_query_metadata_and_stats,
+)
 
 metrics = MetricsWrapper(environment.metrics, "api")
 logger = logging.getLogger("snuba.pipeline.stages.query_execution")
@@ -166,7 +171,12 @@ def _run_and_apply_column_names(
         else:
             alias_name_mapping[alias] = [name]
 
-    transform_column_names(result, alias_name_mapping)
+    try:
+        transform_column_names(result, alias_name_mapping)
+    except BaseException:
+        if result.rows is not None:
+            result.rows.close()
+        raise
     return result
 
 
@@ -249,6 +259,19 @@ def _format_storage_query_and_run(
         span.set_tag("table", table_names)
 
         def execute() -> QueryResult:
+            if _should_stream(clickhouse_query, query_settings):
+                return db_query_stream(
+                    clickhouse_query=clickhouse_query,
+                    query_settings=query_settings,
+                    attribution_info=attribution_info,
+                    dataset_name=query_metadata.dataset,
+                    formatted_query=formatted_query,
+                    reader=reader,
+                    timer=timer,
+                    query_metadata_list=query_metadata.query_list,
+                    stats=stats,
+                    trace_id=span.trace_id,
+                )
             return db_query(
                 clickhouse_query=clickhouse_query,
                 query_settings=query_settings,
@@ -270,6 +293,23 @@ def _format_storage_query_and_run(
             return execute()
 
 
+def _should_stream(
+    clickhouse_query: ClickhouseQuery | CompositeQuery[Table],
+    query_settings: QuerySettings,
+) -> bool:
+    """
+    Streaming is opt in per request and gated by a runtime config. Queries
+    with totals are never streamed since the totals row is only available
+    after all the other rows, and dry runs since they do not run.
+    """
+    return (
+        query_settings.get_stream()
+        and bool(state.get_config("enable_streaming_results", 0))
+        and not clickhouse_query.has_totals()
+        and not query_settings.get_dry_run()
+    )
+
+
 def get_query_size_group(query_size_bytes: int) -> str:
     """
     Given the size of a query string in bytes, returns a string
@@ -1,3 +1,4 @@
+from functools import partial
 from typing import cast
 
 from snuba import state
@@ -9,19 +10,26 @@ from snuba.datasets.plans.storage_processing import (
     build_best_plan,
     transform_subscriptables,
 )
+from snuba.datasets.storages.factory import get_storage
 from snuba.pipeline.composite_entity_processing import translate_composite_query
 from snuba.pipeline.composite_storage_processing import (
     apply_composite_storage_processors,
     build_best_plan_for_composite_query,
 )
+from snuba.pipeline.plan_cache import PlanCache
 from snuba.pipeline.query_pipeline import QueryPipelineData, QueryPipelineStage
 from snuba.pipeline.storage_query_identity_translate import try_translate_storage_query
+from snuba.pipeline.utils.storage_finder import StorageKeyFinder
 from snuba.query.composite import CompositeQuery
 from snuba.query.data_source.simple import Entity, Table
 from snuba.query.logical import EntityQuery
 from snuba.query.logical import Query as LogicalQuery
+from snuba.query.query_settings import QuerySettings
 from snuba.request import Request
 
+entity_plan_cache = PlanCache("entity")
+storage_plan_cache = PlanCache("storage")
+
 
 class EntityProcessingStage(
     QueryPipelineStage[Request, ClickhouseQuery | CompositeQuery[Table]]
@@ -38,7 +46,13 @@ class EntityProcessingStage(
         if isinstance(query, LogicalQuery) and isinstance(
             query.get_from_clause(), Entity
         ):
-            return run_entity_processing_executor(query, pipe_input.query_settings)
+            return entity_plan_cache.process(
+                query,
+                pipe_input.query_settings,
+                partial(
+                    run_entity_processing_executor, query, pipe_input.query_settings
+                ),
+            )
         elif isinstance(query, CompositeQuery):
             # if we were not able to translate the storage query earlier and we got to this point, this is
             # definitely a composite entity query
@@ -62,17 +76,34 @@ class StorageProcessingStage(
         if state.get_config("apply_default_subscriptable_mapping", 1):
             query.transform_expressions(transform_subscriptables)
 
+    def _process_query(
+        self, query: ClickhouseQuery, query_settings: QuerySettings
+    ) -> ClickhouseQuery:
+        self._apply_default_subscriptable_mapping(query)
+        query_plan = build_best_plan(query, query_settings, [])
+        return apply_storage_processors(query_plan, query_settings)
+
     def _process_data(
         self, pipe_input: QueryPipelineData[ClickhouseQuery | CompositeQuery[Table]]
     ) -> ClickhouseQuery | CompositeQuery[Table]:
-        self._apply_default_subscriptable_mapping(pipe_input.data)
-        if isinstance(pipe_input.data, ClickhouseQuery):
-            query_plan = build_best_plan(pipe_input.data, pipe_input.query_settings, [])
-            return apply_storage_processors(query_plan, pipe_input.query_settings)
+        query = pipe_input.data
+        query_settings = pipe_input.query_settings
+        if isinstance(query, ClickhouseQuery):
+            storage = get_storage(StorageKeyFinder().visit(query))
+            return storage_plan_cache.process(
+                query,
+                query_settings,
+                partial(self._process_query, query, query_settings),
+                cacheable=all(
+                    processor.plan_cacheable
+                    for processor in storage.get_query_processors()
+                ),
+            )
         else:
+            self._apply_default_subscriptable_mapping(query)
             composite_query_plan = build_best_plan_for_composite_query(
-                pipe_input.data, pipe_input.query_settings, []
+                query, query_settings, []
             )
             return apply_composite_storage_processors(
-                composite_query_plan, pipe_input.query_settings
+                composite_query_plan, query_settings
             )
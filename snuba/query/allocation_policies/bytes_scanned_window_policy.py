@@ -23,6 +23,7 @@ from snuba.query.allocation_policies import (
     QuotaAllowance,
 )
 from snuba.redis import RedisClientKey, get_redis_client
+from snuba.state.quota_lease import get_budget_leases
 
 logger = logging.getLogger("snuba.query.bytes_scanned_window_policy")
 
@@ -115,6 +116,18 @@ class BytesScannedWindowAllocationPolicy(AllocationPolicy):
                 value_type=int,
                 default=1,
             ),
+            AllocationPolicyConfig(
+                name="local_lease_bytes",
+                description="Number of bytes of the quota of an org a process can let queries scan before checking the quota again (0 disables leasing). Queries admitted within that budget do not check the quota in redis and their usage is reported in batches, so the limit can be exceeded by up to this amount per process.",
+                value_type=int,
+                default=0,
+            ),
+            AllocationPolicyConfig(
+                name="local_lease_ttl_s",
+                description="Maximum number of seconds a process admits queries of an org and holds back their usage before reconciling with redis.",
+                value_type=int,
+                default=10,
+            ),
         ]
 
     def _are_tenant_ids_valid(
@@ -191,6 +204,24 @@ class BytesScannedWindowAllocationPolicy(AllocationPolicy):
         if org_id is not None:
             org_limit_bytes_scanned = self.__get_org_limit_bytes_scanned(org_id)
 
+            lease_bytes = self.get_config_value("local_lease_bytes")
+            leases = get_budget_leases(self.runtime_config_prefix)
+            if lease_bytes > 0:
+                leased_bytes = leases.admit(str(org_id))
+                if leased_bytes is not None:
+                    self.metrics.increment("local_lease_admitted")
+                    return QuotaAllowance(
+                        can_run=True,
+                        max_threads=self.max_threads,
+                        explanation={},
+                        is_throttled=False,
+                        throttle_threshold=org_limit_bytes_scanned,
+                        rejection_threshold=MAX_THRESHOLD,
+                        quota_used=max(org_limit_bytes_scanned - leased_bytes, 0),
+                        quota_unit=QUOTA_UNIT,
+                        suggestion=SUGGESTION,
+                    )
+
             timestamp, granted_quotas = _RATE_LIMITER.check_within_quotas(
                 [
                     RequestedQuota(
@@ -214,6 +245,16 @@ class BytesScannedWindowAllocationPolicy(AllocationPolicy):
             num_threads = self.max_threads
             explanation: dict[str, Any] = {}
             granted_quota = granted_quotas[0]
+            if lease_bytes > 0 and granted_quota.granted > 0:
+                self.metrics.increment("local_lease_acquired")
+                self.__use_quota(
+                    org_id,
+                    leases.grant(
+                        str(org_id),
+                        min(granted_quota.granted, lease_bytes),
+                        self.get_config_value("local_lease_ttl_s"),
+                    ),
+                )
             is_throttled = False
             if granted_quota.granted <= 0:
                 is_throttled = True
@@ -286,35 +327,44 @@ class BytesScannedWindowAllocationPolicy(AllocationPolicy):
         if bytes_scanned == 0:
             return
         if "organization_id" in tenant_ids:
-            org_limit_bytes_scanned = self.__get_org_limit_bytes_scanned(
-                tenant_ids.get("organization_id")
-            )
-            # we can assume that the requested quota was granted (because it was)
-            # we just need to update the quota with however many bytes were consumed
-            _RATE_LIMITER.use_quotas(
-                [
-                    RequestedQuota(
-                        f"{self.runtime_config_prefix}-organization_id-{tenant_ids['organization_id']}",
-                        bytes_scanned,
-                        [
-                            Quota(
-                                window_seconds=self.WINDOW_SECONDS,
-                                granularity_seconds=self.WINDOW_GRANULARITY_SECONDS,
-                                limit=org_limit_bytes_scanned,
-                                prefix_override=f"{self.runtime_config_prefix}-organization_id-{tenant_ids['organization_id']}",
-                            )
-                        ],
-                    )
-                ],
-                grants=[
-                    GrantedQuota(
-                        f"{self.runtime_config_prefix}-organization_id-{tenant_ids['organization_id']}",
-                        granted=bytes_scanned,
-                        reached_quotas=[],
-                    )
-                ],
-                timestamp=int(time.time()),
-            )
+            leases = get_budget_leases(self.runtime_config_prefix)
+            if not leases.consume(str(tenant_ids["organization_id"]), bytes_scanned):
+                self.__use_quota(tenant_ids["organization_id"], bytes_scanned)
+            # Report the usage held back by the leases that are used up or
+            # expired, for every org.
+            for org_id, pending_bytes in leases.collect_pending():
+                self.__use_quota(org_id, pending_bytes)
+
+    def __use_quota(self, org_id: Any, bytes_scanned: int) -> None:
+        if bytes_scanned <= 0:
+            return
+        org_limit_bytes_scanned = self.__get_org_limit_bytes_scanned(org_id)
+        # we can assume that the requested quota was granted (because it was)
+        # we just need to update the quota with however many bytes were consumed
+        _RATE_LIMITER.use_quotas(
+            [
+                RequestedQuota(
+                    f"{self.runtime_config_prefix}-organization_id-{org_id}",
+                    bytes_scanned,
+                    [
+                        Quota(
+                            window_seconds=self.WINDOW_SECONDS,
+                            granularity_seconds=self.WINDOW_GRANULARITY_SECONDS,
+                            limit=org_limit_bytes_scanned,
+                            prefix_override=f"{self.runtime_config_prefix}-organization_id-{org_id}",
+                        )
+                    ],
+                )
+            ],
+            grants=[
+                GrantedQuota(
+                    f"{self.runtime_config_prefix}-organization_id-{org_id}",
+                    granted=bytes_scanned,
+                    reached_quotas=[],
+                )
+            ],
+            timestamp=int(time.time()),
+        )
 
     def __get_org_limit_bytes_scanned(self, org_id: Any) -> int:
         """
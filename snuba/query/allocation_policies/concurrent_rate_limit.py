@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import logging
-from typing import Callable, cast
+import time
+from dataclasses import replace
+from typing import Callable, Optional, cast
 
 from snuba import state
 from snuba.query.allocation_policies import (
@@ -14,11 +16,14 @@ from snuba.query.allocation_policies import (
     QueryResultOrError,
     QuotaAllowance,
 )
+from snuba.state.quota_lease import LeasedSlots, get_slot_leases, get_started_requests
 from snuba.state.rate_limit import (
     RateLimitParameters,
     RateLimitStats,
     rate_limit_finish_request,
+    rate_limit_finish_requests,
     rate_limit_start_request,
+    rate_limit_start_requests,
 )
 
 DEFAULT_CONCURRENT_QUERIES_LIMIT = 22
@@ -39,7 +44,6 @@ from snuba.query.allocation_policies import MAX_THRESHOLD, NO_SUGGESTION
 
 QUOTA_UNIT = "concurrent_queries"
 SUGGESTION = "A customer is sending too many queries to snuba. The customer may be abusing an API or the queries may be innefficient"
-import typing
 
 
 class BaseConcurrentRateLimitAllocationPolicy(AllocationPolicy):
@@ -61,12 +65,150 @@ class BaseConcurrentRateLimitAllocationPolicy(AllocationPolicy):
                 value_type=int,
                 default=state.max_query_duration_s,
             ),
+            AllocationPolicyConfig(
+                name="local_lease_size",
+                description="""number of concurrency slots of a tenant a process reserves at once (0 disables leasing).
+                 Queries that fit in the slots reserved by the process are admitted without a round trip to redis.
+                 Reserved slots that are not used count towards the limit for other processes until the lease expires,
+                 so large values make the limit stricter than configured for tenants spread over many processes""",
+                value_type=int,
+                default=0,
+            ),
+            AllocationPolicyConfig(
+                name="local_lease_ttl_s",
+                description="""number of seconds a process can admit queries with the slots it reserved before reserving them again.
+                 Longer leases save more round trips to redis, but the slots a process reserved and does not use count
+                 towards the limit of the other processes for that long. Capped at max_query_duration_s, after which redis
+                 would stop counting the reserved slots""",
+                value_type=int,
+                default=5,
+            ),
         ]
 
     @property
     def rate_limit_name(self) -> str:
         raise NotImplementedError
 
+    def __release_slots(
+        self,
+        rate_limit_params: RateLimitParameters,
+        leased_slots: Optional[LeasedSlots],
+        rate_limit_prefix: str,
+        rate_limit_shard_factor: int,
+    ) -> None:
+        if leased_slots is not None and leased_slots.slots:
+            rate_limit_finish_requests(
+                [rate_limit_params] * len(leased_slots.slots),
+                leased_slots.slots,
+                rate_limit_shard_factor,
+                True,
+                rate_limit_prefix,
+                self.get_config_value("max_query_duration_s"),
+                leased_slots.started_at,
+                [leased_slots.backend] * len(leased_slots.slots),
+            )
+
+    def __release_expired_leases(
+        self,
+        rate_limit_params: RateLimitParameters,
+        rate_limit_prefix: str,
+        rate_limit_shard_factor: int,
+    ) -> None:
+        leases = get_slot_leases(rate_limit_prefix)
+        for bucket, expired_slots in leases.collect_expired():
+            self.__release_slots(
+                replace(rate_limit_params, bucket=bucket),
+                expired_slots,
+                rate_limit_prefix,
+                rate_limit_shard_factor,
+            )
+
+    def __get_lease_ttl(self) -> int:
+        # The slots are registered in redis like queries, which stop being
+        # counted after max_query_duration_s. A longer lease would keep
+        # admitting queries with slots redis does not count anymore.
+        return min(
+            self.get_config_value("local_lease_ttl_s"),
+            self.get_config_value("max_query_duration_s"),
+        )
+
+    def __is_within_leased_rate_limit(
+        self,
+        query_id: str,
+        rate_limit_params: RateLimitParameters,
+        rate_limit_prefix: str,
+        rate_history_s: int,
+        rate_limit_shard_factor: int,
+        lease_size: int,
+    ) -> tuple[RateLimitStats, bool, str]:
+        leases = get_slot_leases(rate_limit_prefix)
+        self.__release_expired_leases(
+            rate_limit_params, rate_limit_prefix, rate_limit_shard_factor
+        )
+
+        observed = leases.acquire(rate_limit_params.bucket, query_id)
+        if observed is not None:
+            self.metrics.increment("local_lease_admitted")
+            return (
+                RateLimitStats(rate=0, concurrent=observed),
+                True,
+                "within leased limit",
+            )
+
+        # Reserve the slots as if they were queries, in one round trip. The
+        # concurrency is counted after each one so the slots that would go
+        # over the limit can be given back.
+        slots = [f"{query_id}:lease-{i}" for i in range(lease_size)]
+        started_at = time.time()
+        all_stats = rate_limit_start_requests(
+            [rate_limit_params] * lease_size,
+            slots,
+            rate_history_s,
+            rate_limit_shard_factor,
+            rate_limit_prefix,
+            self.get_config_value("max_query_duration_s"),
+            started_at,
+        )
+        rate_limit_stats = all_stats[0]
+        if rate_limit_stats.concurrent == -1:
+            return rate_limit_stats, True, "rate limiter errored, failing open"
+
+        concurrent_limit = cast(int, rate_limit_params.concurrent_limit)
+        granted = [
+            slot
+            for slot, stats in zip(slots, all_stats)
+            if stats.concurrent <= concurrent_limit
+        ]
+        self.__release_slots(
+            rate_limit_params,
+            LeasedSlots(slots[len(granted) :], started_at, rate_limit_stats.backend),
+            rate_limit_prefix,
+            rate_limit_shard_factor,
+        )
+        if not granted:
+            return (
+                rate_limit_stats,
+                False,
+                f"concurrent policy {rate_limit_stats.concurrent} exceeds limit of {concurrent_limit}",
+            )
+
+        self.metrics.increment("local_lease_acquired")
+        self.__release_slots(
+            rate_limit_params,
+            leases.add(
+                rate_limit_params.bucket,
+                granted,
+                self.__get_lease_ttl(),
+                rate_limit_stats.concurrent,
+                started_at,
+                rate_limit_stats.backend,
+            ),
+            rate_limit_prefix,
+            rate_limit_shard_factor,
+        )
+        leases.acquire(rate_limit_params.bucket, query_id)
+        return rate_limit_stats, True, "within limit"
+
     def _is_within_rate_limit(
         self, query_id: str, rate_limit_params: RateLimitParameters
     ) -> tuple[RateLimitStats, bool, str]:
@@ -84,13 +226,32 @@ class BaseConcurrentRateLimitAllocationPolicy(AllocationPolicy):
 
         assert rate_limit_shard_factor > 0
 
+        lease_size = self.get_config_value("local_lease_size")
+        if lease_size > 0:
+            return self.__is_within_leased_rate_limit(
+                query_id,
+                rate_limit_params,
+                rate_limit_prefix,
+                rate_history_s,
+                rate_limit_shard_factor,
+                lease_size,
+            )
+
+        max_query_duration_s = self.get_config_value("max_query_duration_s")
+        started_at = time.time()
         rate_limit_stats = rate_limit_start_request(
             rate_limit_params,
             query_id,
             rate_history_s,
             rate_limit_shard_factor,
             rate_limit_prefix,
-            self.get_config_value("max_query_duration_s"),
+            max_query_duration_s,
+            started_at,
+        )
+        # The query has to be finished in the period and with the backend it
+        # was started with (see rate_limit_finish_requests).
+        get_started_requests(rate_limit_prefix).add(
+            query_id, started_at, rate_limit_stats.backend, max_query_duration_s
         )
         if rate_limit_stats.concurrent == -1:
             return rate_limit_stats, True, "rate limiter errored, failing open"
@@ -113,6 +274,31 @@ class BaseConcurrentRateLimitAllocationPolicy(AllocationPolicy):
         rate_limit_prefix = f"{self.runtime_config_prefix}.rate_limit"
         rate_limit_shard_factor = self.get_config_value("rate_limit_shard_factor")
 
+        bucket, slot = get_slot_leases(rate_limit_prefix).release(query_id)
+        if bucket is not None:
+            # The query ran with a leased slot, which goes back to the lease
+            # unless the lease expired in the meantime.
+            if slot is not None:
+                self.__release_slots(
+                    replace(rate_limit_params, bucket=bucket),
+                    slot,
+                    rate_limit_prefix,
+                    rate_limit_shard_factor,
+                )
+            # Give the idle slots of expired leases back now rather than on
+            # the next query, which may never come for this process.
+            self.__release_expired_leases(
+                rate_limit_params, rate_limit_prefix, rate_limit_shard_factor
+            )
+            return
+
+        started_at, backend = get_started_requests(rate_limit_prefix).pop(query_id)
+        if started_at is None:
+            # The query was not counted (e.g. a pass through referrer or a
+            # query rejected while leasing slots), finishing it would give
+            # back a slot held by another query with the counter backend.
+            return
+
         was_rate_limited = result_or_error.error is not None and isinstance(
             result_or_error.error.__cause__,
             AllocationPolicyViolations,
@@ -124,6 +310,8 @@ class BaseConcurrentRateLimitAllocationPolicy(AllocationPolicy):
             was_rate_limited,
             rate_limit_prefix,
             self.get_config_value("max_query_duration_s"),
+            started_at,
+            backend,
         )
 
 
@@ -269,8 +457,8 @@ class ConcurrentRateLimitAllocationPolicy(BaseConcurrentRateLimitAllocationPolic
             max_threads=self.max_threads,
             explanation={"reason": why, "overrides": overrides},
             is_throttled=False,
-            throttle_threshold=typing.cast(int, rate_limit_params.concurrent_limit),
-            rejection_threshold=typing.cast(int, rate_limit_params.concurrent_limit),
+            throttle_threshold=cast(int, rate_limit_params.concurrent_limit),
+            rejection_threshold=cast(int, rate_limit_params.concurrent_limit),
             quota_used=rate_limit_stats.concurrent,
             quota_unit=QUOTA_UNIT,
             suggestion=suggestion,
@@ -1,9 +1,20 @@
 from __future__ import annotations
 
-from abc import ABC, abstractmethod
+from abc import ABC, ABCMeta, abstractmethod
 from dataclasses import dataclass, replace
 from datetime import date, datetime
-from typing import Callable, Generic, Iterator, Optional, Tuple, TypeVar, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterator,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from snuba import settings
 
@@ -19,7 +30,7 @@ _AUTO_REPR = not settings.PRETTY_FORMAT_EXPRESSIONS
 
 
 # This is a workaround for a mypy bug, found here: https://github.com/python/mypy/issues/5374
-@dataclass(frozen=True, repr=_AUTO_REPR)
+@dataclass(frozen=True, repr=_AUTO_REPR, slots=True)
 class _Expression:
     # TODO: Make it impossible to assign empty string as an alias.
     alias: Optional[str]
@@ -33,8 +44,13 @@ class Expression(_Expression, ABC):
     function calls themselves in the AST), literals, etc.
 
     All expressions can have an optional alias.
+
+    Expressions are slotted and immutable, the subtrees a transformation
+    does not change are shared between the original tree and the result.
     """
 
+    __slots__ = ()
+
     @abstractmethod
     def transform(self, func: Callable[[Expression], Expression]) -> Expression:
         """
@@ -46,7 +62,8 @@ class Expression(_Expression, ABC):
 
         All expressions are frozen dataclasses. This means they are immutable and
         format will either return self or a new instance. It cannot transform the
-        expression in place.
+        expression in place. Nodes whose children are left unchanged are not
+        rebuilt, func is applied to the node itself.
         """
         raise NotImplementedError
 
@@ -257,6 +274,20 @@ class StringifyVisitor(ExpressionVisitor[str]):
         return f"{self._get_line_prefix()}({params_str}) ->\n{transformation_str}\n{self._get_line_prefix()}{self._get_alias_str(exp)}"
 
 
+def _transform_all(
+    expressions: Tuple[Expression, ...], func: Callable[[Expression], Expression]
+) -> Tuple[Expression, ...]:
+    """
+    Transforms every expression of the tuple, returns the tuple itself if
+    none of them changed.
+    """
+    transformed = tuple([expression.transform(func) for expression in expressions])
+    for before, after in zip(expressions, transformed):
+        if before is not after:
+            return transformed
+    return expressions
+
+
 class ColumnVisitor(ExpressionVisitor[set[str]]):
     def __init__(self) -> None:
         self.columns: set[str] = set()
@@ -290,15 +321,64 @@ class ColumnVisitor(ExpressionVisitor[set[str]]):
 
 OptionalScalarType = Union[None, bool, str, float, int, date, datetime]
 
+# Maximum number of leaves of each interned class, the table is emptied when
+# it is full so the leaves currently in use make it back in.
+INTERN_TABLE_SIZE = 10000
+
+
+class _InternedMeta(ABCMeta):
+    """
+    Metaclass of the leaves of the AST which are interned: the same columns
+    and literals are built over and over again by the parsers, the
+    translators and the processors. Equal leaves are the same object, which
+    saves the allocations and makes comparing the trees containing them
+    faster since equal elements of a tuple are compared by identity first.
+
+    ``_intern_key`` returns the key of the node built from the arguments,
+    or None if the node should not be interned.
+    """
+
+    _intern_key: Callable[..., Optional[Hashable]]
+
+    def __init__(cls, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        cls._interned: Dict[Hashable, Any] = {}
+
+    def __call__(cls, *args: Any, **kwargs: Any) -> Any:
+        key = cls._intern_key(*args, **kwargs)
+        if key is None:
+            return super().__call__(*args, **kwargs)
+        interned = cls._interned
+        instance = interned.get(key)
+        if instance is None:
+            instance = super().__call__(*args, **kwargs)
+            if len(interned) >= INTERN_TABLE_SIZE:
+                interned.clear()
+            interned[key] = instance
+        return instance
+
+
+# Values can be equal without being formatted the same way (1 and True, 0.0
+# and -0.0, datetimes in different timezones). Only the literals of these
+# types are interned, with the type of their value in the key.
+_INTERNED_LITERAL_TYPES = (type(None), bool, int, str)
 
-@dataclass(frozen=True, repr=_AUTO_REPR)
-class Literal(Expression):
+
+@dataclass(frozen=True, repr=_AUTO_REPR, slots=True)
+class Literal(Expression, metaclass=_InternedMeta):
     """
     A literal in the SQL expression
     """
 
     value: OptionalScalarType
 
+    @staticmethod
+    def _intern_key(*args: Any, **kwargs: Any) -> Optional[Hashable]:
+        value = args[1] if len(args) > 1 else kwargs.get("value")
+        if type(value) not in _INTERNED_LITERAL_TYPES:
+            return None
+        return (args, tuple(kwargs.items()), type(value))
+
     def transform(self, func: Callable[[Expression], Expression]) -> Expression:
         return func(self)
 
@@ -314,8 +394,8 @@ class Literal(Expression):
         return self.value == other.value
 
 
-@dataclass(frozen=True, repr=_AUTO_REPR)
-class Column(Expression):
+@dataclass(frozen=True, repr=_AUTO_REPR, slots=True)
+class Column(Expression, metaclass=_InternedMeta):
     """
     Represent a column in the schema of the dataset.
     """
@@ -323,6 +403,10 @@ class Column(Expression):
     table_name: Optional[str]
     column_name: str
 
+    @staticmethod
+    def _intern_key(*args: Any, **kwargs: Any) -> Optional[Hashable]:
+        return (args, tuple(kwargs.items()))
+
     def transform(self, func: Callable[[Expression], Expression]) -> Expression:
         return func(self)
 
@@ -341,7 +425,7 @@ class Column(Expression):
         )
 
 
-@dataclass(frozen=True, repr=_AUTO_REPR)
+@dataclass(frozen=True, repr=_AUTO_REPR, slots=True)
 class SubscriptableReference(Expression):
     """
     Accesses one entry of a subscriptable column (for example key based access on
@@ -360,12 +444,11 @@ class SubscriptableReference(Expression):
         return visitor.visit_subscriptable_reference(self)
 
     def transform(self, func: Callable[[Expression], Expression]) -> Expression:
-        transformed = replace(
-            self,
-            column=self.column.transform(func),
-            key=self.key.transform(func),
-        )
-        return func(transformed)
+        column = self.column.transform(func)
+        key = self.key.transform(func)
+        if column is self.column and key is self.key:
+            return func(self)
+        return func(replace(self, column=column, key=key))
 
     def __iter__(self) -> Iterator[Expression]:
         # Since column is a column and key is a literal and since none of
@@ -387,7 +470,7 @@ class SubscriptableReference(Expression):
         )
 
 
-@dataclass(frozen=True, repr=_AUTO_REPR)
+@dataclass(frozen=True, repr=_AUTO_REPR, slots=True)
 class FunctionCall(Expression):
     """
     Represents an expression that resolves to a function call on Clickhouse.
@@ -415,11 +498,10 @@ class FunctionCall(Expression):
         transformation function and we do not run that same function over the
         new children.
         """
-        transformed = replace(
-            self,
-            parameters=tuple(map(lambda child: child.transform(func), self.parameters)),
-        )
-        return func(transformed)
+        parameters = _transform_all(self.parameters, func)
+        if parameters is self.parameters:
+            return func(self)
+        return func(replace(self, parameters=parameters))
 
     def __iter__(self) -> Iterator[Expression]:
         """
@@ -450,7 +532,7 @@ class FunctionCall(Expression):
         return True
 
 
-@dataclass(frozen=True, repr=_AUTO_REPR)
+@dataclass(frozen=True, repr=_AUTO_REPR, slots=True)
 class CurriedFunctionCall(Expression):
     """
     This function call represent a function with currying: f(x)(y).
@@ -475,12 +557,16 @@ class CurriedFunctionCall(Expression):
         one transforms the internal function before applying the function to the
         parameters.
         """
-        transformed = replace(
-            self,
-            internal_function=self.internal_function.transform(func),
-            parameters=tuple(map(lambda child: child.transform(func), self.parameters)),
+        internal_function = self.internal_function.transform(func)
+        parameters = _transform_all(self.parameters, func)
+        if (
+            internal_function is self.internal_function
+            and parameters is self.parameters
+        ):
+            return func(self)
+        return func(
+            replace(self, internal_function=internal_function, parameters=parameters)
         )
-        return func(transformed)
 
     def __iter__(self) -> Iterator[Expression]:
         """
@@ -509,7 +595,7 @@ class CurriedFunctionCall(Expression):
         return True
 
 
-@dataclass(frozen=True, repr=_AUTO_REPR)
+@dataclass(frozen=True, repr=_AUTO_REPR, slots=True)
 class Argument(Expression):
     """
     A bound variable in a lambda expression. This is used to refer to variables
@@ -533,7 +619,7 @@ class Argument(Expression):
         return self.name == other.name
 
 
-@dataclass(frozen=True, repr=_AUTO_REPR)
+@dataclass(frozen=True, repr=_AUTO_REPR, slots=True)
 class Lambda(Expression):
     """
     A lambda expression in the form (x,y,z -> transform(x,y,z))
@@ -550,8 +636,10 @@ class Lambda(Expression):
         Applies the transformation to the inner expression but not to the parameters
         declaration.
         """
-        transformed = replace(self, transformation=self.transformation.transform(func))
-        return func(transformed)
+        transformation = self.transformation.transform(func)
+        if transformation is self.transformation:
+            return func(self)
+        return func(replace(self, transformation=transformation))
 
     def __iter__(self) -> Iterator[Expression]:
         """
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import logging
+import re
 from dataclasses import dataclass, replace
+from functools import partial
 from typing import Any, Callable, Dict, Optional, Sequence, Tuple, Union
 
 import sentry_sdk
@@ -57,6 +59,7 @@ from snuba.query.mql.context_population import (
     start_end_time_condition,
 )
 from snuba.query.mql.mql_context import MQLContext
+from snuba.query.parser.cache import LiteralKind, ParseCache
 from snuba.query.parser.exceptions import ParsingException
 from snuba.query.processors.logical.filter_in_select_optimizer import (
     FilterInSelectOptimizer,
@@ -102,6 +105,24 @@ UNARY_OPERATORS = {
     "-": "negate",
 }
 
+# Quoted strings ending with a wildcard are parsed as a LIKE condition rather
+# than an equality, they are part of the shape of the query. The pattern of
+# strings is the one of quoted_string.
+mql_parse_cache = ParseCache(
+    "mql",
+    re.compile(
+        r"(?P<quoted_mri>`[^`]*`)"
+        r'|(?P<wildcard>"[^"\\]*(?:\\.[^"\\]*)*\*")'
+        r'|(?P<string>"([^"\\]*(?:\\.[^"\\]*)*)")'
+    ),
+    {
+        "string": LiteralKind(
+            lambda text: text[1:-1].replace('\\"', '"'),
+            lambda i: f'"__snuba_literal_{i}__"',
+        )
+    },
+)
+
 
 class MQLVisitor(NodeVisitor):  # type: ignore
     """
@@ -1379,7 +1400,11 @@ class ParsePopulateResolveMQL(
         mql_str, dataset, mql_context_dict, settings = pipe_input.data
 
         with sentry_sdk.start_span(op="parser", description="parse_mql_query_initial"):
-            query = parse_mql_query_body(mql_str, dataset)
+            query = mql_parse_cache.parse(
+                mql_str,
+                partial(parse_mql_query_body, dataset=dataset),
+                get_dataset_name(dataset),
+            )
 
         with sentry_sdk.start_span(
             op="parser", description="populate_query_from_mql_context"
@@ -0,0 +1,292 @@
+"""
+Cache of the ASTs produced by the parsers, keyed by the shape of the query.
+
+Most queries are generated by a few thousand templates and only differ by
+the literals they contain (ids, dates, tag values...). The body of a query
+is split into its literal tokens and the text around them, the shape. A
+shape is parsed once, with a unique sentinel in place of each literal, and
+the resulting AST is kept. The queries with the same shape get a copy of
+that AST where the sentinels are replaced by their own literals, which is
+much faster than running the grammar and the visitor.
+
+The tokenizer of a language only knows about the lexical structure of the
+queries, it cannot tell whether the value of a token may change how the
+rest of the query is parsed. So the first time a shape is seen, the query
+is parsed as usual and the AST produced by the template is compared with
+it: the shapes whose AST does not only depend on the literals through
+``Literal`` nodes (and the aliases derived from the text of the query) are
+never parsed from the cache.
+"""
+
+from __future__ import annotations
+
+import copy
+import re
+from collections import OrderedDict
+from dataclasses import replace
+from threading import Lock
+from typing import (
+    Any,
+    Callable,
+    Hashable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from snuba import environment, settings, state
+from snuba.query import Query
+from snuba.query.composite import CompositeQuery
+from snuba.query.data_source.join import JoinClause
+from snuba.query.expressions import Expression, Literal
+from snuba.utils.metrics.wrapper import MetricsWrapper
+
+metrics = MetricsWrapper(environment.metrics, "parser.cache")
+
+TQuery = TypeVar("TQuery", bound=Query)
+
+
+class LiteralKind(NamedTuple):
+    # Returns the value of a token of this kind, the one the visitor of the
+    # language puts in the ``Literal`` node.
+    value: Callable[[str], Any]
+    # Returns the text of the i-th sentinel. Sentinels must not be prefixes
+    # of one another and should not be found in real queries.
+    sentinel: Callable[[int], str]
+
+
+# The fragments of text between the literals of the query and the kind of
+# each literal.
+Shape = Tuple[Tuple[str, ...], Tuple[str, ...]]
+Key = Tuple[Hashable, Shape]
+
+
+class _Template(NamedTuple):
+    query: Query
+    # Index of the token each sentinel value stands for.
+    indexes: Mapping[Any, int]
+    # Aliases and selected expression names which contain sentinels.
+    names: frozenset[str]
+    sentinels: Optional[Pattern[str]]
+    texts: Mapping[str, int]
+
+
+def _rebind(
+    query: TQuery,
+    bind: Callable[[Expression], Expression],
+    rename: Callable[[str], str],
+) -> TQuery:
+    # Expressions are immutable and processing replaces the fields of the
+    # query rather than modifying them, so a shallow copy whose expressions
+    # are all transformed shares nothing mutable with the template.
+    copied = copy.copy(query)
+    copied.set_experiments({**query.get_experiments()})
+    copied.transform_expressions(bind)
+    copied.set_ast_selected_columns(
+        [
+            replace(selected, name=rename(selected.name)) if selected.name else selected
+            for selected in copied.get_selected_columns()
+        ]
+    )
+    if isinstance(copied, CompositeQuery):
+        from_clause = copied.get_from_clause()
+        if isinstance(from_clause, Query):
+            copied.set_from_clause(_rebind(from_clause, bind, rename))
+        elif isinstance(from_clause, JoinClause):
+            copied.set_from_clause(_copy_join_clause(from_clause))
+    return copied
+
+
+def _copy_join_clause(join_clause: JoinClause[Any]) -> JoinClause[Any]:
+    # The MQL parser adds keys to the join clauses of the query it parsed.
+    left_node = join_clause.left_node
+    if isinstance(left_node, JoinClause):
+        left_node = _copy_join_clause(left_node)
+    return replace(join_clause, left_node=left_node, keys=list(join_clause.keys))
+
+
+def _walk(query: Query) -> Iterator[Query]:
+    yield query
+    if isinstance(query, CompositeQuery):
+        from_clause = query.get_from_clause()
+        if isinstance(from_clause, Query):
+            yield from _walk(from_clause)
+
+
+def _is_supported(query: Query) -> bool:
+    if isinstance(query, CompositeQuery):
+        from_clause = query.get_from_clause()
+        if isinstance(from_clause, Query):
+            return _is_supported(from_clause)
+        if isinstance(from_clause, JoinClause):
+            return not any(
+                isinstance(node.data_source, Query)
+                for node in from_clause.get_alias_node_map().values()
+            )
+    return True
+
+
+class ParseCache:
+    """
+    Bounded LRU cache of the ASTs of the query shapes of a language.
+
+    ``pattern`` finds the tokens of the query. Matches of a named group
+    listed in ``kinds`` are literals, any other match is kept as part of
+    the shape: it lets the tokenizer skip the parts of the query where
+    something that looks like a literal is not one (identifiers, quoted
+    aliases, LIMIT clauses...).
+    """
+
+    def __init__(
+        self,
+        language: str,
+        pattern: Pattern[str],
+        kinds: Mapping[str, LiteralKind],
+        max_size: Optional[int] = None,
+    ) -> None:
+        self.__language = language
+        self.__pattern = pattern
+        self.__kinds = kinds
+        self.__max_size = (
+            max_size if max_size is not None else settings.PARSE_CACHE_SIZE
+        )
+        self.__templates: OrderedDict[Key, Optional[_Template]] = OrderedDict()
+        self.__lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.__templates)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__templates.clear()
+
+    def tokenize(self, body: str) -> Tuple[Shape, Sequence[str]]:
+        fragments: List[str] = []
+        kinds: List[str] = []
+        tokens: List[str] = []
+        position = 0
+        for match in self.__pattern.finditer(body):
+            kind = match.lastgroup
+            if kind is None or kind not in self.__kinds:
+                continue
+            fragments.append(body[position : match.start()])
+            kinds.append(kind)
+            tokens.append(match.group())
+            position = match.end()
+        fragments.append(body[position:])
+        return (tuple(fragments), tuple(kinds)), tokens
+
+    def parse(
+        self, body: str, parse: Callable[[str], TQuery], context: Hashable = None
+    ) -> TQuery:
+        """
+        Returns the AST of the body, which ``parse`` produces. ``context``
+        is part of the key, it identifies anything other than the body the
+        result of ``parse`` depends on.
+        """
+        if self.__max_size <= 0 or not state.get_config("parse_cache_enabled", 1):
+            return parse(body)
+
+        tags = {"language": self.__language}
+        shape, tokens = self.tokenize(body)
+        key = (context, shape)
+        with self.__lock:
+            found = key in self.__templates
+            if found:
+                self.__templates.move_to_end(key)
+                template = self.__templates[key]
+
+        if found:
+            if template is None:
+                metrics.increment("uncacheable", tags=tags)
+                return parse(body)
+            metrics.increment("hit", tags=tags)
+            return self.__bind(template, shape, tokens)  # type: ignore
+
+        metrics.increment("miss", tags=tags)
+        query = parse(body)
+        template = self.__build_template(shape, tokens, parse, query)
+        with self.__lock:
+            self.__templates[key] = template
+            while len(self.__templates) > self.__max_size:
+                self.__templates.popitem(last=False)
+        return query
+
+    def __bind(self, template: _Template, shape: Shape, tokens: Sequence[str]) -> Query:
+        _, kinds = shape
+        values = [self.__kinds[kind].value(token) for kind, token in zip(kinds, tokens)]
+        indexes = template.indexes
+        names = template.names
+
+        def rename(name: str) -> str:
+            if name not in names:
+                return name
+            assert template.sentinels is not None
+            return template.sentinels.sub(
+                lambda match: tokens[template.texts[match.group()]], name
+            )
+
+        def bind(expression: Expression) -> Expression:
+            if isinstance(expression, Literal) and expression.value in indexes:
+                expression = Literal(
+                    expression.alias, values[indexes[expression.value]]
+                )
+            if expression.alias is not None and expression.alias in names:
+                expression = replace(expression, alias=rename(expression.alias))
+            return expression
+
+        return _rebind(template.query, bind, rename)
+
+    def __build_template(
+        self,
+        shape: Shape,
+        tokens: Sequence[str],
+        parse: Callable[[str], Query],
+        expected: Query,
+    ) -> Optional[_Template]:
+        fragments, kinds = shape
+        texts = [self.__kinds[kind].sentinel(i) for i, kind in enumerate(kinds)]
+        probe = "".join(
+            fragment + text for fragment, text in zip(fragments, [*texts, ""])
+        )
+        try:
+            query = parse(probe)
+        except Exception:
+            return None
+        if not _is_supported(query):
+            return None
+
+        sentinels = (
+            re.compile("|".join(re.escape(text) for text in texts)) if texts else None
+        )
+        names = set()
+        if sentinels is not None:
+            for subquery in _walk(query):
+                for expression in subquery.get_all_expressions():
+                    alias = expression.alias
+                    if alias is not None and sentinels.search(alias):
+                        names.add(alias)
+                for selected in subquery.get_selected_columns():
+                    name = selected.name
+                    if name is not None and sentinels.search(name):
+                        names.add(name)
+
+        template = _Template(
+            query=query,
+            indexes={
+                self.__kinds[kind].value(text): i
+                for i, (kind, text) in enumerate(zip(kinds, texts))
+            },
+            names=frozenset(names),
+            sentinels=sentinels,
+            texts={text: i for i, text in enumerate(texts)},
+        )
+        if self.__bind(template, shape, tokens) != expected:
+            return None
+        return template
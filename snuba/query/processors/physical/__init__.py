@@ -1,11 +1,12 @@
 import os
 from abc import ABC, abstractmethod
-from typing import cast
+from typing import ClassVar, FrozenSet, List, Sequence, cast
 
 from snuba.clickhouse.query import Query
 from snuba.query.composite import CompositeQuery
 from snuba.query.data_source.simple import Table
 from snuba.query.query_settings import QuerySettings
+from snuba.query.rewriter import Rule, rewrite_query
 from snuba.utils.registered_class import RegisteredClass, import_submodules_in_directory
 
 
@@ -24,6 +25,12 @@ class ClickhouseQueryProcessor(ABC, metaclass=RegisteredClass):
     instance will be reused.
     """
 
+    # Whether the result of the processor only depends on the query, the query
+    # settings and the runtime configs. The queries of a storage with a processor
+    # depending on anything else (state kept in Redis for example) are never
+    # served from the plan cache (see snuba.pipeline.plan_cache).
+    plan_cacheable: ClassVar[bool] = True
+
     @classmethod
     def from_kwargs(cls, **kwargs: str) -> "ClickhouseQueryProcessor":
         return cls(**kwargs)
@@ -42,6 +49,79 @@ class ClickhouseQueryProcessor(ABC, metaclass=RegisteredClass):
         return cast("ClickhouseQueryProcessor", cls.class_from_name(name))
 
 
+class ExpressionRewritingProcessor(ClickhouseQueryProcessor):
+    """
+    A processor that only rewrites the expressions of the query node by node
+    through rules (see snuba.query.rewriter). The rules of the consecutive
+    rewriting processors of a storage are applied in a single traversal of
+    the query (see fuse_processors), so they must follow the constraints
+    described in snuba.query.rewriter with respect to one another.
+    """
+
+    # Config keys of the processors this one is never fused with when they
+    # come before it: the ones it needs to have rewritten the whole query,
+    # its rules included, before its rules are built or applied.
+    depends_on: ClassVar[FrozenSet[str]] = frozenset()
+
+    @abstractmethod
+    def get_rules(self, query: Query, query_settings: QuerySettings) -> Sequence[Rule]:
+        """
+        Returns the rules to apply to the query. When the processor is fused
+        with others, this is called before any of them rewrites the query.
+        """
+        raise NotImplementedError
+
+    def process_query(self, query: Query, query_settings: QuerySettings) -> None:
+        rewrite_query(query, self.get_rules(query, query_settings))
+
+
+class FusedRewritingProcessor(ExpressionRewritingProcessor):
+    """
+    Applies the rules of a sequence of rewriting processors in a single
+    traversal of the query.
+    """
+
+    def __init__(self, processors: Sequence[ExpressionRewritingProcessor]) -> None:
+        self.processors = processors
+
+    def get_rules(self, query: Query, query_settings: QuerySettings) -> Sequence[Rule]:
+        return [
+            rule
+            for processor in self.processors
+            for rule in processor.get_rules(query, query_settings)
+        ]
+
+
+def fuse_processors(
+    processors: Sequence[ClickhouseQueryProcessor],
+) -> Sequence[ClickhouseQueryProcessor]:
+    """
+    Replaces each run of consecutive rewriting processors which do not
+    depend on one another with a processor that applies all their rules in
+    one traversal. The order of the processors is preserved.
+    """
+    fused: List[ClickhouseQueryProcessor] = []
+    group: List[ExpressionRewritingProcessor] = []
+
+    def close_group() -> None:
+        if len(group) > 1:
+            fused.append(FusedRewritingProcessor(list(group)))
+        else:
+            fused.extend(group)
+        group.clear()
+
+    for processor in processors:
+        if not isinstance(processor, ExpressionRewritingProcessor):
+            close_group()
+            fused.append(processor)
+            continue
+        if any(member.config_key() in processor.depends_on for member in group):
+            close_group()
+        group.append(processor)
+    close_group()
+    return fused
+
+
 class CompositeQueryProcessor(ABC):
     """
     A transformation applied to a Clickhouse Composite Query.
@@ -2,18 +2,21 @@ from typing import Sequence
 
 from snuba.clickhouse.query import Query
 from snuba.query.expressions import Expression
+from snuba.query.expressions import FunctionCall as FunctionCallExpr
 from snuba.query.matchers import (
     Any,
     Column,
     FunctionCall,
     Integer,
     Literal,
+    MatchResult,
     Or,
     Param,
     String,
 )
-from snuba.query.processors.physical import ClickhouseQueryProcessor
+from snuba.query.processors.physical import ExpressionRewritingProcessor
 from snuba.query.query_settings import QuerySettings
+from snuba.query.rewriter import Rule
 
 """
 This optimizer is necessary because SnQL does not permit conditions like
@@ -26,7 +29,7 @@ leverage the bloom filter index if they exist.
 """
 
 
-class ArrayHasOptimizer(ClickhouseQueryProcessor):
+class ArrayHasOptimizer(ExpressionRewritingProcessor):
     def __init__(self, array_columns: Sequence[str]):
         self.__array_has_pattern = FunctionCall(
             String("equals"),
@@ -49,14 +52,8 @@ class ArrayHasOptimizer(ClickhouseQueryProcessor):
             ),
         )
 
-    def process_query(self, query: Query, query_settings: QuerySettings) -> None:
-        def replace_expression(expr: Expression) -> Expression:
-            match = self.__array_has_pattern.match(expr)
-
-            # The has condition we are looking for are not present, so skip this entirely
-            if match is None:
-                return expr
-
+    def get_rules(self, query: Query, query_settings: QuerySettings) -> Sequence[Rule]:
+        def replace_expression(expr: Expression, match: MatchResult) -> Expression:
             return match.expression("has")
 
-        query.transform_expressions(replace_expression)
+        return [Rule(replace_expression, FunctionCallExpr, self.__array_has_pattern)]
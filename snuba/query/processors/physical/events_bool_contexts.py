@@ -1,4 +1,5 @@
 from dataclasses import replace
+from typing import Sequence
 
 from snuba.clickhouse.query import Query
 from snuba.query.conditions import ConditionFunctions, binary_condition
@@ -6,12 +7,13 @@ from snuba.query.dsl import literals_tuple
 from snuba.query.expressions import Expression
 from snuba.query.expressions import FunctionCall as FunctionCallExpr
 from snuba.query.expressions import Literal as LiteralExpr
-from snuba.query.matchers import Column, FunctionCall, Literal, Or, String
-from snuba.query.processors.physical import ClickhouseQueryProcessor
+from snuba.query.matchers import Column, FunctionCall, Literal, MatchResult, Or, String
+from snuba.query.processors.physical import ExpressionRewritingProcessor
 from snuba.query.query_settings import QuerySettings
+from snuba.query.rewriter import Rule
 
 
-class EventsPromotedBooleanContextsProcessor(ClickhouseQueryProcessor):
+class EventsPromotedBooleanContextsProcessor(ExpressionRewritingProcessor):
     """
     When Discover started using contexts it turned out that, if we return
     promoted contexts through the contexts[...] syntax we have an inconsistency
@@ -30,7 +32,7 @@ class EventsPromotedBooleanContextsProcessor(ClickhouseQueryProcessor):
     patch to the events storage for as long as it exists.
     """
 
-    def process_query(self, query: Query, query_settings: QuerySettings) -> None:
+    def get_rules(self, query: Query, query_settings: QuerySettings) -> Sequence[Rule]:
         # We care only of promoted contexts, so we do not need to match
         # the original nested expression.
         matcher = FunctionCall(
@@ -49,38 +51,36 @@ class EventsPromotedBooleanContextsProcessor(ClickhouseQueryProcessor):
             ),
         )
 
-        def replace_exp(exp: Expression) -> Expression:
-            if matcher.match(exp) is not None:
-                inner = replace(exp, alias=None)
-                return FunctionCallExpr(
-                    exp.alias,
-                    "if",
-                    (
-                        binary_condition(
-                            ConditionFunctions.IN,
-                            inner,
-                            literals_tuple(
-                                None,
-                                [LiteralExpr(None, "1"), LiteralExpr(None, "True")],
-                            ),
+        def replace_exp(exp: Expression, _: MatchResult) -> Expression:
+            inner = replace(exp, alias=None)
+            return FunctionCallExpr(
+                exp.alias,
+                "if",
+                (
+                    binary_condition(
+                        ConditionFunctions.IN,
+                        inner,
+                        literals_tuple(
+                            None,
+                            [LiteralExpr(None, "1"), LiteralExpr(None, "True")],
                         ),
-                        LiteralExpr(None, "True"),
-                        LiteralExpr(None, "False"),
                     ),
-                )
-            return exp
+                    LiteralExpr(None, "True"),
+                    LiteralExpr(None, "False"),
+                ),
+            )
 
-        query.transform_expressions(replace_exp)
+        return [Rule(replace_exp, FunctionCallExpr, matcher)]
 
 
-class EventsBooleanContextsProcessor(ClickhouseQueryProcessor):
+class EventsBooleanContextsProcessor(ExpressionRewritingProcessor):
     """
     Like EventsPromotedBooleanContextsProcessor but operates on the
     non promoted context fields to ensure the same results get returned
     from the errors and events storages.
     """
 
-    def process_query(self, query: Query, query_settings: QuerySettings) -> None:
+    def get_rules(self, query: Query, query_settings: QuerySettings) -> Sequence[Rule]:
         matcher = FunctionCall(
             String("arrayElement"),
             (
@@ -106,28 +106,23 @@ class EventsBooleanContextsProcessor(ClickhouseQueryProcessor):
             ),
         )
 
-        def process_column(exp: Expression) -> Expression:
-            match = matcher.match(exp)
-
-            if match:
-                inner = replace(exp, alias=None)
-                return FunctionCallExpr(
-                    exp.alias,
-                    "if",
-                    (
-                        binary_condition(
-                            ConditionFunctions.IN,
-                            inner,
-                            literals_tuple(
-                                None,
-                                [LiteralExpr(None, "1"), LiteralExpr(None, "True")],
-                            ),
+        def process_column(exp: Expression, _: MatchResult) -> Expression:
+            inner = replace(exp, alias=None)
+            return FunctionCallExpr(
+                exp.alias,
+                "if",
+                (
+                    binary_condition(
+                        ConditionFunctions.IN,
+                        inner,
+                        literals_tuple(
+                            None,
+                            [LiteralExpr(None, "1"), LiteralExpr(None, "True")],
                         ),
-                        LiteralExpr(None, "True"),
-                        LiteralExpr(None, "False"),
                     ),
-                )
-
-            return exp
+                    LiteralExpr(None, "True"),
+                    LiteralExpr(None, "False"),
+                ),
+            )
 
-        query.transform_expressions(process_column)
+        return [Rule(process_column, FunctionCallExpr, matcher)]
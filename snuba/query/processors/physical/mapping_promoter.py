@@ -1,4 +1,4 @@
-from typing import Mapping, NamedTuple, Optional
+from typing import Mapping, NamedTuple, Optional, Sequence
 
 from snuba.clickhouse.query import Query
 from snuba.clickhouse.translators.snuba.mappers import (
@@ -9,8 +9,10 @@ from snuba.clickhouse.translators.snuba.mappers import (
     mapping_pattern,
 )
 from snuba.query.expressions import Column, Expression, FunctionCall
-from snuba.query.processors.physical import ClickhouseQueryProcessor
+from snuba.query.matchers import MatchResult
+from snuba.query.processors.physical import ExpressionRewritingProcessor
 from snuba.query.query_settings import QuerySettings
+from snuba.query.rewriter import Rule
 
 
 class SubscriptableMatch(NamedTuple):
@@ -64,7 +66,7 @@ def match_subscriptable_reference(exp: Expression) -> Optional[SubscriptableMatc
     )
 
 
-class MappingColumnPromoter(ClickhouseQueryProcessor):
+class MappingColumnPromoter(ExpressionRewritingProcessor):
     """
     Promotes expressions that access the value of a mapping column by
     replacing them with the corresponding promoted column provided in
@@ -90,8 +92,8 @@ class MappingColumnPromoter(ClickhouseQueryProcessor):
         self.__specs = mapping_specs
         self.__cast_to_string = cast_to_string
 
-    def process_query(self, query: Query, query_settings: QuerySettings) -> None:
-        def transform_nested_column(exp: Expression) -> Expression:
+    def get_rules(self, query: Query, query_settings: QuerySettings) -> Sequence[Rule]:
+        def transform_nested_column(exp: Expression, _: MatchResult) -> Expression:
             subscript = match_subscriptable_reference(exp)
             if subscript is None:
                 return exp
@@ -129,4 +131,4 @@ class MappingColumnPromoter(ClickhouseQueryProcessor):
 
             return exp
 
-        query.transform_expressions(transform_nested_column)
+        return [Rule(transform_nested_column, FunctionCall)]
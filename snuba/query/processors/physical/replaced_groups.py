@@ -32,6 +32,9 @@ class PostReplacementConsistencyEnforcer(ClickhouseQueryProcessor):
     have to remove those rows manually or to run the query in FINAL mode.
     """
 
+    # The replaced groups are read from Redis.
+    plan_cacheable = False
+
     def __init__(self, project_column: str, replacer_state_name: Optional[str]) -> None:
         self.__project_column = project_column
         self.__groups_column = "group_id"
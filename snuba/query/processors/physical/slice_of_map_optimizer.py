@@ -1,17 +1,20 @@
+from typing import Sequence
+
 from snuba.clickhouse.query import Query
 from snuba.query.expressions import Expression, FunctionCall
-from snuba.query.processors.physical import ClickhouseQueryProcessor
+from snuba.query.processors.physical import ExpressionRewritingProcessor
 from snuba.query.query_settings import QuerySettings
+from snuba.query.rewriter import Rule
 
 
-class SliceOfMapOptimizer(ClickhouseQueryProcessor):
+class SliceOfMapOptimizer(ExpressionRewritingProcessor):
     """
     Convert `arraySlice(arrayMap(...))` to `arrayMap(arraySlice(...))`. This is
     a pattern often produced by UUIDArrayColumnProcessor.
     """
 
-    def process_query(self, query: Query, query_settings: QuerySettings) -> None:
-        query.transform_expressions(self._process_expressions)
+    def get_rules(self, query: Query, query_settings: QuerySettings) -> Sequence[Rule]:
+        return [Rule(lambda exp, _: self._process_expressions(exp), FunctionCall)]
 
     def _process_expressions(self, exp: Expression) -> Expression:
         if isinstance(exp, FunctionCall) and exp.function_name == "arraySlice":
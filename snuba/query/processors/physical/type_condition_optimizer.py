@@ -1,12 +1,21 @@
+from typing import Sequence
+
 from snuba.clickhouse.query import Query
 from snuba.query.expressions import Expression
+from snuba.query.expressions import FunctionCall as FunctionCallExpr
 from snuba.query.expressions import Literal as LiteralExpr
-from snuba.query.matchers import Column, FunctionCall, Literal, String
-from snuba.query.processors.physical import ClickhouseQueryProcessor
+from snuba.query.matchers import Column, FunctionCall, Literal, MatchResult, String
+from snuba.query.processors.physical import ExpressionRewritingProcessor
 from snuba.query.query_settings import QuerySettings
+from snuba.query.rewriter import Rule
+
+TYPE_CONDITION_MATCHER = FunctionCall(
+    String("notEquals"),
+    (Column(None, String("type")), Literal(String("transaction"))),
+)
 
 
-class TypeConditionOptimizer(ClickhouseQueryProcessor):
+class TypeConditionOptimizer(ExpressionRewritingProcessor):
     """
     Temporary processor that optimizes the type condition by stripping
     any condition matching type != transaction on the errrors storage.
@@ -14,16 +23,8 @@ class TypeConditionOptimizer(ClickhouseQueryProcessor):
     required for compatibility with the events storage.
     """
 
-    def process_query(self, query: Query, query_settings: QuerySettings) -> None:
-        def replace_exp(exp: Expression) -> Expression:
-            matcher = FunctionCall(
-                String("notEquals"),
-                (Column(None, String("type")), Literal(String("transaction"))),
-            )
-
-            if matcher.match(exp):
-                return LiteralExpr(None, 1)
-
-            return exp
+    def get_rules(self, query: Query, query_settings: QuerySettings) -> Sequence[Rule]:
+        def replace_exp(exp: Expression, _: MatchResult) -> Expression:
+            return LiteralExpr(None, 1)
 
-        query.transform_expressions(replace_exp)
+        return [Rule(replace_exp, FunctionCallExpr, TYPE_CONDITION_MATCHER)]
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Set
+from typing import Sequence, Set
 
 from snuba.clickhouse.query import Query
 from snuba.query.conditions import ConditionFunctions
@@ -9,16 +9,21 @@ from snuba.query.matchers import Any as AnyMatch
 from snuba.query.matchers import Column as ColumnMatch
 from snuba.query.matchers import FunctionCall as FunctionCallMatch
 from snuba.query.matchers import Literal as LiteralMatch
-from snuba.query.matchers import Or, Param, String
-from snuba.query.processors.physical import ClickhouseQueryProcessor
+from snuba.query.matchers import MatchResult, Or, Param, String
+from snuba.query.processors.physical import ExpressionRewritingProcessor
 from snuba.query.query_settings import QuerySettings
+from snuba.query.rewriter import Rule, RuleScope
 
 
 class ColumnTypeError(ValidationException):
     pass
 
 
-class BaseTypeConverter(ClickhouseQueryProcessor, ABC):
+class BaseTypeConverter(ExpressionRewritingProcessor, ABC):
+    # Promoted columns can be converted columns, the conditions on them
+    # must be known before the rules are built.
+    depends_on = frozenset({"MappingColumnPromoter"})
+
     def __init__(self, columns: Set[str], optimize_ordering: bool = False):
         self.columns = columns
         self.optimize_ordering = optimize_ordering
@@ -99,21 +104,24 @@ class BaseTypeConverter(ClickhouseQueryProcessor, ABC):
             ]
         )
 
-    def process_query(self, query: Query, query_settings: QuerySettings) -> None:
-        query.transform_expressions(
-            self._process_expressions, skip_transform_condition=True
-        )
+    def get_rules(self, query: Query, query_settings: QuerySettings) -> Sequence[Rule]:
+        def process_expression(exp: Expression, _: MatchResult) -> Expression:
+            return self._process_expressions(exp)
 
+        def process_condition(exp: Expression, _: MatchResult) -> Expression:
+            return self.__process_optimizable_condition(exp)
+
+        # The conditions on the columns are rewritten only if there are
+        # some the literals can be converted for, in which case the columns
+        # of the condition are left untouched.
         condition = query.get_condition()
-        if condition is not None:
-            if self.__contains_unoptimizable_condition(condition):
-                processed = condition.transform(self._process_expressions)
-            else:
-                processed = condition.transform(self.__process_optimizable_condition)
-                if condition == processed:
-                    processed = processed.transform(self._process_expressions)
+        if condition is None or not self.__is_optimizable_condition(condition):
+            return [Rule(process_expression)]
 
-            query.set_ast_condition(processed)
+        return [
+            Rule(process_expression, scope=RuleScope.NOT_CONDITION),
+            Rule(process_condition, scope=RuleScope.CONDITION),
+        ]
 
     def __strip_column_alias(self, exp: Expression) -> Expression:
         assert isinstance(exp, Column)
@@ -121,16 +129,23 @@ class BaseTypeConverter(ClickhouseQueryProcessor, ABC):
             alias=None, table_name=exp.table_name, column_name=exp.column_name
         )
 
-    def __contains_unoptimizable_condition(self, exp: Expression) -> bool:
+    def __is_optimizable_condition(self, exp: Expression) -> bool:
         """
-        Returns true if there is an unoptimizable condition, otherwise false.
+        Returns true if some condition in the expression can have its
+        literals converted and none of them is unoptimizable. This only
+        matches the nodes, nothing is rebuilt.
         """
+        optimizable = False
         for e in exp:
-            match = self.__unoptimizable_condition_matcher.match(e)
-            if match is not None:
-                return True
-
-        return False
+            if self.__unoptimizable_condition_matcher.match(e) is not None:
+                return False
+            if not optimizable:
+                optimizable = (
+                    self.__condition_matcher.match(e) is not None
+                    or self.__in_condition_matcher.match(e) is not None
+                )
+
+        return optimizable
 
     def __process_optimizable_condition(self, exp: Expression) -> Expression:
         def assert_literal(lit: Expression) -> Literal:
@@ -1,26 +1,33 @@
+from typing import Sequence
+
 from snuba.clickhouse.query import Query
 from snuba.query.expressions import Column, Expression, FunctionCall, Literal
-from snuba.query.processors.physical import ClickhouseQueryProcessor
+from snuba.query.matchers import MatchResult
+from snuba.query.processors.physical import ExpressionRewritingProcessor
 from snuba.query.query_settings import QuerySettings
+from snuba.query.rewriter import Rule
 
 
-class UserColumnProcessor(ClickhouseQueryProcessor):
+class UserColumnProcessor(ExpressionRewritingProcessor):
     """
     Return null instead of empty user to align errors to events storage behavior.
     This translation is applied as a column processor rather than a translator, so
     that it will be properly applied to the promoted sentry:user tag.
     """
 
-    def process_query(self, query: Query, query_settings: QuerySettings) -> None:
-        def process_column(exp: Expression) -> Expression:
-            if isinstance(exp, Column):
-                if exp.column_name == "user":
-                    return FunctionCall(
-                        exp.alias,
-                        "nullIf",
-                        (Column(None, None, "user"), Literal(None, "")),
-                    )
+    # The promoter may wrap the promoted column in a function.
+    depends_on = frozenset({"MappingColumnPromoter"})
+
+    def get_rules(self, query: Query, query_settings: QuerySettings) -> Sequence[Rule]:
+        def process_column(exp: Expression, _: MatchResult) -> Expression:
+            assert isinstance(exp, Column)
+            if exp.column_name == "user":
+                return FunctionCall(
+                    exp.alias,
+                    "nullIf",
+                    (Column(None, None, "user"), Literal(None, "")),
+                )
 
             return exp
 
-        query.transform_expressions(process_column)
+        return [Rule(process_column, Column)]
@@ -56,6 +56,10 @@ class QuerySettings(ABC):
     def get_asynchronous(self) -> bool:
         pass
 
+    @abstractmethod
+    def get_stream(self) -> bool:
+        pass
+
 
 # TODO: I don't like that there are two different classes for the same thing
 # this could probably be replaces with a `source` attribute on the class
@@ -76,6 +80,7 @@ class HTTPQuerySettings(QuerySettings):
         legacy: bool = False,
         referrer: str = "unknown",
         asynchronous: bool = False,
+        stream: bool = False,
     ) -> None:
         super().__init__()
         self.__turbo = turbo
@@ -88,6 +93,7 @@ class HTTPQuerySettings(QuerySettings):
         self.__clickhouse_settings: MutableMapping[str, Any] = {}
         self.referrer = referrer
         self.__asynchronous = asynchronous
+        self.__stream = stream
 
     def get_turbo(self) -> bool:
         return self.__turbo
@@ -119,6 +125,9 @@ class HTTPQuerySettings(QuerySettings):
     def get_asynchronous(self) -> bool:
         return self.__asynchronous
 
+    def get_stream(self) -> bool:
+        return self.__stream
+
 
 class SubscriptionQuerySettings(QuerySettings):
     """
@@ -179,3 +188,6 @@ class SubscriptionQuerySettings(QuerySettings):
 
     def get_asynchronous(self) -> bool:
         return False
+
+    def get_stream(self) -> bool:
+        return False
@@ -0,0 +1,100 @@
+"""
+Rewrites the expressions of a query with the rules of several processors in a
+single traversal.
+
+Most query processors only replace some nodes of the query with other nodes
+(a column with a function of that column, a condition with a simpler one...)
+and each of them walks and copies every expression of the query to do so. A
+rule is the replacement a processor applies to the nodes of a given type,
+optionally only to the ones that match a pattern (see snuba.query.matchers).
+The rules of several processors are applied in one bottom-up traversal: a
+node is passed to every rule, in the order of the processors, once all its
+children have been rewritten by every rule.
+
+This gives the same query as applying the processors one after the other as
+long as the rules of a processor:
+- do not need to look inside the nodes created by the rules of the
+  processors before it, they only see the node returned at the same
+  position;
+- do not depend on the children of a node being left untouched by the rules
+  of the processors after it.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, Optional, Sequence, Type
+
+from snuba.query import Query
+from snuba.query.expressions import Expression
+from snuba.query.matchers import MatchResult, Pattern
+
+_NO_PARAMS = MatchResult()
+
+
+class RuleScope(Enum):
+    ALL = "all"
+    # Only the expressions of the WHERE clause.
+    CONDITION = "condition"
+    # Every expression except the ones of the WHERE clause.
+    NOT_CONDITION = "not_condition"
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    Replaces the nodes of type ``node_type`` (any node if there is no type)
+    matching ``pattern`` (any node of that type if there is no pattern) with
+    the result of ``rewrite``, which receives the parameters found by the
+    pattern.
+    """
+
+    rewrite: Callable[[Expression, MatchResult], Expression]
+    node_type: Optional[Type[Expression]] = None
+    pattern: Optional[Pattern[Expression]] = None
+    scope: RuleScope = RuleScope.ALL
+
+
+class _Rewriter:
+    def __init__(self, rules: Sequence[Rule]) -> None:
+        self.__rules = rules
+
+    def __call__(self, exp: Expression) -> Expression:
+        for rule in self.__rules:
+            # A rule can change the type of the node the next rules see.
+            if rule.node_type is not None and not isinstance(exp, rule.node_type):
+                continue
+            if rule.pattern is None:
+                exp = rule.rewrite(exp, _NO_PARAMS)
+            else:
+                match = rule.pattern.match(exp)
+                if match is not None:
+                    exp = rule.rewrite(exp, match)
+        return exp
+
+
+def rewrite_query(query: Query, rules: Sequence[Rule]) -> None:
+    """
+    Applies the rules, in order, to every expression of the query in a
+    single traversal of each clause.
+    """
+    if not rules:
+        return
+    if all(rule.scope == RuleScope.ALL for rule in rules):
+        query.transform_expressions(_Rewriter(rules))
+        return
+
+    query.transform_expressions(
+        _Rewriter([rule for rule in rules if rule.scope != RuleScope.CONDITION]),
+        skip_transform_condition=True,
+    )
+    condition = query.get_condition()
+    if condition is not None:
+        query.set_ast_condition(
+            condition.transform(
+                _Rewriter(
+                    [rule for rule in rules if rule.scope != RuleScope.NOT_CONDITION]
+                )
+            )
+        )
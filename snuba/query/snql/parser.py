@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+import re
 from dataclasses import replace
 from datetime import datetime, timedelta
 from functools import partial
@@ -82,6 +83,7 @@ from snuba.query.parser import (
     parse_subscriptables,
     validate_aliases,
 )
+from snuba.query.parser.cache import LiteralKind, ParseCache
 from snuba.query.parser.exceptions import ParsingException, PostProcessingError
 from snuba.query.query_settings import HTTPQuerySettings, QuerySettings
 from snuba.query.schema import POSITIVE_OPERATORS
@@ -94,6 +96,8 @@ from snuba.query.snql.expression_visitor import (
     LowPriOperator,
     LowPriTuple,
     generic_visit,
+    numeric_literal_value,
+    quoted_literal_value,
     visit_arithmetic_term,
     visit_column_name,
     visit_function_name,
@@ -225,6 +229,26 @@ snql_grammar = Grammar(
 """
 )
 
+# The numbers of the clauses which do not accept expressions, subscripts and
+# quoted aliases are part of the shape of the query. The pattern of strings
+# is the one of quoted_literal.
+snql_parse_cache = ParseCache(
+    "snql",
+    re.compile(
+        r"(?P<clause>\b(?:LIMIT|OFFSET|GRANULARITY|SAMPLE)\s+[-0-9.e+]+)"
+        r"|(?P<quoted_alias>`[^`]*`)"
+        r"|(?P<subscript>\[[^\[\]]*\])"
+        r"|(?P<string>(?<!\\)'(?:(?<!\\)(?:\\{2})*\\'|[^'])*(?<!\\)(?:\\{2})*')"
+        r"|(?P<number>(?<![\w.\-])[0-9]+(?:\.[0-9]+)?(?:e[\+\-][0-9]+)?(?![\w.]))"
+    ),
+    {
+        "string": LiteralKind(
+            quoted_literal_value, lambda i: f"'__snuba_literal_{i}__'"
+        ),
+        "number": LiteralKind(numeric_literal_value, lambda i: str(9876500000000 + i)),
+    },
+)
+
 
 class AndTuple(NamedTuple):
     op: str
@@ -948,6 +972,15 @@ class SnQLVisitor(NodeVisitor):  # type: ignore
         return generic_visit(node, visited_children)
 
 
+def _parse_snql_body(
+    body: str,
+) -> Union[CompositeQuery[LogicalDataSource], LogicalQuery]:
+    exp_tree = snql_grammar.parse(body)
+    parsed = SnQLVisitor().visit(exp_tree)
+    assert isinstance(parsed, (CompositeQuery, LogicalQuery))  # mypy
+    return parsed
+
+
 def parse_snql_query_initial(
     body: str,
 ) -> Union[CompositeQuery[LogicalDataSource], LogicalQuery]:
@@ -957,8 +990,7 @@ def parse_snql_query_initial(
     processors and are supposed to update the AST.
     """
     try:
-        exp_tree = snql_grammar.parse(body)
-        parsed = SnQLVisitor().visit(exp_tree)
+        parsed = snql_parse_cache.parse(body, _parse_snql_body)
     except ParsingException as e:
         logger.warning(f"Invalid SnQL query ({e}): {body}")
         raise e
@@ -1245,7 +1277,7 @@ def _array_column_conditions(
 
 
 def _mangle_query_aliases(
-    query: Union[CompositeQuery[LogicalDataSource], LogicalQuery],
+    query: Union[CompositeQuery[LogicalDataSource], LogicalQuery]
 ) -> None:
     """
     If a query has a subquery, the inner query will get its aliases mangled. This is
@@ -1567,6 +1599,68 @@ def parse_snql_query(
         raise PostProcessingError(query)
 
 
+def parse_snql_query_template(
+    body: str,
+) -> Union[CompositeQuery[LogicalDataSource], LogicalQuery]:
+    """
+    Runs the steps of ``parse_snql_query`` that only depend on the body of
+    the query: parsing and post processing. The result is meant to be kept
+    and completed, on a copy, with ``complete_snql_query_template`` by
+    callers that run the same query many times with different custom
+    processing (e.g. subscriptions with different time ranges).
+    """
+    with sentry_sdk.start_span(op="parser", description="parse_snql_query_initial"):
+        query = parse_snql_query_initial(body)
+
+    try:
+        _post_process(query, [_treeify_or_and_conditions])
+        _post_process(query, POST_PROCESSORS)
+    except InvalidQueryException:
+        raise
+    except Exception:
+        raise PostProcessingError(query)
+    return query
+
+
+def complete_snql_query_template(
+    query: Union[CompositeQuery[LogicalDataSource], LogicalQuery],
+    dataset: Dataset,
+    custom_processing: Optional[CustomProcessors] = None,
+    settings: QuerySettings | None = None,
+) -> Union[CompositeQuery[LogicalDataSource], LogicalQuery]:
+    """
+    Runs the steps of ``parse_snql_query`` that follow the post processing
+    on a query returned by ``parse_snql_query_template``. The query is
+    modified in place.
+    """
+    try:
+        _process_and_validate_query(query, dataset, custom_processing, settings)
+    except InvalidQueryException:
+        raise
+    except Exception:
+        raise PostProcessingError(query)
+    return query
+
+
+def _process_and_validate_query(
+    query: Union[CompositeQuery[LogicalDataSource], LogicalQuery],
+    dataset: Dataset,
+    custom_processing: Optional[CustomProcessors],
+    settings: QuerySettings | None,
+) -> None:
+    # Custom processing to tweak the AST before validation
+    with sentry_sdk.start_span(op="processor", description="custom_processing"):
+        if custom_processing is not None:
+            _post_process(query, custom_processing, settings)
+    # Time based processing
+    with sentry_sdk.start_span(op="processor", description="time_based_processing"):
+        _post_process(query, [_replace_time_condition], settings)
+    _post_process(query, [_select_entity_for_dataset(dataset)], settings)
+    # Validating
+    with sentry_sdk.start_span(op="validate", description="expression_validators"):
+        _post_process(query, VALIDATORS)
+
+
 class PostProcessAndValidateQuery(
     QueryPipelineStage[
         tuple[
@@ -1596,16 +1690,6 @@ class PostProcessAndValidateQuery(
                 POST_PROCESSORS,
                 settings,
             )
-        # Custom processing to tweak the AST before validation
-        with sentry_sdk.start_span(op="processor", description="custom_processing"):
-            if custom_processing is not None:
-                _post_process(query, custom_processing, settings)
-        # Time based processing
-        with sentry_sdk.start_span(op="processor", description="time_based_processing"):
-            _post_process(query, [_replace_time_condition], settings)
-        _post_process(query, [_select_entity_for_dataset(dataset)], settings)
-        # Validating
-        with sentry_sdk.start_span(op="validate", description="expression_validators"):
-            _post_process(query, VALIDATORS)
+        _process_and_validate_query(query, dataset, custom_processing, settings)
 
         return query
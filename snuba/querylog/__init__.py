@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+import logging
 import time
+from functools import partial
 from random import random
 from typing import Any, Mapping, Optional, Union
 
@@ -14,14 +16,57 @@ from snuba.cogs.accountant import record_cogs
 from snuba.datasets.storage import StorageNotAvailable
 from snuba.query.exceptions import QueryPlanException
 from snuba.querylog.query_metadata import QueryStatus, SnubaQueryMetadata, Status
+from snuba.querylog.worker import QuerylogWorker, Task
 from snuba.request import Request
 from snuba.utils.metrics.timer import Timer
 from snuba.utils.metrics.wrapper import MetricsWrapper
 from snuba.web import QueryException, QueryResult
 
 metrics = MetricsWrapper(environment.metrics, "api")
+logger = logging.getLogger("snuba.querylog")
 from snuba.querylog.query_metadata import get_request_status
 
+_worker = QuerylogWorker(settings.QUERYLOG_WORKER_QUEUE_SIZE)
+
+
+def _submit(task: Task) -> None:
+    """
+    Runs the task on the querylog worker, or right away if the worker is
+    disabled.
+    """
+    if settings.QUERYLOG_WORKER_QUEUE_SIZE <= 0:
+        task()
+    else:
+        _worker.submit(task)
+
+
+def flush_worker(timeout: Optional[float] = None) -> bool:
+    """
+    Waits until the queries queued on the worker are recorded, without
+    waiting for the producer. Returns False if some are still pending after
+    ``timeout`` seconds.
+    """
+    return _worker.flush(timeout)
+
+
+def flush(timeout: Optional[float] = None) -> None:
+    """
+    Records the queries still queued on the worker, then waits for the
+    querylog producer to deliver them. To be called before shutting down,
+    with a ``timeout`` so that a stuck worker or producer cannot block the
+    shutdown. The queries not recorded by then are dropped.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    if not flush_worker(timeout):
+        logger.warning(
+            "Querylog worker not flushed after %s seconds, dropping %d queries",
+            timeout,
+            _worker.pending,
+        )
+    state.flush_producer(
+        max(deadline - time.monotonic(), 0) if deadline is not None else None
+    )
+
 
 def _record_timer_metrics(
     request: Request,
@@ -171,15 +216,28 @@ def record_query(
     if not isinstance(result, QueryPlanException):
         extra_data = result.extra
     if settings.RECORD_QUERIES:
-        # Send to redis
-        # We convert this to a dict before passing it to state in order to avoid a
-        # circular dependency, where state would depend on the higher level
-        # QueryMetadata class
-        state.record_query(query_metadata.to_dict())
-        _record_timer_metrics(request, timer, query_metadata, result)
-        _record_bytes_scanned_metrics(query_metadata, result)
-        _record_cogs(request, query_metadata, result)
+        # Freezes the timings of the request before they are recorded.
+        timer.finish()
+        # Sentry tags go on the scope of the request thread, everything else
+        # is done by the querylog worker.
         _add_tags(timer, extra_data.get("experiments"), query_metadata)
+        _submit(partial(_record_query, request, timer, query_metadata, result))
+
+
+def _record_query(
+    request: Request,
+    timer: Timer,
+    query_metadata: SnubaQueryMetadata,
+    result: Union[QueryResult, QueryException, QueryPlanException],
+) -> None:
+    # Send to redis
+    # We convert this to a dict before passing it to state in order to avoid a
+    # circular dependency, where state would depend on the higher level
+    # QueryMetadata class
+    state.record_query(query_metadata.to_dict())
+    _record_timer_metrics(request, timer, query_metadata, result)
+    _record_bytes_scanned_metrics(query_metadata, result)
+    _record_cogs(request, query_metadata, result)
 
 
 def _add_tags(
@@ -254,15 +312,18 @@ def record_invalid_request(
     _record_failure_metric_with_status(
         QueryStatus.INVALID_REQUEST, request_status, timer, referrer, exception_name
     )
-    state.record_query(
-        _build_failed_request_dict(
-            request_id,
-            body,
-            dataset,
-            organization,
-            request_status,
-            referrer,
-            exception_name,
+    _submit(
+        partial(
+            state.record_query,
+            _build_failed_request_dict(
+                request_id,
+                body,
+                dataset,
+                organization,
+                request_status,
+                referrer,
+                exception_name,
+            ),
         )
     )
 
@@ -285,15 +346,18 @@ def record_error_building_request(
     _record_failure_metric_with_status(
         QueryStatus.ERROR, request_status, timer, referrer, exception_name
     )
-    state.record_query(
-        _build_failed_request_dict(
-            request_id,
-            body,
-            dataset,
-            organization,
-            request_status,
-            referrer,
-            exception_name,
+    _submit(
+        partial(
+            state.record_query,
+            _build_failed_request_dict(
+                request_id,
+                body,
+                dataset,
+                organization,
+                request_status,
+                referrer,
+                exception_name,
+            ),
         )
     )
 
@@ -3,7 +3,17 @@ from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
-from typing import Any, Dict, MutableSequence, Optional, Set, cast
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    MutableSequence,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 
 from clickhouse_driver.errors import ErrorCodes
 from sentry_kafka_schemas.schema_types import snuba_queries_v1
@@ -202,18 +212,80 @@ class ClickhouseQueryProfile:
         }
 
 
-@dataclass(frozen=True)
 class ClickhouseQueryMetadata:
-    sql: str
-    sql_anonymized: str
-    start_timestamp: Optional[datetime]
-    end_timestamp: Optional[datetime]
-    stats: Dict[str, Any]
-    status: QueryStatus
-    request_status: Status
-    profile: ClickhouseQueryProfile
-    trace_id: str
-    result_profile: Optional[snuba_queries_v1._QueryMetadataResultProfileObject] = None
+    """
+    Metadata about one of the ClickHouse queries run for a request.
+
+    The anonymized SQL and the profile of the query are only needed to build
+    the querylog entry, which happens on the querylog worker. They can be
+    given as functions computing them, which are called the first time the
+    value is accessed.
+    """
+
+    def __init__(
+        self,
+        sql: str,
+        sql_anonymized: Union[str, Callable[[], str]],
+        start_timestamp: Optional[datetime],
+        end_timestamp: Optional[datetime],
+        stats: Dict[str, Any],
+        status: QueryStatus,
+        request_status: Status,
+        profile: Union[ClickhouseQueryProfile, Callable[[], ClickhouseQueryProfile]],
+        trace_id: str,
+        result_profile: Optional[
+            snuba_queries_v1._QueryMetadataResultProfileObject
+        ] = None,
+    ) -> None:
+        self.sql = sql
+        self.__sql_anonymized = sql_anonymized
+        self.start_timestamp = start_timestamp
+        self.end_timestamp = end_timestamp
+        self.stats = stats
+        self.status = status
+        self.request_status = request_status
+        self.__profile = profile
+        self.trace_id = trace_id
+        self.result_profile = result_profile
+
+    @property
+    def sql_anonymized(self) -> str:
+        if callable(self.__sql_anonymized):
+            self.__sql_anonymized = self.__sql_anonymized()
+        return self.__sql_anonymized
+
+    @property
+    def profile(self) -> ClickhouseQueryProfile:
+        if callable(self.__profile):
+            self.__profile = self.__profile()
+        return self.__profile
+
+    def __fields(self) -> Tuple[Tuple[str, Any], ...]:
+        return (
+            ("sql", self.sql),
+            ("sql_anonymized", self.sql_anonymized),
+            ("start_timestamp", self.start_timestamp),
+            ("end_timestamp", self.end_timestamp),
+            ("stats", self.stats),
+            ("status", self.status),
+            ("request_status", self.request_status),
+            ("profile", self.profile),
+            ("trace_id", self.trace_id),
+            ("result_profile", self.result_profile),
+        )
+
+    # Compared and printed like the dataclass it used to be, with the lazy
+    # values computed.
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.__fields() == cast(ClickhouseQueryMetadata, other).__fields()
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={value!r}" for name, value in self.__fields())
+        return f"{self.__class__.__qualname__}({fields})"
 
     def to_dict(self) -> snuba_queries_v1.QueryMetadata:
         start = int(self.start_timestamp.timestamp()) if self.start_timestamp else None
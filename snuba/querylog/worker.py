@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+from snuba import environment
+from snuba.utils.metrics.wrapper import MetricsWrapper
+
+metrics = MetricsWrapper(environment.metrics, "querylog.worker")
+logger = logging.getLogger("snuba.querylog")
+
+Task = Callable[[], None]
+
+
+class QuerylogWorker:
+    """
+    Runs the querylog bookkeeping of the requests (building the querylog
+    entry, encoding it, writing it to Redis and producing it to Kafka) on a
+    background thread, so it does not add to the latency of the requests.
+
+    The queue is bounded: when the worker cannot keep up, tasks are dropped
+    and counted rather than blocking the request threads.
+    """
+
+    def __init__(self, max_queue_size: int) -> None:
+        self.__max_queue_size = max_queue_size
+        self.__queue: queue.Queue[Task] = queue.Queue(max_queue_size)
+        self.__lock = threading.Lock()
+        self.__pid: Optional[int] = None
+        self.dropped = 0
+
+    def submit(self, task: Task) -> bool:
+        """
+        Queues the task, returns False if it was dropped because the queue
+        is full.
+        """
+        self.__ensure_thread()
+        try:
+            self.__queue.put_nowait(task)
+        except queue.Full:
+            self.dropped += 1
+            metrics.increment("dropped")
+            return False
+        return True
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of tasks queued or running.
+        """
+        return self.__queue.unfinished_tasks
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every queued task has run. Returns False if there are
+        still tasks pending after ``timeout`` seconds.
+        """
+        if self.__pid != os.getpid():
+            return True
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.__queue.all_tasks_done:
+            while self.__queue.unfinished_tasks:
+                if deadline is None:
+                    self.__queue.all_tasks_done.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.__queue.all_tasks_done.wait(remaining)
+        return True
+
+    def __ensure_thread(self) -> None:
+        # Threads do not survive forks, each process needs its own worker and
+        # the tasks queued by the parent are not its own.
+        if self.__pid == os.getpid():
+            return
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            if self.__pid is not None:
+                self.__queue = queue.Queue(self.__max_queue_size)
+            self.__pid = os.getpid()
+            threading.Thread(
+                target=self.__run,
+                args=(self.__queue,),
+                name="snuba-querylog",
+                daemon=True,
+            ).start()
+
+    def __run(self, tasks: queue.Queue[Task]) -> None:
+        while True:
+            task = tasks.get()
+            try:
+                task()
+            except Exception as e:
+                logger.exception("Could not record query due to error: %r", e)
+            finally:
+                tasks.task_done()
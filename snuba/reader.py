@@ -10,6 +10,7 @@ from typing import (
     Iterator,
     List,
     Mapping,
+    MutableMapping,
     Optional,
     Pattern,
     Sequence,
@@ -71,7 +72,7 @@ R = TypeVar("R")
 
 
 def transform_nullable(
-    function: Callable[[T], R]
+    function: Callable[[T], R],
 ) -> Callable[[Optional[T]], Optional[R]]:
     def transform_column(value: Optional[T]) -> Optional[R]:
         if value is None:
@@ -82,6 +83,27 @@ def transform_nullable(
     return transform_column
 
 
+def _find_column_transformer(
+    column_transformations: Sequence[Tuple[Pattern[str], Callable[[Any], Any]]],
+    column_type: str,
+) -> Optional[Callable[[Any], Any]]:
+    is_nullable, type = unwrap_nullable_type(column_type)
+
+    transformer = next(
+        (
+            transformer
+            for pattern, transformer in column_transformations
+            if pattern.match(type)
+        ),
+        None,
+    )
+
+    if transformer is not None and is_nullable:
+        transformer = transform_nullable(transformer)
+
+    return transformer
+
+
 def build_result_transformer(
     column_transformations: Sequence[Tuple[Pattern[str], Callable[[Any], Any]]],
 ) -> Callable[[Result], None]:
@@ -93,23 +115,13 @@ def build_result_transformer(
 
     def transform_result(result: Result) -> None:
         for column in result["meta"]:
-            is_nullable, type = unwrap_nullable_type(column["type"])
-
-            transformer = next(
-                (
-                    transformer
-                    for pattern, transformer in column_transformations
-                    if pattern.match(type)
-                ),
-                None,
+            transformer = _find_column_transformer(
+                column_transformations, column["type"]
             )
 
             if transformer is None:
                 continue
 
-            if is_nullable:
-                transformer = transform_nullable(transformer)
-
             name = column["name"]
             for row in iterate_rows(result):
                 row[name] = transformer(row[name])
@@ -117,6 +129,69 @@ def build_result_transformer(
     return transform_result
 
 
+def build_column_transformer(
+    column_transformations: Sequence[Tuple[Pattern[str], Callable[[Any], Any]]],
+) -> Callable[[str, Sequence[Any]], Sequence[Any]]:
+    """
+    Builds and returns a function that transforms all the values of a
+    column of the given data type at once. This is the columnar equivalent
+    of ``build_result_transformer``: the transformation function is looked
+    up once per data type and applied to the whole column in a single pass.
+    """
+    transformers: MutableMapping[str, Optional[Callable[[Any], Any]]] = {}
+
+    def transform_column(column_type: str, values: Sequence[Any]) -> Sequence[Any]:
+        if column_type not in transformers:
+            transformers[column_type] = _find_column_transformer(
+                column_transformations, column_type
+            )
+
+        transformer = transformers[column_type]
+        if transformer is None:
+            return values
+
+        # Columns like timestamps of time series are made of few distinct
+        # values, in which case each of them is transformed only once.
+        try:
+            distinct = set(values)
+        except TypeError:
+            return list(map(transformer, values))
+        if len(distinct) * 2 > len(values):
+            return list(map(transformer, values))
+        transformed = {value: transformer(value) for value in distinct}
+        return list(map(transformed.__getitem__, values))
+
+    return transform_column
+
+
+class ResultStream:
+    """
+    The result of a query whose rows are produced incrementally, as they are
+    read from the database. The profile of the query is only available once
+    all the rows have been consumed. ``close`` releases what the query holds
+    on to even if the rows were never iterated.
+    """
+
+    def __init__(
+        self,
+        meta: List[Column],
+        rows: Iterator[Row],
+        get_profile: Callable[[], Optional[Dict[str, Any]]] = lambda: None,
+        close: Callable[[], None] = lambda: None,
+    ) -> None:
+        self.meta = meta
+        self.rows = rows
+        self.__get_profile = get_profile
+        self.__close = close
+
+    def close(self) -> None:
+        self.__close()
+
+    @property
+    def profile(self) -> Optional[Dict[str, Any]]:
+        return self.__get_profile()
+
+
 class Reader(ABC):
     def __init__(
         self, cache_partition_id: Optional[str], query_settings_prefix: Optional[str]
@@ -136,6 +211,20 @@ class Reader(ABC):
         """Execute a query."""
         raise NotImplementedError
 
+    def execute_stream(
+        self,
+        query: FormattedQuery,
+        settings: Optional[Mapping[str, str]] = None,
+    ) -> ResultStream:
+        """
+        Execute a query and return its rows as they are read. Readers that
+        cannot stream results return the materialized result as a stream.
+        """
+        result = self.execute(query, settings)
+        return ResultStream(
+            result["meta"], iter(result["data"]), lambda: result.get("profile")
+        )
+
     @property
     def cache_partition_id(self) -> Optional[str]:
         """
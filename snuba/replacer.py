@@ -21,11 +21,12 @@ from typing import (
 
 import simplejson as json
 from arroyo.backends.kafka import KafkaPayload
-from arroyo.processing.strategies import CommitOffsets, RunTask
+from arroyo.processing.strategies import BatchStep, CommitOffsets, RunTask
 from arroyo.processing.strategies.abstract import (
     ProcessingStrategy,
     ProcessingStrategyFactory,
 )
+from arroyo.processing.strategies.batching import ValuesBatch
 from arroyo.types import BrokerValue, Commit, Message, Partition
 
 from snuba import settings
@@ -285,11 +286,21 @@ TResult = TypeVar("TResult")
 
 
 class ReplacerStrategyFactory(ProcessingStrategyFactory[KafkaPayload]):
+    """
+    Executes the replacements one message at a time, or in batches of up to
+    ``max_batch_size`` messages (waiting for at most ``max_batch_time_ms``)
+    whose compatible replacements can be merged together.
+    """
+
     def __init__(
         self,
         worker: ReplacerWorker,
+        max_batch_size: int = 1,
+        max_batch_time_ms: int = settings.DEFAULT_MAX_BATCH_TIME_MS,
     ) -> None:
         self.__worker = worker
+        self.__max_batch_size = max_batch_size
+        self.__max_batch_time_ms = max_batch_time_ms
 
     def create_with_partitions(
         self,
@@ -301,9 +312,26 @@ class ReplacerStrategyFactory(ProcessingStrategyFactory[KafkaPayload]):
             batch = [] if processed is None else [processed]
             return self.__worker.flush_batch(batch)
 
+        def batch_processing_func(message: Message[ValuesBatch[KafkaPayload]]) -> None:
+            batch = []
+            # Messages are processed one by one, in order, as processing a
+            # message can depend on the ones before it (merges).
+            for value in message.payload:
+                processed = self.__worker.process_message(Message(value))
+                if processed is not None:
+                    batch.append(processed)
+            return self.__worker.flush_batch(batch)
+
         commit_offsets: ProcessingStrategy[Any] = CommitOffsets(commit)
 
-        return RunTask(processing_func, commit_offsets)
+        if self.__max_batch_size <= 1:
+            return RunTask(processing_func, commit_offsets)
+
+        return BatchStep(
+            max_batch_size=self.__max_batch_size,
+            max_batch_time=self.__max_batch_time_ms / 1000.0,
+            next_step=RunTask(batch_processing_func, commit_offsets),
+        )
 
 
 class ReplacerWorker:
@@ -444,6 +472,21 @@ class ReplacerWorker:
             ClickhouseClientSettings.REPLACE
         )
 
+        # In a batch, the query flags of every replacement are written before
+        # any of them is executed. Queries only get more conservative until
+        # the replacements are done, even if some of them turn out to impact
+        # no row.
+        batch_mode = len(batch) > 1 and bool(
+            get_int_config("replacer_merge_replacements_enabled", 1)
+        )
+        if batch_mode:
+            merged = self._merge_replacements(batch)
+            self.metrics.increment("merged_replacements", len(batch) - len(merged))
+            batch = merged
+            need_optimize = self.__replacer_processor.pre_replacements(
+                [replacement for _, replacement in batch]
+            )
+
         for message_metadata, replacement in batch:
             start_time = datetime.now()
 
@@ -457,10 +500,11 @@ class ReplacerWorker:
             else:
                 count = 0
 
-            need_optimize = (
-                self.__replacer_processor.pre_replacement(replacement, count)
-                or need_optimize
-            )
+            if not batch_mode:
+                need_optimize = (
+                    self.__replacer_processor.pre_replacement(replacement, count)
+                    or need_optimize
+                )
 
             query_executor = self.__get_insert_executor(replacement)
             with self.__rate_limiter as state:
@@ -490,6 +534,24 @@ class ReplacerWorker:
                 "Optimized %s partitions on %s" % (num_dropped, clickhouse_read.host)
             )
 
+    def _merge_replacements(
+        self, batch: Sequence[Tuple[ReplacementMessageMetadata, Replacement]]
+    ) -> Sequence[Tuple[ReplacementMessageMetadata, Replacement]]:
+        """
+        Merges the consecutive replacements of a batch that can be executed
+        as one, so the replacements are still executed in the order of their
+        messages. A merged replacement gets the metadata of its last message.
+        """
+        merged: List[Tuple[ReplacementMessageMetadata, Replacement]] = []
+        for message_metadata, replacement in batch:
+            if merged:
+                combined = merged[-1][1].merge(replacement)
+                if combined is not None:
+                    merged[-1] = (message_metadata, combined)
+                    continue
+            merged.append((message_metadata, replacement))
+        return merged
+
     def _message_already_processed(self, metadata: ReplacementMessageMetadata) -> bool:
         """
         Figure out whether or not the message was already processed.
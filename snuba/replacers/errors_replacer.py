@@ -6,7 +6,7 @@ import random
 import uuid
 from abc import abstractmethod
 from collections import deque
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from functools import cached_property
 from typing import (
@@ -46,9 +46,10 @@ from snuba.processor import (
     ReplacementType,
     _hashify,
 )
-from snuba.replacers.projects_query_flags import ProjectsQueryFlags
+from snuba.replacers.projects_query_flags import ProjectsQueryFlags, RedisPipeline
 from snuba.replacers.replacements_and_expiry import (
     get_config_auto_replacements_bypass_projects,
+    redis_client,
 )
 from snuba.replacers.replacer_processor import Replacement as ReplacementBase
 from snuba.replacers.replacer_processor import (
@@ -56,7 +57,7 @@ from snuba.replacers.replacer_processor import (
     ReplacerProcessor,
     ReplacerState,
 )
-from snuba.state import get_config
+from snuba.state import get_config, get_int_config
 from snuba.utils.metrics.wrapper import MetricsWrapper
 
 """
@@ -249,14 +250,26 @@ class ErrorsReplacer(ReplacerProcessor[Replacement]):
     def get_state(self) -> ReplacerState:
         return self.__state_name
 
-    def pre_replacement(self, replacement: Replacement, matching_records: int) -> bool:
+    def pre_replacement(
+        self,
+        replacement: Replacement,
+        matching_records: int,
+        pipeline: Optional[RedisPipeline] = None,
+    ) -> bool:
+        """
+        The query time flags are added to ``pipeline`` when provided, the
+        caller then executes it.
+        """
         project_id = replacement.get_project_id()
         query_time_flags = replacement.get_query_time_flags()
 
         if not settings.REPLACER_IMMEDIATE_OPTIMIZE:
             if isinstance(query_time_flags, NeedsFinal):
                 ProjectsQueryFlags.set_project_needs_final(
-                    project_id, self.__state_name, replacement.get_replacement_type()
+                    project_id,
+                    self.__state_name,
+                    replacement.get_replacement_type(),
+                    pipeline,
                 )
 
             elif isinstance(query_time_flags, ExcludeGroups):
@@ -265,6 +278,7 @@ class ErrorsReplacer(ReplacerProcessor[Replacement]):
                     query_time_flags.group_ids,
                     self.__state_name,
                     replacement.get_replacement_type(),
+                    pipeline,
                 )
 
         elif query_time_flags is not None:
@@ -272,6 +286,36 @@ class ErrorsReplacer(ReplacerProcessor[Replacement]):
 
         return False
 
+    def pre_replacements(self, replacements: Sequence[Replacement]) -> bool:
+        # The flags of the whole batch are written in a single round trip.
+        pipeline = redis_client.pipeline()
+        need_optimize = False
+        for replacement in replacements:
+            need_optimize = (
+                self.pre_replacement(replacement, 0, pipeline) or need_optimize
+            )
+        pipeline.execute()
+        return need_optimize
+
+
+def _merge_group_ids(
+    group_ids: Sequence[int], following: Sequence[int]
+) -> Optional[Sequence[int]]:
+    """
+    Returns the groups of two replacements merged into one, unless there are
+    too many of them for a single query.
+    """
+    max_group_ids = cast(
+        int,
+        get_int_config(
+            "replacer_max_merged_group_ids", settings.REPLACER_MAX_MERGED_GROUP_IDS
+        ),
+    )
+    merged = list(dict.fromkeys([*group_ids, *following]))
+    if len(merged) > max_group_ids:
+        return None
+    return merged
+
 
 def _build_event_set_filter(
     project_id: int,
@@ -409,6 +453,9 @@ class DeleteGroupsReplacement(Replacement):
     required_columns: Sequence[str]
     timestamp: datetime
     group_ids: Sequence[int]
+    # Set when replacements with different timestamps are merged, every group
+    # then has its own timestamp.
+    group_timestamps: Mapping[int, datetime] = field(default_factory=dict)
 
     @classmethod
     def parse_message(
@@ -443,15 +490,63 @@ class DeleteGroupsReplacement(Replacement):
     def get_replacement_type(cls) -> ReplacementType:
         return ReplacementType.END_DELETE_GROUPS
 
+    def __get_group_timestamps(self) -> Mapping[int, datetime]:
+        return self.group_timestamps or {gid: self.timestamp for gid in self.group_ids}
+
+    def merge(self, following: ReplacementBase) -> Optional[ReplacementBase]:
+        if (
+            not isinstance(following, DeleteGroupsReplacement)
+            or following.project_id != self.project_id
+            or following.required_columns != self.required_columns
+        ):
+            return None
+        group_ids = _merge_group_ids(self.group_ids, following.group_ids)
+        if group_ids is None:
+            return None
+
+        # Deleting the rows of a group received before one timestamp then the
+        # ones received before another deletes the ones received before the
+        # latest of them.
+        group_timestamps = dict(self.__get_group_timestamps())
+        for gid, timestamp in following.__get_group_timestamps().items():
+            group_timestamps[gid] = max(timestamp, group_timestamps.get(gid, timestamp))
+        timestamp = max(self.timestamp, following.timestamp)
+
+        return DeleteGroupsReplacement(
+            project_id=self.project_id,
+            required_columns=self.required_columns,
+            timestamp=timestamp,
+            group_ids=group_ids,
+            group_timestamps=(
+                {}
+                if all(ts == timestamp for ts in group_timestamps.values())
+                else group_timestamps
+            ),
+        )
+
     @cached_property
     def _where_clause(self) -> str:
         group_ids = ", ".join(str(gid) for gid in self.group_ids)
-        timestamp = self.timestamp.strftime(DATETIME_FORMAT)
+        if not self.group_timestamps:
+            timestamp = self.timestamp.strftime(DATETIME_FORMAT)
+            received_condition = f"received <= CAST('{timestamp}' AS DateTime)"
+        else:
+            groups_by_timestamp: MutableMapping[datetime, List[int]] = {}
+            for gid in self.group_ids:
+                groups_by_timestamp.setdefault(self.group_timestamps[gid], []).append(
+                    gid
+                )
+            received_condition = " OR ".join(
+                f"(group_id IN ({', '.join(str(gid) for gid in gids)}) "
+                f"AND received <= CAST('{ts.strftime(DATETIME_FORMAT)}' AS DateTime))"
+                for ts, gids in groups_by_timestamp.items()
+            )
+            received_condition = f"({received_condition})"
 
         return f"""\
             PREWHERE group_id IN ({group_ids})
             WHERE project_id = {self.project_id}
-            AND received <= CAST('{timestamp}' AS DateTime)
+            AND {received_condition}
             AND NOT deleted
         """
 
@@ -601,6 +696,17 @@ class ExcludeGroupsReplacement(Replacement):
     def get_replacement_type(cls) -> ReplacementType:
         return ReplacementType.EXCLUDE_GROUPS
 
+    def merge(self, following: ReplacementBase) -> Optional[ReplacementBase]:
+        if (
+            not isinstance(following, ExcludeGroupsReplacement)
+            or following.project_id != self.project_id
+        ):
+            return None
+        group_ids = _merge_group_ids(self.group_ids, following.group_ids)
+        if group_ids is None:
+            return None
+        return ExcludeGroupsReplacement(project_id=self.project_id, group_ids=group_ids)
+
     def get_insert_query(self, table_name: str) -> Optional[str]:
         return None
 
@@ -4,10 +4,21 @@ import sys
 import time
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, List, Mapping, MutableMapping, Optional, Sequence, Set, Tuple
+from typing import (
+    Any,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 import sentry_sdk
 
+from redis.client import Pipeline
 from redis.cluster import ClusterPipeline as StrictClusterPipeline
 from snuba import settings
 from snuba.processor import ReplacementType
@@ -17,6 +28,9 @@ from snuba.state import get_config
 
 redis_client = get_redis_client(RedisClientKey.REPLACEMENTS_STORE)
 
+# The pipeline of either a single node or a cluster client.
+RedisPipeline = Union[Pipeline, StrictClusterPipeline]
+
 
 @dataclass
 class ProjectsQueryFlags:
@@ -44,14 +58,20 @@ class ProjectsQueryFlags:
         project_id: int,
         state_name: Optional[ReplacerState],
         replacement_type: ReplacementType,
+        pipeline: Optional[RedisPipeline] = None,
     ) -> None:
+        """
+        The commands are added to ``pipeline`` when provided, the caller then
+        executes it. The same goes for set_project_exclude_groups.
+        """
         key, type_key = ProjectsQueryFlags._build_project_needs_final_key_and_type_key(
             project_id, state_name
         )
-        p = redis_client.pipeline()
+        p = pipeline if pipeline is not None else redis_client.pipeline()
         p.set(key, time.time(), ex=settings.REPLACER_KEY_TTL)
         p.set(type_key, replacement_type, ex=settings.REPLACER_KEY_TTL)
-        p.execute()
+        if pipeline is None:
+            p.execute()
 
     @staticmethod
     def set_project_exclude_groups(
@@ -60,6 +80,7 @@ class ProjectsQueryFlags:
         state_name: Optional[ReplacerState],
         #  replacement type is just for metrics, not necessary for functionality
         replacement_type: ReplacementType,
+        pipeline: Optional[RedisPipeline] = None,
     ) -> None:
         """
         This method is called when a replacement comes in. For a specific project, record
@@ -78,7 +99,7 @@ class ProjectsQueryFlags:
         ) = ProjectsQueryFlags._build_project_exclude_groups_key_and_type_key(
             project_id, state_name
         )
-        p = redis_client.pipeline()
+        p = pipeline if pipeline is not None else redis_client.pipeline()
 
         # the redis key size limit is defined as 2 times the clickhouse query size
         # limit. there is an explicit check in the query processor for the same
@@ -111,7 +132,8 @@ class ProjectsQueryFlags:
         )
         p.expire(type_key, int(settings.REPLACER_KEY_TTL))
 
-        p.execute()
+        if pipeline is None:
+            p.execute()
 
     @classmethod
     def load_from_redis(
@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from enum import Enum
-from typing import Any, Generic, Mapping, Optional, TypeVar, cast
+from typing import Any, Generic, Mapping, Optional, Sequence, TypeVar, cast
 
 from typing_extensions import NamedTuple
 
@@ -56,6 +56,13 @@ class Replacement(ABC):
     def should_write_every_node(self) -> bool:
         raise NotImplementedError()
 
+    def merge(self, following: "Replacement") -> Optional["Replacement"]:
+        """
+        Returns a replacement with the same effect as running this one then
+        the following one, if they can be run as a single replacement.
+        """
+        return None
+
 
 R = TypeVar("R", bound=Replacement)
 
@@ -104,6 +111,18 @@ class ReplacerProcessor(ABC, Generic[R], metaclass=RegisteredClass):
         """
         return False
 
+    def pre_replacements(self, replacements: Sequence[R]) -> bool:
+        """
+        Runs the actions of pre_replacement for a batch of replacements
+        before any of them is executed. The rows they impact are not counted
+        yet, as each count depends on the replacements executed before it.
+        Returns whether any of them needs the table to be optimized.
+        """
+        need_optimize = False
+        for replacement in replacements:
+            need_optimize = self.pre_replacement(replacement, 0) or need_optimize
+        return need_optimize
+
     def post_replacement(self, replacement: R, matching_records: int) -> None:
         """
         Custom actions to run after the replacement was executed.
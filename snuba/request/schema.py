@@ -180,6 +180,9 @@ SETTINGS_SCHEMAS: Mapping[Type[QuerySettings], Schema] = {
             # TODO: move this to attribution
             "legacy": {"type": "boolean", "default": False},
             "referrer": {"type": "string", "default": "<unknown>"},
+            # Stream the rows of the result as they are read from Clickhouse
+            # instead of buffering the whole result. Meant for large exports.
+            "stream": {"type": "boolean", "default": False},
         },
         "additionalProperties": False,
     },
@@ -6,6 +6,34 @@ import jsonschema
 Schema = Mapping[str, Any]  # placeholder for JSON schema
 
 
+_validate_properties = jsonschema.Draft6Validator.VALIDATORS["properties"]
+
+
+def _validate_and_default(
+    validator: object,
+    properties: Mapping[str, Any],
+    instance: MutableMapping[str, Any],
+    schema: Mapping[str, Any],
+) -> Generator[Exception, None, None]:
+    for property, subschema in properties.items():
+        if property not in instance and "default" in subschema:
+            if callable(subschema["default"]):
+                default_value = subschema["default"]()
+            else:
+                default_value = copy.deepcopy(subschema["default"])
+            instance[property] = default_value
+
+    for error in _validate_properties(validator, properties, instance, schema):
+        yield error
+
+
+# Extending a validator creates a new class, which is expensive enough to
+# show up in the cost of every request: it is only done once.
+_DefaultingValidator = jsonschema.validators.extend(
+    jsonschema.Draft4Validator, {"properties": _validate_and_default}
+)
+
+
 def validate_jsonschema(
     value: MutableMapping[str, Any],
     schema: MutableMapping[str, Any],
@@ -16,38 +44,13 @@ def validate_jsonschema(
     value if the value conforms to the schema, otherwise raising a
     ``jsonschema.ValidationError``.
     """
-    orig = jsonschema.Draft6Validator.VALIDATORS["properties"]
-
-    def validate_and_default(
-        validator: object,
-        properties: Mapping[str, Any],
-        instance: MutableMapping[str, Any],
-        schema: Mapping[str, Any],
-    ) -> Generator[Exception, None, None]:
-        for property, subschema in properties.items():
-            if property not in instance and "default" in subschema:
-                if callable(subschema["default"]):
-                    default_value = subschema["default"]()
-                else:
-                    default_value = copy.deepcopy(subschema["default"])
-                instance[property] = default_value
-
-        for error in orig(validator, properties, instance, schema):
-            yield error
-
     # Using schema defaults during validation will cause the input value to be
     # mutated, so to be on the safe side we create a deep copy of that value to
     # avoid unwanted side effects for the calling function.
     if set_defaults:
         value = copy.deepcopy(value)
 
-    validator_cls = (
-        jsonschema.validators.extend(
-            jsonschema.Draft4Validator, {"properties": validate_and_default}
-        )
-        if set_defaults
-        else jsonschema.Draft6Validator
-    )
+    validator_cls = _DefaultingValidator if set_defaults else jsonschema.Draft6Validator
 
     validator_cls(
         schema,
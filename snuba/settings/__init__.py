@@ -79,6 +79,21 @@ DISABLED_DATASETS: Set[str] = set()
 
 # Clickhouse Options
 CLICKHOUSE_MAX_POOL_SIZE = 25
+# How many of its independent queries a request can run concurrently on the
+# query thread pool (see snuba.web.parallel).
+PARALLEL_QUERIES_MAX_CONCURRENCY = 8
+# Number of connections of the query connection pools that are established
+# in the background when the API starts, 0 disables the warmup.
+CLICKHOUSE_POOL_WARMUP_CONNECTIONS = int(
+    os.environ.get("CLICKHOUSE_POOL_WARMUP_CONNECTIONS", 0)
+)
+# How often idle pooled connections are pinged by the background health
+# check. Only pools that were warmed up are checked.
+CLICKHOUSE_POOL_HEALTH_CHECK_INTERVAL_SEC = 30.0
+# Smoothing factor of the per host latency and error rate averages used to
+# route queries between replicas, and how hard errors penalize a host.
+CLICKHOUSE_HOST_HEALTH_EWMA_ALPHA = 0.2
+CLICKHOUSE_HOST_HEALTH_ERROR_PENALTY = 4.0
 
 CLUSTERS: Sequence[Mapping[str, Any]] = [
     {
@@ -129,6 +144,14 @@ DOGSTATSD_SAMPLING_RATES = {
     "metrics.processor.distribution.size": 0.1,
 }
 DDM_METRICS_SAMPLE_RATE = float(os.environ.get("SNUBA_DDM_METRICS_SAMPLE_RATE", 0.01))
+# When set, counters and gauges are aggregated in the process and sent every
+# that many seconds instead of being sent on every call.
+DOGSTATSD_AGGREGATION_INTERVAL_SEC: float | None = (
+    float(os.environ.get("SNUBA_STATSD_AGGREGATION_INTERVAL_SEC") or 0) or None
+)
+# Max number of distinct metrics (name and tags) aggregated between two
+# sends, the calls for the other ones are sent right away.
+DOGSTATSD_AGGREGATION_MAX_KEYS = 10000
 
 CLICKHOUSE_READONLY_USER = os.environ.get("CLICKHOUSE_READONLY_USER", "default")
 CLICKHOUSE_READONLY_PASSWORD = os.environ.get("CLICKHOUSE_READONLY_PASSWORD", "")
@@ -192,12 +215,25 @@ REDIS_CLUSTERS: RedisClusters = {
 
 # Query Recording Options
 RECORD_QUERIES = False
+# Maximum number of queries waiting to be recorded by the querylog worker
+# thread, queries are dropped when it is full. 0 records them on the request
+# thread instead.
+QUERYLOG_WORKER_QUEUE_SIZE = 10000
+# How long the queries still queued are given to be recorded when the process
+# shuts down, the ones not recorded by then are dropped.
+QUERYLOG_SHUTDOWN_FLUSH_TIMEOUT_SEC = 5.0
 
 # Record COGS
 RECORD_COGS = False
 
 # Runtime Config Options
 CONFIG_MEMOIZE_TIMEOUT = 10
+# Runtime configs are kept in memory and invalidated through Redis pub/sub
+# when they change. CONFIG_MEMOIZE_TIMEOUT is how often the version of the
+# configs is polled in case a notification was missed, snapshots are
+# reloaded unconditionally after CONFIG_SNAPSHOT_MAX_AGE seconds.
+CONFIG_PUSH_INVALIDATION = True
+CONFIG_SNAPSHOT_MAX_AGE = 300
 CONFIG_STATE: Mapping[str, Optional[Any]] = {}
 
 # Sentry Options
@@ -268,6 +304,9 @@ REPLACER_MAX_GROUP_IDS_TO_EXCLUDE = 256
 REPLACER_IMMEDIATE_OPTIMIZE = False
 REPLACER_PROCESSING_TIMEOUT_THRESHOLD = 2 * 60  # 2 minutes in seconds
 REPLACER_PROCESSING_TIMEOUT_THRESHOLD_KEY_TTL = 60 * 60  # 1 hour in seconds
+# Max number of groups of the replacements of a batch merged into a single
+# count and insert query.
+REPLACER_MAX_MERGED_GROUP_IDS = 5000
 
 TURBO_SAMPLE_RATE = 0.1
 
@@ -289,6 +328,12 @@ RAISE_ON_READTHROUGH_CACHE_REDIS_FAILURES = False
 # require live and up to date data, so caching should be avoided entirely.
 BYPASS_CACHE_REFERRERS = ["subscriptions_executor"]
 
+# Bounds of the in-process result cache that sits in front of the redis
+# readthrough cache. The limits apply to each cache partition. The cache
+# itself is enabled through the `local_cache.enabled` runtime config.
+LOCAL_RESULT_CACHE_PARTITION_MAX_BYTES = 64 * 1024 * 1024
+LOCAL_RESULT_CACHE_MAX_ENTRY_BYTES = 4 * 1024 * 1024
+
 # (logical topic name, # of partitions)
 TOPIC_PARTITION_COUNTS: Mapping[str, int] = {}
 
@@ -336,6 +381,9 @@ SEPARATE_SCHEDULER_EXECUTOR_SUBSCRIPTIONS_DEV = os.environ.get(
 SUBSCRIPTIONS_DEFAULT_BUFFER_SIZE = 10000
 # (entity name, buffer size)
 SUBSCRIPTIONS_ENTITY_BUFFER_SIZE: Mapping[str, int] = {}
+# Number of parsed subscription queries the executor keeps, the least
+# recently executed ones are parsed again when they are evicted.
+SUBSCRIPTIONS_QUERY_TEMPLATE_CACHE_SIZE = 50000
 
 # Enable profiles ingestion
 ENABLE_PROFILES_CONSUMER = os.environ.get("ENABLE_PROFILES_CONSUMER", False)
@@ -395,6 +443,16 @@ SLICED_STORAGE_SETS: Mapping[str, int] = {}
 # to slice id
 LOGICAL_PARTITION_MAPPING: Mapping[str, Mapping[int, int]] = {}
 
+# Number of query shapes whose AST the SnQL and MQL parsers each keep, the
+# queries with a known shape are parsed by binding their literals to a copy
+# of its AST. 0 disables the cache.
+PARSE_CACHE_SIZE = 5000
+
+# Number of processed queries the entity and the storage processing stages
+# each keep, a query equal to one they processed before gets a copy of the
+# processed query. 0 disables the cache.
+PLAN_CACHE_SIZE = 2000
+
 # From testing, the max query size that can be sent to clickhouse is 131535 bytes (~128.452 KiB)
 MAX_QUERY_SIZE_BYTES = 128 * 1024  # 128 KiB
 
@@ -7,10 +7,10 @@ from dataclasses import dataclass
 from functools import partial
 from typing import (
     Any,
+    Dict,
     Iterable,
     Mapping,
     Optional,
-    Protocol,
     Sequence,
     SupportsFloat,
     Tuple,
@@ -25,6 +25,11 @@ from sentry_kafka_schemas.schema_types import snuba_queries_v1
 
 from snuba import environment, settings
 from snuba.redis import RedisClientKey, get_redis_client
+from snuba.state.config_snapshot import (
+    ConfigSnapshot,
+    ConfigSnapshotStore,
+    get_version_key,
+)
 from snuba.utils.metrics.wrapper import MetricsWrapper
 from snuba.utils.streams.configuration_builder import build_kafka_producer_configuration
 from snuba.utils.streams.topics import Topic
@@ -70,35 +75,6 @@ class MismatchedTypeException(Exception):
     new_type: Type[Any]
 
 
-class ConfigKeyCallable(Protocol):  # Necessary for typing the memoize
-    def __call__(self, config_key: str = config_hash) -> Any:
-        pass
-
-
-class memoize:
-    """
-    Simple expiring memoizer for state functions that takes a config key.
-    """
-
-    def __init__(self, timeout: int = 1) -> None:
-        self.timeout = timeout
-        self.saved: dict[str, Any] = {}
-        self.at: dict[str, float] = {}
-
-    def __call__(self, func: ConfigKeyCallable) -> ConfigKeyCallable:
-        def wrapper(config_key: str = config_hash) -> Any:
-            now = time.time()
-            at = self.at.get(config_key, 0.0)
-            if now > at + self.timeout or config_key not in self.saved:
-                self.saved[config_key], self.at[config_key] = (
-                    func(config_key=config_key),
-                    now,
-                )
-            return self.saved[config_key]
-
-        return wrapper
-
-
 def get_typed_value(value: Any) -> Any:
     # Return the given value based on its correct type
     # It supports the following types: int, float, string
@@ -144,7 +120,9 @@ def set_config(
             p.hset(config_history_hash, key, json.dumps(change_record))
         p.lpush(config_changes_list, json.dumps((key, change_record)))
         p.ltrim(config_changes_list, 0, config_changes_list_limit)
+        p.incr(get_version_key(config_key))
         p.execute()
+        _config_snapshots.notify_change(config_key)
         logger.info(f"Successfully changed option {key} to {value}")
     except MismatchedTypeException as exc:
         logger.exception(
@@ -196,34 +174,64 @@ def get_config(
 def _get_config(
     key: str, default: Optional[Any] = None, config_key: str = config_hash
 ) -> Optional[Any]:
-    return get_all_configs(config_key=config_key).get(key, default)
+    return get_raw_configs(config_key=config_key).get(key, default)
 
 
 def get_configs(
     key_defaults: Iterable[Tuple[str, Optional[Any]]], config_key: str = config_hash
 ) -> Sequence[Optional[Any]]:
-    all_confs = get_all_configs(config_key=config_key)
+    all_confs = get_raw_configs(config_key=config_key)
     return [all_confs.get(k, d) for k, d in key_defaults]
 
 
+def get_configs_with_prefix(
+    prefix: str, config_key: str = config_hash
+) -> Mapping[str, Optional[Any]]:
+    """
+    Returns the configs whose key starts with ``prefix``, keyed by the rest
+    of their key. Prefixes ending with ``/`` are looked up in an index, so
+    this does not depend on the total number of configs.
+    """
+    all_confs = get_raw_configs(config_key=config_key)
+    if isinstance(all_confs, ConfigSnapshot):
+        return all_confs.with_prefix(prefix)
+    return {k[len(prefix) :]: v for k, v in all_confs.items() if k.startswith(prefix)}
+
+
 def get_all_configs(config_key: str = config_hash) -> Mapping[str, Optional[Any]]:
     return {k: v for k, v in get_raw_configs(config_key=config_key).items()}
 
 
-@memoize(settings.CONFIG_MEMOIZE_TIMEOUT)
+def _load_raw_configs(config_key: str) -> Dict[str, Optional[Any]]:
+    all_configs = rds.hgetall(config_key)
+    configs = {
+        k.decode("utf-8"): get_typed_value(v.decode("utf-8"))
+        for k, v in all_configs.items()
+        if v is not None
+    }
+    if os.environ.get("SENTRY_SINGLE_TENANT"):
+        # Single Tenant has this overriding CONFIG_STATE.
+        for k, v in settings.CONFIG_STATE.items():
+            configs[k] = v
+    return configs
+
+
+_config_snapshots = ConfigSnapshotStore(
+    rds,
+    _load_raw_configs,
+    refresh_interval=settings.CONFIG_MEMOIZE_TIMEOUT,
+    max_age=settings.CONFIG_SNAPSHOT_MAX_AGE,
+    push_invalidation=settings.CONFIG_PUSH_INVALIDATION,
+)
+
+
 def get_raw_configs(config_key: str = config_hash) -> Mapping[str, Optional[Any]]:
+    """
+    Returns the runtime configs from the in-process snapshot, which is
+    refreshed when the configs change (see ``ConfigSnapshotStore``).
+    """
     try:
-        all_configs = rds.hgetall(config_key)
-        configs = {
-            k.decode("utf-8"): get_typed_value(v.decode("utf-8"))
-            for k, v in all_configs.items()
-            if v is not None
-        }
-        if os.environ.get("SENTRY_SINGLE_TENANT"):
-            # Single Tenant has this overriding CONFIG_STATE.
-            for k, v in settings.CONFIG_STATE.items():
-                configs[k] = v
-        return configs
+        return _config_snapshots.get(config_key)
     except Exception as ex:
         logger.exception(ex)
         if os.environ.get("SENTRY_SINGLE_TENANT"):
@@ -363,8 +371,15 @@ def record_query(query_metadata: snuba_queries_v1.Querylog) -> None:
         logger.exception("Could not record query due to error: %r", ex)
 
 
-def flush_producer() -> None:
+def flush_producer(timeout: Optional[float] = None) -> None:
     global kfk
     if kfk is not None:
-        messages_remaining = kfk.flush()
-        logger.debug(f"{messages_remaining} querylog messages pending delivery")
+        if timeout is None:
+            messages_remaining = kfk.flush()
+            logger.debug(f"{messages_remaining} querylog messages pending delivery")
+        else:
+            messages_remaining = kfk.flush(timeout)
+            if messages_remaining:
+                logger.warning(
+                    f"Dropping {messages_remaining} querylog messages not delivered after {timeout} seconds"
+                )
@@ -30,6 +30,14 @@ class Cache(Generic[TValue], ABC):
         """
         raise NotImplementedError
 
+    def get_remaining_ttl(self, key: str) -> Optional[float]:
+        """
+        Returns the number of seconds before the value at the given key
+        expires, 0 if there is no such value. Returns None if the value
+        does not expire or if it cannot be known.
+        """
+        return None
+
     @abstractmethod
     def get_readthrough(
         self,
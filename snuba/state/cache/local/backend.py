@@ -0,0 +1,179 @@
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, NamedTuple, Optional, cast
+
+from snuba import environment
+from snuba.state import get_config
+from snuba.state.cache.abstract import Cache, TValue
+from snuba.utils.clock import Clock, SystemClock
+from snuba.utils.metrics.timer import Timer
+from snuba.utils.metrics.wrapper import MetricsWrapper
+
+logger = logging.getLogger(__name__)
+metrics = MetricsWrapper(environment.metrics, "local_cache")
+
+# Hit type reported through ``record_cache_hit_type`` when the value was
+# served by the in-process tier. It extends the hit types defined by the
+# redis backend.
+RESULT_LOCAL_VALUE = 4
+
+
+class _Entry(NamedTuple):
+    value: object
+    size: int
+    expires_at: float
+
+
+class LocalCache(Cache[TValue]):
+    """
+    A bounded, size aware, in-process LRU cache that sits in front of
+    another cache (generally a ``RedisCache``).
+
+    Hits in this tier do not perform any network I/O nor decoding. Misses
+    are delegated to the wrapped cache and the value it returns is
+    stored locally.
+
+    Entries never live longer than ``cache_expiry_sec``, which is the TTL
+    used by the redis tier, and can be made shorter through the
+    ``local_cache.ttl_sec`` runtime config. A value read from the wrapped
+    cache does not outlive its entry there either, so a value is never
+    served for longer than ``cache_expiry_sec`` after it was computed.
+
+    Values stored here are shared between callers. Callers are free to
+    mutate what they get back, thus ``copy`` is applied every time a value
+    crosses the boundary of this cache.
+    """
+
+    def __init__(
+        self,
+        inner: Cache[TValue],
+        name: str,
+        max_size_bytes: int,
+        max_entry_size_bytes: int,
+        sizeof: Callable[[TValue], int],
+        copy: Callable[[TValue], TValue],
+        clock: Clock = SystemClock(),
+    ) -> None:
+        self.__inner = inner
+        self.__max_size_bytes = max_size_bytes
+        self.__max_entry_size_bytes = max_entry_size_bytes
+        self.__sizeof = sizeof
+        self.__copy = copy
+        self.__clock = clock
+        self.__tags = {"partition": name}
+
+        self.__entries: OrderedDict[str, _Entry] = OrderedDict()
+        self.__size_bytes = 0
+        self.__lock = Lock()
+
+    @property
+    def size_bytes(self) -> int:
+        return self.__size_bytes
+
+    def __is_enabled(self) -> bool:
+        return bool(get_config("local_cache.enabled", 0)) and not get_config(
+            "read_through_cache.short_circuit", 0
+        )
+
+    def __get_ttl(self) -> float:
+        ttl = float(get_config("cache_expiry_sec", 1) or 0)
+        local_ttl = get_config("local_cache.ttl_sec", None)
+        if local_ttl is not None:
+            ttl = min(ttl, float(local_ttl))
+        return ttl
+
+    def __get_local(self, key: str) -> Optional[TValue]:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= self.__clock.time():
+                self.__remove(key)
+                metrics.increment("expired", tags=self.__tags)
+                return None
+            self.__entries.move_to_end(key)
+            value = entry.value
+
+        return self.__copy(cast(TValue, value))
+
+    def __set_local(
+        self, key: str, value: TValue, remaining_ttl: Optional[float] = None
+    ) -> None:
+        ttl = self.__get_ttl()
+        if remaining_ttl is not None:
+            ttl = min(ttl, remaining_ttl)
+        if ttl <= 0:
+            return
+
+        size = self.__sizeof(value)
+        if size > self.__max_entry_size_bytes:
+            metrics.increment("entry_too_large", tags=self.__tags)
+            return
+
+        stored = self.__copy(value)
+        evicted = 0
+        with self.__lock:
+            self.__remove(key)
+            self.__entries[key] = _Entry(stored, size, self.__clock.time() + ttl)
+            self.__size_bytes += size
+            while self.__size_bytes > self.__max_size_bytes and self.__entries:
+                self.__remove(next(iter(self.__entries)))
+                evicted += 1
+            size_bytes = self.__size_bytes
+            entries = len(self.__entries)
+
+        if evicted:
+            metrics.increment("evicted", evicted, tags=self.__tags)
+        metrics.gauge("size_bytes", size_bytes, tags=self.__tags)
+        metrics.gauge("entries", entries, tags=self.__tags)
+
+    def __remove(self, key: str) -> None:
+        # Must be called while holding the lock.
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.__size_bytes -= entry.size
+
+    def get(self, key: str) -> Optional[TValue]:
+        if self.__is_enabled():
+            value = self.__get_local(key)
+            if value is not None:
+                return value
+        return self.__inner.get(key)
+
+    def set(self, key: str, value: TValue) -> None:
+        self.__inner.set(key, value)
+        if self.__is_enabled():
+            self.__set_local(key, value)
+
+    def get_readthrough(
+        self,
+        key: str,
+        function: Callable[[], TValue],
+        record_cache_hit_type: Callable[[int], None],
+        timer: Optional[Timer] = None,
+    ) -> TValue:
+        if not self.__is_enabled():
+            return self.__inner.get_readthrough(
+                key, function, record_cache_hit_type, timer
+            )
+
+        value = self.__get_local(key)
+        if timer is not None:
+            timer.mark("local_cache_get")
+        if value is not None:
+            metrics.increment("hit", tags=self.__tags)
+            record_cache_hit_type(RESULT_LOCAL_VALUE)
+            return value
+
+        metrics.increment("miss", tags=self.__tags)
+        value = self.__inner.get_readthrough(
+            key, function, record_cache_hit_type, timer
+        )
+        try:
+            self.__set_local(key, value, self.__inner.get_remaining_ttl(key))
+        except Exception:
+            # The local tier is an optimization, failing to populate it
+            # must never fail the query.
+            logger.warning("Failed to populate the local cache", exc_info=True)
+        return value
@@ -1,15 +1,26 @@
 import logging
-from typing import Callable, Optional
+import time
+import uuid
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import Lock
+from typing import Callable, MutableMapping, Optional, Tuple
 
 from redis.exceptions import ConnectionError, ReadOnlyError
 from redis.exceptions import TimeoutError as RedisTimeoutError
 from snuba import environment, settings
 from snuba.redis import RedisClientType
 from snuba.state import get_config
-from snuba.state.cache.abstract import Cache, TValue
+from snuba.state.cache.abstract import (
+    Cache,
+    ExecutionError,
+    ExecutionTimeoutError,
+    TValue,
+)
 from snuba.utils.codecs import ExceptionAwareCodec
 from snuba.utils.metrics.timer import Timer
 from snuba.utils.metrics.wrapper import MetricsWrapper
+from snuba.utils.serializable_exception import SerializableException
 
 logger = logging.getLogger(__name__)
 metrics = MetricsWrapper(environment.metrics, "read_through_cache")
@@ -20,6 +31,8 @@ RESULT_EXECUTE = 1
 RESULT_WAIT = 2
 SIMPLE_READTHROUGH = 3
 
+REDIS_ERRORS = (ConnectionError, ReadOnlyError, RedisTimeoutError)
+
 
 class RedisCache(Cache[TValue]):
     def __init__(
@@ -32,6 +45,12 @@ class RedisCache(Cache[TValue]):
         self.__prefix = prefix
         self.__codec = codec
 
+        # Executions in progress in this process, used to coalesce identical
+        # concurrent calls to ``get_readthrough`` when single flight is on.
+        # The future resolves to the encoded value (or encoded exception).
+        self.__inflight: MutableMapping[str, Future[bytes]] = {}
+        self.__inflight_lock = Lock()
+
     def __build_key(
         self, key: str, prefix: Optional[str] = None, suffix: Optional[str] = None
     ) -> str:
@@ -53,6 +72,16 @@ class RedisCache(Cache[TValue]):
             ex=get_config("cache_expiry_sec", 1),
         )
 
+    def get_remaining_ttl(self, key: str) -> Optional[float]:
+        try:
+            ttl_ms = self.__client.pttl(self.__build_key(key))
+        except REDIS_ERRORS:
+            return None
+        if ttl_ms == -1:
+            # The key exists but has no expiry.
+            return None
+        return max(ttl_ms, 0) / 1000
+
     def __get_value_with_simple_readthrough(
         self,
         key: str,
@@ -69,9 +98,11 @@ class RedisCache(Cache[TValue]):
         metric_tags = timer.tags if timer is not None else {}
 
         if cached_value is not None:
+            metrics.increment("hit", tags=metric_tags)
             record_cache_hit_type(RESULT_VALUE)
             return self.__codec.decode(cached_value)
         else:
+            metrics.increment("miss", tags=metric_tags)
             try:
                 value = function()
                 self.__client.set(
@@ -87,6 +118,245 @@ class RedisCache(Cache[TValue]):
                 raise e
             return value
 
+    def __get_single_flight_timeout(self) -> int:
+        return int(get_config("read_through_cache.single_flight_timeout_sec", 30) or 1)
+
+    def __get_single_flight_poll_interval(self) -> float:
+        return (
+            int(
+                get_config("read_through_cache.single_flight_poll_interval_ms", 50) or 1
+            )
+            / 1000
+        )
+
+    def __encode_error(self, error: Exception) -> bytes:
+        if not isinstance(error, SerializableException):
+            error = ExecutionError(f"{error.__class__.__name__}: {error}")
+        return self.__codec.encode_exception(error)
+
+    def __get_value_with_single_flight(
+        self,
+        key: str,
+        function: Callable[[], TValue],
+        record_cache_hit_type: Callable[[int], None],
+        timer: Optional[Timer] = None,
+    ) -> TValue:
+        """
+        Coalesces concurrent calls for the same key within this process,
+        the first caller (the leader) goes through the distributed lock while
+        the others wait for its outcome.
+        """
+        with self.__inflight_lock:
+            flight = self.__inflight.get(key)
+            is_leader = flight is None
+            if flight is None:
+                flight = self.__inflight[key] = Future()
+
+        if not is_leader:
+            record_cache_hit_type(RESULT_WAIT)
+            metrics.increment("single_flight.local_wait")
+            try:
+                encoded = flight.result(timeout=self.__get_single_flight_timeout())
+            except FutureTimeoutError:
+                raise ExecutionTimeoutError(
+                    "Timed out waiting for the in-flight execution of the query"
+                )
+            if timer is not None:
+                timer.mark("cache_wait")
+            # Every waiter decodes its own copy of the value so that callers
+            # can safely mutate what they get.
+            return self.__codec.decode(encoded)
+
+        try:
+            value, encoded = self.__with_fail_open(
+                self.__get_value_with_distributed_lock,
+                key,
+                function,
+                record_cache_hit_type,
+                timer,
+            )
+        except Exception as e:
+            flight.set_result(self.__encode_error(e))
+            raise
+        else:
+            flight.set_result(encoded)
+        finally:
+            with self.__inflight_lock:
+                del self.__inflight[key]
+        return value
+
+    def __get_value_with_distributed_lock(
+        self,
+        key: str,
+        function: Callable[[], TValue],
+        record_cache_hit_type: Callable[[int], None],
+        timer: Optional[Timer] = None,
+    ) -> Tuple[TValue, bytes]:
+        result_key = self.__build_key(key)
+        lock_key = self.__build_key(key, suffix="lock")
+
+        cached_value = self.__client.get(result_key)
+        if timer is not None:
+            timer.mark("cache_get")
+        metric_tags = timer.tags if timer is not None else {}
+
+        if cached_value is not None:
+            metrics.increment("hit", tags=metric_tags)
+            record_cache_hit_type(RESULT_VALUE)
+            return self.__codec.decode(cached_value), cached_value
+
+        metrics.increment("miss", tags=metric_tags)
+        timeout = self.__get_single_flight_timeout()
+        # Every execution has its own generation, so that the clients waiting
+        # on it never pick up the outcome of a previous execution of the key.
+        generation = uuid.uuid4().hex
+        if self.__client.set(lock_key, generation, nx=True, ex=timeout):
+            return self.__execute_and_publish(
+                key, generation, function, record_cache_hit_type, timeout, timer
+            )
+        return self.__wait_for_value(key, record_cache_hit_type, timer)
+
+    def __execute_and_publish(
+        self,
+        key: str,
+        generation: str,
+        function: Callable[[], TValue],
+        record_cache_hit_type: Callable[[int], None],
+        timeout: int,
+        timer: Optional[Timer] = None,
+    ) -> Tuple[TValue, bytes]:
+        result_key = self.__build_key(key)
+        lock_key = self.__build_key(key, suffix="lock")
+        error_key = self.__build_key(key, suffix=f"error/{generation}")
+        metric_tags = timer.tags if timer is not None else {}
+
+        start = time.time()
+        try:
+            value = function()
+        except Exception as e:
+            metrics.increment("execute_error", tags=metric_tags)
+            try:
+                pipe = self.__client.pipeline()
+                pipe.set(error_key, self.__encode_error(e), ex=timeout)
+                pipe.delete(lock_key)
+                pipe.execute()
+            except REDIS_ERRORS:
+                # Waiters will time out, the original error is more relevant.
+                logger.warning("Failed to notify waiters of an error", exc_info=True)
+            raise e
+
+        if time.time() - start >= timeout:
+            # The lock expired while executing. Another client may have
+            # populated the cache since, do not overwrite it with a value
+            # that may be staler.
+            metrics.increment("execute_timeout", tags=metric_tags)
+            raise TimeoutError("Execution of the query exceeded the cache lock timeout")
+
+        encoded = self.__codec.encode(value)
+        record_cache_hit_type(RESULT_EXECUTE)
+        try:
+            pipe = self.__client.pipeline()
+            pipe.set(result_key, encoded, ex=get_config("cache_expiry_sec", 1))
+            pipe.delete(lock_key)
+            pipe.execute()
+        except REDIS_ERRORS:
+            # The value was computed already, there is no reason to fail the
+            # caller (or execute the function again).
+            if settings.RAISE_ON_READTHROUGH_CACHE_REDIS_FAILURES:
+                raise
+            metrics.increment("snuba.read_through_cache.fail_open")
+        if timer is not None:
+            timer.mark("cache_set")
+        return value, encoded
+
+    def __wait_for_value(
+        self,
+        key: str,
+        record_cache_hit_type: Callable[[int], None],
+        timer: Optional[Timer] = None,
+    ) -> Tuple[TValue, bytes]:
+        """
+        Polls for the outcome of the execution that holds the lock. Waiters
+        do not block on Redis, so they do not hold a connection of the pool
+        while the query runs.
+        """
+        result_key = self.__build_key(key)
+        lock_key = self.__build_key(key, suffix="lock")
+        metric_tags = timer.tags if timer is not None else {}
+
+        record_cache_hit_type(RESULT_WAIT)
+        metrics.increment("single_flight.wait", tags=metric_tags)
+
+        # The timeout clock starts when the lock is taken, so the remaining
+        # lock TTL is the upper bound of the wait.
+        pipe = self.__client.pipeline()
+        pipe.get(lock_key)
+        pipe.pttl(lock_key)
+        generation, remaining_ms = pipe.execute()
+        deadline = time.time() + max(remaining_ms, 0) / 1000
+        poll_interval = self.__get_single_flight_poll_interval()
+        error_key = (
+            self.__build_key(key, suffix=f"error/{generation.decode('utf-8')}")
+            if generation is not None
+            else None
+        )
+
+        while True:
+            pipe = self.__client.pipeline()
+            pipe.get(result_key)
+            pipe.get(lock_key)
+            if error_key is not None:
+                pipe.get(error_key)
+            cached_value, current_generation, *error = pipe.execute()
+
+            if cached_value is not None:
+                if timer is not None:
+                    timer.mark("cache_wait")
+                return self.__codec.decode(cached_value), cached_value
+
+            if error and error[0] is not None:
+                # Raises the exception encoded by the client that executed.
+                self.__codec.decode(error[0])
+                raise ExecutionError("Another client failed to execute the query")
+
+            # The value or the error is written in the same transaction that
+            # releases the lock. If neither was found, the lock expired while
+            # executing. A later execution of the key is not waited on.
+            if (
+                generation is None
+                or current_generation != generation
+                or time.time() >= deadline
+            ):
+                break
+            time.sleep(min(poll_interval, max(deadline - time.time(), 0)))
+
+        if timer is not None:
+            timer.mark("cache_wait")
+        metrics.increment("single_flight.wait_timeout", tags=metric_tags)
+        raise ExecutionTimeoutError(
+            "Timed out waiting for another client to execute the query"
+        )
+
+    def __with_fail_open(
+        self,
+        get_value: Callable[
+            [str, Callable[[], TValue], Callable[[int], None], Optional[Timer]],
+            Tuple[TValue, bytes],
+        ],
+        key: str,
+        function: Callable[[], TValue],
+        record_cache_hit_type: Callable[[int], None],
+        timer: Optional[Timer] = None,
+    ) -> Tuple[TValue, bytes]:
+        try:
+            return get_value(key, function, record_cache_hit_type, timer)
+        except (*REDIS_ERRORS, ValueError):
+            if settings.RAISE_ON_READTHROUGH_CACHE_REDIS_FAILURES:
+                raise
+            metrics.increment("snuba.read_through_cache.fail_open")
+            value = function()
+            return value, self.__codec.encode(value)
+
     def get_readthrough(
         self,
         key: str,
@@ -99,12 +369,19 @@ class RedisCache(Cache[TValue]):
         if get_config("read_through_cache.short_circuit", 0):
             return function()
 
+        # Coalesces identical concurrent queries, within this process and
+        # across processes, so that only one of them is executed.
+        if get_config("read_through_cache.single_flight", 0):
+            return self.__get_value_with_single_flight(
+                key, function, record_cache_hit_type, timer
+            )
+
         try:
             # set disable_lua_scripts to use the simple read-through cache without queueing.
             return self.__get_value_with_simple_readthrough(
                 key, function, record_cache_hit_type, timer
             )
-        except (ConnectionError, ReadOnlyError, RedisTimeoutError, ValueError):
+        except (*REDIS_ERRORS, ValueError):
             if settings.RAISE_ON_READTHROUGH_CACHE_REDIS_FAILURES:
                 raise
             metrics.increment("snuba.read_through_cache.fail_open")
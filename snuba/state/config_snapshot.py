@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Iterator, Mapping, MutableMapping, Optional
+
+from redis import Redis
+from redis.cluster import RedisCluster
+from snuba import environment
+from snuba.utils.clock import Clock, SystemClock
+from snuba.utils.metrics.wrapper import MetricsWrapper
+
+metrics = MetricsWrapper(environment.metrics, "snuba.state")
+logger = logging.getLogger("snuba.state")
+
+RedisClientType = Redis | RedisCluster
+
+# Channel on which the name of a config hash is published every time one of
+# its values changes.
+CONFIG_CHANGES_CHANNEL = "snuba-config-changes-channel"
+
+
+def get_version_key(config_key: str) -> str:
+    """
+    Key of the counter incremented every time a value of the ``config_key``
+    hash is changed.
+    """
+    return f"{config_key}-version"
+
+
+class ConfigSnapshot(Mapping[str, Any]):
+    """
+    Immutable view of the content of a config hash at a given version.
+
+    Besides regular lookups, it can return all the configs whose key starts
+    with a prefix ending with ``/`` (e.g. ``referrer/<r>/query_settings/``)
+    with a single dictionary lookup. The index is built the first time it
+    is needed and lives as long as the snapshot.
+    """
+
+    def __init__(
+        self,
+        values: Dict[str, Any],
+        version: Optional[int],
+        generation: int,
+        loaded_at: float,
+    ) -> None:
+        self.__values = values
+        self.version = version
+        self.generation = generation
+        self.loaded_at = loaded_at
+        self.checked_at = loaded_at
+        self.__prefix_index: Optional[Mapping[str, Mapping[str, Any]]] = None
+        self.__fingerprint: Optional[str] = None
+
+    def __getitem__(self, key: str) -> Any:
+        return self.__values[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__values)
+
+    def __len__(self) -> int:
+        return len(self.__values)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.__values.get(key, default)
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Hash of the configs of the snapshot. Unlike the version, which
+        starts over when Redis is flushed, it only changes with the configs.
+        """
+        if self.__fingerprint is None:
+            self.__fingerprint = hashlib.md5(
+                repr(sorted(self.__values.items())).encode("utf-8")
+            ).hexdigest()
+        return self.__fingerprint
+
+    def __build_prefix_index(self) -> Mapping[str, Mapping[str, Any]]:
+        index: MutableMapping[str, Dict[str, Any]] = {}
+        for key, value in self.__values.items():
+            position = key.find("/")
+            while position != -1:
+                index.setdefault(key[: position + 1], {})[key[position + 1 :]] = value
+                position = key.find("/", position + 1)
+        return index
+
+    def with_prefix(self, prefix: str) -> Mapping[str, Any]:
+        """
+        Returns the configs whose key starts with ``prefix``, keyed by the
+        rest of their key.
+        """
+        if not prefix.endswith("/"):
+            return {
+                key[len(prefix) :]: value
+                for key, value in self.__values.items()
+                if key.startswith(prefix)
+            }
+        if self.__prefix_index is None:
+            # Concurrent callers may build the index twice, which is
+            # harmless since the snapshot does not change.
+            self.__prefix_index = self.__build_prefix_index()
+        return self.__prefix_index.get(prefix, {})
+
+
+class ConfigSnapshotStore:
+    """
+    Keeps the latest snapshot of each config hash in memory.
+
+    Writers increment a version counter next to the hash and publish the
+    name of the hash on ``CONFIG_CHANGES_CHANNEL`` (see ``notify_change``).
+
+    * While a listener thread is subscribed to that channel, a snapshot is
+      invalidated as soon as a notification is received.
+    * In any case, the version counter is polled every ``refresh_interval``
+      seconds and the hash is only read again if the version changed. A
+      subscription can die without an error (e.g. on a Redis failover), so
+      this bounds how stale the configs can be even while subscribed.
+
+    Snapshots are reloaded unconditionally once they are ``max_age``
+    seconds old regardless. A ``refresh_interval`` of 0 disables caching
+    altogether.
+    """
+
+    def __init__(
+        self,
+        client: RedisClientType,
+        load: Callable[[str], Dict[str, Any]],
+        refresh_interval: float,
+        max_age: float,
+        push_invalidation: bool = True,
+        clock: Clock = SystemClock(),
+    ) -> None:
+        self.__client = client
+        self.__clock = clock
+        self.__load = load
+        self.__refresh_interval = refresh_interval
+        self.__max_age = max_age
+        self.__push_invalidation = push_invalidation
+
+        self.__snapshots: MutableMapping[str, ConfigSnapshot] = {}
+        # Bumped every time a config hash is invalidated. A snapshot is only
+        # valid if it was loaded at the current generation of its hash,
+        # which discards loads racing with an invalidation.
+        self.__generations: MutableMapping[str, int] = {}
+        self.__lock = threading.Lock()
+
+        self.__listening = False
+        self.__listener_pid: Optional[int] = None
+
+    def get(self, config_key: str) -> ConfigSnapshot:
+        if self.__refresh_interval <= 0:
+            return self.__reload(config_key)
+
+        if self.__push_invalidation:
+            self.__ensure_listener()
+
+        snapshot = self.__snapshots.get(config_key)
+        now = self.__clock.time()
+        if (
+            snapshot is None
+            or snapshot.generation != self.__generations.get(config_key, 0)
+            or now >= snapshot.loaded_at + self.__max_age
+        ):
+            return self.__reload(config_key)
+
+        if now < snapshot.checked_at + self.__refresh_interval:
+            return snapshot
+
+        try:
+            version = self.__get_version(config_key)
+        except Exception as e:
+            # Serve the last known configs while Redis is unavailable.
+            logger.warning("Could not check the config version: %s", e)
+            snapshot.checked_at = now
+            return snapshot
+
+        if version != snapshot.version:
+            if self.__listening:
+                # The change should have been notified, the subscription may
+                # not be receiving anything.
+                metrics.increment("config_change_notification_missed")
+            return self.__reload(config_key)
+        snapshot.checked_at = now
+        return snapshot
+
+    def invalidate(self, config_key: Optional[str] = None) -> None:
+        with self.__lock:
+            keys = [config_key] if config_key is not None else list(self.__snapshots)
+            for key in keys:
+                self.__generations[key] = self.__generations.get(key, 0) + 1
+
+    def notify_change(self, config_key: str) -> None:
+        """
+        Called after the ``config_key`` hash was changed (the version
+        counter is incremented by the writer, in the same transaction as the
+        change). Notifies every process.
+        """
+        self.invalidate(config_key)
+        try:
+            self.__client.publish(CONFIG_CHANGES_CHANNEL, config_key)
+        except Exception as e:
+            # Other processes will notice the new version when polling.
+            logger.warning("Could not publish config change: %s", e)
+
+    def __get_version(self, config_key: str) -> Optional[int]:
+        version = self.__client.get(get_version_key(config_key))
+        return int(version) if version is not None else None
+
+    def __reload(self, config_key: str) -> ConfigSnapshot:
+        generation = self.__generations.get(config_key, 0)
+        try:
+            version = self.__get_version(config_key)
+            values = self.__load(config_key)
+        except Exception:
+            # Serve the last known configs while Redis is unavailable, the
+            # next call will try again.
+            previous = self.__snapshots.get(config_key)
+            if previous is None:
+                raise
+            metrics.increment("config_snapshot_reload_failed")
+            return previous
+        snapshot = ConfigSnapshot(values, version, generation, self.__clock.time())
+        if self.__refresh_interval > 0:
+            self.__snapshots[config_key] = snapshot
+            metrics.increment("config_snapshot_reload")
+        return snapshot
+
+    def __ensure_listener(self) -> None:
+        # Threads do not survive forks, each process needs its own listener.
+        if self.__listener_pid == os.getpid():
+            return
+        with self.__lock:
+            if self.__listener_pid == os.getpid():
+                return
+            self.__listener_pid = os.getpid()
+            self.__listening = False
+            threading.Thread(
+                target=self.__listen, name="snuba-config-listener", daemon=True
+            ).start()
+
+    def __listen(self) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                pubsub = self.__client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CONFIG_CHANGES_CHANNEL)
+                # Changes made while not subscribed were missed.
+                self.invalidate()
+                self.__listening = True
+                backoff = 1.0
+                for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        data = message["data"]
+                        self.invalidate(
+                            data.decode("utf-8") if isinstance(data, bytes) else data
+                        )
+            except Exception as e:
+                logger.warning("Config change subscription failed: %s", e)
+            self.__listening = False
+            self.__clock.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
@@ -0,0 +1,311 @@
+"""
+Per-process leases on quotas that are shared through Redis.
+
+Checking a shared quota in Redis for every query costs a network round trip
+per query. With leases, a process takes a chunk of the quota at once and
+admits the queries that fit in that chunk locally, only going back to Redis
+when the chunk runs out or when the lease expires. The chunk size and the
+lease duration bound how far the local decisions can drift from the global
+limit.
+
+Leases, and the start of the queries counted in shared rate limits, live in
+module level registries rather than on the allocation policies because
+policies have to be pickleable.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, MutableMapping, NamedTuple, Optional, Sequence, Tuple
+
+from snuba.utils.clock import Clock, SystemClock
+
+
+class LeasedSlots(NamedTuple):
+    """
+    Slots to give back to the shared quota, with the time and the backend
+    they were registered with.
+    """
+
+    slots: Sequence[str]
+    started_at: float
+    backend: str
+
+
+@dataclass
+class _SlotLease:
+    # Ids under which the slots were registered in the shared quota.
+    free: List[str]
+    expires_at: float
+    # Usage of the shared quota when the lease was taken.
+    observed: int
+    started_at: float
+    backend: str
+    in_use: int = 0
+
+    def take_free(self) -> LeasedSlots:
+        released, self.free = self.free, []
+        return LeasedSlots(released, self.started_at, self.backend)
+
+
+class SlotLeases:
+    """
+    Leases of concurrency slots. Every slot is registered in the shared
+    quota as if it was a running query, a process holding a lease can then
+    run as many queries as it has slots without telling anybody.
+
+    Leasing slots never lets more queries run than the limit: a slot that is
+    leased but not used only makes the quota look more used than it is to
+    the other processes, until the lease expires and the slot is given back.
+    """
+
+    def __init__(self, clock: Clock = SystemClock()) -> None:
+        self.__clock = clock
+        self.__leases: MutableMapping[str, _SlotLease] = {}
+        # query id -> (bucket, slot id, lease) of the queries holding a slot
+        self.__holders: MutableMapping[str, Tuple[str, str, _SlotLease]] = {}
+        self.__lock = threading.Lock()
+
+    def acquire(self, bucket: str, query_id: str) -> Optional[int]:
+        """
+        Takes a slot of the lease of ``bucket`` for the query and returns
+        the usage of the shared quota observed when the lease was taken.
+        Returns None if there is no valid lease or if all its slots are in
+        use.
+        """
+        with self.__lock:
+            lease = self.__leases.get(bucket)
+            if (
+                lease is None
+                or lease.expires_at <= self.__clock.time()
+                or not lease.free
+            ):
+                return None
+            slot = lease.free.pop()
+            lease.in_use += 1
+            self.__holders[query_id] = (bucket, slot, lease)
+            return lease.observed
+
+    def add(
+        self,
+        bucket: str,
+        slots: Sequence[str],
+        ttl: float,
+        observed: int,
+        started_at: float,
+        backend: str,
+    ) -> Optional[LeasedSlots]:
+        """
+        Installs a new lease for ``bucket``, whose slots were registered in
+        the shared quota at ``started_at`` with ``backend``. Returns the free
+        slots of the lease it replaces, which the caller has to give back.
+        """
+        with self.__lock:
+            previous = self.__leases.get(bucket)
+            self.__leases[bucket] = _SlotLease(
+                list(slots), self.__clock.time() + ttl, observed, started_at, backend
+            )
+            if previous is None or not previous.free:
+                return None
+            return previous.take_free()
+
+    def release(self, query_id: str) -> Tuple[Optional[str], Optional[LeasedSlots]]:
+        """
+        Gives back the slot held by the query. If the lease of the slot is
+        still valid, the slot goes back to it and ``(bucket, None)`` is
+        returned. Otherwise ``(bucket, LeasedSlots([slot], ...))`` is
+        returned and the caller has to give the slot back to the shared
+        quota. ``(None, None)`` means the
+        query does not hold a slot.
+        """
+        with self.__lock:
+            holder = self.__holders.pop(query_id, None)
+            if holder is None:
+                return None, None
+            bucket, slot, lease = holder
+            lease.in_use -= 1
+            if (
+                self.__leases.get(bucket) is lease
+                and lease.expires_at > self.__clock.time()
+            ):
+                lease.free.append(slot)
+                return bucket, None
+            return bucket, LeasedSlots([slot], lease.started_at, lease.backend)
+
+    def collect_expired(self) -> Sequence[Tuple[str, LeasedSlots]]:
+        """
+        Removes the expired leases and returns their free slots, which the
+        caller has to give back to the shared quota.
+        """
+        now = self.__clock.time()
+        expired = []
+        with self.__lock:
+            for bucket, lease in list(self.__leases.items()):
+                if lease.expires_at <= now:
+                    del self.__leases[bucket]
+                    if lease.free:
+                        expired.append((bucket, lease.take_free()))
+        return expired
+
+
+class _StartedRequest(NamedTuple):
+    started_at: float
+    backend: str
+
+
+class StartedRequests:
+    """
+    The time and the backend the queries that are not leasing slots were
+    registered with in a shared rate limit, which are needed to finish them
+    (see rate_limit_finish_requests).
+
+    Queries that are never finished are forgotten after ``max_age``, the
+    shared rate limit does not count them any longer either.
+    """
+
+    def __init__(self, clock: Clock = SystemClock()) -> None:
+        self.__clock = clock
+        self.__requests: OrderedDict[str, _StartedRequest] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def add(
+        self, query_id: str, started_at: float, backend: str, max_age: float
+    ) -> None:
+        with self.__lock:
+            cutoff = self.__clock.time() - max_age
+            while self.__requests:
+                oldest = next(iter(self.__requests.values()))
+                if oldest.started_at > cutoff:
+                    break
+                self.__requests.popitem(last=False)
+            self.__requests[query_id] = _StartedRequest(started_at, backend)
+
+    def pop(self, query_id: str) -> Tuple[Optional[float], Optional[str]]:
+        """
+        Returns ``(started_at, backend)`` of the query, ``(None, None)`` if
+        it is unknown.
+        """
+        with self.__lock:
+            request = self.__requests.pop(query_id, None)
+        if request is None:
+            return None, None
+        return request.started_at, request.backend
+
+
+@dataclass
+class _BudgetLease:
+    budget: int
+    expires_at: float
+    used: int = 0
+    # Usage not reported to the shared quota yet.
+    pending: int = 0
+
+
+class BudgetLeases:
+    """
+    Leases on an amount of a consumable resource (e.g. bytes scanned) whose
+    cost is only known once the query ran.
+
+    A lease is granted with a budget that was available in the shared quota.
+    Queries are admitted locally as long as the usage recorded since the
+    lease was granted stays under that budget. The usage is reported to the
+    shared quota in batches: once the budget is used up or when the lease
+    expires.
+    """
+
+    def __init__(self, clock: Clock = SystemClock()) -> None:
+        self.__clock = clock
+        self.__leases: MutableMapping[str, _BudgetLease] = {}
+        self.__lock = threading.Lock()
+
+    def admit(self, key: str) -> Optional[int]:
+        """
+        Returns the budget left in the lease of ``key``, None if the query
+        cannot be admitted locally.
+        """
+        with self.__lock:
+            lease = self.__leases.get(key)
+            if (
+                lease is None
+                or lease.expires_at <= self.__clock.time()
+                or lease.used >= lease.budget
+            ):
+                return None
+            return lease.budget - lease.used
+
+    def grant(self, key: str, budget: int, ttl: float) -> int:
+        """
+        Installs a new lease for ``key``. Returns the usage of the previous
+        lease that still has to be reported.
+        """
+        with self.__lock:
+            previous = self.__leases.get(key)
+            self.__leases[key] = _BudgetLease(budget, self.__clock.time() + ttl)
+            return previous.pending if previous is not None else 0
+
+    def consume(self, key: str, amount: int) -> bool:
+        """
+        Records usage against the lease of ``key``. Returns False if there
+        is no lease, in which case the caller reports the usage itself.
+        """
+        with self.__lock:
+            lease = self.__leases.get(key)
+            if lease is None:
+                return False
+            lease.used += amount
+            lease.pending += amount
+            return True
+
+    def collect_pending(self) -> Sequence[Tuple[str, int]]:
+        """
+        Returns ``(key, usage)`` for the leases whose usage has to
+        be reported now: the ones that are used up or expired. Expired
+        leases are removed.
+        """
+        now = self.__clock.time()
+        pending = []
+        with self.__lock:
+            for key, lease in list(self.__leases.items()):
+                expired = lease.expires_at <= now
+                if expired:
+                    del self.__leases[key]
+                if lease.pending and (expired or lease.used >= lease.budget):
+                    pending.append((key, lease.pending))
+                    lease.pending = 0
+        return pending
+
+
+_slot_leases: MutableMapping[str, SlotLeases] = {}
+_budget_leases: MutableMapping[str, BudgetLeases] = {}
+_started_requests: MutableMapping[str, StartedRequests] = {}
+_registry_lock = threading.Lock()
+
+
+def get_slot_leases(name: str) -> SlotLeases:
+    with _registry_lock:
+        if name not in _slot_leases:
+            _slot_leases[name] = SlotLeases()
+        return _slot_leases[name]
+
+
+def get_budget_leases(name: str) -> BudgetLeases:
+    with _registry_lock:
+        if name not in _budget_leases:
+            _budget_leases[name] = BudgetLeases()
+        return _budget_leases[name]
+
+
+def get_started_requests(name: str) -> StartedRequests:
+    with _registry_lock:
+        if name not in _started_requests:
+            _started_requests[name] = StartedRequests()
+        return _started_requests[name]
+
+
+def reset_leases() -> None:
+    with _registry_lock:
+        _slot_leases.clear()
+        _budget_leases.clear()
+        _started_requests.clear()
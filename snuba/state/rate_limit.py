@@ -1,17 +1,19 @@
 from __future__ import annotations
 
+import hashlib
 import logging
 import sys
 import time
 import uuid
 from collections import ChainMap, namedtuple
-from contextlib import AbstractContextManager, ExitStack, contextmanager
-from dataclasses import dataclass
+from contextlib import AbstractContextManager, contextmanager
+from dataclasses import dataclass, field
 from types import TracebackType
 from typing import Any
 from typing import ChainMap as TypingChainMap
 from typing import Iterator, MutableMapping, Optional, Sequence, Type
 
+from redis.exceptions import NoScriptError
 from snuba import environment, state
 from snuba.redis import RedisClientKey, get_redis_client
 from snuba.state import get_configs, set_config
@@ -26,6 +28,13 @@ PROJECT_REFERRER_RATE_LIMIT_NAME = "project_referrer"
 REFERRER_RATE_LIMIT_NAME = "referrer"
 TABLE_RATE_LIMIT_NAME = "table"
 
+# The implementations of the rate limits. The backend of a rate limit is
+# picked by its name with the `rate_limit_backend_<rate_limit_name>` runtime
+# config, it defaults to the sorted sets.
+ZSET_BACKEND = "zset"
+COUNTER_BACKEND = "counter"
+RATE_LIMIT_BACKEND_KEY_PREFIX = "rate_limit_backend_"
+
 metrics = MetricsWrapper(environment.metrics, "api")
 
 rds = get_redis_client(RedisClientKey.RATE_LIMITER)
@@ -91,6 +100,9 @@ class RateLimitStats:
 
     rate: float
     concurrent: int
+    # The backend the request was started with, it has to be finished with
+    # the same one even if the config changed meanwhile.
+    backend: str = field(default=ZSET_BACKEND, compare=False)
 
 
 class RateLimitStatsContainer:
@@ -138,6 +150,190 @@ def _get_bucket_key(prefix: str, bucket: str, shard_id: int) -> str:
     return "{}{}{}".format(prefix, bucket, shard_suffix)
 
 
+def _get_backends(rate_limit_params: Sequence[RateLimitParameters]) -> Sequence[str]:
+    names = list({params.rate_limit_name for params in rate_limit_params})
+    backends = dict(
+        zip(
+            names,
+            get_configs(
+                [(f"{RATE_LIMIT_BACKEND_KEY_PREFIX}{name}", None) for name in names]
+            ),
+        )
+    )
+    return [
+        (
+            COUNTER_BACKEND
+            if backends[params.rate_limit_name] == COUNTER_BACKEND
+            else ZSET_BACKEND
+        )
+        for params in rate_limit_params
+    ]
+
+
+# The counter backend keeps two kinds of keys per bucket, the hash tag keeps
+# them in the same slot of a cluster so a single script can use them:
+#
+# * the theoretical arrival time (TAT) of the Generic Cell Rate Algorithm, in
+#   microseconds. Every query pushes it one emission interval (1 / the
+#   per-second limit) in the future, it never goes behind the current time.
+#   How far ahead of now it is tells how many queries were admitted
+#   recently: a per-second limit is exceeded when it is more than
+#   rate_lookback_s ahead, which allows the same number of queries over the
+#   lookback window as the sorted sets do.
+# * one counter of running queries per period of max_query_duration_s, the
+#   leases. A query increments the counter of the period it starts in and
+#   decrements that same counter when it finishes. The queries running are
+#   the ones of the current and of the previous period: the lease of a query
+#   that never finished (the process was killed) stops being counted after
+#   two periods at most, when its counter expires.
+#
+# Both are updated and read by one script, instead of the sorted set commands
+# and the count of every shard.
+_COUNTER_START_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local backlog = 0
+if interval > 0 then
+    local tat = tonumber(redis.call('GET', KEYS[1])) or now
+    if tat < now then
+        tat = now
+    end
+    tat = tat + interval
+    backlog = tat - now
+    redis.call('SET', KEYS[1], string.format('%.0f', tat), 'PX', math.ceil(backlog / 1000) + 1)
+end
+local concurrent = 0
+if ARGV[3] == '1' then
+    concurrent = redis.call('INCR', KEYS[2])
+    if concurrent == 1 then
+        -- The name of the counter tells when it is read, the expiration only
+        -- has to outlive that.
+        redis.call('EXPIRE', KEYS[2], ARGV[4])
+    end
+    concurrent = concurrent + (tonumber(redis.call('GET', KEYS[3])) or 0)
+end
+return {math.floor(backlog), concurrent}
+"""
+
+# Gives back what _COUNTER_START_SCRIPT took. The TAT is only moved back for
+# queries that did not run. Counters that expired in the meantime are not
+# recreated with a negative count.
+_COUNTER_FINISH_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+if interval > 0 then
+    local tat = tonumber(redis.call('GET', KEYS[1]))
+    if tat then
+        tat = tat - interval
+        if tat > now then
+            redis.call('SET', KEYS[1], string.format('%.0f', tat), 'PX', math.ceil((tat - now) / 1000) + 1)
+        else
+            redis.call('DEL', KEYS[1])
+        end
+    end
+end
+if ARGV[3] == '1' and redis.call('DECR', KEYS[2]) < 0 then
+    redis.call('DEL', KEYS[2])
+end
+return 0
+"""
+
+
+class _Script:
+    """
+    A Lua script run with EVALSHA, so its source is only sent to Redis the
+    first time the process uses it, instead of with every command.
+    """
+
+    def __init__(self, source: str) -> None:
+        self.__source = source
+        self.__sha = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        self.__loaded = False
+
+    def queue(self, pipe: Any, keys: Sequence[str], args: Sequence[Any]) -> None:
+        pipe.execute_command("EVALSHA", self.__sha, len(keys), *keys, *args)
+
+    def load(self) -> None:
+        if not self.__loaded:
+            rds.execute_command("SCRIPT LOAD", self.__source)
+            self.__loaded = True
+
+    def forget(self) -> None:
+        """
+        Loads the script again the next time it is used, after Redis lost
+        it (it restarted or failed over).
+        """
+        self.__loaded = False
+
+
+_counter_start_script = _Script(_COUNTER_START_SCRIPT)
+_counter_finish_script = _Script(_COUNTER_FINISH_SCRIPT)
+
+
+def _execute(pipe: Any, backends: Sequence[str]) -> Any:
+    if COUNTER_BACKEND in backends:
+        _counter_start_script.load()
+        _counter_finish_script.load()
+    try:
+        return pipe.execute()
+    except NoScriptError:
+        # The commands without a script ran, running them again would count
+        # the queries twice. This call fails open and the next one loads
+        # the scripts again.
+        _counter_start_script.forget()
+        _counter_finish_script.forget()
+        raise
+
+
+def _get_counter_keys(prefix: str, bucket: str) -> tuple[str, str]:
+    return f"{prefix}{{{bucket}}}:tat", f"{prefix}{{{bucket}}}:leases:"
+
+
+def _get_emission_interval_us(params: RateLimitParameters) -> float:
+    assert params.per_second_limit is not None
+    return 10**6 / params.per_second_limit
+
+
+def _counter_start(
+    pipe: Any,
+    params: RateLimitParameters,
+    prefix: str,
+    now: float,
+    max_query_duration_s: int,
+) -> None:
+    tat_key, leases_key = _get_counter_keys(prefix, params.bucket)
+    period = int(now // max_query_duration_s)
+    interval = 0.0
+    if params.per_second_limit is not None and params.per_second_limit > 0:
+        interval = _get_emission_interval_us(params)
+    _counter_start_script.queue(
+        pipe,
+        [tat_key, f"{leases_key}{period}", f"{leases_key}{period - 1}"],
+        [
+            int(now * 10**6),
+            repr(interval),
+            int(params.concurrent_limit is not None),
+            # The counter is read until the end of the next period.
+            2 * max_query_duration_s + 1,
+        ],
+    )
+
+
+def _counter_stats(params: RateLimitParameters, result: Any) -> RateLimitStats:
+    backlog_us, concurrent = result
+    if params.per_second_limit is None:
+        rate = 0.0
+    elif params.per_second_limit > 0:
+        requests = backlog_us / _get_emission_interval_us(params)
+        rate = requests / float(state.rate_lookback_s)
+    else:
+        # Nothing is allowed, this query is already too many.
+        rate = 1 / float(state.rate_lookback_s)
+    return RateLimitStats(
+        rate=rate, concurrent=int(concurrent), backend=COUNTER_BACKEND
+    )
+
+
 def rate_limit_start_request(
     rate_limit_params: RateLimitParameters,
     query_id: str,
@@ -145,6 +341,7 @@ def rate_limit_start_request(
     rate_limit_shard_factor: int,
     rate_limit_prefix: str,
     max_query_duration_s: int | None = None,
+    now: float | None = None,
 ) -> RateLimitStats:
     """
     The first half of the rate limiting algorithm. This function is called before the thing
@@ -157,6 +354,7 @@ def rate_limit_start_request(
         rate_history_sec: int - How many seconds to retain completed queries for the per-second rolling window limit
         rate_limit_shard_factor: int - How many shards to use for the rate limit buckets
         max_query_duration_s: how long we consider a query to be running before it is killed and cleaned up, defaults to state.max_query_duration_s
+        now: the time the query starts at, defaults to the current time. The counter backend needs it to finish the request.
 
     Usage:
 
@@ -189,121 +387,171 @@ def rate_limit_start_request(
                                       ^
                                      now
 
+        Rate limits using the counter backend (see COUNTER_BACKEND) keep
+        counters instead, see _COUNTER_START_SCRIPT. They do not keep the
+        query ids and ignore rate_history_sec and rate_limit_shard_factor.
+
     """
-    now = time.time()
+    return rate_limit_start_requests(
+        [rate_limit_params],
+        [query_id],
+        rate_history_sec,
+        rate_limit_shard_factor,
+        rate_limit_prefix,
+        max_query_duration_s,
+        now,
+    )[0]
+
+
+def rate_limit_start_requests(
+    rate_limit_params: Sequence[RateLimitParameters],
+    query_ids: Sequence[str],
+    rate_history_sec: int,
+    rate_limit_shard_factor: int,
+    rate_limit_prefix: str,
+    max_query_duration_s: int | None = None,
+    now: float | None = None,
+) -> Sequence[RateLimitStats]:
+    """
+    Runs rate_limit_start_request for several rate limits in a single Redis
+    round trip. ``query_ids`` are the ids the query is registered with in
+    each rate limit, in the same order as ``rate_limit_params``.
+
+    The commands of each rate limit are queued in order, so a rate limit
+    sees the queries registered by the previous ones when they share a
+    bucket, exactly like running them one after the other.
+    """
+    assert len(rate_limit_params) == len(query_ids)
+    now = now if now is not None else time.time()
     max_query_duration_s = max_query_duration_s or state.max_query_duration_s
+    backends = _get_backends(rate_limit_params)
 
-    # Compute the set shard to which we should add and remove the query_id
-    bucket_shard = hash(query_id) % rate_limit_shard_factor
-    query_bucket = _get_bucket_key(
-        rate_limit_prefix, rate_limit_params.bucket, bucket_shard
-    )
     use_transaction_pipe = bool(
         state.get_config("rate_limit_use_transaction_pipe", False)
     )
 
     pipe = rds.pipeline(transaction=use_transaction_pipe)
 
-    # cleanup old query timestamps past our retention window
-    #
-    # it is fine to only perform this cleanup for the shard of the current
-    # query, because on average there will be many other queries that hit other
-    # shards and perform cleanup there
-    pipe.zremrangebyscore(query_bucket, "-inf", "({:f}".format(now - rate_history_sec))
-
-    # Now for the tricky bit:
-    # ======================
-    # The query's *deadline* is added to the sorted set of timestamps, therefore
-    # labeling its execution as in the future.
-
-    # All queries with timestamps in the future are considered to be executing *right now*
-    # Example:
-
-    # now = 100
-    # max_query_duration_s = 30
-    # rate_lookback_s = 10
-    # sorted_set (timestamps only for clarity) = [91, 94, 97, 103, 105, 130]
-
-    # EXPLANATION:
-    # ===========
-
-    # queries that have finished running
-    # (in this example there are 3 queries in the last 10 seconds
-    #  thus the per second rate is 3/10 = 0.3)
-    #      |
-    #      v
-    #  -----------              v--- the current query, vaulted into the future
-    #  [91, 94, 97, 103, 105, 130]
-    #               -------------- < - queries currently running
-    #                                (how many queries are
-    #                                   running concurrently; in this case 3)
-    #              ^
-    #              | current time
-    pipe.zadd(query_bucket, {query_id: now + max_query_duration_s})
-
-    # bump the expiration date of the entire set so that it roughly aligns with
-    # the expiration date of the latest item.
-    #
-    # we do this in order to avoid leaking redis sets in the event that two
-    # things occur at the same time:
-    # 1. a bucket stops receiving requests (this can happen if a bucket
-    #    corresponds to a deleted project id)
-    # 2. a previous request to the same bucket was killed off so that the set
-    #    has a dangling item (ie. a process was killed)
-    #
-    # the TTL is calculated as such:
-    #
-    # * in the previous zadd command, the last item is inserted with timestamp
-    #   `now + max_query_duration_s`.
-    # * the next query's zremrangebyscore would remove this item on `now +
-    #   max_query_duration_s + rate_history_s` at the earliest.
-    # * add +1 to account for rounding errors when casting to int
-    pipe.expire(query_bucket, int(max_query_duration_s + rate_history_sec + 1))
-
-    if rate_limit_params.per_second_limit is not None:
-        # count queries that have finished for the per-second rate
-        for shard_i in range(rate_limit_shard_factor):
-            bucket = _get_bucket_key(
-                rate_limit_prefix, rate_limit_params.bucket, shard_i
-            )
-            pipe.zcount(bucket, now - state.rate_lookback_s, now)
-
-    if rate_limit_params.concurrent_limit is not None:
-        # count the amount queries in the "future" which tells us the amount
-        # of concurrent queries
-        for shard_i in range(rate_limit_shard_factor):
-            bucket = _get_bucket_key(
-                rate_limit_prefix, rate_limit_params.bucket, shard_i
-            )
-            pipe.zcount(bucket, "({:f}".format(now), "+inf")
+    for params, query_id, backend in zip(rate_limit_params, query_ids, backends):
+        if backend == COUNTER_BACKEND:
+            _counter_start(pipe, params, rate_limit_prefix, now, max_query_duration_s)
+            continue
+
+        # Compute the set shard to which we should add and remove the query_id
+        bucket_shard = hash(query_id) % rate_limit_shard_factor
+        query_bucket = _get_bucket_key(rate_limit_prefix, params.bucket, bucket_shard)
+
+        # cleanup old query timestamps past our retention window
+        #
+        # it is fine to only perform this cleanup for the shard of the current
+        # query, because on average there will be many other queries that hit other
+        # shards and perform cleanup there
+        pipe.zremrangebyscore(
+            query_bucket, "-inf", "({:f}".format(now - rate_history_sec)
+        )
+
+        # Now for the tricky bit:
+        # ======================
+        # The query's *deadline* is added to the sorted set of timestamps, therefore
+        # labeling its execution as in the future.
+
+        # All queries with timestamps in the future are considered to be executing *right now*
+        # Example:
+
+        # now = 100
+        # max_query_duration_s = 30
+        # rate_lookback_s = 10
+        # sorted_set (timestamps only for clarity) = [91, 94, 97, 103, 105, 130]
+
+        # EXPLANATION:
+        # ===========
+
+        # queries that have finished running
+        # (in this example there are 3 queries in the last 10 seconds
+        #  thus the per second rate is 3/10 = 0.3)
+        #      |
+        #      v
+        #  -----------              v--- the current query, vaulted into the future
+        #  [91, 94, 97, 103, 105, 130]
+        #               -------------- < - queries currently running
+        #                                (how many queries are
+        #                                   running concurrently; in this case 3)
+        #              ^
+        #              | current time
+        pipe.zadd(query_bucket, {query_id: now + max_query_duration_s})
+
+        # bump the expiration date of the entire set so that it roughly aligns with
+        # the expiration date of the latest item.
+        #
+        # we do this in order to avoid leaking redis sets in the event that two
+        # things occur at the same time:
+        # 1. a bucket stops receiving requests (this can happen if a bucket
+        #    corresponds to a deleted project id)
+        # 2. a previous request to the same bucket was killed off so that the set
+        #    has a dangling item (ie. a process was killed)
+        #
+        # the TTL is calculated as such:
+        #
+        # * in the previous zadd command, the last item is inserted with timestamp
+        #   `now + max_query_duration_s`.
+        # * the next query's zremrangebyscore would remove this item on `now +
+        #   max_query_duration_s + rate_history_s` at the earliest.
+        # * add +1 to account for rounding errors when casting to int
+        pipe.expire(query_bucket, int(max_query_duration_s + rate_history_sec + 1))
+
+        if params.per_second_limit is not None:
+            # count queries that have finished for the per-second rate
+            for shard_i in range(rate_limit_shard_factor):
+                bucket = _get_bucket_key(rate_limit_prefix, params.bucket, shard_i)
+                pipe.zcount(bucket, now - state.rate_lookback_s, now)
+
+        if params.concurrent_limit is not None:
+            # count the amount queries in the "future" which tells us the amount
+            # of concurrent queries
+            for shard_i in range(rate_limit_shard_factor):
+                bucket = _get_bucket_key(rate_limit_prefix, params.bucket, shard_i)
+                pipe.zcount(bucket, "({:f}".format(now), "+inf")
 
     try:
-        results = pipe.execute()
+        results = _execute(pipe, backends)
         pipe_results = iter(results)
 
-        # skip zremrangebyscore, zadd and expire
-        next(pipe_results)
-        next(pipe_results)
-        next(pipe_results)
-
-        if rate_limit_params.per_second_limit is not None:
-            historical = sum(next(pipe_results) for _ in range(rate_limit_shard_factor))
-        else:
-            historical = 0
-
-        if rate_limit_params.concurrent_limit is not None:
-            concurrent = sum(next(pipe_results) for _ in range(rate_limit_shard_factor))
-        else:
-            concurrent = 0
+        stats = []
+        for params, backend in zip(rate_limit_params, backends):
+            if backend == COUNTER_BACKEND:
+                stats.append(_counter_stats(params, next(pipe_results)))
+                continue
+
+            # skip zremrangebyscore, zadd and expire
+            next(pipe_results)
+            next(pipe_results)
+            next(pipe_results)
+
+            if params.per_second_limit is not None:
+                historical = sum(
+                    next(pipe_results) for _ in range(rate_limit_shard_factor)
+                )
+            else:
+                historical = 0
+
+            if params.concurrent_limit is not None:
+                concurrent = sum(
+                    next(pipe_results) for _ in range(rate_limit_shard_factor)
+                )
+            else:
+                concurrent = 0
+
+            per_second = historical / float(state.rate_lookback_s)
+            stats.append(RateLimitStats(rate=per_second, concurrent=concurrent))
     except Exception as ex:
         # if something goes wrong, we don't want to block the request,
         # set the values such that they pass under any limit
         logger.exception(ex)
-        return RateLimitStats(rate=-1, concurrent=-1)
-
-    per_second = historical / float(state.rate_lookback_s)
+        return [
+            RateLimitStats(rate=-1, concurrent=-1, backend=backend)
+            for backend in backends
+        ]
 
-    stats = RateLimitStats(rate=per_second, concurrent=concurrent)
     return stats
 
 
@@ -314,46 +562,89 @@ def rate_limit_finish_request(
     was_rate_limited: bool,
     rate_limit_prefix: str,
     max_query_duration_s: int | None = None,
+    started_at: float | None = None,
+    backend: str | None = None,
 ) -> None:
     """Second half of rate limiting, called after the request is finished. See rate_limit_start_request for details"""
-    bucket_shard = hash(query_id) % rate_limit_shard_factor
-    query_bucket = _get_bucket_key(
-        rate_limit_prefix, rate_limit_params.bucket, bucket_shard
+    rate_limit_finish_requests(
+        [rate_limit_params],
+        [query_id],
+        rate_limit_shard_factor,
+        was_rate_limited,
+        rate_limit_prefix,
+        max_query_duration_s,
+        started_at,
+        [backend] if backend is not None else None,
     )
+
+
+def rate_limit_finish_requests(
+    rate_limit_params: Sequence[RateLimitParameters],
+    query_ids: Sequence[str],
+    rate_limit_shard_factor: int,
+    was_rate_limited: bool,
+    rate_limit_prefix: str,
+    max_query_duration_s: int | None = None,
+    started_at: float | None = None,
+    backends: Sequence[str] | None = None,
+) -> None:
+    """
+    Runs rate_limit_finish_request for several rate limits in a single Redis
+    round trip. See rate_limit_start_requests.
+
+    ``started_at`` is the ``now`` the requests were started with. The
+    counter backend gives the lease of the query back to the period it
+    started in, without it the lease is given back to the current period,
+    which is only right for queries that did not run across two periods.
+
+    ``backends`` are the backends of the RateLimitStats the requests were
+    started with. Without them the backends are read from the config again,
+    which is wrong for the requests started before the config changed.
+    """
+    assert len(rate_limit_params) == len(query_ids)
+    now = time.time()
+    started_at = started_at if started_at is not None else now
     max_query_duration_s = max_query_duration_s or state.max_query_duration_s
+    if backends is None:
+        backends = _get_backends(rate_limit_params)
+    assert len(backends) == len(rate_limit_params)
     pipe = rds.pipeline()
-    if was_rate_limited:
-        try:
+    for params, query_id, backend in zip(rate_limit_params, query_ids, backends):
+        if backend == COUNTER_BACKEND:
+            tat_key, leases_key = _get_counter_keys(rate_limit_prefix, params.bucket)
+            interval = 0.0
+            if (
+                was_rate_limited
+                and params.per_second_limit is not None
+                and params.per_second_limit > 0
+            ):
+                interval = _get_emission_interval_us(params)
+            _counter_finish_script.queue(
+                pipe,
+                [tat_key, f"{leases_key}{int(started_at // max_query_duration_s)}"],
+                [
+                    int(now * 10**6),
+                    repr(interval),
+                    int(params.concurrent_limit is not None),
+                ],
+            )
+            continue
+
+        bucket_shard = hash(query_id) % rate_limit_shard_factor
+        query_bucket = _get_bucket_key(rate_limit_prefix, params.bucket, bucket_shard)
+        if was_rate_limited:
             pipe.zrem(query_bucket, query_id)  # not allowed / not counted
-            pipe.expire(query_bucket, max_query_duration_s)
-            pipe.execute()
-        except Exception as ex:
-            logger.exception(ex)
-    else:
-        try:
+        else:
             # return the query to its start time, if the query_id was actually added.
             pipe.zincrby(query_bucket, -float(max_query_duration_s), query_id)
-            pipe.expire(query_bucket, max_query_duration_s)
-            pipe.execute()
-        except Exception as ex:
-            logger.exception(ex)
-
-
-@contextmanager
-def rate_limit(
-    rate_limit_params: RateLimitParameters,
-) -> Iterator[Optional[RateLimitStats]]:
-    """
-    A context manager for rate limiting that allows for limiting based on:
-        * a rolling-window per-second rate
-        * the number of queries concurrently running.
+        pipe.expire(query_bucket, max_query_duration_s)
+    try:
+        _execute(pipe, backends)
+    except Exception as ex:
+        logger.exception(ex)
 
-    usage:
-        with rate_limit(rate_limit_params) as stats:
-            do_something()
-            # will raise RateLimitExceeded if the rate limit is exceeded
 
-    """
+def _get_settings() -> tuple[bool, int, int]:
     (bypass_rate_limit, rate_history_s, rate_limit_shard_factor,) = state.get_configs(
         [
             # bool (0/1) flag to disable rate limits altogether
@@ -369,22 +660,12 @@ def rate_limit(
     assert isinstance(rate_history_s, int)
     assert isinstance(rate_limit_shard_factor, int)
     assert rate_limit_shard_factor > 0
+    return bypass_rate_limit == 1, rate_history_s, rate_limit_shard_factor
 
-    if bypass_rate_limit == 1:
-        yield None
-        return
-
-    query_id_uuid = uuid.uuid4()
-    query_id = str(query_id_uuid)
-
-    rate_limit_stats = rate_limit_start_request(
-        rate_limit_params,
-        query_id,
-        rate_history_s,
-        rate_limit_shard_factor,
-        state.ratelimit_prefix,
-    )
 
+def _check_limits(
+    rate_limit_params: RateLimitParameters, rate_limit_stats: RateLimitStats
+) -> Optional[RateLimitExceeded]:
     rate_limit_name = rate_limit_params.rate_limit_name
 
     Reason = namedtuple("Reason", "scope name val limit")
@@ -403,23 +684,64 @@ def rate_limit(
         ),
     ]
     reason = next((r for r in reasons if r.limit is not None and r.val > r.limit), None)
-    if reason:
+    if reason is None:
+        return None
+    return RateLimitExceeded(
+        "{r.scope} {r.name} of {r.val:.0f} exceeds limit of {r.limit:.0f}".format(
+            r=reason
+        ),
+        scope=reason.scope,
+        name=reason.name,
+    )
+
+
+@contextmanager
+def rate_limit(
+    rate_limit_params: RateLimitParameters,
+) -> Iterator[Optional[RateLimitStats]]:
+    """
+    A context manager for rate limiting that allows for limiting based on:
+        * a rolling-window per-second rate
+        * the number of queries concurrently running.
+
+    usage:
+        with rate_limit(rate_limit_params) as stats:
+            do_something()
+            # will raise RateLimitExceeded if the rate limit is exceeded
+
+    """
+    bypass_rate_limit, rate_history_s, rate_limit_shard_factor = _get_settings()
+    if bypass_rate_limit:
+        yield None
+        return
+
+    query_id_uuid = uuid.uuid4()
+    query_id = str(query_id_uuid)
+    started_at = time.time()
+
+    rate_limit_stats = rate_limit_start_request(
+        rate_limit_params,
+        query_id,
+        rate_history_s,
+        rate_limit_shard_factor,
+        state.ratelimit_prefix,
+        now=started_at,
+    )
+
+    exceeded = _check_limits(rate_limit_params, rate_limit_stats)
+    if exceeded:
         rate_limit_finish_request(
             rate_limit_params,
             query_id,
             rate_limit_shard_factor,
             True,
             state.ratelimit_prefix,
+            started_at=started_at,
+            backend=rate_limit_stats.backend,
         )
+        raise exceeded
 
-        raise RateLimitExceeded(
-            "{r.scope} {r.name} of {r.val:.0f} exceeds limit of {r.limit:.0f}".format(
-                r=reason
-            ),
-            scope=reason.scope,
-            name=reason.name,
-        )
-
+    rolled_back = False
     try:
         yield rate_limit_stats
         _, err, _ = sys.exc_info()
@@ -434,15 +756,23 @@ def rate_limit(
                 rate_limit_shard_factor,
                 True,
                 state.ratelimit_prefix,
+                started_at=started_at,
+                backend=rate_limit_stats.backend,
             )
+            rolled_back = True
     finally:
-        rate_limit_finish_request(
-            rate_limit_params,
-            query_id,
-            rate_limit_shard_factor,
-            False,
-            state.ratelimit_prefix,
-        )
+        # The counters were already given back, finishing again would give
+        # back the lease of another query.
+        if not rolled_back or rate_limit_stats.backend == ZSET_BACKEND:
+            rate_limit_finish_request(
+                rate_limit_params,
+                query_id,
+                rate_limit_shard_factor,
+                False,
+                state.ratelimit_prefix,
+                started_at=started_at,
+                backend=rate_limit_stats.backend,
+            )
 
 
 def _record_metrics(
@@ -469,30 +799,62 @@ class RateLimitAggregator(AbstractContextManager):  # type: ignore
     """
     Runs the rate limits provided by the `rate_limit_params` configuration object.
 
-    It runs the rate limits in the order described by `rate_limit_params`.
+    All the rate limits are checked in a single Redis round trip when
+    entering the context, and released in a single one when exiting it.
+    Exceeded limits are reported in the order described by
+    `rate_limit_params`.
     """
 
     def __init__(self, rate_limit_params: Sequence[RateLimitParameters]) -> None:
         self.rate_limit_params = rate_limit_params
-        self.stack = ExitStack()
+        self.__query_ids: Sequence[str] = []
+        self.__shard_factor = 1
+        self.__started_at: Optional[float] = None
+        self.__backends: Sequence[str] = []
+
+    def __finish(self, was_rate_limited: bool) -> None:
+        query_ids, self.__query_ids = self.__query_ids, []
+        if query_ids:
+            rate_limit_finish_requests(
+                self.rate_limit_params,
+                query_ids,
+                self.__shard_factor,
+                was_rate_limited,
+                state.ratelimit_prefix,
+                started_at=self.__started_at,
+                backends=self.__backends,
+            )
 
     def __enter__(self) -> RateLimitStatsContainer:
         stats = RateLimitStatsContainer()
 
-        for rate_limit_param in self.rate_limit_params:
-            try:
-                child_stats = self.stack.enter_context(rate_limit(rate_limit_param))
-                if child_stats:
-                    stats.add_stats(rate_limit_param.rate_limit_name, child_stats)
-            except RateLimitExceeded as e:
-                # If an exception occurs in one of the rate limiters, the __exit__ callbacks are not
-                # called since the error happened in the __enter__ method and not in the context
-                # block itself. In the case that one of the rate limiters caught a limit, we need
-                # these exit functions to be called so we can roll back any limits that were set
-                # earlier in the stack.
-                self.__exit__(*sys.exc_info())
-                _record_metrics(e, rate_limit_param)
-                raise e
+        bypass_rate_limit, rate_history_s, self.__shard_factor = _get_settings()
+        if bypass_rate_limit or not self.rate_limit_params:
+            return stats
+
+        # Every rate limit registers the query with its own id so that
+        # rate limits sharing a bucket count it once each.
+        self.__query_ids = [str(uuid.uuid4()) for _ in self.rate_limit_params]
+        self.__started_at = time.time()
+        all_stats = rate_limit_start_requests(
+            self.rate_limit_params,
+            self.__query_ids,
+            rate_history_s,
+            self.__shard_factor,
+            state.ratelimit_prefix,
+            now=self.__started_at,
+        )
+        self.__backends = [child_stats.backend for child_stats in all_stats]
+
+        for rate_limit_param, child_stats in zip(self.rate_limit_params, all_stats):
+            exceeded = _check_limits(rate_limit_param, child_stats)
+            if exceeded:
+                # Roll back all the rate limits, none of them should count
+                # a query that did not run.
+                self.__finish(True)
+                _record_metrics(exceeded, rate_limit_param)
+                raise exceeded
+            stats.add_stats(rate_limit_param.rate_limit_name, child_stats)
 
         return stats
 
@@ -502,4 +864,7 @@ class RateLimitAggregator(AbstractContextManager):  # type: ignore
         exc_val: Optional[BaseException],
         exc_tb: Optional[TracebackType],
     ) -> None:
-        self.stack.pop_all().close()
+        # Exiting while another rate limiter's RateLimitExceeded is being
+        # handled means the query did not run.
+        _, err, _ = sys.exc_info()
+        self.__finish(exc_type is None and isinstance(err, RateLimitExceeded))
@@ -1,11 +1,13 @@
 from __future__ import annotations
 
+import copy
 import logging
 from abc import ABC, abstractmethod
 from concurrent.futures import Future
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from functools import partial
+from functools import lru_cache, partial
+from threading import Lock
 from typing import (
     Any,
     Iterator,
@@ -14,6 +16,7 @@ from typing import (
     NamedTuple,
     NewType,
     Optional,
+    Sequence,
     Tuple,
     Union,
 )
@@ -24,28 +27,47 @@ from snuba.datasets.entities.entity_key import EntityKey
 from snuba.datasets.entities.factory import get_entity
 from snuba.datasets.entity import Entity
 from snuba.datasets.entity_subscriptions.validators import InvalidSubscriptionError
+from snuba.query import SelectedExpression
 from snuba.query.composite import CompositeQuery
 from snuba.query.conditions import (
     BooleanFunctions,
     ConditionFunctions,
     binary_condition,
     combine_and_conditions,
+    in_condition,
 )
 from snuba.query.data_source.join import JoinClause
 from snuba.query.data_source.simple import Entity as EntityDS
-from snuba.query.expressions import Column, Expression, Literal
+from snuba.query.data_source.simple import LogicalDataSource
+from snuba.query.expressions import (
+    Column,
+    CurriedFunctionCall,
+    Expression,
+    FunctionCall,
+    Literal,
+)
+from snuba.query.functions import is_aggregation_function
 from snuba.query.logical import Query
-from snuba.query.query_settings import SubscriptionQuerySettings
+from snuba.query.query_settings import QuerySettings, SubscriptionQuerySettings
+from snuba.query.snql.parser import (
+    CustomProcessors,
+    complete_snql_query_template,
+    parse_snql_query_template,
+)
 from snuba.reader import Result
 from snuba.request import Request
-from snuba.request.schema import RequestSchema
-from snuba.request.validation import build_request, parse_snql_query
+from snuba.request.schema import RequestParts, RequestSchema
+from snuba.request.validation import Parser, build_request, parse_snql_query
 from snuba.subscriptions.utils import Tick
 from snuba.utils.metrics import MetricsBackend
 from snuba.utils.metrics.timer import Timer
 
 SUBSCRIPTION_REFERRER = "subscription"
 
+# The column identifying the project of the rows returned by the queries of
+# several subscriptions grouped by project.
+PROJECT_ID_COLUMN = "_subscription_project_id"
+
 # These are subscription payload keys which need to be set as attributes in SubscriptionData.
 SUBSCRIPTION_DATA_PAYLOAD_KEYS = {
     "project_id",
@@ -93,6 +115,7 @@ class SubscriptionData:
         timestamp: datetime,
         offset: Optional[int],
         query: Union[CompositeQuery[EntityDS], Query],
+        project_ids: Optional[Sequence[int]] = None,
     ) -> None:
         added_timestamp_column = False
         from_clause = query.get_from_clause()
@@ -108,13 +131,19 @@ class SubscriptionData:
                 "Only simple queries and join queries are supported"
             )
         for entity_alias, entity in entities:
-            conditions_to_add: List[Expression] = [
-                binary_condition(
+            project_column = Column(None, entity_alias, "project_id")
+            project_condition: Expression
+            if project_ids is None:
+                project_condition = binary_condition(
                     ConditionFunctions.EQ,
-                    Column(None, entity_alias, "project_id"),
+                    project_column,
                     Literal(None, self.project_id),
-                ),
-            ]
+                )
+            else:
+                project_condition = in_condition(
+                    project_column, [Literal(None, p) for p in project_ids]
+                )
+            conditions_to_add: List[Expression] = [project_condition]
 
             required_timestamp_column = entity.required_time_column
             if required_timestamp_column is not None:
@@ -156,6 +185,25 @@ class SubscriptionData:
                 "At least one Entity must have a timestamp column for subscriptions"
             )
 
+    def group_by_project(
+        self, project_ids: Sequence[int], query: Union[CompositeQuery[EntityDS], Query]
+    ) -> None:
+        """
+        Turns the query into the query of all the projects provided, with one
+        row per project identified by the ``PROJECT_ID_COLUMN`` column. Only
+        valid if ``SubscriptionQueryTemplate.can_group_by_project`` is true.
+        """
+        assert isinstance(query, Query)
+        project_column = Column(f"_snuba_{PROJECT_ID_COLUMN}", None, "project_id")
+        query.set_ast_selected_columns(
+            [
+                *query.get_selected_columns(),
+                SelectedExpression(PROJECT_ID_COLUMN, project_column),
+            ]
+        )
+        query.set_ast_groupby([project_column])
+        query.set_limit(len(project_ids))
+
     def validate(self) -> None:
         if self.time_window_sec < 60:
             raise InvalidSubscriptionError(
@@ -179,15 +227,36 @@ class SubscriptionData:
         timer: Timer,
         metrics: Optional[MetricsBackend] = None,
         referrer: str = SUBSCRIPTION_REFERRER,
+        template: Optional[SubscriptionQueryTemplate] = None,
+        project_ids: Optional[Sequence[int]] = None,
     ) -> Request:
-        schema = RequestSchema.build(SubscriptionQuerySettings)
+        """
+        Builds the request of an execution of the subscription. If a
+        template of the query is provided, the query is not parsed again and
+        only the conditions of the execution are added to a copy of the
+        template.
+
+        If project ids are provided, the request runs the query of the
+        subscription for all these projects at once and returns one row per
+        project (see ``group_by_project``).
+        """
+        schema = _get_request_schema()
 
         custom_processing = []
-        subscription_validators = self.entity.get_subscription_validators()
-        if subscription_validators:
-            for validator in subscription_validators:
-                custom_processing.append(validator.validate)
-        custom_processing.append(partial(self.add_conditions, timestamp, offset))
+        if template is None:
+            parser: Parser = parse_snql_query
+            subscription_validators = self.entity.get_subscription_validators()
+            if subscription_validators:
+                for validator in subscription_validators:
+                    custom_processing.append(validator.validate)
+        else:
+            assert template.data == self, "the template is of another subscription"
+            parser = template.parse
+        custom_processing.append(
+            partial(self.add_conditions, timestamp, offset, project_ids=project_ids)
+        )
+        if project_ids is not None:
+            custom_processing.append(partial(self.group_by_project, project_ids))
 
         tenant_ids = {**self.tenant_ids}
         tenant_ids["referrer"] = referrer
@@ -200,7 +269,7 @@ class SubscriptionData:
                 "query": self.query,
                 "tenant_ids": tenant_ids,
             },
-            parse_snql_query,
+            parser,
             SubscriptionQuerySettings,
             schema,
             dataset,
@@ -249,6 +318,112 @@ class SubscriptionData:
         return subscription_data_dict
 
 
+@lru_cache(maxsize=None)
+def _get_request_schema() -> RequestSchema:
+    return RequestSchema.build(SubscriptionQuerySettings)
+
+
+class SubscriptionQueryTemplate:
+    """
+    The query of a subscription parsed, post processed and validated once,
+    so that executing the subscription again only requires to add the
+    conditions of the execution (time range, offset) to a copy of it.
+
+    The template is compiled the first time it is used, through
+    ``SubscriptionData.build_request``, so that invalid queries are reported
+    the same way they are without a template. A template is only valid for
+    the ``SubscriptionData`` it was created from and has to be replaced
+    when the subscription changes.
+    """
+
+    def __init__(self, data: SubscriptionData) -> None:
+        self.data = data
+        self.__query: Optional[Union[Query, CompositeQuery[LogicalDataSource]]] = None
+        self.__lock = Lock()
+
+    def __get_query(self) -> Union[Query, CompositeQuery[LogicalDataSource]]:
+        with self.__lock:
+            if self.__query is None:
+                query = parse_snql_query_template(self.data.query)
+                subscription_validators = self.data.entity.get_subscription_validators()
+                if subscription_validators:
+                    for validator in subscription_validators:
+                        validator.validate(query)
+                self.__query = query
+            return self.__query
+
+    def can_group_by_project(self) -> bool:
+        """
+        Whether the query can run for several projects at once by grouping
+        it by project: it must be a simple query that returns a single row
+        of aggregations.
+        """
+        query = self.__get_query()
+        if not isinstance(query, Query):
+            return False
+        if (
+            query.get_groupby()
+            or query.get_having()
+            or query.get_orderby()
+            or query.get_limitby()
+            or query.get_arrayjoin()
+            or query.has_totals()
+        ):
+            return False
+        return all(
+            _is_aggregation(selected.expression)
+            for selected in query.get_selected_columns()
+        )
+
+    def parse(
+        self,
+        request_parts: RequestParts,
+        settings: QuerySettings,
+        dataset: Dataset,
+        custom_processing: Optional[CustomProcessors] = None,
+    ) -> Union[Query, CompositeQuery[LogicalDataSource]]:
+        return complete_snql_query_template(
+            _copy_query(self.__get_query()), dataset, custom_processing, settings
+        )
+
+
+def _is_aggregation(expression: Expression) -> bool:
+    # Columns may only be referenced inside aggregate functions, otherwise
+    # they would have to be part of the group by.
+    if isinstance(expression, Literal):
+        return True
+    if isinstance(expression, CurriedFunctionCall):
+        return is_aggregation_function(expression.internal_function.function_name)
+    if isinstance(expression, FunctionCall):
+        return is_aggregation_function(expression.function_name) or all(
+            _is_aggregation(parameter) for parameter in expression.parameters
+        )
+    return False
+
+
+def _copy_query(
+    query: Union[Query, CompositeQuery[LogicalDataSource]]
+) -> Union[Query, CompositeQuery[LogicalDataSource]]:
+    # Expressions and data sources are immutable, only the containers
+    # holding them are copied so that nothing done to the copy, in place
+    # or not, reaches the template. Copying the whole tree (and the schema
+    # of the entities referenced by the data source) would cost about as
+    # much as parsing the query again.
+    copied = copy.copy(query)
+    copied.set_ast_selected_columns(list(query.get_selected_columns()))
+    copied.set_ast_groupby(list(query.get_groupby()))
+    copied.set_ast_orderby(list(query.get_orderby()))
+    array_join = query.get_arrayjoin()
+    if array_join is not None:
+        copied.set_arrayjoin(list(array_join))
+    copied.set_experiments({**query.get_experiments()})
+    if isinstance(copied, CompositeQuery):
+        from_clause = copied.get_from_clause()
+        if isinstance(from_clause, (Query, CompositeQuery)):
+            copied.set_from_clause(_copy_query(from_clause))
+    return copied
+
+
 class Subscription(NamedTuple):
     identifier: SubscriptionIdentifier
     data: SubscriptionData
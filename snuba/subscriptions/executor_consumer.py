@@ -1,12 +1,24 @@
 from __future__ import annotations
 
+import json
 import logging
 import math
 import time
-from collections import deque
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Deque, Mapping, Optional, Sequence, Tuple
+from threading import Lock
+from typing import (
+    Any,
+    Deque,
+    List,
+    Mapping,
+    MutableMapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
 from arroyo import Message, Partition, Topic
 from arroyo.backends.abstract import Producer
@@ -20,7 +32,7 @@ from arroyo.processing.strategies.healthcheck import Healthcheck
 from arroyo.processing.strategies.produce import Produce
 from arroyo.types import Commit
 
-from snuba import state
+from snuba import settings, state
 from snuba.clickhouse.errors import ClickhouseError
 from snuba.consumers.utils import get_partition_count
 from snuba.datasets.dataset import Dataset
@@ -35,7 +47,11 @@ from snuba.subscriptions.codecs import (
     SubscriptionTaskResultEncoder,
 )
 from snuba.subscriptions.data import (
+    PROJECT_ID_COLUMN,
     ScheduledSubscriptionTask,
+    Subscription,
+    SubscriptionIdentifier,
+    SubscriptionQueryTemplate,
     SubscriptionTaskResult,
     SubscriptionTaskResultFuture,
 )
@@ -213,10 +229,41 @@ class SubscriptionExecutorProcessingFactory(ProcessingStrategyFactory[KafkaPaylo
         return strategy
 
 
+TaskFuture = Tuple[ScheduledSubscriptionTask, "Future[Tuple[Request, Result]]"]
+
+
+class _Batch(NamedTuple):
+    deadline: float
+    tasks: List[TaskFuture]
+
+
+def _get_batch_key(task: ScheduledSubscriptionTask) -> Tuple[Any, ...]:
+    # Tasks can be executed by the same query if they are executed for the
+    # same time range and their subscriptions only differ by project.
+    data = task.task.subscription.data
+    return (
+        task.task.entity.value,
+        task.timestamp,
+        task.task.tick_upper_offset,
+        data.query,
+        data.time_window_sec,
+        json.dumps(data.metadata, sort_keys=True),
+        json.dumps(data.tenant_ids, sort_keys=True),
+    )
+
+
 class ExecuteQuery(ProcessingStrategy[KafkaPayload]):
     """
     Decodes a scheduled subscription task from the Kafka payload, builds
     the request and executes the ClickHouse query.
+
+    When the ``executor_batch_window_ms`` runtime config is set, the tasks
+    are not executed right away: the tasks received within the window whose
+    subscriptions only differ by project are executed by a single query
+    grouped by project, and its rows are split into the results of each
+    task. Queries that cannot be grouped (see
+    ``SubscriptionQueryTemplate.can_group_by_project``) are executed on
+    their own once the window is over.
     """
 
     def __init__(
@@ -253,25 +300,63 @@ class ExecuteQuery(ProcessingStrategy[KafkaPayload]):
             self.__metrics, "executor.concurrent.clickhouse"
         )
 
-    def __execute_query(
-        self, task: ScheduledSubscriptionTask, tick_upper_offset: int
-    ) -> Tuple[Request, Result]:
+        # The parsed queries of the subscriptions executed recently, in
+        # least recently executed first order.
+        self.__templates: OrderedDict[
+            SubscriptionIdentifier, SubscriptionQueryTemplate
+        ] = OrderedDict()
+        self.__templates_lock = Lock()
+
+        self.__batches: MutableMapping[Tuple[Any, ...], _Batch] = {}
+
+    def __get_template(self, subscription: Subscription) -> SubscriptionQueryTemplate:
+        with self.__templates_lock:
+            template = self.__templates.get(subscription.identifier)
+            if template is not None and template.data == subscription.data:
+                self.__templates.move_to_end(subscription.identifier)
+                self.__metrics.increment("executor.template_cache.hit")
+                return template
+
+            # The subscription is new or it was updated since its query was
+            # parsed.
+            self.__metrics.increment("executor.template_cache.miss")
+            template = SubscriptionQueryTemplate(subscription.data)
+            self.__templates[subscription.identifier] = template
+            self.__templates.move_to_end(subscription.identifier)
+            while (
+                len(self.__templates) > settings.SUBSCRIPTIONS_QUERY_TEMPLATE_CACHE_SIZE
+            ):
+                self.__templates.popitem(last=False)
+            return template
+
+    def __record_latency(self, task: ScheduledSubscriptionTask, now: float) -> None:
         # Measure the amount of time that took between the task's scheduled
         # time and it beginning to execute.
         self.__metrics.timing(
-            "executor.latency", (time.time() - task.timestamp.timestamp()) * 1000
+            "executor.latency", (now - task.timestamp.timestamp()) * 1000
         )
 
+    def __execute_query(
+        self, task: ScheduledSubscriptionTask, tick_upper_offset: int
+    ) -> Tuple[Request, Result]:
+        self.__record_latency(task, time.time())
+        return self.__run_query(task, tick_upper_offset)
+
+    def __run_query(
+        self, task: ScheduledSubscriptionTask, tick_upper_offset: int
+    ) -> Tuple[Request, Result]:
         timer = Timer("query")
 
         with self.__concurrent_gauge:
-            request = task.task.subscription.data.build_request(
+            subscription = task.task.subscription
+            request = subscription.data.build_request(
                 self.__dataset,
                 task.timestamp,
                 tick_upper_offset,
                 timer,
                 self.__metrics,
                 "subscriptions_executor",
+                template=self.__get_template(subscription),
             )
 
             result = run_query(
@@ -284,7 +369,155 @@ class ExecuteQuery(ProcessingStrategy[KafkaPayload]):
 
             return (request, result)
 
+    def __add_to_batch(
+        self,
+        task: ScheduledSubscriptionTask,
+        future: Future[Tuple[Request, Result]],
+        window_sec: float,
+    ) -> None:
+        key = _get_batch_key(task)
+        batch = self.__batches.get(key)
+        if batch is None:
+            batch = self.__batches[key] = _Batch(time.time() + window_sec, [])
+        batch.tasks.append((task, future))
+
+        max_size = state.get_config("executor_batch_max_size", 100)
+        assert max_size is not None, "Invalid executor_batch_max_size config"
+        if len(batch.tasks) >= max_size:
+            self.__flush_batch(key)
+
+    def __flush_batches(self, force: bool = False) -> None:
+        now = time.time()
+        for key, batch in list(self.__batches.items()):
+            if force or batch.deadline <= now:
+                self.__flush_batch(key)
+
+    def __flush_batch(self, key: Tuple[Any, ...]) -> None:
+        tasks = self.__batches.pop(key).tasks
+        if len(tasks) > 1 and self.__can_group(tasks[0][0]):
+            self.__executor.submit(self.__execute_grouped, tasks)
+        else:
+            for task, future in tasks:
+                self.__executor.submit(self.__execute_into, task, future)
+
+    def __can_group(self, task: ScheduledSubscriptionTask) -> bool:
+        try:
+            return self.__get_template(task.task.subscription).can_group_by_project()
+        except Exception:
+            # The query is invalid, executing the tasks on their own reports
+            # the error for each of them.
+            return False
+
+    def __execute_into(
+        self,
+        task: ScheduledSubscriptionTask,
+        future: Future[Tuple[Request, Result]],
+    ) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(self.__execute_query(task, task.task.tick_upper_offset))
+        except Exception as error:
+            future.set_exception(error)
+
+    def __execute_grouped(self, tasks: Sequence[TaskFuture]) -> None:
+        tasks = [
+            (task, future)
+            for task, future in tasks
+            if future.set_running_or_notify_cancel()
+        ]
+        if not tasks:
+            return
+        now = time.time()
+        for task, _ in tasks:
+            self.__record_latency(task, now)
+        self.__metrics.timing("executor.grouped_tasks", len(tasks))
+
+        try:
+            results = self.__execute_grouped_query([task for task, _ in tasks])
+        except Exception as error:
+            for _, future in tasks:
+                future.set_exception(error)
+            return
+
+        # The projects without data in the time window have no row in the
+        # grouped result. The query of a project without data returns the
+        # aggregations of an empty set, which are the same for all the
+        # projects of the batch: it is only executed once, and only these
+        # projects fail if it does.
+        missing = [
+            (task, future)
+            for (task, future), result in zip(tasks, results)
+            if result is None
+        ]
+        empty_result: Optional[Tuple[Request, Result]] = None
+        if missing:
+            first, _ = missing[0]
+            try:
+                empty_result = self.__run_query(first, first.task.tick_upper_offset)
+            except Exception as error:
+                for _, future in missing:
+                    future.set_exception(error)
+
+        for (_, future), result in zip(tasks, results):
+            if result is not None:
+                future.set_result(result)
+            elif empty_result is not None:
+                future.set_result(empty_result)
+
+    def __execute_grouped_query(
+        self, tasks: Sequence[ScheduledSubscriptionTask]
+    ) -> Sequence[Optional[Tuple[Request, Result]]]:
+        """
+        Returns the result of each task, None for the projects that have no
+        row in the result of the grouped query.
+        """
+
+        first = tasks[0]
+        subscription = first.task.subscription
+        timer = Timer("query")
+
+        with self.__concurrent_gauge:
+            request = subscription.data.build_request(
+                self.__dataset,
+                first.timestamp,
+                first.task.tick_upper_offset,
+                timer,
+                self.__metrics,
+                "subscriptions_executor",
+                template=self.__get_template(subscription),
+                project_ids=sorted(
+                    {task.task.subscription.data.project_id for task in tasks}
+                ),
+            )
+
+            result = run_query(
+                self.__dataset,
+                request,
+                timer,
+                robust=True,
+                concurrent_queries_gauge=self.__concurrent_clickhouse_gauge,
+            ).result
+
+        rows = {row[PROJECT_ID_COLUMN]: row for row in result["data"]}
+        meta = [
+            column for column in result["meta"] if column["name"] != PROJECT_ID_COLUMN
+        ]
+
+        results: List[Optional[Tuple[Request, Result]]] = []
+        for task in tasks:
+            row = rows.get(task.task.subscription.data.project_id)
+            if row is None:
+                results.append(None)
+                continue
+            data = {k: v for k, v in row.items() if k != PROJECT_ID_COLUMN}
+            results.append((request, {**result, "data": [data], "meta": meta}))
+
+        return results
+
     def poll(self) -> None:
+        self.__flush_batches()
+
         while self.__queue:
             if not self.__queue[0][1].future.done():
                 break
@@ -337,7 +570,12 @@ class ExecuteQuery(ProcessingStrategy[KafkaPayload]):
         ):
             should_execute = False
 
-        if should_execute:
+        batch_window_ms = state.get_config("executor_batch_window_ms", 0)
+        if should_execute and batch_window_ms:
+            future: Future[Tuple[Request, Result]] = Future()
+            self.__queue.append((message, SubscriptionTaskResultFuture(task, future)))
+            self.__add_to_batch(task, future, batch_window_ms / 1000)
+        elif should_execute:
             try:
                 self.__queue.append(
                     (
@@ -366,12 +604,19 @@ class ExecuteQuery(ProcessingStrategy[KafkaPayload]):
     def terminate(self) -> None:
         self.__closed = True
 
+        for batch in self.__batches.values():
+            for _, future in batch.tasks:
+                future.cancel()
+        self.__batches.clear()
+
         self.__executor.shutdown()
         self.__next_step.terminate()
 
     def join(self, timeout: Optional[float] = None) -> None:
         start = time.time()
 
+        self.__flush_batches(force=True)
+
         while self.__queue:
             remaining = timeout - (time.time() - start) if timeout is not None else None
 
@@ -3,8 +3,8 @@ from abc import ABC, abstractmethod
 from datetime import datetime, timedelta
 from enum import Enum
 from typing import (
+    Callable,
     Iterator,
-    List,
     Mapping,
     MutableMapping,
     MutableSequence,
@@ -12,6 +12,7 @@ from typing import (
     Sequence,
     Tuple,
 )
+from uuid import UUID
 
 from snuba import settings, state
 from snuba.datasets.entities.entity_key import EntityKey
@@ -52,6 +53,19 @@ class TaskBuilder(ABC):
     def reset_metrics(self) -> Sequence[Tuple[str, int, Tags]]:
         raise NotImplementedError
 
+    def get_slot(self, subscription: Subscription) -> Optional[int]:
+        """
+        Returns the second of the resolution period the subscription is
+        scheduled at, i.e. a task is built at the timestamps where
+        ``timestamp % resolution`` is equal to the slot. This lets the
+        scheduler index the subscriptions by slot and only consider the
+        ones that are due.
+
+        Builders that do not schedule subscriptions at a fixed slot return
+        None, the scheduler then asks them about every subscription.
+        """
+        return None
+
 
 class ImmediateTaskBuilder(TaskBuilder):
     """
@@ -80,6 +94,9 @@ class ImmediateTaskBuilder(TaskBuilder):
         self.__count = 0
         return metrics
 
+    def get_slot(self, subscription: Subscription) -> Optional[int]:
+        return 0
+
 
 class JitteredTaskBuilder(TaskBuilder):
     """
@@ -143,6 +160,12 @@ class JitteredTaskBuilder(TaskBuilder):
         self.__count_max_resolution = 0
         return metrics
 
+    def get_slot(self, subscription: Subscription) -> Optional[int]:
+        resolution = subscription.data.resolution_sec
+        if resolution > settings.MAX_RESOLUTION_FOR_JITTER:
+            return 0
+        return subscription.identifier.uuid.int % resolution
+
 
 class TaskBuilderMode(Enum):
     IMMEDIATE = "immediate"
@@ -281,6 +304,58 @@ class DelegateTaskBuilder(TaskBuilder):
         ]
 
 
+class SubscriptionIndex:
+    """
+    Time wheels of subscriptions: the subscriptions are grouped by
+    resolution, then by the slot (second of the resolution period) they are
+    scheduled at according to ``get_slot``. Finding the subscriptions due at
+    a timestamp costs one lookup per distinct resolution instead of going
+    through every subscription.
+
+    The index is updated incrementally when subscriptions are added or
+    removed.
+    """
+
+    def __init__(self, get_slot: Callable[[Subscription], Optional[int]]) -> None:
+        self.__get_slot = get_slot
+        # resolution -> slot -> subscription uuid -> subscription
+        self.__wheels: MutableMapping[
+            int, MutableMapping[int, MutableMapping[UUID, Subscription]]
+        ] = {}
+        self.__positions: MutableMapping[UUID, Tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.__positions)
+
+    def add(self, subscription: Subscription) -> None:
+        key = subscription.identifier.uuid
+        self.remove(key)
+        resolution = subscription.data.resolution_sec
+        slot = self.__get_slot(subscription)
+        assert slot is not None, "the task builder does not schedule at fixed slots"
+        wheel = self.__wheels.setdefault(resolution, {})
+        wheel.setdefault(slot, {})[key] = subscription
+        self.__positions[key] = (resolution, slot)
+
+    def remove(self, key: UUID) -> None:
+        position = self.__positions.pop(key, None)
+        if position is None:
+            return
+        resolution, slot = position
+        wheel = self.__wheels[resolution]
+        del wheel[slot][key]
+        if not wheel[slot]:
+            del wheel[slot]
+            if not wheel:
+                del self.__wheels[resolution]
+
+    def get_due(self, timestamp: int) -> Iterator[Subscription]:
+        for resolution, wheel in self.__wheels.items():
+            subscriptions = wheel.get(timestamp % resolution)
+            if subscriptions:
+                yield from subscriptions.values()
+
+
 def filter_subscriptions(
     subscriptions: MutableSequence[Subscription],
     entity_key: EntityKey,
@@ -335,8 +410,11 @@ class SubscriptionScheduler(SubscriptionSchedulerBase):
         self.__partition_id = partition_id
         self.__metrics = metrics
 
-        self.__subscriptions: List[Subscription] = []
+        self.__subscriptions: MutableMapping[UUID, Subscription] = {}
         self.__last_refresh: Optional[datetime] = None
+        # Index of the subscriptions for the builder it was built for.
+        self.__index: Optional[SubscriptionIndex] = None
+        self.__index_builder: Optional[TaskBuilder] = None
 
         self.__delegate_builder = DelegateTaskBuilder()
         self.__jittered_builder = JitteredTaskBuilder()
@@ -363,23 +441,42 @@ class SubscriptionScheduler(SubscriptionSchedulerBase):
             # We are transitioning between jittered and immediate mode. We must use the delegate builder.
             self.__builder = self.__delegate_builder
 
-    def __get_subscriptions(self) -> MutableSequence[Subscription]:
+    def __refresh_subscriptions(self) -> None:
         current_time = datetime.now()
 
         if (
             self.__last_refresh is None
             or (current_time - self.__last_refresh) > self.__cache_ttl
         ):
-            self.__subscriptions = [
+            subscriptions: MutableSequence[Subscription] = [
                 Subscription(SubscriptionIdentifier(self.__partition_id, uuid), data)
                 for uuid, data in self.__store.all()
             ]
-            self.__last_refresh = current_time
             self.__metrics.gauge(
                 "schedule.size",
-                len(self.__subscriptions),
+                len(subscriptions),
                 tags={"partition": str(self.__partition_id)},
             )
+            if self.__slice_id is not None:
+                subscriptions = filter_subscriptions(
+                    subscriptions, self.__entity_key, self.__metrics, self.__slice_id
+                )
+
+            refreshed = {
+                subscription.identifier.uuid: subscription
+                for subscription in subscriptions
+            }
+            if self.__index is not None:
+                # Only the subscriptions that changed are moved in the index.
+                for uuid, subscription in self.__subscriptions.items():
+                    if refreshed.get(uuid) != subscription:
+                        self.__index.remove(uuid)
+                for uuid, subscription in refreshed.items():
+                    if self.__subscriptions.get(uuid) != subscription:
+                        self.__index.add(subscription)
+
+            self.__subscriptions = refreshed
+            self.__last_refresh = current_time
 
         self.__metrics.timing(
             "schedule.staleness",
@@ -387,25 +484,38 @@ class SubscriptionScheduler(SubscriptionSchedulerBase):
             tags={"partition": str(self.__partition_id)},
         )
 
-        if self.__slice_id is not None:
-            return filter_subscriptions(
-                self.__subscriptions, self.__entity_key, self.__metrics, self.__slice_id
-            )
-        else:
-            return self.__subscriptions
+    def __get_index(self) -> Optional[SubscriptionIndex]:
+        builder = self.__builder
+        if self.__index_builder is not builder:
+            self.__index = None
+            self.__index_builder = builder
+            # While transitioning between modes, the delegate builder does
+            # not schedule subscriptions at fixed slots, all of them are
+            # considered at every timestamp.
+            if builder is not self.__delegate_builder:
+                self.__index = SubscriptionIndex(builder.get_slot)
+                for subscription in self.__subscriptions.values():
+                    self.__index.add(subscription)
+        return self.__index
+
+    def __get_candidates(self, timestamp: int) -> Iterator[Subscription]:
+        if self.__index is not None:
+            return self.__index.get_due(timestamp)
+        return iter(self.__subscriptions.values())
 
     def find(self, tick: Tick) -> Iterator[ScheduledSubscriptionTask]:
         self.__reset_builder()
 
         interval = tick.timestamps
 
-        subscriptions = self.__get_subscriptions()
+        self.__refresh_subscriptions()
+        self.__get_index()
 
         for timestamp in range(
             math.ceil(interval.lower),
             math.ceil(interval.upper),
         ):
-            for subscription in subscriptions:
+            for subscription in self.__get_candidates(timestamp):
                 task = self.__builder.get_task(
                     SubscriptionWithMetadata(
                         self.__entity_key, subscription, tick.offsets.upper
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import FrozenSet, MutableMapping, Optional, Tuple, Union
+
+from snuba.utils.metrics.backends.abstract import MetricsBackend
+from snuba.utils.metrics.types import Tags
+
+logger = logging.getLogger(__name__)
+
+_Key = Tuple[str, Optional[FrozenSet[Tuple[str, str]]], Optional[str]]
+
+
+def _key(name: str, tags: Optional[Tags], unit: Optional[str]) -> _Key:
+    return (name, frozenset(tags.items()) if tags else None, unit)
+
+
+def _tags(key: _Key) -> Optional[Tags]:
+    return dict(key[1]) if key[1] is not None else None
+
+
+class AggregatingMetricsBackend(MetricsBackend):
+    """
+    A metrics backend that aggregates the metrics in the process and sends
+    them to another backend at regular intervals, from a background thread.
+
+    Counters are summed and gauges keep their last value. Timings,
+    distributions and events are sent right away: their percentiles are
+    computed by the agent (or server side), which needs every value, and
+    cannot be combined across processes once computed in each of them.
+
+    Metrics are aggregated by name, tags and unit. At most ``max_keys`` of
+    them are held between two flushes, the calls for any other one are sent
+    right away and counted in ``metrics_aggregator.overflow``.
+    """
+
+    def __init__(
+        self,
+        backend: MetricsBackend,
+        flush_interval_sec: float,
+        max_keys: int = 10000,
+    ) -> None:
+        self.__backend = backend
+        self.__flush_interval_sec = flush_interval_sec
+        self.__max_keys = max_keys
+
+        self.__lock = threading.Lock()
+        self.__counters: MutableMapping[_Key, Union[int, float]] = {}
+        self.__gauges: MutableMapping[_Key, Union[int, float]] = {}
+        self.__keys = 0
+        self.__overflow = 0
+
+        self.__pid: Optional[int] = None
+        self.__flush_lock = threading.Lock()
+
+    def increment(
+        self,
+        name: str,
+        value: Union[int, float] = 1,
+        tags: Optional[Tags] = None,
+        unit: Optional[str] = None,
+    ) -> None:
+        self.__ensure_thread()
+        key = _key(name, tags, unit)
+        with self.__lock:
+            current = self.__counters.get(key)
+            if current is not None:
+                self.__counters[key] = current + value
+                return
+            if self.__keys < self.__max_keys:
+                self.__keys += 1
+                self.__counters[key] = value
+                return
+            self.__overflow += 1
+        self.__backend.increment(name, value, tags, unit)
+
+    def gauge(
+        self,
+        name: str,
+        value: Union[int, float],
+        tags: Optional[Tags] = None,
+        unit: Optional[str] = None,
+    ) -> None:
+        self.__ensure_thread()
+        key = _key(name, tags, unit)
+        with self.__lock:
+            if key in self.__gauges:
+                self.__gauges[key] = value
+                return
+            if self.__keys < self.__max_keys:
+                self.__keys += 1
+                self.__gauges[key] = value
+                return
+            self.__overflow += 1
+        self.__backend.gauge(name, value, tags, unit)
+
+    def timing(
+        self,
+        name: str,
+        value: Union[int, float],
+        tags: Optional[Tags] = None,
+        unit: Optional[str] = None,
+    ) -> None:
+        self.__backend.timing(name, value, tags, unit)
+
+    def distribution(
+        self,
+        name: str,
+        value: Union[int, float],
+        tags: Optional[Tags] = None,
+        unit: Optional[str] = None,
+    ) -> None:
+        self.__backend.distribution(name, value, tags, unit)
+
+    def events(
+        self,
+        title: str,
+        text: str,
+        alert_type: str,
+        priority: str,
+        tags: Optional[Tags] = None,
+    ) -> None:
+        self.__backend.events(title, text, alert_type, priority, tags)
+
+    def flush(self) -> None:
+        """
+        Sends the metrics aggregated since the last flush to the backend.
+        """
+        # Only one flush at a time takes and sends the metrics, so the gauges
+        # sent by a flush cannot be overwritten by older ones.
+        with self.__flush_lock:
+            with self.__lock:
+                counters, self.__counters = self.__counters, {}
+                gauges, self.__gauges = self.__gauges, {}
+                overflow, self.__overflow = self.__overflow, 0
+                self.__keys = 0
+
+            for key, value in counters.items():
+                self.__backend.increment(key[0], value, _tags(key), key[2])
+            for key, value in gauges.items():
+                self.__backend.gauge(key[0], value, _tags(key), key[2])
+            if overflow:
+                self.__backend.increment("metrics_aggregator.overflow", overflow)
+
+    def __ensure_thread(self) -> None:
+        # Threads do not survive forks, each process needs its own flusher.
+        # The metrics aggregated by the parent before the fork are the
+        # parent's to send.
+        if self.__pid == os.getpid():
+            return
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            if self.__pid is not None:
+                self.__counters, self.__gauges = {}, {}
+                self.__keys = 0
+                self.__overflow = 0
+            self.__pid = os.getpid()
+            threading.Thread(
+                target=self.__run,
+                name="snuba-metrics-aggregator",
+                daemon=True,
+            ).start()
+
+    def __run(self) -> None:
+        while True:
+            time.sleep(self.__flush_interval_sec)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("Could not flush the metrics: %r", e)
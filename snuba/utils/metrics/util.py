@@ -1,3 +1,4 @@
+import atexit
 import inspect
 from functools import partial, wraps
 from typing import Any, Callable, Mapping, Optional, TypeVar, cast
@@ -41,7 +42,7 @@ def create_metrics(
     from snuba.utils.metrics.backends.dualwrite import SentryDatadogMetricsBackend
     from snuba.utils.metrics.backends.sentry import SentryMetricsBackend
 
-    return SentryDatadogMetricsBackend(
+    backend: MetricsBackend = SentryDatadogMetricsBackend(
         DatadogMetricsBackend(
             partial(
                 DogStatsd,
@@ -57,6 +58,20 @@ def create_metrics(
         SentryMetricsBackend(),
     )
 
+    if settings.DOGSTATSD_AGGREGATION_INTERVAL_SEC is not None:
+        from snuba.utils.metrics.backends.aggregating import AggregatingMetricsBackend
+
+        aggregating_backend = AggregatingMetricsBackend(
+            backend,
+            settings.DOGSTATSD_AGGREGATION_INTERVAL_SEC,
+            max_keys=settings.DOGSTATSD_AGGREGATION_MAX_KEYS,
+        )
+        # Sends what was aggregated since the last flush before exiting.
+        atexit.register(aggregating_backend.flush)
+        return aggregating_backend
+
+    return backend
+
 
 F = TypeVar("F", bound=Callable[..., Any])
 
@@ -581,7 +581,7 @@ class FixedString(ColumnType[TModifiers]):
 class UInt(ColumnType[TModifiers]):
     def __init__(self, size: int, modifiers: Optional[TModifiers] = None) -> None:
         super().__init__(modifiers)
-        assert size in (8, 16, 32, 64)
+        assert size in (8, 16, 32, 64, 128, 256)
         self.size = size
 
     def _repr_content(self) -> str:
@@ -607,7 +607,7 @@ class UInt(ColumnType[TModifiers]):
 class Int(ColumnType[TModifiers]):
     def __init__(self, size: int, modifiers: Optional[TModifiers] = None) -> None:
         super().__init__(modifiers)
-        assert size in (8, 16, 32, 64)
+        assert size in (8, 16, 32, 64, 128, 256)
         self.size = size
 
     def _repr_content(self) -> str:
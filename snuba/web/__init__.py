@@ -1,7 +1,18 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Any, Mapping, TypedDict, cast
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Generator,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    TypedDict,
+    cast,
+)
 
 from snuba.reader import Column, Result, Row, transform_rows
 from snuba.utils.serializable_exception import JsonSerializable, SerializableException
@@ -51,6 +62,14 @@ class QueryException(SerializableException):
         return cast(QueryExtraData, extra)
 
 
+class StreamClosedException(SerializableException):
+    """
+    Exception recorded when the consumer of streamed rows stopped reading
+    them before the end of the result, generally because the client went
+    away.
+    """
+
+
 class QueryTooLongException(SerializableException):
     """
     Exception thrown when a query string is too long for ClickHouse.
@@ -60,10 +79,91 @@ class QueryTooLongException(SerializableException):
     """
 
 
+class StreamedRows:
+    """
+    Rows of a ``QueryResult`` that are produced while they are read from the
+    database instead of being materialized in ``Result["data"]``.
+
+    Nothing is read until the rows are iterated, so every layer that needs to
+    transform the rows wraps the iterator it received instead. Layers that
+    need to account for the query once it is over (querylog, allocation
+    policies) register a callback with ``on_close``.
+
+    ``close`` must be called once the rows are consumed, or when they never
+    will be (e.g. the client went away before the response started). It
+    closes every layer, which releases the database connection even if the
+    rows were never iterated, then runs the callbacks.
+    """
+
+    def __init__(self, rows: Iterator[Row]) -> None:
+        self.__rows = rows
+        self.__layers: List[Iterator[Row]] = [rows]
+        self.__close_callbacks: List[Callable[[], None]] = []
+        self.__closed = False
+        # Set by the layer that executes the query if it failed, or if the
+        # stream was closed, before the end of the rows.
+        self.error: Optional[QueryException] = None
+
+    def wrap(self, wrapper: Callable[[Iterator[Row]], Iterator[Row]]) -> None:
+        self.__rows = wrapper(self.__rows)
+        self.__layers.append(self.__rows)
+
+    def map(self, transformer: Callable[[Row], Row]) -> None:
+        def transform(rows: Iterator[Row]) -> Generator[Row, None, None]:
+            for row in rows:
+                yield transformer(row)
+
+        self.wrap(transform)
+
+    def on_close(self, callback: Callable[[], None]) -> None:
+        """
+        Registers a callback run by ``close``. Callbacks run in the order
+        they were registered, so the layers closer to the database run
+        first.
+        """
+        self.__close_callbacks.append(callback)
+
+    def close(self) -> None:
+        if self.__closed:
+            return
+        self.__closed = True
+        # A generator that was never started does not close the iterator it
+        # wraps, so every layer is closed explicitly.
+        closes: List[Callable[[], None]] = [
+            partial(close_rows, rows) for rows in reversed(self.__layers)
+        ]
+        error: Optional[Exception] = None
+        for close in closes + self.__close_callbacks:
+            try:
+                close()
+            except Exception as e:
+                # The other layers and callbacks still run.
+                error = error or e
+        if error is not None:
+            raise error
+
+    def __iter__(self) -> Iterator[Row]:
+        return self.__rows
+
+
+def close_rows(rows: Iterator[Row]) -> None:
+    """
+    Closes an iterator of rows if it supports it (e.g. generators), which
+    releases whatever it holds on to.
+    """
+    close = getattr(rows, "close", None)
+    if close is not None:
+        close()
+
+
 @dataclass(frozen=True)
 class QueryResult:
     result: Result
     extra: QueryExtraData
+    # Set when the rows are streamed, in which case ``result["data"]`` is
+    # empty and the querylog entry is only complete once the rows are
+    # exhausted.
+    rows: Optional[StreamedRows] = None
 
     @property
     def quota_allowance(self) -> Mapping[str, Mapping[str, Any]]:
@@ -86,6 +186,8 @@ def transform_column_names(
         return new_row
 
     transform_rows(result.result, transformer)
+    if result.rows is not None:
+        result.rows.map(transformer)
 
     new_meta = []
     for c in result.result["meta"]:
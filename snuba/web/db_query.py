@@ -7,7 +7,18 @@ from dataclasses import dataclass
 from functools import partial
 from hashlib import md5
 from threading import Lock
-from typing import Any, Mapping, MutableMapping, MutableSequence, Optional, Union, cast
+from typing import (
+    Any,
+    Callable,
+    Generator,
+    Iterator,
+    Mapping,
+    MutableMapping,
+    MutableSequence,
+    Optional,
+    Union,
+    cast,
+)
 
 import rapidjson
 import sentry_sdk
@@ -47,9 +58,10 @@ from snuba.querylog.query_metadata import (
     get_query_status_from_error_codes,
     get_request_status,
 )
-from snuba.reader import Reader, Result
+from snuba.reader import Reader, Result, Row
 from snuba.redis import RedisClientKey, get_redis_client
 from snuba.state.cache.abstract import Cache, ExecutionTimeoutError
+from snuba.state.cache.local.backend import RESULT_LOCAL_VALUE, LocalCache
 from snuba.state.cache.redis.backend import (
     RESULT_VALUE,
     RESULT_WAIT,
@@ -67,7 +79,14 @@ from snuba.utils.serializable_exception import (
     SerializableException,
     SerializableExceptionDict,
 )
-from snuba.web import QueryException, QueryResult, constants
+from snuba.web import (
+    QueryException,
+    QueryResult,
+    StreamClosedException,
+    StreamedRows,
+    constants,
+    result_cache_codec,
+)
 
 metrics = MetricsWrapper(environment.metrics, "db_query")
 
@@ -78,10 +97,28 @@ _THROTTLED_BY = "throttled_by"
 
 
 class ResultCacheCodec(ExceptionAwareCodec[bytes, Result]):
+    """
+    Encodes results as JSON, or in the columnar binary format of
+    ``snuba.web.result_cache_codec`` when the ``result_cache.columnar_codec``
+    runtime config is enabled. Both formats are always decoded so that
+    entries written before the rollout (or a rollback) remain readable.
+    """
+
     def encode(self, value: Result) -> bytes:
+        if state.get_config("result_cache.columnar_codec", 0):
+            encoded = result_cache_codec.encode(
+                value,
+                compression_threshold=state.get_config(
+                    "result_cache.compression_threshold_bytes", 16 * 1024
+                ),
+            )
+            if encoded is not None:
+                return encoded
         return cast(str, rapidjson.dumps(value, default=str)).encode("utf-8")
 
     def decode(self, value: bytes) -> Result:
+        if result_cache_codec.is_columnar(value):
+            return result_cache_codec.decode(value)
         ret = rapidjson.loads(value)
         if ret.get("__type__", "DNE") == "SerializableException":
             raise SerializableException.from_dict(cast(SerializableExceptionDict, ret))
@@ -93,16 +130,50 @@ class ResultCacheCodec(ExceptionAwareCodec[bytes, Result]):
         return cast(str, rapidjson.dumps(value.to_dict())).encode("utf-8")
 
 
+def _estimate_result_size(result: Result) -> int:
+    """
+    Cheap approximation of the memory footprint of a result, used to bound
+    the size of the local result cache.
+    """
+    size = 0
+    for row in result["data"]:
+        for value in row.values():
+            size += len(value) if isinstance(value, (str, bytes)) else 8
+    return size + 64 * len(result["meta"])
+
+
+def _copy_result(result: Result) -> Result:
+    """
+    Copies the containers of a result so that callers can transform rows and
+    meta in place without affecting the cached value.
+    """
+    copied = cast(Result, dict(result))
+    copied["meta"] = list(result["meta"])
+    copied["data"] = [dict(row) for row in result["data"]]
+    if "totals" in result:
+        copied["totals"] = dict(result["totals"])
+    return copied
+
+
+def _build_cache_partition(partition_id: str, prefix: str) -> Cache[Result]:
+    return LocalCache(
+        RedisCache(redis_cache_client, prefix, ResultCacheCodec()),
+        partition_id,
+        max_size_bytes=settings.LOCAL_RESULT_CACHE_PARTITION_MAX_BYTES,
+        max_entry_size_bytes=settings.LOCAL_RESULT_CACHE_MAX_ENTRY_BYTES,
+        sizeof=_estimate_result_size,
+        copy=_copy_result,
+    )
+
+
 DEFAULT_CACHE_PARTITION_ID = "default"
 
 # We are not initializing all the cache partitions here and instead relying on lazy
 # initialization because this module only learn of cache partitions ids from the
 # reader when running a query.
 cache_partitions: MutableMapping[str, Cache[Result]] = {
-    DEFAULT_CACHE_PARTITION_ID: RedisCache(
-        redis_cache_client,
-        "snuba-query-cache:",
-        ResultCacheCodec(),
+    DEFAULT_CACHE_PARTITION_ID: _build_cache_partition(
+        DEFAULT_CACHE_PARTITION_ID, "snuba-query-cache:"
     )
 }
 # This lock prevents us from initializing the cache twice. The cache is initialized
@@ -136,19 +207,19 @@ def update_query_metadata_and_stats(
         stats["error_code"] = error_code
     if triggered_rate_limiter is not None:
         stats["triggered_rate_limiter"] = triggered_rate_limiter
-    sql_anonymized = format_query_anonymized(query).get_sql()
     start, end = get_time_range_estimate(cast(ProcessableQuery[Table], query))
 
     query_metadata_list.append(
         ClickhouseQueryMetadata(
             sql=sql,
-            sql_anonymized=sql_anonymized,
+            # Only computed if the query is recorded, by the querylog worker.
+            sql_anonymized=lambda: format_query_anonymized(query).get_sql(),
             start_timestamp=start,
             end_timestamp=end,
             stats=dict(stats),
             status=status,
             request_status=request_status,
-            profile=generate_profile(query),
+            profile=partial(generate_profile, query),
             trace_id=trace_id,
             result_profile=profile_data,
         )
@@ -212,10 +283,8 @@ def _get_cache_partition(reader: Reader) -> Cache[Result]:
             # during the first query. So, for the vast majority of queries, the overhead
             # of acquiring the lock is not needed.
             if partition_id not in cache_partitions:
-                cache_partitions[partition_id] = RedisCache(
-                    redis_cache_client,
-                    f"snuba-query-cache:{partition_id}:",
-                    ResultCacheCodec(),
+                cache_partitions[partition_id] = _build_cache_partition(
+                    partition_id, f"snuba-query-cache:{partition_id}:"
                 )
 
     return cache_partitions[
@@ -325,6 +394,10 @@ def execute_query_with_readthrough_caching(
         if hit_type == RESULT_VALUE:
             stats["cache_hit"] = 1
             span_tag = "cache_hit"
+        elif hit_type == RESULT_LOCAL_VALUE:
+            stats["cache_hit"] = 1
+            stats["cache_hit_local"] = 1
+            span_tag = "cache_hit_local"
         elif hit_type == RESULT_WAIT:
             stats["is_duplicate"] = 1
             span_tag = "cache_wait"
@@ -374,29 +447,25 @@ def _get_query_settings_from_config(
     #      same entity/dataset, using cache_partition right now. This is
     #      not ideal but it works for now.
     """
-    all_confs = state.get_all_configs()
-
     # Populate the query settings with the default values
     clickhouse_query_settings: MutableMapping[str, Any] = {
-        k.split("/", 1)[1]: v
-        for k, v in all_confs.items()
-        if k.startswith("query_settings/")
+        **state.get_configs_with_prefix("query_settings/")
     }
 
     if async_override:
-        for k, v in all_confs.items():
-            if k.startswith("async_query_settings/"):
-                clickhouse_query_settings[k.split("/", 1)[1]] = v
+        clickhouse_query_settings.update(
+            state.get_configs_with_prefix("async_query_settings/")
+        )
 
     if override_prefix:
-        for k, v in all_confs.items():
-            if k.startswith(f"{override_prefix}/query_settings/"):
-                clickhouse_query_settings[k.split("/", 2)[2]] = v
+        clickhouse_query_settings.update(
+            state.get_configs_with_prefix(f"{override_prefix}/query_settings/")
+        )
 
     if referrer:
-        for k, v in all_confs.items():
-            if k.startswith(f"referrer/{referrer}/query_settings/"):
-                clickhouse_query_settings[k.split("/", 3)[3]] = v
+        clickhouse_query_settings.update(
+            state.get_configs_with_prefix(f"referrer/{referrer}/query_settings/")
+        )
 
     return clickhouse_query_settings
 
@@ -420,40 +489,11 @@ def _raw_query(
     this function is responsible for running the clickhouse query and if there is any error, constructing the
     QueryException that  the rest of the stack depends on. See the `db_query` docstring for more details
     """
-    clickhouse_query_settings = _get_query_settings_from_config(
-        reader.get_query_settings_prefix(),
-        query_settings.get_asynchronous(),
-        referrer=attribution_info.referrer,
+    clickhouse_query_settings = _get_clickhouse_query_settings(
+        query_settings, attribution_info, dataset_name, reader, timer, stats
     )
-    resource_quota = query_settings.get_resource_quota()
-    max_threads = resource_quota.max_threads if resource_quota else None
-    if max_threads:
-        clickhouse_query_settings["max_threads"] = max_threads
-    timer.mark("get_configs")
-
     sql = formatted_query.get_sql()
 
-    # Force query to use the first shard replica, which
-    # should have synchronously received any cluster writes
-    # before this query is run.
-    consistent = query_settings.get_consistent()
-    stats["consistent"] = consistent
-    if consistent:
-        sample_rate = state.get_config(
-            f"{dataset_name}_ignore_consistent_queries_sample_rate", 0
-        )
-        assert sample_rate is not None
-        ignore_consistent = random.random() < float(sample_rate)
-        if not ignore_consistent:
-            clickhouse_query_settings["load_balancing"] = "in_order"
-            clickhouse_query_settings["max_threads"] = 1
-        else:
-            stats["consistent"] = False
-            metrics.increment(
-                "ignored_consistent_queries",
-                tags={"dataset": dataset_name, "referrer": attribution_info.referrer},
-            )
-
     update_with_status = partial(
         update_query_metadata_and_stats,
         query=clickhouse_query,
@@ -477,50 +517,13 @@ def _raw_query(
             referrer=attribution_info.referrer,
         )
     except Exception as cause:
-        error_code = None
-        trigger_rate_limiter = None
-        status = None
-        request_status = get_request_status(cause)
-        if isinstance(cause, RateLimitExceeded):
-            status = QueryStatus.RATE_LIMITED
-            trigger_rate_limiter = cause.extra_data.get("scope", "")
-        elif isinstance(cause, ClickhouseError):
-            error_code = cause.code
-            status = get_query_status_from_error_codes(error_code)
-
-            with configure_scope() as scope:
-                fingerprint = ["{{default}}", str(cause.code), dataset_name]
-                if error_code not in constants.CLICKHOUSE_SYSTEMATIC_FAILURES:
-                    fingerprint.append(attribution_info.referrer)
-                scope.fingerprint = fingerprint
-        elif isinstance(cause, TimeoutError):
-            status = QueryStatus.TIMEOUT
-        elif isinstance(cause, ExecutionTimeoutError):
-            status = QueryStatus.TIMEOUT
-
-        if request_status.slo == SLO.AGAINST:
-            logger.exception("Error running query: %s\n%s", sql, cause)
-
-        with configure_scope() as scope:
-            if scope.span:
-                sentry_sdk.set_tag("slo_status", request_status.status.value)
-
-        stats = update_with_status(
-            status=status or QueryStatus.ERROR,
-            request_status=request_status,
-            error_code=error_code,
-            triggered_rate_limiter=str(trigger_rate_limiter),
-        )
-        raise QueryException.from_args(
-            # This exception needs to have the message of the cause in it for sentry
-            # to pick it up properly
-            cause.__class__.__name__,
-            str(cause),
-            {
-                "stats": stats,
-                "sql": sql,
-                "experiments": clickhouse_query.get_experiments(),
-            },
+        raise _build_query_exception(
+            cause,
+            clickhouse_query,
+            dataset_name,
+            attribution_info,
+            sql,
+            update_with_status,
         ) from cause
     else:
         stats = update_with_status(
@@ -538,6 +541,108 @@ def _raw_query(
         )
 
 
+def _get_clickhouse_query_settings(
+    query_settings: QuerySettings,
+    attribution_info: AttributionInfo,
+    dataset_name: str,
+    reader: Reader,
+    timer: Timer,
+    stats: MutableMapping[str, Any],
+) -> MutableMapping[str, Any]:
+    clickhouse_query_settings = _get_query_settings_from_config(
+        reader.get_query_settings_prefix(),
+        query_settings.get_asynchronous(),
+        referrer=attribution_info.referrer,
+    )
+    resource_quota = query_settings.get_resource_quota()
+    max_threads = resource_quota.max_threads if resource_quota else None
+    if max_threads:
+        clickhouse_query_settings["max_threads"] = max_threads
+    timer.mark("get_configs")
+
+    # Force query to use the first shard replica, which
+    # should have synchronously received any cluster writes
+    # before this query is run.
+    consistent = query_settings.get_consistent()
+    stats["consistent"] = consistent
+    if consistent:
+        sample_rate = state.get_config(
+            f"{dataset_name}_ignore_consistent_queries_sample_rate", 0
+        )
+        assert sample_rate is not None
+        ignore_consistent = random.random() < float(sample_rate)
+        if not ignore_consistent:
+            clickhouse_query_settings["load_balancing"] = "in_order"
+            clickhouse_query_settings["max_threads"] = 1
+        else:
+            stats["consistent"] = False
+            metrics.increment(
+                "ignored_consistent_queries",
+                tags={"dataset": dataset_name, "referrer": attribution_info.referrer},
+            )
+
+    return clickhouse_query_settings
+
+
+def _build_query_exception(
+    cause: Exception,
+    clickhouse_query: Union[Query, CompositeQuery[Table]],
+    dataset_name: str,
+    attribution_info: AttributionInfo,
+    sql: str,
+    update_with_status: Callable[..., MutableMapping[str, Any]],
+) -> QueryException:
+    """
+    Records the failure of a query in the querylog metadata and wraps its
+    cause in the QueryException the rest of the stack depends on.
+    """
+    error_code = None
+    trigger_rate_limiter = None
+    status = None
+    request_status = get_request_status(cause)
+    if isinstance(cause, RateLimitExceeded):
+        status = QueryStatus.RATE_LIMITED
+        trigger_rate_limiter = cause.extra_data.get("scope", "")
+    elif isinstance(cause, ClickhouseError):
+        error_code = cause.code
+        status = get_query_status_from_error_codes(error_code)
+
+        with configure_scope() as scope:
+            fingerprint = ["{{default}}", str(cause.code), dataset_name]
+            if error_code not in constants.CLICKHOUSE_SYSTEMATIC_FAILURES:
+                fingerprint.append(attribution_info.referrer)
+            scope.fingerprint = fingerprint
+    elif isinstance(cause, TimeoutError):
+        status = QueryStatus.TIMEOUT
+    elif isinstance(cause, ExecutionTimeoutError):
+        status = QueryStatus.TIMEOUT
+
+    if request_status.slo == SLO.AGAINST:
+        logger.exception("Error running query: %s\n%s", sql, cause)
+
+    with configure_scope() as scope:
+        if scope.span:
+            sentry_sdk.set_tag("slo_status", request_status.status.value)
+
+    stats = update_with_status(
+        status=status or QueryStatus.ERROR,
+        request_status=request_status,
+        error_code=error_code,
+        triggered_rate_limiter=str(trigger_rate_limiter),
+    )
+    return QueryException.from_args(
+        # This exception needs to have the message of the cause in it for sentry
+        # to pick it up properly
+        cause.__class__.__name__,
+        str(cause),
+        {
+            "stats": stats,
+            "sql": sql,
+            "experiments": clickhouse_query.get_experiments(),
+        },
+    )
+
+
 def _get_allocation_policies(
     query: Query | CompositeQuery[Table],
 ) -> list[AllocationPolicy]:
@@ -676,30 +781,14 @@ def db_query(
             robust,
         )
     except AllocationPolicyViolations as e:
-        update_query_metadata_and_stats(
-            query=clickhouse_query,
-            sql=formatted_query.get_sql(),
-            stats=stats,
-            query_metadata_list=query_metadata_list,
-            query_settings={},
-            trace_id=trace_id,
-            status=QueryStatus.RATE_LIMITED,
-            request_status=Status(RequestStatus.RATE_LIMITED),
-            profile_data=None,
-            error_code=None,
-            triggered_rate_limiter="AllocationPolicy",
-        )
-
-        error = QueryException.from_args(
-            AllocationPolicyViolations.__name__,
-            "Query cannot be run due to allocation policies",
-            extra={
-                "stats": stats,
-                "sql": "no sql run",
-                "experiments": {},
-            },
+        error = _build_allocation_policy_violation(
+            e,
+            clickhouse_query,
+            formatted_query,
+            stats,
+            query_metadata_list,
+            trace_id,
         )
-        error.__cause__ = e
     except QueryException as e:
         error = e
     except Exception as e:
@@ -707,19 +796,13 @@ def db_query(
         # if it didn't do that, something is very wrong so we just panic out here
         raise e
     finally:
-        result_or_error = QueryResultOrError(query_result=result, error=error)
-        _record_bytes_scanned(
-            result_or_error,
+        _update_quota_balance(
+            QueryResultOrError(query_result=result, error=error),
+            allocation_policies,
             attribution_info,
             dataset_name,
-            allocation_policies[0].storage_key,
+            query_id,
         )
-        for allocation_policy in allocation_policies:
-            allocation_policy.update_quota_balance(
-                tenant_ids=attribution_info.tenant_ids,
-                query_id=query_id,
-                result_or_error=result_or_error,
-            )
         if stats.get("cache_hit"):
             metrics.increment("cache_hit", tags={"dataset": dataset_name})
         elif stats.get("is_duplicate"):
@@ -735,6 +818,237 @@ def db_query(
         )
 
 
+def db_query_stream(
+    clickhouse_query: Union[Query, CompositeQuery[Table]],
+    query_settings: QuerySettings,
+    attribution_info: AttributionInfo,
+    dataset_name: str,
+    # NOTE: This variable is a piece of state which is updated and used outside this function
+    query_metadata_list: MutableSequence[ClickhouseQueryMetadata],
+    formatted_query: FormattedQuery,
+    reader: Reader,
+    timer: Timer,
+    # NOTE: This variable is a piece of state which is updated and used outside this function
+    stats: MutableMapping[str, Any],
+    trace_id: str,
+) -> QueryResult:
+    """
+    Streaming counterpart of ``db_query``: the returned QueryResult carries
+    the rows in ``rows`` and they are read from Clickhouse while they are
+    consumed.
+
+    * The readthrough cache is bypassed, streamed results are never cached.
+    * Allocation policies are applied before the query runs, like in
+      ``db_query``. The quota balance is updated once the rows are
+      exhausted, the query failed, or the rows were closed before the end
+      (whether they were iterated or not).
+    * The querylog metadata of the query is recorded, and ``stats`` updated,
+      at the same moment. Errors that happen while the rows are read are
+      raised by the iterator as QueryException.
+    """
+    allocation_policies = _get_allocation_policies(clickhouse_query)
+    query_id = uuid.uuid4().hex
+
+    def finish(result: Optional[QueryResult], error: Optional[QueryException]) -> None:
+        _update_quota_balance(
+            QueryResultOrError(query_result=result, error=error),
+            allocation_policies,
+            attribution_info,
+            dataset_name,
+            query_id,
+        )
+        metrics.increment("streamed_query", tags={"dataset": dataset_name})
+
+    try:
+        _apply_allocation_policies_quota(
+            query_settings,
+            attribution_info,
+            formatted_query,
+            stats,
+            allocation_policies,
+            query_id,
+        )
+    except AllocationPolicyViolations as e:
+        error = _build_allocation_policy_violation(
+            e,
+            clickhouse_query,
+            formatted_query,
+            stats,
+            query_metadata_list,
+            trace_id,
+        )
+        finish(None, error)
+        raise error
+
+    clickhouse_query_settings = _get_clickhouse_query_settings(
+        query_settings, attribution_info, dataset_name, reader, timer, stats
+    )
+    clickhouse_query_settings.update(query_settings.get_clickhouse_settings())
+    clickhouse_query_settings["query_id"] = f"randomized-{uuid.uuid4().hex}"
+    sql = formatted_query.get_sql()
+
+    update_with_status = partial(
+        update_query_metadata_and_stats,
+        query=clickhouse_query,
+        query_metadata_list=query_metadata_list,
+        sql=sql,
+        stats=stats,
+        query_settings=clickhouse_query_settings,
+        trace_id=trace_id,
+    )
+
+    def fail(cause: Exception) -> QueryException:
+        error = _build_query_exception(
+            cause,
+            clickhouse_query,
+            dataset_name,
+            attribution_info,
+            sql,
+            update_with_status,
+        )
+        error.__cause__ = cause
+        finish(None, error)
+        return error
+
+    try:
+        stream = reader.execute_stream(formatted_query, clickhouse_query_settings)
+    except Exception as cause:
+        raise fail(cause) from cause
+    timer.mark("execute")
+
+    result: Result = {"meta": stream.meta, "data": []}
+    streamed_rows = StreamedRows(stream.rows)
+    query_result = QueryResult(
+        result,
+        {
+            "stats": stats,
+            "sql": sql,
+            "experiments": clickhouse_query.get_experiments(),
+        },
+        rows=streamed_rows,
+    )
+
+    # Set once the query was accounted for, either when the rows are
+    # exhausted or when reading them failed.
+    accounted = False
+
+    def account(rows: Iterator[Row]) -> Generator[Row, None, None]:
+        nonlocal accounted
+        result_rows = 0
+        try:
+            for row in rows:
+                result_rows += 1
+                yield row
+        except Exception as cause:
+            accounted = True
+            streamed_rows.error = fail(cause)
+            raise streamed_rows.error from cause
+
+        accounted = True
+        stats.update(
+            {
+                "result_rows": result_rows,
+                "result_cols": len(stream.meta),
+                "max_threads": clickhouse_query_settings.get("max_threads", None),
+            }
+        )
+        result["profile"] = stream.profile
+        update_with_status(
+            status=QueryStatus.SUCCESS,
+            request_status=get_request_status(),
+            profile_data=_build_result_profile(stream.profile),
+        )
+        finish(query_result, None)
+
+    def on_close() -> None:
+        # The consumer stopped reading before the end of the result, or never
+        # started (e.g. the client disconnected): the query did not complete.
+        if not accounted:
+            streamed_rows.error = fail(
+                StreamClosedException("Result stream closed before completion")
+            )
+
+    streamed_rows.wrap(account)
+    streamed_rows.on_close(stream.close)
+    streamed_rows.on_close(on_close)
+    return query_result
+
+
+def _build_result_profile(
+    profile: Optional[Mapping[str, Any]],
+) -> Optional[snuba_queries_v1._QueryMetadataResultProfileObject]:
+    """
+    Builds the profile recorded in the querylog, which only has some of the
+    fields of the profile of a query.
+    """
+    if profile is None:
+        return None
+    result_profile = snuba_queries_v1._QueryMetadataResultProfileObject()
+    if "bytes" in profile:
+        result_profile["bytes"] = profile["bytes"]
+    if "progress_bytes" in profile:
+        result_profile["progress_bytes"] = profile["progress_bytes"]
+    if "elapsed" in profile:
+        result_profile["elapsed"] = profile["elapsed"]
+    return result_profile
+
+
+def _build_allocation_policy_violation(
+    cause: AllocationPolicyViolations,
+    clickhouse_query: Union[Query, CompositeQuery[Table]],
+    formatted_query: FormattedQuery,
+    stats: MutableMapping[str, Any],
+    query_metadata_list: MutableSequence[ClickhouseQueryMetadata],
+    trace_id: str,
+) -> QueryException:
+    update_query_metadata_and_stats(
+        query=clickhouse_query,
+        sql=formatted_query.get_sql(),
+        stats=stats,
+        query_metadata_list=query_metadata_list,
+        query_settings={},
+        trace_id=trace_id,
+        status=QueryStatus.RATE_LIMITED,
+        request_status=Status(RequestStatus.RATE_LIMITED),
+        profile_data=None,
+        error_code=None,
+        triggered_rate_limiter="AllocationPolicy",
+    )
+
+    error = QueryException.from_args(
+        AllocationPolicyViolations.__name__,
+        "Query cannot be run due to allocation policies",
+        extra={
+            "stats": stats,
+            "sql": "no sql run",
+            "experiments": {},
+        },
+    )
+    error.__cause__ = cause
+    return error
+
+
+def _update_quota_balance(
+    result_or_error: QueryResultOrError,
+    allocation_policies: list[AllocationPolicy],
+    attribution_info: AttributionInfo,
+    dataset_name: str,
+    query_id: str,
+) -> None:
+    _record_bytes_scanned(
+        result_or_error,
+        attribution_info,
+        dataset_name,
+        allocation_policies[0].storage_key,
+    )
+    for allocation_policy in allocation_policies:
+        allocation_policy.update_quota_balance(
+            tenant_ids=attribution_info.tenant_ids,
+            query_id=query_id,
+            result_or_error=result_or_error,
+        )
+
+
 @dataclass
 class _QuotaAndPolicy:
     quota_allowance: QuotaAllowance
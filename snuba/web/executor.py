@@ -0,0 +1,15 @@
+"""
+Thread pool shared by the queries that a request runs concurrently, for the
+web layer (see ``snuba.web.parallel``) and the RPC endpoints alike. It is
+sized after the ClickHouse connection pool, since every query it runs holds
+a connection.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from snuba import settings
+
+query_executor = ThreadPoolExecutor(
+    max_workers=settings.CLICKHOUSE_MAX_POOL_SIZE,
+    thread_name_prefix="snuba-query",
+)
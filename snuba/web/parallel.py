@@ -0,0 +1,100 @@
+"""
+Runs the independent ClickHouse queries of a single request concurrently.
+
+The queries are executed on the query thread pool shared by every request
+of the process (``snuba.web.executor``), each request can run at most
+``max_concurrency`` of them at once so that one request with many queries
+cannot take over the pool. The request as a whole has a deadline: the time
+the queries have to complete is not reset for every query, so a request
+takes as long as its slowest queries rather than the sum of all of them.
+
+Each query is expected to be run through ``snuba.web.query.run_query`` with
+its own ``Timer``, so that its query log entry and ClickHouse query metadata
+only describe that query (timers are not thread safe).
+"""
+
+from __future__ import annotations
+
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Callable, List, MutableMapping, Optional, Sequence, TypeVar
+
+from snuba import environment, settings, state
+from snuba.utils.metrics.wrapper import MetricsWrapper
+from snuba.utils.serializable_exception import SerializableException
+from snuba.web.executor import query_executor
+
+metrics = MetricsWrapper(environment.metrics, "api.parallel_queries")
+
+T = TypeVar("T")
+
+
+class ParallelQueriesTimeout(SerializableException):
+    """
+    The queries of a request did not complete before the deadline of the
+    request.
+    """
+
+
+def run_in_parallel(
+    tasks: Sequence[Callable[[], T]],
+    timeout: float,
+    max_concurrency: Optional[int] = None,
+) -> Sequence[T]:
+    """
+    Runs the tasks concurrently and returns their results in the same order.
+
+    If a task fails, or if the tasks do not all complete within ``timeout``
+    seconds, the tasks that did not start yet are cancelled and the error is
+    raised. Tasks that already started cannot be interrupted, they complete
+    in the background (ClickHouse enforces its own timeout on them).
+    """
+    if max_concurrency is None:
+        max_concurrency = int(
+            state.get_config(
+                "parallel_queries_max_concurrency",
+                settings.PARALLEL_QUERIES_MAX_CONCURRENCY,
+            )
+            or 1
+        )
+    max_concurrency = max(max_concurrency, 1)
+    deadline = time.monotonic() + timeout
+
+    results: MutableMapping[int, T] = {}
+    running: MutableMapping[Future[T], int] = {}
+    pending = iter(enumerate(tasks))
+
+    def submit_next() -> bool:
+        item = next(pending, None)
+        if item is None:
+            return False
+        index, task = item
+        running[query_executor.submit(task)] = index
+        return True
+
+    start = time.monotonic()
+    try:
+        while len(running) < max_concurrency and submit_next():
+            pass
+
+        while running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                metrics.increment("timeout")
+                raise ParallelQueriesTimeout(
+                    f"{len(tasks) - len(results)} of {len(tasks)} queries did not complete within {timeout}s"
+                )
+            done, _ = wait(running, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                # Raises the exception of the task if it failed.
+                results[index] = future.result()
+                submit_next()
+    finally:
+        for future in running:
+            future.cancel()
+
+    metrics.timing("duration", (time.monotonic() - start) * 1000)
+    metrics.distribution("queries", len(tasks))
+    ordered: List[T] = [results[i] for i in range(len(tasks))]
+    return ordered
@@ -82,9 +82,19 @@ def run_query(
         result = _run_query_pipeline(
             request, timer, query_metadata, robust, concurrent_queries_gauge
         )
-        if not request.query_settings.get_dry_run():
-            record_query(request, timer, query_metadata, result)
-        _set_query_final(request, result.extra)
+        if result.rows is not None:
+            _record_query_on_completion(request, timer, query_metadata, result)
+            try:
+                _set_query_final(request, result.extra)
+            except BaseException:
+                # Nobody will consume the rows, this releases the
+                # connection and records the query.
+                result.rows.close()
+                raise
+        else:
+            if not request.query_settings.get_dry_run():
+                record_query(request, timer, query_metadata, result)
+            _set_query_final(request, result.extra)
     except InvalidQueryException as error:
         request_status = get_request_status(error)
         record_invalid_request(
@@ -111,6 +121,30 @@ def run_query(
     return result
 
 
+def _record_query_on_completion(
+    request: Request,
+    timer: Timer,
+    query_metadata: SnubaQueryMetadata,
+    result: QueryResult,
+) -> None:
+    """
+    The querylog entry of a streamed result is written once its rows are
+    closed, when the metadata of the query is complete.
+    """
+
+    streamed_rows = result.rows
+    assert streamed_rows is not None
+
+    def record() -> None:
+        if streamed_rows.error is not None:
+            _set_query_final(request, streamed_rows.error.extra)
+            record_query(request, timer, query_metadata, streamed_rows.error)
+        else:
+            record_query(request, timer, query_metadata, result)
+
+    streamed_rows.on_close(record)
+
+
 def _get_dataset(dataset_name: Optional[str]) -> Dataset:
     if dataset_name:
         try:
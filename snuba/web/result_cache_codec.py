@@ -0,0 +1,195 @@
+"""
+Compact binary encoding of query results for the result cache.
+
+The legacy encoding of the result cache is the JSON representation of the
+``Result``, which repeats every column name in every row. This encoding is
+columnar instead: column names are stored once, columns that have a fixed
+width numeric type are stored as packed arrays, every other column is stored
+as a JSON array. The payload can be compressed.
+
+Layout::
+
+    MAGIC (4 bytes) | version (1 byte) | compression (1 byte) | body
+
+    body = header length (uint32, little endian) | header (JSON) | segments
+
+The header contains every key of the result except ``data`` and the list of
+``[name, kind, size]`` of each column, which describes the segments that
+follow it in order.
+
+JSON documents never start with the magic bytes, which is how encoded values
+are told apart from the legacy JSON ones.
+
+Bodies are compressed with zstd. Values compressed with zlib by earlier
+versions are still decoded.
+"""
+
+from __future__ import annotations
+
+import struct
+import sys
+import zlib
+from array import array
+from operator import itemgetter
+from typing import Any, List, MutableSequence, Optional, Sequence, Tuple, cast
+
+import rapidjson
+import zstandard
+
+from snuba.reader import Result, Row
+
+MAGIC = b"\xffSRC"
+VERSION = 1
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+
+_HEADER_LENGTH = struct.Struct("<I")
+_PREFIX_LENGTH = len(MAGIC) + 2
+
+# Column kinds. Array kinds are the typecodes of the ``array`` module.
+KIND_JSON = "json"
+_INT_TYPES = {"Int8", "Int16", "Int32", "Int64", "UInt8", "UInt16", "UInt32"}
+_FLOAT_TYPES = {"Float32", "Float64"}
+
+
+def is_columnar(value: bytes) -> bool:
+    return value[: len(MAGIC)] == MAGIC
+
+
+def _column_kind(clickhouse_type: Optional[str]) -> str:
+    if clickhouse_type in _INT_TYPES:
+        return "q"
+    if clickhouse_type == "UInt64":
+        return "Q"
+    if clickhouse_type in _FLOAT_TYPES:
+        return "d"
+    return KIND_JSON
+
+
+def _encode_column(kind: str, values: Sequence[Any]) -> Tuple[str, bytes]:
+    if kind != KIND_JSON:
+        # Values that do not fit the declared type (nulls, ints in float
+        # columns, etc.) make the column fall back to JSON so that decoding
+        # returns exactly what was encoded.
+        python_type = float if kind == "d" else int
+        if all(type(v) is python_type for v in values):
+            try:
+                packed = array(kind, values)
+            except OverflowError:
+                pass
+            else:
+                if sys.byteorder == "big":
+                    packed.byteswap()
+                return kind, packed.tobytes()
+
+    return KIND_JSON, cast(str, rapidjson.dumps(values, default=str)).encode("utf-8")
+
+
+def _decode_column(kind: str, segment: bytes) -> List[Any]:
+    if kind == KIND_JSON:
+        return cast(List[Any], rapidjson.loads(segment))
+    packed = array(kind)
+    packed.frombytes(segment)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tolist()
+
+
+def _extract_columns(data: Sequence[Row]) -> Optional[Tuple[List[str], List[Any]]]:
+    """
+    Transposes the rows into columns. Returns None if the rows do not all
+    share the same columns, which cannot be represented in this encoding.
+    """
+    if not data:
+        return [], []
+
+    names = list(data[0].keys())
+    if set(map(len, data)) != {len(names)}:
+        return None
+
+    try:
+        if len(names) == 1:
+            return names, [list(map(itemgetter(names[0]), data))]
+        return names, list(zip(*map(itemgetter(*names), data)))
+    except KeyError:
+        return None
+
+
+def encode(
+    value: Result, compression_threshold: Optional[int] = None
+) -> Optional[bytes]:
+    """
+    Encodes a result in the columnar format. The body is compressed when it
+    is larger than ``compression_threshold`` bytes.
+
+    Returns None if the result cannot be represented in this format, in which
+    case the caller should fall back to the legacy encoding.
+    """
+    extracted = _extract_columns(value.get("data", []))
+    if extracted is None:
+        return None
+    names, columns = extracted
+
+    types = {column.get("name"): column.get("type") for column in value.get("meta", [])}
+    descriptors: MutableSequence[Tuple[str, str, int]] = []
+    segments: MutableSequence[bytes] = []
+    for name, values in zip(names, columns):
+        kind, segment = _encode_column(_column_kind(types.get(name)), values)
+        descriptors.append((name, kind, len(segment)))
+        segments.append(segment)
+
+    header = cast(
+        str,
+        rapidjson.dumps(
+            {
+                "result": {k: v for k, v in value.items() if k != "data"},
+                "columns": descriptors,
+                "rows": len(value.get("data", [])),
+            },
+            default=str,
+        ),
+    ).encode("utf-8")
+    body = b"".join([_HEADER_LENGTH.pack(len(header)), header, *segments])
+
+    compression = COMPRESSION_NONE
+    if compression_threshold is not None and len(body) > compression_threshold:
+        compression = COMPRESSION_ZSTD
+        body = zstandard.ZstdCompressor(level=1).compress(body)
+
+    return b"".join([MAGIC, bytes([VERSION, compression]), body])
+
+
+def decode(value: bytes) -> Result:
+    if not is_columnar(value):
+        raise ValueError("Not a columnar result cache value")
+    version, compression = value[len(MAGIC)], value[len(MAGIC) + 1]
+    if version != VERSION:
+        raise ValueError(f"Unsupported result cache encoding version {version}")
+
+    body = memoryview(value)[_PREFIX_LENGTH:]
+    if compression == COMPRESSION_ZSTD:
+        body = memoryview(zstandard.ZstdDecompressor().decompress(body))
+    elif compression == COMPRESSION_ZLIB:
+        body = memoryview(zlib.decompress(body))
+    elif compression != COMPRESSION_NONE:
+        raise ValueError(f"Unsupported result cache compression {compression}")
+
+    (header_length,) = _HEADER_LENGTH.unpack_from(body)
+    offset = _HEADER_LENGTH.size + header_length
+    header = rapidjson.loads(bytes(body[_HEADER_LENGTH.size : offset]))
+
+    names: List[str] = []
+    columns: List[List[Any]] = []
+    for name, kind, size in header["columns"]:
+        names.append(name)
+        columns.append(_decode_column(kind, bytes(body[offset : offset + size])))
+        offset += size
+
+    result = cast(Result, header["result"])
+    if columns:
+        result["data"] = [dict(zip(names, values)) for values in zip(*columns)]
+    else:
+        result["data"] = [{} for _ in range(header["rows"])]
+    return result
@@ -1,8 +1,6 @@
 import uuid
-from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any, Literal, MutableMapping, Optional
 
-from snuba import settings
 from snuba.attribution import AppID
 from snuba.attribution.attribution_info import AttributionInfo
 from snuba.datasets.entities.entity_key import EntityKey
@@ -14,9 +12,11 @@ from snuba.query.query_settings import HTTPQuerySettings
 from snuba.request import Request
 from snuba.utils.metrics.timer import Timer
 from snuba.web import QueryResult
+from snuba.web.executor import query_executor
 from snuba.web.query import run_query
 
-eap_executor = ThreadPoolExecutor(max_workers=settings.CLICKHOUSE_MAX_POOL_SIZE)
+# The EAP queries run on the query thread pool of the web layer.
+eap_executor = query_executor
 
 
 def run_eap_query(
@@ -59,26 +59,3 @@ def run_eap_query(
     )
 
     return run_query(PluggableDataset(name=dataset, all_entities=[]), request, timer)
-
-
-def run_eap_query_async(
-    dataset: Literal["eap_spans", "spans_str_attrs", "spans_num_attrs"],
-    query: Query,
-    original_body: dict[str, Any],
-    referrer: str,
-    organization_id: int,
-    parent_api: str,
-    timer: Timer,
-    clickhouse_settings: Optional[MutableMapping[str, Any]] = None,
-) -> Future[QueryResult]:
-    return eap_executor.submit(
-        run_eap_query,
-        dataset=dataset,
-        query=query,
-        original_body=original_body,
-        referrer=referrer,
-        organization_id=organization_id,
-        parent_api=parent_api,
-        timer=timer,
-        clickhouse_settings=clickhouse_settings,
-    )
@@ -0,0 +1,112 @@
+"""
+Cache of the aggregates of the buckets of a timeseries.
+
+The timeseries endpoint splits a request into buckets aligned on the
+granularity of the request, every bucket is the aggregate of the data
+between two timestamps. The ones that are over do not change anymore (as
+long as the late data has arrived), so their aggregates are kept in Redis
+and the next requests on the same data only query the buckets that are not
+cached, usually the last one.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+from typing import Any, Optional, Sequence, Tuple
+
+import rapidjson
+from sentry_protos.snuba.v1alpha.endpoint_aggregate_bucket_pb2 import (
+    AggregateBucketRequest,
+)
+
+from snuba import environment
+from snuba.redis import RedisClientKey, RedisClientType, get_redis_client
+from snuba.utils.metrics.wrapper import MetricsWrapper
+
+logger = logging.getLogger(__name__)
+metrics = MetricsWrapper(environment.metrics, "timeseries.bucket_cache")
+
+# Bumped every time the content of the cached buckets changes, e.g. the way
+# an aggregate is computed, so that the buckets cached before are not used.
+VERSION = 1
+KEY_PREFIX = f"snuba-timeseries-bucket:v{VERSION}:"
+
+# The aggregates of a bucket, one per aggregate function of the request.
+BucketValue = Sequence[Any]
+
+
+def get_series_key(request: AggregateBucketRequest) -> str:
+    """
+    Identifies the data the buckets of a request aggregate: the projects,
+    the filter and the aggregate. Requests that only differ by their time
+    range or granularity share their buckets.
+    """
+    normalized = AggregateBucketRequest(
+        key=request.key,
+        aggregate=request.aggregate,
+        filter=request.filter,
+    )
+    normalized.meta.organization_id = request.meta.organization_id
+    normalized.meta.project_ids.extend(sorted(set(request.meta.project_ids)))
+    return hashlib.md5(normalized.SerializeToString(deterministic=True)).hexdigest()
+
+
+class BucketCache:
+    def __init__(self, client: Optional[RedisClientType] = None) -> None:
+        self.__client = client or get_redis_client(RedisClientKey.CACHE)
+
+    def __build_key(self, series: str, start_ts: int, bucket_size_secs: int) -> str:
+        # The buckets of a series are in the same slot of a cluster, they are
+        # read and written together.
+        return f"{KEY_PREFIX}{{{series}}}:{bucket_size_secs}:{start_ts}"
+
+    def get_many(
+        self, series: str, starts: Sequence[int], bucket_size_secs: int
+    ) -> Sequence[Optional[BucketValue]]:
+        """
+        Returns the cached aggregates of the buckets starting at ``starts``,
+        None for the ones that are not cached. Redis errors and entries that
+        cannot be decoded are treated as misses.
+        """
+        if not starts:
+            return []
+        try:
+            values = self.__client.mget(
+                [self.__build_key(series, start, bucket_size_secs) for start in starts]
+            )
+            results = [rapidjson.loads(v) if v is not None else None for v in values]
+        except Exception as e:
+            logger.warning("Could not read the cached buckets: %r", e, exc_info=True)
+            metrics.increment("error", tags={"operation": "get"})
+            return [None] * len(starts)
+
+        hits = sum(1 for r in results if r is not None)
+        metrics.increment("hit", hits)
+        metrics.increment("miss", len(results) - hits)
+        return results
+
+    def set_many(
+        self,
+        series: str,
+        buckets: Sequence[Tuple[int, BucketValue, int]],
+        bucket_size_secs: int,
+    ) -> None:
+        """
+        Caches the aggregates of buckets given as (start, aggregates, TTL in
+        seconds).
+        """
+        if not buckets:
+            return
+        try:
+            pipe = self.__client.pipeline(transaction=False)
+            for start, value, ttl in buckets:
+                pipe.set(
+                    self.__build_key(series, start, bucket_size_secs),
+                    rapidjson.dumps(value),
+                    ex=ttl,
+                )
+            pipe.execute()
+        except Exception as e:
+            logger.warning("Could not cache the buckets: %r", e, exc_info=True)
+            metrics.increment("error", tags={"operation": "set"})
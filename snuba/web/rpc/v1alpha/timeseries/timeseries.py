@@ -1,6 +1,7 @@
+import functools
 import itertools
 import time
-from typing import Any, Iterable, MutableMapping, Optional, Type
+from typing import Any, Callable, Iterable, MutableMapping, Optional, Sequence, Type
 
 from google.protobuf.json_format import MessageToDict
 from sentry_protos.snuba.v1alpha.endpoint_aggregate_bucket_pb2 import (
@@ -10,10 +11,13 @@ from sentry_protos.snuba.v1alpha.endpoint_aggregate_bucket_pb2 import (
     AggregateBucketResponse,
 )
 
+from snuba import state
 from snuba.query import SelectedExpression
 from snuba.query.dsl import and_cond
 from snuba.query.logical import Query
 from snuba.utils.metrics.timer import Timer
+from snuba.web import QueryResult
+from snuba.web.parallel import run_in_parallel
 from snuba.web.rpc import RPCEndpoint
 from snuba.web.rpc.common.common import (
     project_id_and_org_conditions,
@@ -21,11 +25,18 @@ from snuba.web.rpc.common.common import (
     trace_item_filters_to_expression,
     treeify_or_and_conditions,
 )
-from snuba.web.rpc.common.eap_execute import run_eap_query_async
+from snuba.web.rpc.common.eap_execute import run_eap_query
 from snuba.web.rpc.v1alpha.timeseries import aggregate_functions
+from snuba.web.rpc.v1alpha.timeseries.bucket_cache import (
+    BucketCache,
+    BucketValue,
+    get_series_key,
+)
 
 EIGHT_HOUR_GRANULARITY = 60 * 60 * 8
 ONE_HOUR_GRANULARITY = 60 * 60
+# How long all the bucket queries of a request have to complete.
+QUERIES_TIMEOUT_SECS = 60
 
 
 class TimeseriesQuerier:
@@ -45,6 +56,8 @@ class TimeseriesQuerier:
         )
         self.referrer = request.meta.referrer
         self.organization_id = request.meta.organization_id
+        self.series_key = get_series_key(request)
+        self.bucket_cache = BucketCache()
 
     def create_clickhouse_query(
         self, start_ts: int, end_ts: int, bucket_size_secs: int
@@ -84,6 +97,20 @@ class TimeseriesQuerier:
             )  # store this query cache entry for 90 days
         return clickhouse_settings
 
+    def get_cache_ttl(self, start_ts: int, bucket_size_secs: int) -> Optional[int]:
+        """
+        How long the aggregates of a bucket are cached by Snuba, the same as
+        in the ClickHouse query cache. None if the bucket is not over.
+        """
+        end_ts = start_ts + bucket_size_secs
+        if end_ts >= self.end_ts or end_ts > time.time():
+            return None
+        clickhouse_settings = self.get_clickhouse_settings(
+            start_ts, True, bucket_size_secs
+        )
+        assert clickhouse_settings is not None
+        return int(clickhouse_settings["query_cache_ttl"])
+
     def get_request_granularity(self) -> int:
         if (
             self.granularity_secs % EIGHT_HOUR_GRANULARITY == 0
@@ -119,33 +146,73 @@ class TimeseriesQuerier:
         # into one big response (if necessary)
         request_granularity = self.get_request_granularity()
 
-        all_results: Iterable[list[Any]] = (
-            [
-                run_eap_query_async(
-                    dataset="eap_spans",
-                    query=self.create_clickhouse_query(
-                        start_ts,
-                        min(start_ts + request_granularity, self.end_ts),
-                        request_granularity,
-                    ),
-                    clickhouse_settings=self.get_clickhouse_settings(
-                        start_ts,
-                        start_ts + request_granularity < self.end_ts,
-                        request_granularity,
-                    ),
-                    referrer="eap.timeseries",
-                    organization_id=self.organization_id,
-                    parent_api="eap.timeseries",
-                    timer=self.timer,
-                    original_body=self.original_body,
-                )
-                .result(60)
-                .result["data"][0][f"agg{agg_idx}"]
+        starts = range(self.rounded_start_ts, self.end_ts, request_granularity)
+        bucket_results: MutableMapping[int, BucketValue] = {}
+        cache_ttls = {
+            start_ts: self.get_cache_ttl(start_ts, request_granularity)
+            for start_ts in starts
+        }
+        use_bucket_cache = bool(state.get_config("timeseries_bucket_cache_enabled", 0))
+        if use_bucket_cache:
+            # Only the buckets that are over are cached, they are the same
+            # for every request on the same data.
+            cacheable = [s for s in starts if cache_ttls[s] is not None]
+            cached = self.bucket_cache.get_many(
+                self.series_key, cacheable, request_granularity
+            )
+            for start_ts, value in zip(cacheable, cached):
+                if value is not None:
+                    bucket_results[start_ts] = value
+            self.timer.mark("get_cached_buckets")
+
+        # The buckets are independent queries, they run concurrently with a
+        # single deadline for the whole request. Each query gets its own
+        # timer: they are not thread safe, and the query log entry of a
+        # query should only contain its own timings.
+        missing = [s for s in starts if s not in bucket_results]
+        queries: Sequence[Callable[[], QueryResult]] = [
+            functools.partial(
+                run_eap_query,
+                dataset="eap_spans",
+                query=self.create_clickhouse_query(
+                    start_ts,
+                    min(start_ts + request_granularity, self.end_ts),
+                    request_granularity,
+                ),
+                clickhouse_settings=self.get_clickhouse_settings(
+                    start_ts,
+                    start_ts + request_granularity < self.end_ts,
+                    request_granularity,
+                ),
+                referrer="eap.timeseries",
+                organization_id=self.organization_id,
+                parent_api="eap.timeseries",
+                timer=Timer("eap.timeseries.bucket", tags=self.timer.tags),
+                original_body=self.original_body,
+            )
+            for start_ts in missing
+        ]
+        query_results = run_in_parallel(queries, QUERIES_TIMEOUT_SECS)
+        self.timer.mark("execute_queries")
+
+        for start_ts, query_result in zip(missing, query_results):
+            bucket_results[start_ts] = [
+                query_result.result["data"][0][f"agg{agg_idx}"]
                 for agg_idx in range(len(self.aggregates))
             ]
-            for start_ts in range(
-                self.rounded_start_ts, self.end_ts, request_granularity
+        if use_bucket_cache:
+            self.bucket_cache.set_many(
+                self.series_key,
+                [
+                    (start_ts, bucket_results[start_ts], ttl)
+                    for start_ts in missing
+                    if (ttl := cache_ttls[start_ts]) is not None
+                ],
+                request_granularity,
             )
+
+        all_results: Iterable[list[Any]] = (
+            list(bucket_results[start_ts]) for start_ts in starts
         )
 
         merged_results = self.merge_results(all_results, request_granularity)
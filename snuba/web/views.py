@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import atexit
 import functools
+import itertools
 import logging
 import random
 import time
@@ -10,6 +11,7 @@ from typing import (
     Any,
     Callable,
     Dict,
+    Iterator,
     Mapping,
     MutableMapping,
     MutableSequence,
@@ -35,12 +37,12 @@ from flask import (
     render_template,
 )
 from flask import request as http_request
+from flask import stream_with_context
 from werkzeug import Response as WerkzeugResponse
 from werkzeug.exceptions import InternalServerError
 
-from snuba import settings, util
+from snuba import querylog, settings, state, util
 from snuba.clickhouse.errors import ClickhouseError
-from snuba.clickhouse.http import JSONRowEncoder
 from snuba.clusters.cluster import ClickhouseClientSettings
 from snuba.cogs.accountant import close_cogs_recorder
 from snuba.consumers.types import KafkaMessageMetadata
@@ -55,6 +57,7 @@ from snuba.query.allocation_policies import AllocationPolicyViolations
 from snuba.query.exceptions import InvalidQueryException, QueryPlanException
 from snuba.query.query_settings import HTTPQuerySettings
 from snuba.redis import all_redis_clients
+from snuba.request import Request as SnubaRequest
 from snuba.request.exceptions import InvalidJsonRequestException, JsonDecodeException
 from snuba.request.schema import RequestSchema
 from snuba.state.rate_limit import RateLimitExceeded, RateLimitParameters, rate_limit
@@ -70,7 +73,7 @@ from snuba.utils.health_info import (
 )
 from snuba.utils.metrics.timer import Timer
 from snuba.utils.metrics.util import with_span
-from snuba.web import QueryException, QueryTooLongException
+from snuba.web import QueryException, QueryResult, QueryTooLongException, StreamedRows
 from snuba.web.constants import get_http_status_for_clickhouse_error
 from snuba.web.converters import DatasetConverter, EntityConverter, StorageConverter
 from snuba.web.delete_query import (
@@ -118,6 +121,7 @@ application.url_map.converters["dataset"] = DatasetConverter
 application.url_map.converters["entity"] = EntityConverter
 application.url_map.converters["storage"] = StorageConverter
 atexit.register(close_cogs_recorder)
+atexit.register(querylog.flush, settings.QUERYLOG_SHUTDOWN_FLUSH_TIMEOUT_SEC)
 
 
 @application.errorhandler(InvalidJsonRequestException)
@@ -458,38 +462,15 @@ def dataset_query(
             {"Content-Type": "application/json"},
         )
     except QueryException as exception:
-        status = 500
-        cause = exception.__cause__
-        if isinstance(cause, (RateLimitExceeded, AllocationPolicyViolations)):
-            status = 429
-            details = {
-                "type": "rate-limited",
-                "message": str(cause),
-            }
-        elif isinstance(cause, ClickhouseError):
-            status = get_http_status_for_clickhouse_error(cause)
-            details = {
-                "type": "clickhouse",
-                "message": str(cause),
-                "code": cause.code,
-            }
-        elif isinstance(cause, QueryTooLongException):
-            status = 400
-            details = {"type": "query-too-long", "message": str(cause)}
-        elif isinstance(cause, Exception):
-            details = {
-                "type": "unknown",
-                "message": str(cause),
-            }
-        else:
-            raise  # exception should have been chained
-
+        status, details = _get_query_exception_details(exception)
         return Response(
             json.dumps(
                 {
                     "error": details,
                     "timing": timer.for_json(),
-                    "quota_allowance": getattr(cause, "quota_allowance", {}),
+                    "quota_allowance": getattr(
+                        exception.__cause__, "quota_allowance", {}
+                    ),
                     **exception.extra,
                 }
             ),
@@ -510,6 +491,14 @@ def dataset_query(
             status,
             {"Content-Type": "application/json"},
         )
+    if result.rows is not None:
+        rows = result.rows
+        try:
+            return _stream_query_result(request, result, rows, timer)
+        except BaseException:
+            rows.close()
+            raise
+
     payload: MutableMapping[str, Any] = {
         **result.result,
         "timing": timer.for_json(),
@@ -522,6 +511,125 @@ def dataset_query(
     return Response(dump_payload(payload), 200, {"Content-Type": "application/json"})
 
 
+def _get_query_exception_details(
+    exception: QueryException,
+) -> Tuple[int, Mapping[str, Any]]:
+    status = 500
+    cause = exception.__cause__
+    details: Mapping[str, Any]
+    if isinstance(cause, (RateLimitExceeded, AllocationPolicyViolations)):
+        status = 429
+        details = {
+            "type": "rate-limited",
+            "message": str(cause),
+        }
+    elif isinstance(cause, ClickhouseError):
+        status = get_http_status_for_clickhouse_error(cause)
+        details = {
+            "type": "clickhouse",
+            "message": str(cause),
+            "code": cause.code,
+        }
+    elif isinstance(cause, QueryTooLongException):
+        status = 400
+        details = {"type": "query-too-long", "message": str(cause)}
+    elif isinstance(cause, Exception):
+        details = {
+            "type": "unknown",
+            "message": str(cause),
+        }
+    else:
+        raise exception  # exception should have been chained
+
+    return status, details
+
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+
+def _stream_query_result(
+    request: SnubaRequest,
+    result: QueryResult,
+    rows: StreamedRows,
+    timer: Timer,
+) -> Response:
+    """
+    Sends the rows of a streamed result as they are read from Clickhouse.
+
+    The response is NDJSON if the client accepts it: a first line with the
+    meta, one line per row, then a last line with the timing (and the stats
+    if they are enabled). Otherwise it is the same JSON document as the one
+    of a regular query.
+
+    The status code is sent before the query is over, so errors that happen
+    while the rows are read are reported through an ``error`` key of the
+    last line/of the document, with the details a regular query would give.
+    """
+    ndjson = http_request.accept_mimetypes.best == NDJSON_CONTENT_TYPE
+    chunk_size = int(state.get_config("streaming_results_chunk_size", 1000) or 1)
+
+    def trailer() -> MutableMapping[str, Any]:
+        if rows.error is not None:
+            _, details = _get_query_exception_details(rows.error)
+            return {
+                "error": details,
+                "timing": timer.for_json(),
+                "quota_allowance": getattr(rows.error.__cause__, "quota_allowance", {}),
+                **rows.error.extra,
+            }
+        payload: MutableMapping[str, Any] = {
+            "timing": timer.for_json(),
+            "quota_allowance": result.quota_allowance,
+        }
+        if settings.STATS_IN_RESPONSE or request.query_settings.get_debug():
+            payload.update(result.extra)
+        return payload
+
+    def generate() -> Iterator[str]:
+        meta = dump_payload({"meta": result.result["meta"]})
+        if ndjson:
+            yield meta + "\n"
+        else:
+            # The document is built around the meta: ``{"meta": [...]``
+            # followed by the rows and the trailer keys.
+            yield meta[:-1] + ', "data": ['
+
+        separator = "\n" if ndjson else ", "
+        first = True
+        iterator = iter(rows)
+        try:
+            while True:
+                chunk = [
+                    dump_payload(row) for row in itertools.islice(iterator, chunk_size)
+                ]
+                if not chunk:
+                    break
+                yield ("" if first else separator) + separator.join(chunk)
+                first = False
+        except QueryException:
+            # Recorded in ``rows.error`` and reported in the trailer.
+            pass
+        finally:
+            rows.close()
+
+        payload = dump_payload(trailer())
+        if ndjson:
+            yield ("" if first else "\n") + payload + "\n"
+        else:
+            yield "], " + payload[1:]
+
+    response = Response(
+        stream_with_context(generate()),
+        200,
+        {"Content-Type": NDJSON_CONTENT_TYPE if ndjson else "application/json"},
+    )
+    # Closing the generator does not run its ``finally`` if it never started
+    # (e.g. the client went away before the first chunk), the rows are closed
+    # when the response is closed in any case.
+    response.call_on_close(rows.close)
+    return response
+
+
 @application.errorhandler(InvalidSubscriptionError)
 def handle_subscription_error(exception: InvalidSubscriptionError) -> Response:
     data = {"error": {"type": "subscription", "message": str(exception)}}
@@ -606,7 +714,7 @@ if application.debug or application.testing:
 
         BatchWriterEncoderWrapper(
             table_writer.get_batch_writer(metrics),
-            JSONRowEncoder(),
+            table_writer.get_row_encoder(),
         ).write(rows)
 
         return ("ok", 200, {"Content-Type": "text/plain"})
@@ -5,4 +5,7 @@ setup_logging()
 setup_sentry()
 initialize_snuba()
 
+from snuba.clusters.cluster import warmup_connection_pools  # noqa
 from snuba.web.views import application  # noqa
+
+warmup_connection_pools()
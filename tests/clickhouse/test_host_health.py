@@ -0,0 +1,63 @@
+from collections import Counter
+
+from snuba.clickhouse.host_health import HostHealth
+
+FAST = ("fast", 9000)
+SLOW = ("slow", 9000)
+BROKEN = ("broken", 9000)
+NEW = ("new", 9000)
+
+
+def test_ewma() -> None:
+    health = HostHealth(alpha=0.5)
+    assert health.get(FAST) is None
+
+    health.record(FAST, 0.1, error=False)
+    assert health.get(FAST) == (0.1, 0.0)
+    health.record(FAST, 0.3, error=False)
+    assert health.get(FAST) == (0.2, 0.0)
+    # Failures do not contribute to the latency.
+    health.record(FAST, 10.0, error=True)
+    assert health.get(FAST) == (0.2, 0.5)
+
+
+def test_latency_unknown_until_success() -> None:
+    health = HostHealth(alpha=0.5)
+    health.record(NEW, None, error=True)
+    assert health.get(NEW) == (None, 1.0)
+    # The failure did not make the host look fast.
+    health.record(NEW, 0.1, error=False)
+    assert health.get(NEW) == (0.1, 0.5)
+
+    health.record(SLOW, 1.0, error=True)
+    health.record(FAST, 0.01, error=False)
+    health.record(FAST, 0.01, error=False)
+    health.record(SLOW, 0.1, error=False)
+    weights = health.get_weights([FAST, SLOW])
+    assert weights[0] > weights[1]
+
+
+def test_choose_prefers_healthy_hosts() -> None:
+    health = HostHealth(alpha=0.5, error_penalty=4.0)
+    health.record(FAST, 0.01, error=False)
+    health.record(SLOW, 0.1, error=False)
+    health.record(BROKEN, 0.01, error=False)
+    for _ in range(5):
+        health.record(BROKEN, None, error=True)
+
+    weights = health.get_weights([FAST, SLOW, BROKEN, NEW])
+    assert weights[0] > weights[1] > weights[2]
+    # Unknown hosts are assumed to be as fast as the fastest known one.
+    assert weights[3] == weights[0]
+
+    chosen = Counter(health.choose([FAST, SLOW, BROKEN]) for _ in range(2000))
+    assert chosen[FAST] > chosen[SLOW] > chosen[BROKEN]
+    # Unhealthy hosts still get some traffic so that they can recover.
+    assert chosen[BROKEN] > 0
+
+
+def test_choose_all_broken() -> None:
+    health = HostHealth()
+    health.record(FAST, None, error=True)
+    health.record(SLOW, None, error=True)
+    assert health.choose([FAST, SLOW]) in {FAST, SLOW}
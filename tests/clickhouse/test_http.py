@@ -1,6 +1,11 @@
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Sequence, Tuple
 from unittest.mock import Mock
 
+import lz4.frame
 import pytest
+import zstandard
 
 from snuba.clickhouse.http import HTTPWriteBatch, InsertStatement, ValuesRowEncoder
 from snuba.query.expressions import FunctionCall, Literal
@@ -58,3 +63,80 @@ def test_http_write_batch_raises_exception_on_timeout() -> None:
 
     with pytest.raises(TimeoutError):
         batch.join(timeout=0.1)
+
+
+def _run_batch(compression: str, rows: Sequence[bytes]) -> Tuple[Mock, bytes, Mock]:
+    pool = Mock()
+    sent = bytearray()
+
+    def urlopen(method: str, url: str, headers: Any, body: Iterable[bytes]) -> Mock:
+        for chunk in body:
+            assert chunk
+            sent.extend(chunk)
+        return Mock(status=200)
+
+    pool.urlopen = Mock(side_effect=urlopen)
+    metrics = Mock()
+    with ThreadPoolExecutor() as executor:
+        batch = HTTPWriteBatch(
+            executor=executor,
+            pool=pool,
+            metrics=metrics,
+            user="user",
+            password="password",
+            statement=InsertStatement(table_name="table"),
+            encoding=None,
+            options={},
+            chunk_size=2,
+            buffer_size=1,
+            compression=compression,
+        )
+        for row in rows:
+            batch.append(row)
+        batch.close()
+        batch.join(timeout=5)
+    return pool, bytes(sent), metrics
+
+
+@pytest.mark.parametrize(
+    "compression, decompress",
+    [
+        pytest.param("gzip", gzip.decompress, id="gzip"),
+        pytest.param(
+            "zstd",
+            lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+            id="zstd",
+        ),
+        pytest.param("lz4", lz4.frame.decompress, id="lz4"),
+    ],
+)
+def test_http_write_batch_compression(
+    compression: str, decompress: Callable[[bytes], bytes]
+) -> None:
+    rows = [b'{"event_id": "%d", "message": "message"}\n' % i for i in range(100)]
+    pool, sent, metrics = _run_batch(compression, rows)
+
+    assert pool.urlopen.call_args.kwargs["headers"]["Content-Encoding"] == compression
+    assert decompress(sent) == b"".join(rows)
+
+    ratios = [
+        call.args[1]
+        for call in metrics.timing.call_args_list
+        if call.args[0] == "http_batch.compression_ratio"
+    ]
+    assert ratios == [sum(len(row) for row in rows) / len(sent)]
+
+
+def test_http_write_batch_compression_of_encoded_body() -> None:
+    with pytest.raises(ValueError):
+        HTTPWriteBatch(
+            executor=Mock(),
+            pool=Mock(),
+            metrics=DummyMetricsBackend(),
+            user="user",
+            password="password",
+            statement=InsertStatement(table_name="table"),
+            encoding="gzip",
+            options={},
+            compression="zstd",
+        )
@@ -1,7 +1,8 @@
 import queue
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import Any, Callable
 from unittest import mock
+from uuid import UUID
 
 import pytest
 from clickhouse_driver import errors
@@ -9,7 +10,13 @@ from dateutil.tz import tz
 
 from snuba import state
 from snuba.clickhouse.errors import ClickhouseError
-from snuba.clickhouse.native import ClickhousePool, transform_datetime
+from snuba.clickhouse.formatter.nodes import FormattedQuery, StringNode
+from snuba.clickhouse.native import (
+    ClickhousePool,
+    ConnectionQueue,
+    NativeDriverReader,
+    transform_datetime,
+)
 
 
 def test_transform_datetime() -> None:
@@ -33,7 +40,7 @@ def test_robust_concurrency_limit() -> None:
     )
 
     pool = ClickhousePool("host", 100, "test", "test", "test")
-    pool.pool = queue.LifoQueue(1)
+    pool.pool = ConnectionQueue(1)
     pool.pool.put(connection, block=False)
 
     with pytest.raises(ClickhouseError):
@@ -67,7 +74,7 @@ def test_concurrency_limit() -> None:
     state.set_config("simultaneous_queries_sleep_seconds", 0.5)
 
     pool = ClickhousePool("host", 100, "test", "test", "test")
-    pool.pool = queue.LifoQueue(1)
+    pool.pool = ConnectionQueue(1)
     pool.pool.put(connection, block=False)
 
     with pytest.raises(ClickhouseError):
@@ -120,7 +127,7 @@ def test_fallback_logic() -> None:
     with mock.patch.object(
         pool, "_create_conn", lambda x, y=False: network_failure_connection
     ):
-        pool.pool = queue.LifoQueue(1)
+        pool.pool = ConnectionQueue(1)
         pool.pool.put(network_failure_connection, block=False)
         pool.fallback_pool = queue.LifoQueue(1)
         pool.fallback_pool.put(verification_connection, block=False)
@@ -156,7 +163,7 @@ def test_execute_retries(retryable: bool, expected: int) -> None:
     with mock.patch.object(
         pool, "_create_conn", lambda x, y=False: socket_timeout_connection
     ):
-        pool.pool = queue.LifoQueue(1)
+        pool.pool = ConnectionQueue(1)
         pool.pool.put(socket_timeout_connection, block=False)
         with pytest.raises(ClickhouseError):
             pool.execute("SELECT something", retryable=retryable)
@@ -164,3 +171,206 @@ def test_execute_retries(retryable: bool, expected: int) -> None:
     assert (
         socket_timeout_connection.execute.call_count == expected
     ), f"Expected {expected} (failed) attempts with main connection pool"
+
+
+COLUMN_TYPES = [
+    ("id", "UUID"),
+    ("day", "Date"),
+    ("timestamp", "Nullable(DateTime)"),
+    ("count", "UInt64"),
+    ("count", "UInt64"),
+]
+ROWS = [
+    (UUID(int=1), date(2020, 1, 2), datetime(2020, 1, 2, 3, 4, 5), 1, 2),
+    (UUID(int=2), date(2020, 1, 3), None, 3, 4),
+    (UUID(int=3), date(2020, 1, 4), datetime(2020, 1, 4, 3, 4, 5), 5, 6),
+]
+
+
+@pytest.mark.parametrize("with_totals", [True, False])
+@pytest.mark.parametrize("rows", [ROWS, []])
+@pytest.mark.redis_db
+def test_columnar_results(with_totals: bool, rows: list[Any]) -> None:
+    def execute(*args: Any, columnar: bool = False, **kwargs: Any) -> Any:
+        if columnar:
+            return list(zip(*rows)), COLUMN_TYPES
+        return rows, COLUMN_TYPES
+
+    connection = mock.Mock()
+    connection.execute.side_effect = execute
+    connection.last_query.profile_info.bytes = 0
+    connection.last_query.profile_info.blocks = 0
+    connection.last_query.profile_info.rows = 0
+    connection.last_query.progress.bytes = 0
+    connection.last_query.elapsed = 0.0
+
+    pool = ClickhousePool(CLUSTER_HOST, CLUSTER_PORT, "test", "test", TEST_DB_NAME)
+    pool.pool = ConnectionQueue(1)
+    pool.pool.put(connection, block=False)
+    reader = NativeDriverReader(None, pool, None)
+    query = FormattedQuery([StringNode("SELECT something")])
+    with_totals = with_totals and bool(rows)
+
+    expected = reader.execute(query, with_totals=with_totals)
+    state.set_config("native_reader_columnar_results", 1)
+    columnar = reader.execute(query, with_totals=with_totals)
+
+    assert columnar == expected
+    assert [c["name"] for c in columnar["meta"]] == ["id", "day", "timestamp", "count"]
+    if rows:
+        assert columnar["data"][0] == {
+            "id": "00000000-0000-0000-0000-000000000001",
+            "day": "2020-01-02T00:00:00+00:00",
+            "timestamp": "2020-01-02T03:04:05+00:00",
+            "count": 2,
+        }
+        assert columnar["data"][1]["timestamp"] is None
+
+
+@pytest.mark.redis_db
+def test_execute_stream() -> None:
+    connection = mock.Mock()
+    connection.execute.return_value = (ROWS, COLUMN_TYPES)
+    connection.execute_iter.side_effect = lambda *args, **kwargs: iter(
+        [COLUMN_TYPES, *ROWS]
+    )
+    connection.last_query.profile_info.bytes = 10
+    connection.last_query.profile_info.blocks = 1
+    connection.last_query.profile_info.rows = 3
+    connection.last_query.progress.bytes = 20
+    connection.last_query.elapsed = 0.1
+
+    pool = ClickhousePool(CLUSTER_HOST, CLUSTER_PORT, "test", "test", TEST_DB_NAME)
+    pool.pool = ConnectionQueue(1)
+    pool.pool.put(connection, block=False)
+    reader = NativeDriverReader(None, pool, None)
+    query = FormattedQuery([StringNode("SELECT something")])
+
+    expected = reader.execute(query)
+    state.set_config("native_reader_stream_chunk_size", 2)
+    stream = reader.execute_stream(query, {"query_id": "abc"})
+    assert connection.execute_iter.call_args.kwargs["query_id"] == "abc"
+    assert stream.meta == expected["meta"]
+    # The connection is held until the rows are consumed.
+    assert pool.pool.empty()
+    assert stream.profile is None
+
+    assert list(stream.rows) == expected["data"]
+    assert stream.profile == {
+        "bytes": 10,
+        "progress_bytes": 20,
+        "blocks": 1,
+        "rows": 3,
+        "elapsed": 0.1,
+    }
+    assert pool.pool.get(block=False) is connection
+
+    # A connection whose results were not entirely read cannot be reused.
+    pool.pool.put(connection, block=False)
+    stream = reader.execute_stream(query)
+    next(stream.rows)
+    stream.rows.close()  # type: ignore
+    connection.disconnect.assert_called_once()
+    assert pool.pool.get(block=False) is None
+
+    # Nor can the one of a stream that is closed before being iterated.
+    connection.disconnect.reset_mock()
+    pool.pool.put(connection, block=False)
+    stream = reader.execute_stream(query)
+    stream.close()
+    connection.disconnect.assert_called_once()
+    assert pool.pool.get(block=False) is None
+
+
+@pytest.mark.redis_db
+def test_execute_stream_error() -> None:
+    connection = mock.Mock()
+    connection.execute_iter.side_effect = TestError("broken")
+
+    pool = ClickhousePool(CLUSTER_HOST, CLUSTER_PORT, "test", "test", TEST_DB_NAME)
+    pool.pool = ConnectionQueue(1)
+    pool.pool.put(connection, block=False)
+
+    with pytest.raises(ClickhouseError) as e:
+        pool.execute_iter("SELECT something")
+    assert e.value.code == 1
+    connection.disconnect.assert_called_once()
+    assert pool.pool.get(block=False) is None
+
+
+@pytest.mark.redis_db
+def test_warmup_and_health_checks() -> None:
+    created: list[mock.Mock] = []
+
+    def create_conn(use_fallback_host: bool = False) -> mock.Mock:
+        conn = mock.Mock()
+        conn.connection.connected = False
+        conn.connection.connect.side_effect = lambda: setattr(
+            conn.connection, "connected", True
+        )
+        conn.connection.ping.return_value = True
+        created.append(conn)
+        return conn
+
+    pool = ClickhousePool(
+        CLUSTER_HOST, CLUSTER_PORT, "test", "test", TEST_DB_NAME, max_pool_size=3
+    )
+    with mock.patch.object(pool, "_create_conn", create_conn):
+        assert pool.warmup(2) == 2
+        assert len(created) == 2
+        assert all(conn.connection.connect.call_count == 1 for conn in created)
+
+        # Warm connections are used before the placeholders.
+        assert pool.pool.get(block=False) is created[0]
+        assert pool.pool.get(block=False) is created[1]
+        assert pool.pool.get(block=False) is None
+        for conn in [None, created[1], created[0]]:
+            pool.pool.put(conn, block=False)
+
+        # Broken connections are replaced by the health check.
+        created[1].connection.ping.return_value = False
+        pool.check_idle_connections()
+        created[1].disconnect.assert_called_once()
+        assert created[0].connection.ping.call_count == 1
+        assert len(created) == 3
+        assert [pool.pool.get(block=False) for _ in range(3)] == [
+            created[0],
+            created[2],
+            None,
+        ]
+
+
+def test_connection_queue_put_least_recent() -> None:
+    pool = ConnectionQueue(3)
+    conns = [mock.Mock() for _ in range(3)]
+    pool.put(conns[0], block=False)
+    pool.put_least_recent(conns[1])
+    pool.put(conns[2], block=False)
+    with pytest.raises(queue.Full):
+        pool.put_least_recent(None)
+
+    assert [pool.get(block=False) for _ in range(3)] == [conns[2], conns[0], conns[1]]
+
+
+def test_health_checks_leave_the_pool_available() -> None:
+    pool = ClickhousePool(
+        CLUSTER_HOST, CLUSTER_PORT, "test", "test", TEST_DB_NAME, max_pool_size=3
+    )
+    conns = [mock.Mock() for _ in range(3)]
+    in_pool: list[int] = []
+
+    def ping() -> bool:
+        # Only the connection being checked is out of the pool.
+        in_pool.append(pool.pool.qsize())
+        return True
+
+    for conn in conns:
+        conn.connection.connected = True
+        conn.connection.ping.side_effect = ping
+        assert pool.pool.get(block=False) is None
+    for conn in conns:
+        pool.pool.put(conn, block=False)
+
+    pool.check_idle_connections()
+    assert in_pool == [2, 2, 2]
+    assert [pool.pool.get(block=False) for _ in range(3)] == conns[::-1]
@@ -0,0 +1,291 @@
+import pickle
+import struct
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from snuba.clickhouse.columns import (
+    UUID,
+    AggregateFunction,
+    Array,
+    ColumnSet,
+    DateTime,
+    DateTime64,
+    Enum,
+    FixedString,
+    Int,
+    IPv4,
+    IPv6,
+    Map,
+    Nested,
+)
+from snuba.clickhouse.columns import SchemaModifiers as Modifiers
+from snuba.clickhouse.columns import SimpleAggregateFunction, String, UInt
+from snuba.clickhouse.http import InsertStatement
+from snuba.clickhouse.row_binary import RowBinaryEncoder
+from snuba.clusters.cluster import ClickhouseClientSettings, get_cluster
+from snuba.clusters.storage_sets import StorageSetKey
+from snuba.utils.metrics.backends.dummy import DummyMetricsBackend
+
+DEFAULT = b"\x01"
+PROVIDED = b"\x00"
+
+
+def encoder(columns: ColumnSet) -> RowBinaryEncoder:
+    return RowBinaryEncoder(list(columns))
+
+
+def test_scalars() -> None:
+    columns = ColumnSet(
+        [
+            ("project_id", UInt(64)),
+            ("message", String()),
+            ("level", FixedString(4)),
+            ("timestamp", DateTime()),
+            ("start", DateTime64(6)),
+            ("kind", Enum([("a", 1), ("b", 2)])),
+        ]
+    )
+    timestamp = datetime(2024, 1, 2, 3, 4, 5, 600000)
+    encoded = encoder(columns).encode(
+        {
+            "project_id": 1,
+            "message": "héllo",
+            "level": "ok",
+            "timestamp": timestamp,
+            "start": timestamp,
+            "kind": "b",
+        }
+    )
+    seconds = int(timestamp.replace(tzinfo=timezone.utc).timestamp())
+    assert encoded == b"".join(
+        [
+            PROVIDED + struct.pack("<Q", 1),
+            PROVIDED + b"\x06" + "héllo".encode("utf-8"),
+            PROVIDED + b"ok\x00\x00",
+            PROVIDED + struct.pack("<I", seconds),
+            PROVIDED + struct.pack("<q", seconds * 10**6 + 600000),
+            PROVIDED + struct.pack("<b", 2),
+        ]
+    )
+
+
+def test_dates_as_strings() -> None:
+    columns = ColumnSet([("timestamp", DateTime())])
+    assert encoder(columns).encode({"timestamp": "2024-01-02 03:04:05"}) == encoder(
+        columns
+    ).encode({"timestamp": datetime(2024, 1, 2, 3, 4, 5)})
+
+
+def test_uuid_and_ips() -> None:
+    columns = ColumnSet([("event_id", UUID()), ("ip_v4", IPv4()), ("ip_v6", IPv6())])
+    event_id = uuid.UUID("0102030405060708090a0b0c0d0e0f10")
+    encoded = encoder(columns).encode(
+        {"event_id": event_id.hex, "ip_v4": "1.2.3.4", "ip_v6": "::1"}
+    )
+    assert encoded == b"".join(
+        [
+            PROVIDED
+            + struct.pack("<Q", 0x0102030405060708)
+            + struct.pack("<Q", 0x090A0B0C0D0E0F10),
+            PROVIDED + struct.pack("<I", 0x01020304),
+            PROVIDED + b"\x00" * 15 + b"\x01",
+        ]
+    )
+
+
+def test_defaults_and_nulls() -> None:
+    columns = ColumnSet(
+        [
+            ("a", UInt(8)),
+            ("b", UInt(8, Modifiers(nullable=True))),
+            ("c", UInt(8, Modifiers(nullable=True))),
+        ]
+    )
+    # Missing columns and nulls in non nullable columns use the default,
+    # nulls in nullable columns are NULL.
+    assert encoder(columns).encode({"a": None, "b": None}) == b"".join(
+        [DEFAULT, PROVIDED + b"\x01", DEFAULT]
+    )
+    assert encoder(columns).encode({"a": 1, "b": 2, "c": 3}) == b"".join(
+        [PROVIDED + b"\x01", PROVIDED + b"\x00\x02", PROVIDED + b"\x00\x03"]
+    )
+
+
+def test_composite_types() -> None:
+    columns = ColumnSet(
+        [
+            ("tags", Nested([("key", String()), ("value", String())])),
+            ("counts", Array(UInt(16))),
+            ("attrs", Map(String(), UInt(8))),
+            ("total", SimpleAggregateFunction("sum", [UInt(32)])),
+        ]
+    )
+    encoded = encoder(columns).encode(
+        {
+            "tags.key": ["k"],
+            "tags.value": ["v"],
+            "counts": [1, 2],
+            "attrs": {"x": 1},
+            "total": 5,
+        }
+    )
+    assert encoded == b"".join(
+        [
+            PROVIDED + b"\x01\x01k",
+            PROVIDED + b"\x01\x01v",
+            PROVIDED + b"\x02\x01\x00\x02\x00",
+            PROVIDED + b"\x01\x01x\x01",
+            PROVIDED + struct.pack("<I", 5),
+        ]
+    )
+
+
+def test_wide_integers() -> None:
+    columns = ColumnSet(
+        [
+            ("a", UInt(128)),
+            ("b", Int(128)),
+            ("c", UInt(256)),
+            ("d", Int(256)),
+        ]
+    )
+    encoded = encoder(columns).encode({"a": 2**127 + 1, "b": -2, "c": 1, "d": -1})
+    assert encoded == b"".join(
+        [
+            PROVIDED + b"\x01" + b"\x00" * 14 + b"\x80",
+            PROVIDED + b"\xfe" + b"\xff" * 15,
+            PROVIDED + b"\x01" + b"\x00" * 31,
+            PROVIDED + b"\xff" * 32,
+        ]
+    )
+
+
+def test_long_string_length() -> None:
+    columns = ColumnSet([("message", String())])
+    assert encoder(columns).encode({"message": "a" * 300}) == (
+        PROVIDED + b"\xac\x02" + b"a" * 300
+    )
+
+
+def test_pickle() -> None:
+    columns = ColumnSet([("project_id", UInt(64)), ("message", String())])
+    row = {"project_id": 1, "message": "hello"}
+    unpickled = pickle.loads(pickle.dumps(encoder(columns)))
+    assert unpickled.encode(row) == encoder(columns).encode(row)
+
+
+def test_unsupported_type() -> None:
+    with pytest.raises(TypeError):
+        encoder(ColumnSet([("count", AggregateFunction("count", [UInt(8)]))]))
+
+
+@pytest.mark.clickhouse_db
+def test_insert_and_read_back() -> None:
+    cluster = get_cluster(StorageSetKey.EVENTS)
+    connection = cluster.get_query_connection(ClickhouseClientSettings.MIGRATE)
+    table = f"{connection.database}.row_binary_test"
+
+    # The schema of the encoder only knows the types of the values, so
+    # LowCardinality columns are encoded as their inner type.
+    columns = ColumnSet(
+        [
+            ("id", UInt(64)),
+            ("message", String()),
+            ("level", String()),
+            ("release", String(Modifiers(nullable=True))),
+            ("environment", String(Modifiers(nullable=True))),
+            ("counts", Array(UInt(16, Modifiers(nullable=True)))),
+            ("attrs", Map(String(), String())),
+            ("tags", Nested([("key", String()), ("value", String())])),
+            ("timestamp", DateTime64(6)),
+            ("event_id", UUID()),
+            ("big", UInt(128)),
+            ("signed", Int(256)),
+        ]
+    )
+    connection.execute(f"DROP TABLE IF EXISTS {table}")
+    connection.execute(
+        f"""
+        CREATE TABLE {table} (
+            id UInt64,
+            message String,
+            level LowCardinality(String),
+            release Nullable(String),
+            environment LowCardinality(Nullable(String)) DEFAULT 'prod',
+            counts Array(Nullable(UInt16)),
+            attrs Map(String, String),
+            tags Nested(key String, value String),
+            timestamp DateTime64(6),
+            event_id UUID,
+            big UInt128,
+            signed Int256
+        ) ENGINE = Memory
+        """
+    )
+
+    event_id = uuid.uuid4()
+    timestamp = datetime(2024, 1, 2, 3, 4, 5, 600001)
+    rows = [
+        {
+            "id": 1,
+            "message": "héllo",
+            "level": "error",
+            "release": "1.0",
+            "environment": None,
+            "counts": [1, None, 3],
+            "attrs": {"a": "b"},
+            "tags.key": ["k1", "k2"],
+            "tags.value": ["v1", "v2"],
+            "timestamp": timestamp,
+            "event_id": event_id.hex,
+            "big": 2**127 + 1,
+            "signed": -(2**200),
+        },
+        # Missing columns use the default of the column.
+        {"id": 2, "message": "", "timestamp": timestamp, "event_id": str(event_id)},
+    ]
+
+    try:
+        cluster.get_batch_writer(
+            DummyMetricsBackend(strict=True),
+            InsertStatement("row_binary_test")
+            .with_format("RowBinaryWithDefaults")
+            .with_columns([column.flattened for column in columns]),
+            encoding=None,
+            options=None,
+            chunk_size=None,
+            buffer_size=0,
+        ).write([encoder(columns).encode(row) for row in rows])
+
+        result = connection.execute(
+            f"""
+            SELECT id, message, level, release, environment, counts, attrs,
+                tags.key, tags.value, toUnixTimestamp64Micro(timestamp),
+                event_id, big, signed
+            FROM {table} ORDER BY id
+            """
+        ).results
+    finally:
+        connection.execute(f"DROP TABLE IF EXISTS {table}")
+
+    micros = int(timestamp.replace(tzinfo=timezone.utc).timestamp()) * 10**6 + 600001
+    assert result == [
+        (
+            1,
+            "héllo",
+            "error",
+            "1.0",
+            None,
+            [1, None, 3],
+            {"a": "b"},
+            ["k1", "k2"],
+            ["v1", "v2"],
+            micros,
+            event_id,
+            2**127 + 1,
+            -(2**200),
+        ),
+        (2, "", "", None, "prod", [], {}, [], [], micros, event_id, 0, 0),
+    ]
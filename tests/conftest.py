@@ -235,10 +235,14 @@ def clickhouse_db(
 
 @pytest.fixture(autouse=True)
 def clear_recorded_metrics() -> Generator[None, None, None]:
+    from snuba import querylog
     from snuba.utils.metrics.backends.testing import clear_recorded_metric_calls
 
     yield
 
+    # The querylog worker records the queries of a test in the background,
+    # they must not leak into the next test.
+    querylog.flush_worker()
     clear_recorded_metric_calls()
 
 
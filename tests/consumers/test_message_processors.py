@@ -3,13 +3,17 @@ from __future__ import annotations
 import json
 import time
 from datetime import datetime
-from typing import Type
+from typing import Type, Union
 from unittest.mock import patch
 
 import pytest
 import rust_snuba
 import sentry_kafka_schemas
+from arroyo.backends.kafka import KafkaPayload
+from arroyo.types import BrokerValue, Message, Partition, Topic
 
+from snuba import state
+from snuba.consumers.consumer import BytesInsertBatch, process_message
 from snuba.consumers.types import KafkaMessageMetadata
 from snuba.datasets.processors import DatasetMessageProcessor
 from snuba.datasets.processors.errors_processor import ErrorsProcessor
@@ -20,6 +24,7 @@ from snuba.datasets.processors.outcomes_processor import OutcomesProcessor
 from snuba.datasets.processors.replays_processor import ReplaysProcessor
 from snuba.datasets.processors.rust_compat_processor import RustCompatProcessor
 from snuba.processor import InsertBatch, ReplacementBatch
+from snuba.utils.streams.topics import Topic as SnubaTopic
 
 
 @pytest.mark.parametrize(
@@ -148,3 +153,37 @@ def test_replays_message_processor() -> None:
             # rust message and overly the python message. This fill in the gaps of the python
             # message.
             assert parsed_rust_message | parsed_python_message == parsed_rust_message
+
+
+@pytest.mark.redis_db
+@patch("snuba.settings.DISCARD_OLD_EVENTS", False)
+def test_raw_payload_processing() -> None:
+    """
+    Tests the rows of a Rust processor are the same whether the consumer
+    passes it the payload as received or decoded.
+    """
+    for i, ex in enumerate(sentry_kafka_schemas.iter_examples("outcomes")):
+        message = Message(
+            BrokerValue(
+                KafkaPayload(None, json.dumps(ex.load()).encode("utf-8"), []),
+                Partition(Topic("outcomes"), 0),
+                i,
+                datetime.utcnow(),
+            )
+        )
+
+        def process() -> Union[None, BytesInsertBatch, ReplacementBatch]:
+            return process_message(
+                OutcomesProcessor(), "group", SnubaTopic.OUTCOMES, False, message
+            )
+
+        state.set_config("rust_compat_raw_payload_enabled", 0)
+        decoded = process()
+        state.set_config("rust_compat_raw_payload_enabled", 1)
+        raw = process()
+
+        assert isinstance(decoded, BytesInsertBatch)
+        assert isinstance(raw, BytesInsertBatch)
+        assert [json.loads(row) for row in raw.rows] == [
+            json.loads(row) for row in decoded.rows
+        ]
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+from snuba import state
+from snuba.consumers import rust_processor
+from snuba.datasets.processors.rust_compat_processor import RustCompatProcessor
+from snuba.processor import InsertBatch
+
+
+@pytest.mark.redis_db
+def test_raw_payload_kill_switch() -> None:
+    """
+    Tests the payload is only passed to a Rust processor as received while
+    rust_compat_raw_payload_enabled is set.
+    """
+    processor = mock.Mock(spec=RustCompatProcessor)
+    processor.process_raw_message.return_value = [b'{"value":1}']
+    processor.process_message.return_value = InsertBatch(
+        rows=[{"value": 1}], origin_timestamp=None, sentry_received_timestamp=None
+    )
+    payload = b'{"value": 1}'
+
+    with mock.patch.object(rust_processor, "processor", processor):
+        state.set_config("rust_compat_raw_payload_enabled", 0)
+        rows, _, _ = rust_processor.process_rust_message(
+            payload, 1, 0, datetime.utcnow()
+        )
+        assert rows == [b'{"value":1}']
+        assert processor.process_message.call_args[0][0] == {"value": 1}
+        processor.process_raw_message.assert_not_called()
+
+        state.set_config("rust_compat_raw_payload_enabled", 1)
+        rows, _, _ = rust_processor.process_rust_message(
+            payload, 2, 0, datetime.utcnow()
+        )
+        assert rows == [b'{"value":1}']
+        assert processor.process_raw_message.call_args[0][0] == payload
+        assert processor.process_message.call_count == 1
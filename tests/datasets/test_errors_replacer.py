@@ -2,7 +2,7 @@ import importlib
 import re
 import uuid
 from datetime import datetime, timedelta
-from typing import Any, Callable, Optional, Tuple, Union
+from typing import Any, Callable, Optional, Sequence, Tuple, Union
 
 import pytest
 import simplejson as json
@@ -168,6 +168,39 @@ class TestReplacer(BaseTest):
         self._clear_redis_and_force_merge()
         assert self._issue_count(self.project_id) == []
 
+    def test_delete_groups_batch_insert(self) -> None:
+        events = []
+        for group_id in (1, 2, 3):
+            event = get_raw_event()
+            event["project_id"] = self.project_id
+            event["group_id"] = group_id
+            events.append(event)
+        write_unprocessed_events(self.storage, events)
+
+        timestamp = datetime.utcnow()
+        batch = [
+            self.replacer.process_message(
+                self._wrap(
+                    (
+                        2,
+                        ReplacementType.END_DELETE_GROUPS,
+                        {
+                            "project_id": self.project_id,
+                            "group_ids": group_ids,
+                            "datetime": timestamp.strftime(PAYLOAD_DATETIME_FORMAT),
+                        },
+                    )
+                )
+            )
+            for group_ids in ([1], [2])
+        ]
+        self.replacer.flush_batch([processed for processed in batch if processed])
+
+        assert self._issue_count(self.project_id) == [{"count": 1, "group_id": 3}]
+
+        self._clear_redis_and_force_merge()
+        assert self._issue_count(self.project_id) == [{"count": 1, "group_id": 3}]
+
     def test_reprocessing_flow_insert(self) -> None:
         # We have a group that contains two events, 1 and 2.
         self.event["project_id"] = self.project_id
@@ -927,6 +960,73 @@ class TestReplacerProcess(BaseTest):
             group_ids=[1, 2, 3]
         )
 
+    def test_merge_delete_groups_process(self) -> None:
+        timestamp = datetime.now().replace(microsecond=0)
+        later = timestamp + timedelta(minutes=1)
+
+        def delete_groups(
+            project_id: int, group_ids: Sequence[int], ts: datetime
+        ) -> Tuple[Any, ...]:
+            return (
+                2,
+                ReplacementType.END_DELETE_GROUPS,
+                {
+                    "project_id": project_id,
+                    "group_ids": group_ids,
+                    "datetime": ts.strftime(PAYLOAD_DATETIME_FORMAT),
+                },
+            )
+
+        processed = [
+            self.replacer.process_message(self._wrap(message))
+            for message in [
+                delete_groups(self.project_id, [1, 2], timestamp),
+                delete_groups(self.project_id, [2, 3], later),
+                delete_groups(self.project_id, [4], later),
+                delete_groups(self.project_id + 1, [1], later),
+                (
+                    2,
+                    ReplacementType.EXCLUDE_GROUPS,
+                    {"project_id": self.project_id, "group_ids": [5]},
+                ),
+                (
+                    2,
+                    ReplacementType.EXCLUDE_GROUPS,
+                    {"project_id": self.project_id, "group_ids": [6, 5]},
+                ),
+            ]
+        ]
+        batch = [p for p in processed if p is not None]
+        assert len(batch) == 6
+        merged = self.replacer._merge_replacements(batch)
+        assert len(merged) == 3
+
+        # A merged replacement has the metadata of its last message.
+        metadata, replacement = merged[0]
+        assert metadata == batch[2][0]
+        assert isinstance(replacement, errors_replacer.DeleteGroupsReplacement)
+        assert replacement.get_query_time_flags() == errors_replacer.ExcludeGroups(
+            group_ids=[1, 2, 3, 4]
+        )
+        assert (
+            re.sub("[\n ]+", " ", replacement.get_count_query("foo")).strip()
+            == "SELECT count() FROM foo FINAL PREWHERE group_id IN (1, 2, 3, 4) "
+            f"WHERE project_id = {self.project_id} AND ((group_id IN (1) AND "
+            f"received <= CAST('{timestamp.strftime(DATETIME_FORMAT)}' AS DateTime)) "
+            "OR (group_id IN (2, 3, 4) AND received <= "
+            f"CAST('{later.strftime(DATETIME_FORMAT)}' AS DateTime))) AND NOT deleted"
+        )
+
+        assert merged[1][1] == batch[3][1]
+        _, replacement = merged[2]
+        assert replacement.get_query_time_flags() == errors_replacer.ExcludeGroups(
+            group_ids=[5, 6]
+        )
+
+        set_config("replacer_max_merged_group_ids", 3)
+        assert len(self.replacer._merge_replacements(batch[:3])) == 2
+        delete_config("replacer_max_merged_group_ids")
+
     def test_project_bypass(self) -> None:
         timestamp = datetime.now()
         message = (
@@ -1,3 +1,6 @@
+import pytest
+
+from snuba import state
 from snuba.datasets.storages.factory import get_writable_storage
 from snuba.datasets.storages.storage_key import StorageKey
 from snuba.settings import SLICED_KAFKA_TOPIC_MAP
@@ -19,3 +22,20 @@ def test_get_physical_topic_name(monkeypatch) -> None:  # type: ignore
     physical_topic_name = default_topic_spec.get_physical_topic_name(slice_id=2)
 
     assert physical_topic_name == "ingest-replay-events-2"
+
+
+@pytest.mark.redis_db
+def test_get_insert_compression() -> None:
+    table_writer = get_writable_storage(StorageKey.REPLAYS).get_table_writer()
+    table_name = table_writer.get_schema().get_table_name()
+    assert table_writer.get_insert_compression(table_name) is None
+
+    state.set_config(f"insert_compression_{table_name}", "zstd")
+    assert table_writer.get_insert_compression(table_name) == "zstd"
+
+    state.set_config(f"insert_compression_{table_name}", "none")
+    assert table_writer.get_insert_compression(table_name) is None
+
+    # An unknown compression falls back to no compression.
+    state.set_config(f"insert_compression_{table_name}", "zstandard")
+    assert table_writer.get_insert_compression(table_name) is None
@@ -1,6 +1,7 @@
 import pytest
 
 from snuba import settings as snubasettings
+from snuba import state
 from snuba.attribution import get_app_id
 from snuba.attribution.attribution_info import AttributionInfo
 from snuba.clickhouse.columns import ColumnSet
@@ -8,7 +9,7 @@ from snuba.clickhouse.query import Query
 from snuba.datasets.entities.entity_key import EntityKey
 from snuba.datasets.storages.storage_key import StorageKey
 from snuba.pipeline.query_pipeline import QueryPipelineResult
-from snuba.pipeline.stages.query_execution import ExecutionStage
+from snuba.pipeline.stages.query_execution import ExecutionStage, _should_stream
 from snuba.query import SelectedExpression
 from snuba.query.allocation_policies import (
     MAX_THRESHOLD,
@@ -218,3 +219,12 @@ def test_turbo(ch_query: Query) -> None:
         and "avg(duration)" in res.data.result["data"][0]
     )
     assert ch_query.get_from_clause().sampling_rate == snubasettings.TURBO_SAMPLE_RATE
+
+
+@pytest.mark.redis_db
+def test_should_stream(ch_query: Query) -> None:
+    assert not _should_stream(ch_query, HTTPQuerySettings(stream=True))
+    state.set_config("enable_streaming_results", 1)
+    assert _should_stream(ch_query, HTTPQuerySettings(stream=True))
+    assert not _should_stream(ch_query, HTTPQuerySettings())
+    assert not _should_stream(ch_query, HTTPQuerySettings(stream=True, dry_run=True))
@@ -0,0 +1,153 @@
+from typing import Iterator, Tuple, Union
+from unittest import mock
+
+import pytest
+
+from snuba import state
+from snuba.clickhouse.columns import ColumnSet
+from snuba.clickhouse.query import Query
+from snuba.datasets.factory import get_dataset
+from snuba.datasets.storages.storage_key import StorageKey
+from snuba.pipeline.plan_cache import PlanCache
+from snuba.pipeline.query_pipeline import QueryPipelineResult
+from snuba.pipeline.stages import query_processing
+from snuba.pipeline.stages.query_processing import (
+    EntityProcessingStage,
+    StorageProcessingStage,
+)
+from snuba.query import SelectedExpression
+from snuba.query.data_source.simple import Table
+from snuba.query.dsl import column, equals, literal
+from snuba.query.query_settings import HTTPQuerySettings
+from snuba.query.snql.parser import parse_snql_query
+from snuba.redis import all_redis_clients
+from snuba.state.config_snapshot import ConfigSnapshot
+from snuba.utils.metrics.timer import Timer
+
+TRANSACTIONS_QUERY = (
+    "MATCH (transactions) SELECT count() AS count, tags[foo] BY transaction "
+    "WHERE project_id = 1 AND finish_ts >= toDateTime('2024-01-01T00:00:00') "
+    "AND finish_ts < toDateTime('2024-01-02T00:00:00') LIMIT 10"
+)
+
+EVENTS_QUERY = (
+    "MATCH (events) SELECT count() AS count BY group_id "
+    "WHERE project_id = 1 AND timestamp >= toDateTime('2024-01-01T00:00:00') "
+    "AND timestamp < toDateTime('2024-01-02T00:00:00')"
+)
+
+
+@pytest.fixture
+def plan_caches() -> Iterator[Tuple[PlanCache, PlanCache]]:
+    entity_cache = PlanCache("entity", 10)
+    storage_cache = PlanCache("storage", 10)
+    with mock.patch.object(
+        query_processing, "entity_plan_cache", entity_cache
+    ), mock.patch.object(query_processing, "storage_plan_cache", storage_cache):
+        yield entity_cache, storage_cache
+
+
+def _process(body: str) -> Query:
+    query_settings = HTTPQuerySettings(referrer="test")
+    query = parse_snql_query(body, get_dataset("discover"))
+    result = StorageProcessingStage().execute(
+        EntityProcessingStage().execute(
+            QueryPipelineResult(
+                data=mock.Mock(query=query),
+                query_settings=query_settings,
+                timer=Timer("test"),
+                error=None,
+            )
+        )
+    )
+    assert result.error is None
+    assert isinstance(result.data, Query)
+    return result.data
+
+
+@pytest.mark.redis_db
+def test_plan_cache(plan_caches: Tuple[PlanCache, PlanCache]) -> None:
+    entity_cache, storage_cache = plan_caches
+    state.set_config("plan_cache_enabled", 0)
+    expected = _process(TRANSACTIONS_QUERY)
+    assert len(entity_cache) == len(storage_cache) == 0
+
+    state.set_config("plan_cache_enabled", 1)
+    first = _process(TRANSACTIONS_QUERY)
+    assert len(entity_cache) == len(storage_cache) == 1
+    with mock.patch(
+        "snuba.pipeline.stages.query_processing.run_entity_processing_executor"
+    ) as run_entity_processing:
+        second = _process(TRANSACTIONS_QUERY)
+        assert run_entity_processing.call_count == 0
+
+    assert first == expected
+    assert second == expected
+    assert second is not first
+    # Processed queries are modified in place by the execution stage, this
+    # must not change the cached ones.
+    second.add_condition_to_ast(equals(column("project_id"), literal(2)))
+    second.set_limit(1)
+    assert _process(TRANSACTIONS_QUERY) == expected
+
+    # A config change invalidates every plan.
+    state.set_config("some_config", 1)
+    _process(TRANSACTIONS_QUERY)
+    assert len(entity_cache) == len(storage_cache) == 2
+
+    # The config version starts over when Redis is flushed, plans must not be
+    # reused for different configs with the same version.
+    configs = state.get_raw_configs()
+    assert isinstance(configs, ConfigSnapshot)
+    version = configs.version
+    for redis_client in all_redis_clients():
+        redis_client.flushdb()
+    state.set_config("plan_cache_enabled", 0)
+    state.set_config("plan_cache_enabled", 1)
+    state.set_config("some_config", 2)
+    configs = state.get_raw_configs()
+    assert isinstance(configs, ConfigSnapshot) and configs.version == version
+    _process(TRANSACTIONS_QUERY)
+    assert len(entity_cache) == len(storage_cache) == 3
+
+
+@pytest.mark.redis_db
+def test_uncacheable_storage(plan_caches: Tuple[PlanCache, PlanCache]) -> None:
+    entity_cache, storage_cache = plan_caches
+    # The errors storage reads the replaced groups from Redis.
+    _process(EVENTS_QUERY)
+    _process(EVENTS_QUERY)
+    assert len(entity_cache) == 1
+    assert len(storage_cache) == 0
+
+
+@pytest.mark.redis_db
+def test_plan_cache_literal_types() -> None:
+    cache = PlanCache("test", 10)
+
+    def build(value: Union[int, float, bool]) -> Query:
+        return Query(
+            Table("test", ColumnSet([]), storage_key=StorageKey("test")),
+            selected_columns=[SelectedExpression("value", literal(value))],
+        )
+
+    for value in (1, True, 1.0, 1):
+        process = mock.Mock(return_value=build(value))
+        cache.process(build(value), HTTPQuerySettings(), process)
+    assert len(cache) == 3
+
+
+@pytest.mark.redis_db
+def test_plan_cache_clickhouse_settings() -> None:
+    cache = PlanCache("test", 10)
+    query = Query(Table("test", ColumnSet([]), storage_key=StorageKey("test")))
+
+    def process(query_settings: HTTPQuerySettings) -> Query:
+        query_settings.set_clickhouse_settings({"max_threads": 4})
+        return query
+
+    for _ in range(2):
+        query_settings = HTTPQuerySettings()
+        cache.process(query, query_settings, lambda: process(query_settings))
+        assert query_settings.get_clickhouse_settings() == {"max_threads": 4}
+    assert len(cache) == 1
@@ -1,13 +1,17 @@
 from __future__ import annotations
 
+from unittest import mock
+
 import pytest
 
 from snuba.datasets.storages.storage_key import StorageKey
 from snuba.query.allocation_policies import AllocationPolicy, QueryResultOrError
 from snuba.query.allocation_policies.bytes_scanned_window_policy import (
     _ORG_LESS_REFERRERS,
+    _RATE_LIMITER,
     BytesScannedWindowAllocationPolicy,
 )
+from snuba.state.quota_lease import reset_leases
 from snuba.web import QueryResult
 
 ORG_SCAN_LIMIT = 1000
@@ -179,6 +183,8 @@ def test_simple_config_values(policy: AllocationPolicy) -> None:
         "org_limit_bytes_scanned",
         "org_limit_bytes_scanned_override",
         "throttled_thread_number",
+        "local_lease_bytes",
+        "local_lease_ttl_s",
         "is_active",
         "is_enforced",
         "max_threads",
@@ -279,3 +285,49 @@ def test_cross_org(policy: AllocationPolicy) -> None:
     # make sure that this can be called with cross org queries
     # and nothing raises
     policy.update_quota_balance(tenant_ids, QUERY_ID, None)  # type: ignore
+
+
+@pytest.mark.redis_db
+def test_leased_quota(policy: AllocationPolicy) -> None:
+    reset_leases()
+    _configure_policy(policy)
+    policy.set_config_value("local_lease_bytes", ORG_SCAN_LIMIT // 2)
+    tenant_ids: dict[str, int | str] = {
+        "organization_id": 123,
+        "referrer": "some_referrer",
+    }
+    result = QueryResultOrError(
+        query_result=QueryResult(
+            result={"profile": {"progress_bytes": ORG_SCAN_LIMIT // 4}},
+            extra={"stats": {}, "sql": "", "experiments": {}},
+        ),
+        error=None,
+    )
+
+    with mock.patch.object(
+        _RATE_LIMITER, "check_within_quotas", wraps=_RATE_LIMITER.check_within_quotas
+    ) as check, mock.patch.object(
+        _RATE_LIMITER, "use_quotas", wraps=_RATE_LIMITER.use_quotas
+    ) as use:
+        # The first query leases half of the quota, the second one is
+        # admitted locally. Their usage is reported together once the lease
+        # is used up.
+        for _ in range(2):
+            allowance = policy.get_quota_allowance(tenant_ids, QUERY_ID)
+            assert allowance.max_threads == MAX_THREAD_NUMBER
+            policy.update_quota_balance(tenant_ids, QUERY_ID, result)
+        assert check.call_count == 1
+        assert use.call_count == 1
+        assert use.call_args.kwargs["grants"][0].granted == ORG_SCAN_LIMIT // 2
+
+        # The next lease takes the rest of the quota.
+        for _ in range(2):
+            allowance = policy.get_quota_allowance(tenant_ids, QUERY_ID)
+            assert allowance.max_threads == MAX_THREAD_NUMBER
+            policy.update_quota_balance(tenant_ids, QUERY_ID, result)
+        assert check.call_count == 2
+        assert use.call_count == 2
+
+    allowance = policy.get_quota_allowance(tenant_ids, QUERY_ID)
+    assert allowance.max_threads == THROTTLED_THREAD_NUMBER
+    reset_leases()
@@ -5,6 +5,7 @@ from unittest import mock
 
 import pytest
 
+from snuba import state
 from snuba.datasets.storage import StorageKey
 from snuba.query.allocation_policies import (
     AllocationPolicyViolations,
@@ -14,6 +15,14 @@ from snuba.query.allocation_policies import (
 from snuba.query.allocation_policies.concurrent_rate_limit import (
     ConcurrentRateLimitAllocationPolicy,
 )
+from snuba.state.quota_lease import SlotLeases, reset_leases
+from snuba.state.rate_limit import (
+    COUNTER_BACKEND,
+    RATE_LIMIT_BACKEND_KEY_PREFIX,
+    ZSET_BACKEND,
+    rate_limit_start_requests,
+)
+from snuba.utils.clock import TestingClock
 from snuba.web import QueryException, QueryResult
 
 _RESULT_SUCCESS = QueryResultOrError(
@@ -152,6 +161,109 @@ def test_update_quota_balance(policy: ConcurrentRateLimitAllocationPolicy) -> No
         ).can_run
 
 
+@pytest.mark.redis_db
+def test_leased_slots(policy: ConcurrentRateLimitAllocationPolicy) -> None:
+    reset_leases()
+    policy.set_config_value("local_lease_size", 2)
+    tenant_ids: dict[str, int | str] = {"organization_id": 123}
+
+    with mock.patch(
+        "snuba.query.allocation_policies.concurrent_rate_limit.rate_limit_start_requests",
+        wraps=rate_limit_start_requests,
+    ) as start_requests:
+        # 5 queries fit in 3 leases of 2 slots, the last slot is given back
+        # since it would go over the limit.
+        for i in range(MAX_CONCURRENT_QUERIES):
+            assert policy.get_quota_allowance(tenant_ids, f"abc{i}").can_run
+        assert start_requests.call_count == 3
+        assert not policy.get_quota_allowance(tenant_ids, "rejected").can_run
+
+        # The slot of a finished query is reused without going to redis.
+        policy.update_quota_balance(tenant_ids, "abc4", _RESULT_SUCCESS)
+        start_requests.reset_mock()
+        assert policy.get_quota_allowance(tenant_ids, "abc5").can_run
+        start_requests.assert_not_called()
+        assert not policy.get_quota_allowance(tenant_ids, "rejected").can_run
+
+    for i in (0, 1, 2, 3, 5):
+        policy.update_quota_balance(tenant_ids, f"abc{i}", _RESULT_SUCCESS)
+    reset_leases()
+    # The slots of the replaced leases were given back to redis when their
+    # query finished, only the free slot of the current lease is still held.
+    allowance = policy.get_quota_allowance(tenant_ids, "other_process")
+    assert allowance.can_run
+    assert allowance.quota_used == 2
+    reset_leases()
+
+
+@pytest.mark.redis_db
+def test_leased_slots_expire(policy: ConcurrentRateLimitAllocationPolicy) -> None:
+    policy.set_config_value("local_lease_size", 2)
+    policy.set_config_value("local_lease_ttl_s", 60)
+    policy.set_config_value("max_query_duration_s", 10)
+    tenant_ids: dict[str, int | str] = {"organization_id": 123}
+    clock = TestingClock()
+
+    with mock.patch(
+        "snuba.query.allocation_policies.concurrent_rate_limit.get_slot_leases",
+        return_value=SlotLeases(clock),
+    ):
+        assert policy.get_quota_allowance(tenant_ids, "abc0").can_run
+        # The lease ends after max_query_duration_s rather than
+        # local_lease_ttl_s. The slot of the query and the free slot of the
+        # lease are both given back when the query finishes.
+        clock.sleep(10)
+        policy.update_quota_balance(tenant_ids, "abc0", _RESULT_SUCCESS)
+
+    policy.set_config_value("local_lease_size", 0)
+    allowance = policy.get_quota_allowance(tenant_ids, "other_process")
+    assert allowance.can_run
+    assert allowance.quota_used == 1
+
+
+@pytest.mark.redis_db
+def test_counter_backend_across_periods(
+    policy: ConcurrentRateLimitAllocationPolicy,
+) -> None:
+    state.set_config(
+        f"{RATE_LIMIT_BACKEND_KEY_PREFIX}{policy.rate_limit_name}", COUNTER_BACKEND
+    )
+    policy.set_config_value("max_query_duration_s", 60)
+    tenant_ids: dict[str, int | str] = {"organization_id": 123}
+
+    with mock.patch("time.time", return_value=1050):
+        assert policy.get_quota_allowance(tenant_ids, "old").can_run
+    # The counters are per max_query_duration_s period, the queries started
+    # in different ones.
+    with mock.patch("time.time", return_value=1090):
+        assert policy.get_quota_allowance(tenant_ids, "new").quota_used == 2
+        for query_id in ("old", "new"):
+            policy.update_quota_balance(tenant_ids, query_id, _RESULT_SUCCESS)
+        # Each query gave its slot back to the period it was counted in.
+        assert policy.get_quota_allowance(tenant_ids, "last").quota_used == 1
+
+
+@pytest.mark.redis_db
+def test_backend_changed_during_query(
+    policy: ConcurrentRateLimitAllocationPolicy,
+) -> None:
+    backend_key = f"{RATE_LIMIT_BACKEND_KEY_PREFIX}{policy.rate_limit_name}"
+    tenant_ids: dict[str, int | str] = {"organization_id": 123}
+    for started_with, changed_to in (
+        (COUNTER_BACKEND, ZSET_BACKEND),
+        (ZSET_BACKEND, COUNTER_BACKEND),
+    ):
+        state.set_config(backend_key, started_with)
+        assert policy.get_quota_allowance(tenant_ids, "query").can_run
+        state.set_config(backend_key, changed_to)
+        policy.update_quota_balance(tenant_ids, "query", _RESULT_SUCCESS)
+
+        # The query was finished with the backend it started with.
+        state.set_config(backend_key, started_with)
+        assert policy.get_quota_allowance(tenant_ids, "check").quota_used == 1
+        policy.update_quota_balance(tenant_ids, "check", _RESULT_SUCCESS)
+
+
 def test_tenant_selection(policy: ConcurrentRateLimitAllocationPolicy):
     tenant_ids: dict[str, int | str] = {"organization_id": 123, "project_id": 456}
     assert policy._get_tenant_key_and_value(tenant_ids) == ("project_id", 456)
@@ -0,0 +1,122 @@
+import re
+from functools import partial
+from unittest import mock
+
+import pytest
+
+from snuba import state
+from snuba.datasets.factory import get_dataset
+from snuba.query.expressions import Literal
+from snuba.query.mql.parser import mql_parse_cache, parse_mql_query_body
+from snuba.query.parser.cache import LiteralKind, ParseCache
+from snuba.query.snql.expression_visitor import numeric_literal_value
+from snuba.query.snql.parser import _parse_snql_body, snql_parse_cache
+
+# Pairs of queries with the same shape, the second one is parsed from the
+# template built for the first one.
+SNQL_QUERIES = [
+    pytest.param(
+        "MATCH (events) SELECT count() AS count WHERE project_id = 1",
+        "MATCH (events) SELECT count() AS count WHERE project_id = 2",
+        id="number",
+    ),
+    pytest.param(
+        "MATCH (events) SELECT count() AS count WHERE tags[foo] = 'bar' LIMIT 5",
+        "MATCH (events) SELECT count() AS count WHERE tags[foo] = 'b\\'a[z]' LIMIT 5",
+        id="string and subscript",
+    ),
+    pytest.param(
+        "MATCH (events) SELECT divide(count(), 60), quantile(0.5)(duration) "
+        "BY tags[1] WHERE timestamp >= toDateTime('2024-01-01T00:00:00') "
+        "AND project_id IN tuple(1, 2)",
+        "MATCH (events) SELECT divide(count(), 3600), quantile(0.95)(duration) "
+        "BY tags[1] WHERE timestamp >= toDateTime('2024-03-01T00:00:00') "
+        "AND project_id IN tuple(3, 4)",
+        id="aliases containing literals",
+    ),
+    pytest.param(
+        "MATCH { MATCH (events) SELECT count() AS count BY project_id "
+        "WHERE project_id = 1 } SELECT max(count) AS max_count",
+        "MATCH { MATCH (events) SELECT count() AS count BY project_id "
+        "WHERE project_id = 3 } SELECT max(count) AS max_count",
+        id="subquery",
+    ),
+    pytest.param(
+        "MATCH (e: events) -[grouped]-> (g: groupedmessage) "
+        "SELECT count() AS count WHERE e.project_id = 1 AND g.project_id = 1",
+        "MATCH (e: events) -[grouped]-> (g: groupedmessage) "
+        "SELECT count() AS count WHERE e.project_id = 2 AND g.project_id = 2",
+        id="join",
+    ),
+]
+
+
+@pytest.mark.parametrize("first, second", SNQL_QUERIES)
+@pytest.mark.redis_db
+def test_snql_parse_cache(first: str, second: str) -> None:
+    snql_parse_cache.clear()
+    assert snql_parse_cache.tokenize(first)[0] == snql_parse_cache.tokenize(second)[0]
+
+    assert snql_parse_cache.parse(first, _parse_snql_body) == _parse_snql_body(first)
+    assert len(snql_parse_cache) == 1
+
+    parse = mock.Mock(side_effect=_parse_snql_body)
+    parsed = snql_parse_cache.parse(second, parse)
+    assert parse.call_count == 0
+    assert parsed == _parse_snql_body(second)
+
+    # The queries returned are processed in place, this must not change the
+    # template.
+    parsed.set_limit(1)
+    parsed.set_ast_condition(None)
+    assert snql_parse_cache.parse(second, _parse_snql_body) == _parse_snql_body(second)
+
+
+@pytest.mark.redis_db
+def test_uncacheable_shape() -> None:
+    # This tokenizer does not skip the limit, whose value is not stored in a
+    # Literal node. The shape cannot be parsed from the cache.
+    cache = ParseCache(
+        "test",
+        re.compile(r"(?P<number>[0-9]+)"),
+        {"number": LiteralKind(numeric_literal_value, lambda i: str(9876500 + i))},
+    )
+    parse = mock.Mock(side_effect=_parse_snql_body)
+    for limit in range(1, 4):
+        body = f"MATCH (events) SELECT count() AS count LIMIT {limit}"
+        parsed = cache.parse(body, parse)
+        assert parsed.get_limit() == limit
+    assert len(cache) == 1
+    # The body and the template of the first query, then each body.
+    assert parse.call_count == 4
+
+
+@pytest.mark.redis_db
+def test_parse_cache_disabled() -> None:
+    state.set_config("parse_cache_enabled", 0)
+    snql_parse_cache.clear()
+    body = "MATCH (events) SELECT count() AS count WHERE project_id = 1"
+    assert snql_parse_cache.parse(body, _parse_snql_body) == _parse_snql_body(body)
+    assert len(snql_parse_cache) == 0
+
+
+@pytest.mark.redis_db
+def test_mql_parse_cache() -> None:
+    dataset = get_dataset("generic_metrics")
+    parse = partial(parse_mql_query_body, dataset=dataset)
+    mql_parse_cache.clear()
+
+    queries = [
+        'sum(`d:transactions/duration@millisecond`){status_code:"200"} by transaction',
+        'sum(`d:transactions/duration@millisecond`){status_code:"500"} by transaction',
+        # Wildcards change the condition, they are part of the shape.
+        'sum(`d:transactions/duration@millisecond`){status_code:"5*"} by transaction',
+        'sum(`d:transactions/duration@millisecond`){status_code:["1", "2"]}',
+        'sum(`d:transactions/duration@millisecond`){status_code:["3", "4"]}',
+    ]
+    for body in queries:
+        assert mql_parse_cache.parse(body, parse, "generic_metrics") == parse(body)
+    assert len(mql_parse_cache) == 3
+
+    parsed = mql_parse_cache.parse(queries[1], parse, "generic_metrics")
+    assert Literal(None, "500") in parsed.get_condition()  # type: ignore
@@ -290,6 +290,44 @@ TEST_CASES = [
 ]
 
 
+def test_structural_sharing() -> None:
+    """
+    Ensures the subtrees a transformation does not change are not rebuilt.
+    """
+    unchanged = FunctionCall(None, "f1", (Column(None, "t1", "c1"), Literal(None, 1)))
+    lm = Lambda(None, ("x",), FunctionCall(None, "f2", (Argument(None, "x"),)))
+    curried = CurriedFunctionCall(
+        None, FunctionCall(None, "topK", (Literal(None, 5),)), (lm,)
+    )
+    tags = SubscriptableReference(None, Column(None, None, "tags"), Literal(None, "a"))
+    root = FunctionCall("alias", "and", (unchanged, curried, tags))
+    assert root.transform(lambda e: e) is root
+
+    def replace_tag(e: Expression) -> Expression:
+        if isinstance(e, Literal) and e.value == "a":
+            return Literal(None, "b")
+        return e
+
+    transformed = root.transform(replace_tag)
+    assert isinstance(transformed, FunctionCall)
+    assert transformed.parameters[0] is unchanged
+    assert transformed.parameters[1] is curried
+    assert transformed.parameters[2] == SubscriptableReference(
+        None, Column(None, None, "tags"), Literal(None, "b")
+    )
+
+
+def test_interned_leaves() -> None:
+    assert Column(None, "t1", "c1") is Column(None, "t1", "c1")
+    assert Literal(None, "a") is Literal(None, "a")
+    assert Literal("alias", 1) is not Literal(None, 1)
+    # Equal values which are not formatted the same way.
+    assert Literal(None, 1) is not Literal(None, True)
+    assert Literal(None, True).value is True
+    assert Literal(None, 0.0) is not Literal(None, -0.0)
+    assert repr(Literal(None, -0.0)) == "-0.0"
+
+
 @pytest.mark.parametrize("test_expr,expected_str", TEST_CASES)
 def test_format(test_expr, expected_str) -> None:
     assert repr(test_expr) == expected_str
@@ -0,0 +1,155 @@
+from typing import Sequence
+from unittest import mock
+
+import pytest
+
+from snuba import state
+from snuba.clickhouse.columns import ColumnSet
+from snuba.clickhouse.query import Query
+from snuba.datasets.factory import get_dataset
+from snuba.datasets.storages.storage_key import StorageKey
+from snuba.pipeline.query_pipeline import QueryPipelineResult
+from snuba.pipeline.stages.query_processing import (
+    EntityProcessingStage,
+    StorageProcessingStage,
+)
+from snuba.query import SelectedExpression
+from snuba.query.conditions import binary_condition
+from snuba.query.data_source.simple import Table
+from snuba.query.expressions import Column, Expression, FunctionCall, Literal
+from snuba.query.matchers import Column as ColumnMatch
+from snuba.query.matchers import FunctionCall as FunctionCallMatch
+from snuba.query.matchers import MatchResult, Param, String
+from snuba.query.processors.physical import (
+    ClickhouseQueryProcessor,
+    FusedRewritingProcessor,
+    fuse_processors,
+)
+from snuba.query.processors.physical.mapping_promoter import MappingColumnPromoter
+from snuba.query.processors.physical.prewhere import PrewhereProcessor
+from snuba.query.processors.physical.slice_of_map_optimizer import SliceOfMapOptimizer
+from snuba.query.processors.physical.type_condition_optimizer import (
+    TypeConditionOptimizer,
+)
+from snuba.query.processors.physical.user_column_processor import UserColumnProcessor
+from snuba.query.processors.physical.uuid_column_processor import UUIDColumnProcessor
+from snuba.query.query_settings import HTTPQuerySettings
+from snuba.query.rewriter import Rule, RuleScope, rewrite_query
+from snuba.query.snql.parser import parse_snql_query
+from snuba.utils.metrics.timer import Timer
+
+
+def test_rewrite_query() -> None:
+    query = Query(
+        Table("test", ColumnSet([]), storage_key=StorageKey("test")),
+        selected_columns=[
+            SelectedExpression("a", FunctionCall("a", "f", (Column(None, None, "a"),)))
+        ],
+        condition=binary_condition("equals", Column(None, None, "a"), Literal(None, 1)),
+    )
+
+    def wrap(exp: Expression, _: MatchResult) -> Expression:
+        return FunctionCall(exp.alias, "g", (Column(None, None, "b"),))
+
+    def rename(exp: Expression, match: MatchResult) -> Expression:
+        assert isinstance(exp, FunctionCall)
+        return FunctionCall(exp.alias, f"{match.string('name')}2", exp.parameters)
+
+    rewrite_query(
+        query,
+        [
+            Rule(wrap, Column, ColumnMatch(column_name=String("a"))),
+            # Sees the node returned by the rule before it at the same
+            # position.
+            Rule(rename, FunctionCall, FunctionCallMatch(Param("name", String("g")))),
+            Rule(
+                rename,
+                FunctionCall,
+                FunctionCallMatch(Param("name", String("f"))),
+                scope=RuleScope.NOT_CONDITION,
+            ),
+        ],
+    )
+
+    g2 = FunctionCall(None, "g2", (Column(None, None, "b"),))
+    assert query.get_selected_columns() == [
+        SelectedExpression("a", FunctionCall("a", "f2", (g2,)))
+    ]
+    assert query.get_condition() == binary_condition("equals", g2, Literal(None, 1))
+
+
+def test_fuse_processors() -> None:
+    promoter = MappingColumnPromoter({"tags": {"sentry:user": "user"}})
+    user = UserColumnProcessor()
+    uuid = UUIDColumnProcessor({"event_id"})
+    slice_of_map = SliceOfMapOptimizer()
+    prewhere = PrewhereProcessor([])
+    type_condition = TypeConditionOptimizer()
+
+    processors: Sequence[ClickhouseQueryProcessor] = fuse_processors(
+        [promoter, user, uuid, slice_of_map, prewhere, type_condition]
+    )
+
+    assert len(processors) == 4
+    # The user and uuid processors need the promoted columns.
+    assert processors[0] is promoter
+    fused = processors[1]
+    assert isinstance(fused, FusedRewritingProcessor)
+    assert fused.processors == [user, uuid, slice_of_map]
+    assert processors[2] is prewhere
+    assert processors[3] is type_condition
+
+
+QUERIES = [
+    pytest.param(
+        "MATCH (events) SELECT count() AS count, uniq(user) AS users, "
+        "arraySlice(hierarchical_hashes, 0, 2) AS hashes, tags[sentry:user] "
+        "BY group_id, contexts[device.charging] WHERE project_id = 1 AND "
+        "timestamp >= toDateTime('2024-01-01T00:00:00') AND timestamp < "
+        "toDateTime('2024-01-02T00:00:00') AND type != 'transaction' AND "
+        "event_id = 'a7d67cf796774551a95be6543cacd459' AND "
+        "trace_id IN tuple('a7d67cf796774551a95be6543cacd459') LIMIT 10",
+        id="errors",
+    ),
+    pytest.param(
+        "MATCH (transactions) SELECT count() AS count, event_id, "
+        "contexts[device.charging], tags[foo] BY transaction WHERE "
+        "project_id = 1 AND finish_ts >= toDateTime('2024-01-01T00:00:00') "
+        "AND finish_ts < toDateTime('2024-01-02T00:00:00') AND "
+        "event_id = 'a7d67cf796774551a95be6543cacd459' AND span_id = 'abcdef0123456789' LIMIT 10",
+        id="transactions",
+    ),
+]
+
+
+@pytest.mark.parametrize("body", QUERIES)
+@pytest.mark.redis_db
+def test_fused_storage_processors(body: str) -> None:
+    def process() -> Query:
+        query = parse_snql_query(body, get_dataset("discover"))
+        query_settings = HTTPQuerySettings(referrer="test")
+        result = StorageProcessingStage().execute(
+            EntityProcessingStage().execute(
+                QueryPipelineResult(
+                    data=mock.Mock(query=query),
+                    query_settings=query_settings,
+                    timer=Timer("test"),
+                    error=None,
+                )
+            )
+        )
+        assert result.error is None
+        assert isinstance(result.data, Query)
+        return result.data
+
+    state.set_config("fused_query_processors_enabled", 0)
+    expected = process()
+    state.set_config("fused_query_processors_enabled", 1)
+    with mock.patch.object(
+        FusedRewritingProcessor,
+        "process_query",
+        side_effect=FusedRewritingProcessor.process_query,
+        autospec=True,
+    ) as fused:
+        assert process() == expected
+        assert fused.call_count >= 1
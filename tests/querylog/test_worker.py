@@ -0,0 +1,140 @@
+import threading
+from functools import partial
+from typing import Callable, List
+from unittest import mock
+
+from snuba import querylog, settings
+from snuba.querylog.query_metadata import (
+    ClickhouseQueryMetadata,
+    ClickhouseQueryProfile,
+    FilterProfile,
+    QueryStatus,
+    get_request_status,
+)
+from snuba.querylog.worker import QuerylogWorker
+
+
+def test_worker_runs_tasks() -> None:
+    worker = QuerylogWorker(10)
+    done: List[int] = []
+    for i in range(5):
+        assert worker.submit(partial(done.append, i))
+    assert worker.flush(5.0)
+    assert done == [0, 1, 2, 3, 4]
+    assert worker.dropped == 0
+
+
+def test_worker_drops_tasks_when_full() -> None:
+    worker = QuerylogWorker(2)
+    blocked = threading.Event()
+    release = threading.Event()
+
+    def block() -> None:
+        blocked.set()
+        release.wait(5.0)
+
+    done: List[int] = []
+    assert worker.submit(block)
+    assert blocked.wait(5.0)
+    assert worker.submit(lambda: done.append(1))
+    assert worker.submit(lambda: done.append(2))
+    assert not worker.submit(lambda: done.append(3))
+    assert worker.dropped == 1
+    assert not worker.flush(0.01)
+
+    release.set()
+    assert worker.flush(5.0)
+    assert done == [1, 2]
+
+
+def test_worker_survives_failing_tasks() -> None:
+    worker = QuerylogWorker(10)
+    done: List[int] = []
+
+    def fail() -> None:
+        raise ValueError("failed")
+
+    worker.submit(fail)
+    worker.submit(lambda: done.append(1))
+    assert worker.flush(5.0)
+    assert done == [1]
+
+
+def test_record_failure_on_worker() -> None:
+    timer = mock.Mock()
+    with mock.patch.object(
+        settings, "QUERYLOG_WORKER_QUEUE_SIZE", 10
+    ), mock.patch.object(settings, "RECORD_QUERIES", True), mock.patch(
+        "snuba.state.record_query"
+    ) as record_query, mock.patch(
+        "snuba.state.flush_producer"
+    ) as flush_producer:
+        querylog.record_invalid_request(
+            request_id="a" * 32,
+            body={"query": "MATCH"},
+            dataset="events",
+            organization=1,
+            timer=timer,
+            request_status=get_request_status(),
+            referrer="test",
+        )
+        querylog.flush(5.0)
+        record_query.assert_called_once()
+        assert record_query.call_args[0][0]["request"]["id"] == "a" * 32
+        flush_producer.assert_called_once()
+
+
+def test_flush_is_bounded() -> None:
+    blocked = threading.Event()
+    release = threading.Event()
+
+    def block() -> None:
+        blocked.set()
+        release.wait(5.0)
+
+    with mock.patch.object(
+        settings, "QUERYLOG_WORKER_QUEUE_SIZE", 10
+    ), mock.patch.object(querylog, "_worker", QuerylogWorker(10)), mock.patch(
+        "snuba.state.flush_producer"
+    ) as flush_producer, mock.patch.object(
+        querylog.logger, "warning"
+    ) as warning:
+        querylog._submit(block)
+        querylog._submit(lambda: None)
+        assert blocked.wait(5.0)
+
+        # The stuck worker does not block the shutdown, the queries it did not
+        # record are reported.
+        querylog.flush(0.1)
+        assert warning.call_args[0][2] == 2
+        flush_producer.assert_called_once()
+        assert 0 <= flush_producer.call_args[0][0] <= 0.1
+        release.set()
+
+
+def test_clickhouse_query_metadata_eq_and_repr() -> None:
+    def build(sql_anonymized: Callable[[], str]) -> ClickhouseQueryMetadata:
+        return ClickhouseQueryMetadata(
+            sql="select 1",
+            sql_anonymized=sql_anonymized,
+            start_timestamp=None,
+            end_timestamp=None,
+            stats={},
+            status=QueryStatus.SUCCESS,
+            request_status=get_request_status(),
+            profile=ClickhouseQueryProfile(
+                time_range=None,
+                table="events",
+                all_columns=set(),
+                multi_level_condition=False,
+                where_profile=FilterProfile(columns=set(), mapping_cols=set()),
+                groupby_cols=set(),
+                array_join_cols=set(),
+            ),
+            trace_id="a" * 32,
+        )
+
+    # The lazy values are computed to compare and print the metadata.
+    assert build(lambda: "select $I") == build(lambda: "select $I")
+    assert build(lambda: "select $I") != build(lambda: "select $S")
+    assert "sql_anonymized='select $I'" in repr(build(lambda: "select $I"))
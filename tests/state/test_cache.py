@@ -14,8 +14,8 @@ from sentry_redis_tools.failover_redis import FailoverRedis
 from redis.exceptions import ReadOnlyError
 from snuba.redis import RedisClientKey, get_redis_client
 from snuba.state import set_config
-from snuba.state.cache.abstract import Cache
-from snuba.state.cache.redis.backend import RedisCache
+from snuba.state.cache.abstract import Cache, ExecutionTimeoutError
+from snuba.state.cache.redis.backend import RESULT_EXECUTE, RESULT_WAIT, RedisCache
 from snuba.utils.codecs import ExceptionAwareCodec
 from snuba.utils.serializable_exception import (
     SerializableException,
@@ -247,3 +247,135 @@ def test_transient_error(backend: Cache[bytes]) -> None:
         setter.result()
 
     assert waiter.result() == b"hello"
+
+
+@pytest.mark.redis_db
+def test_single_flight_in_process(backend: Cache[bytes]) -> None:
+    set_config("read_through_cache.single_flight", 1)
+    key = "key"
+
+    def slow_function() -> bytes:
+        time.sleep(0.5)
+        return f"{random.random()}".encode("utf-8")
+
+    function = mock.MagicMock(side_effect=slow_function)
+    hit_types: list[int] = []
+
+    futures = [
+        execute(lambda: backend.get_readthrough(key, function, hit_types.append))
+        for _ in range(5)
+    ]
+    results = {future.result() for future in futures}
+
+    assert len(results) == 1
+    assert function.call_count == 1
+    assert hit_types.count(RESULT_EXECUTE) == 1
+    assert hit_types.count(RESULT_WAIT) == 4
+
+
+@pytest.mark.redis_db
+def test_single_flight_across_clients() -> None:
+    set_config("read_through_cache.single_flight", 1)
+    key = "key"
+    # Two caches simulate two different processes sharing the same redis.
+    setter_backend = RedisCache(redis_client, "test", PassthroughCodec())
+    waiter_backend = RedisCache(redis_client, "test", PassthroughCodec())
+
+    def function() -> bytes:
+        time.sleep(1)
+        return f"{random.random()}".encode("utf-8")
+
+    def never_called() -> bytes:
+        raise Exception("The waiter should not execute the function")
+
+    setter = execute(lambda: setter_backend.get_readthrough(key, function, noop))
+    time.sleep(0.2)
+    waiter = execute(lambda: waiter_backend.get_readthrough(key, never_called, noop))
+
+    assert setter.result() == waiter.result()
+
+
+@pytest.mark.redis_db
+def test_single_flight_error() -> None:
+    set_config("read_through_cache.single_flight", 1)
+    key = "key"
+    setter_backend = RedisCache(redis_client, "test", PassthroughCodec())
+    waiter_backend = RedisCache(redis_client, "test", PassthroughCodec())
+
+    class SingleFlightCustomException(SerializableException):
+        pass
+
+    def function() -> bytes:
+        time.sleep(0.5)
+        raise SingleFlightCustomException("error")
+
+    setter = execute(
+        lambda: setter_backend.get_readthrough(key, SingleCallFunction(function), noop)
+    )
+    time.sleep(0.1)
+    waiter = execute(
+        lambda: waiter_backend.get_readthrough(key, SingleCallFunction(function), noop)
+    )
+
+    with pytest.raises(SingleFlightCustomException):
+        setter.result()
+    with pytest.raises(SingleFlightCustomException):
+        waiter.result()
+
+    # Errors are not cached, the next caller executes the function again.
+    assert setter_backend.get_readthrough(key, lambda: b"value", noop) == b"value"
+
+
+@pytest.mark.redis_db
+def test_single_flight_ignores_previous_execution() -> None:
+    set_config("read_through_cache.single_flight", 1)
+    key = "key"
+    setter_backend = RedisCache(redis_client, "test", PassthroughCodec())
+    waiter_backend = RedisCache(redis_client, "test", PassthroughCodec())
+
+    class SingleFlightCustomException(SerializableException):
+        pass
+
+    def failing_function() -> bytes:
+        raise SingleFlightCustomException("error")
+
+    # The error of this execution stays in Redis for a while.
+    with pytest.raises(SingleFlightCustomException):
+        setter_backend.get_readthrough(key, failing_function, noop)
+
+    def slow_function() -> bytes:
+        time.sleep(0.5)
+        return b"value"
+
+    function = mock.MagicMock(side_effect=slow_function)
+    setter = execute(lambda: setter_backend.get_readthrough(key, function, noop))
+    time.sleep(0.1)
+    waiter = execute(lambda: waiter_backend.get_readthrough(key, function, noop))
+
+    # The waiter gets the outcome of the execution it waited on.
+    assert setter.result() == b"value"
+    assert waiter.result() == b"value"
+    assert function.call_count == 1
+
+
+@pytest.mark.redis_db
+def test_single_flight_timeout() -> None:
+    set_config("read_through_cache.single_flight", 1)
+    set_config("read_through_cache.single_flight_timeout_sec", 1)
+    key = "key"
+    setter_backend = RedisCache(redis_client, "test", PassthroughCodec())
+    waiter_backend = RedisCache(redis_client, "test", PassthroughCodec())
+
+    def function() -> bytes:
+        time.sleep(2)
+        return b"value"
+
+    setter = execute(lambda: setter_backend.get_readthrough(key, function, noop))
+    time.sleep(0.1)
+    waiter = execute(lambda: waiter_backend.get_readthrough(key, function, noop))
+
+    with pytest.raises(ExecutionTimeoutError):
+        waiter.result()
+    with pytest.raises(TimeoutError):
+        setter.result()
+    assert setter_backend.get(key) is None
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import time
+from typing import Any, Callable, Dict, MutableSequence
+from unittest import mock
+
+import pytest
+
+from snuba import state
+from snuba.redis import RedisClientKey, get_redis_client
+from snuba.state.config_snapshot import (
+    ConfigSnapshot,
+    ConfigSnapshotStore,
+    get_version_key,
+)
+from snuba.utils.clock import TestingClock
+
+redis_client = get_redis_client(RedisClientKey.CONFIG)
+
+CONFIG_KEY = "test-snapshot-config"
+
+
+def test_prefix_index() -> None:
+    snapshot = ConfigSnapshot(
+        {
+            "query_settings/max_threads": 10,
+            "referrer/api/query_settings/max_threads": 4,
+            "referrer/api/query_settings/timeout/ms": 100,
+            "referrer/other/query_settings/max_threads": 2,
+            "enable_something": 1,
+        },
+        version=1,
+        generation=0,
+        loaded_at=0.0,
+    )
+    assert snapshot["enable_something"] == 1
+    assert snapshot.get("missing", 5) == 5
+    assert snapshot.with_prefix("query_settings/") == {"max_threads": 10}
+    assert snapshot.with_prefix("referrer/api/query_settings/") == {
+        "max_threads": 4,
+        "timeout/ms": 100,
+    }
+    assert snapshot.with_prefix("referrer/missing/query_settings/") == {}
+    assert snapshot.with_prefix("enable_") == {"something": 1}
+
+
+def test_fingerprint() -> None:
+    def build(values: Dict[str, Any], version: int) -> ConfigSnapshot:
+        return ConfigSnapshot(values, version=version, generation=0, loaded_at=0.0)
+
+    fingerprint = build({"a": 1, "b": "x"}, 1).fingerprint
+    assert build({"b": "x", "a": 1}, 2).fingerprint == fingerprint
+    assert build({"a": 2, "b": "x"}, 1).fingerprint != fingerprint
+    assert build({"a": "1", "b": "x"}, 1).fingerprint != fingerprint
+
+
+def build_store(
+    clock: TestingClock, push_invalidation: bool = False
+) -> tuple[ConfigSnapshotStore, MutableSequence[str]]:
+    loads: MutableSequence[str] = []
+
+    def load(config_key: str) -> Dict[str, Any]:
+        loads.append(config_key)
+        return {
+            k.decode("utf-8"): v.decode("utf-8")
+            for k, v in redis_client.hgetall(config_key).items()
+        }
+
+    store = ConfigSnapshotStore(
+        redis_client,
+        load,
+        refresh_interval=10,
+        max_age=100,
+        push_invalidation=push_invalidation,
+        clock=clock,
+    )
+    return store, loads
+
+
+def set_value(key: str, value: str) -> None:
+    p = redis_client.pipeline()
+    p.hset(CONFIG_KEY, key, value)
+    p.incr(get_version_key(CONFIG_KEY))
+    p.execute()
+
+
+@pytest.mark.redis_db
+def test_version_polling() -> None:
+    clock = TestingClock()
+    store, loads = build_store(clock)
+    set_value("foo", "1")
+
+    assert store.get(CONFIG_KEY) == {"foo": "1"}
+    set_value("foo", "2")
+    clock.sleep(5)
+    assert store.get(CONFIG_KEY) == {"foo": "1"}
+    assert len(loads) == 1
+
+    # The version changed, the configs are reloaded.
+    clock.sleep(5)
+    assert store.get(CONFIG_KEY) == {"foo": "2"}
+    assert len(loads) == 2
+
+    # Same version, only the version counter is read.
+    clock.sleep(10)
+    assert store.get(CONFIG_KEY) == {"foo": "2"}
+    assert len(loads) == 2
+
+    # Changes are picked up right away by the process that made them.
+    set_value("foo", "3")
+    store.notify_change(CONFIG_KEY)
+    assert store.get(CONFIG_KEY) == {"foo": "3"}
+
+    # Snapshots are reloaded after max_age even if nothing changed.
+    clock.sleep(100)
+    store.get(CONFIG_KEY)
+    assert len(loads) == 4
+
+
+@pytest.mark.redis_db
+def test_push_invalidation() -> None:
+    clock = TestingClock()
+    store, loads = build_store(clock, push_invalidation=True)
+    other, _ = build_store(clock)
+    set_value("foo", "1")
+
+    with mock.patch("threading.Thread.start") as start:
+        assert store.get(CONFIG_KEY) == {"foo": "1"}
+        start.assert_called_once()
+
+    # Pretend the listener thread subscribed to the changes channel.
+    with mock.patch.object(store, "_ConfigSnapshotStore__listening", True):
+        set_value("foo", "2")
+        with mock.patch.object(redis_client, "publish") as publish:
+            other.notify_change(CONFIG_KEY)
+        publish.assert_called_once()
+        # What the listener thread does when it receives the message.
+        store.invalidate(publish.call_args[0][1])
+        assert store.get(CONFIG_KEY) == {"foo": "2"}
+    assert len(loads) == 2
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 5.0) -> None:
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.mark.redis_db
+def test_push_invalidation_listener() -> None:
+    clock = TestingClock()
+    store, _ = build_store(clock, push_invalidation=True)
+    other, _ = build_store(clock)
+    set_value("foo", "1")
+
+    # Starts the listener thread.
+    assert store.get(CONFIG_KEY) == {"foo": "1"}
+    wait_for(lambda: bool(getattr(store, "_ConfigSnapshotStore__listening")))
+    store.get(CONFIG_KEY)
+
+    # The change is published by another process, and picked up by the
+    # listener before the version is polled again.
+    set_value("foo", "2")
+    other.notify_change(CONFIG_KEY)
+    wait_for(lambda: store.get(CONFIG_KEY) == {"foo": "2"})
+
+
+@pytest.mark.redis_db
+def test_version_polling_while_listening() -> None:
+    clock = TestingClock()
+    store, loads = build_store(clock, push_invalidation=True)
+    set_value("foo", "1")
+
+    with mock.patch("threading.Thread.start"):
+        assert store.get(CONFIG_KEY) == {"foo": "1"}
+
+    # The listener thinks it is subscribed, but the subscription died
+    # silently and the change is never received.
+    with mock.patch.object(store, "_ConfigSnapshotStore__listening", True):
+        set_value("foo", "2")
+        clock.sleep(5)
+        assert store.get(CONFIG_KEY) == {"foo": "1"}
+
+        # The version is still polled, which bounds how stale it can be.
+        clock.sleep(5)
+        assert store.get(CONFIG_KEY) == {"foo": "2"}
+    assert len(loads) == 2
+
+
+@pytest.mark.redis_db
+def test_get_configs_with_prefix() -> None:
+    state.set_config("query_settings/max_threads", 10)
+    state.set_config("referrer/api/query_settings/max_threads", 4)
+    assert state.get_configs_with_prefix("query_settings/") == {"max_threads": 10}
+    assert state.get_configs_with_prefix("referrer/api/query_settings/") == {
+        "max_threads": 4
+    }
+    assert state.get_configs_with_prefix("referrer/other/query_settings/") == {}
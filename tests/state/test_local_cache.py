@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, MutableSequence
+from unittest import mock
+
+import pytest
+
+from snuba.redis import RedisClientKey, get_redis_client
+from snuba.state import set_config
+from snuba.state.cache.local.backend import RESULT_LOCAL_VALUE, LocalCache
+from snuba.state.cache.redis.backend import RESULT_VALUE, RedisCache
+from snuba.utils.clock import TestingClock
+from tests.state.test_cache import PassthroughCodec
+
+redis_client = get_redis_client(RedisClientKey.CACHE)
+
+
+def build_cache(clock: TestingClock, max_size_bytes: int = 100) -> LocalCache[bytes]:
+    return LocalCache(
+        RedisCache(redis_client, "test-local", PassthroughCodec()),
+        "test",
+        max_size_bytes=max_size_bytes,
+        max_entry_size_bytes=20,
+        sizeof=len,
+        copy=lambda value: value,
+        clock=clock,
+    )
+
+
+def recorder() -> tuple[MutableSequence[int], Callable[[int], None]]:
+    hit_types: List[int] = []
+    return hit_types, hit_types.append
+
+
+@pytest.mark.redis_db
+def test_disabled_by_default() -> None:
+    cache = build_cache(TestingClock())
+    function = mock.MagicMock(return_value=b"value")
+    hit_types, record = recorder()
+
+    assert cache.get_readthrough("key", function, record) == b"value"
+    redis_client.delete("test-local{key}")
+    assert cache.get_readthrough("key", function, record) == b"value"
+    assert function.call_count == 2
+    assert RESULT_LOCAL_VALUE not in hit_types
+    assert cache.size_bytes == 0
+
+
+@pytest.mark.redis_db
+def test_local_hit_skips_redis() -> None:
+    set_config("local_cache.enabled", 1)
+    set_config("cache_expiry_sec", 10)
+    clock = TestingClock()
+    cache = build_cache(clock)
+    function = mock.MagicMock(return_value=b"value")
+    hit_types, record = recorder()
+
+    assert cache.get_readthrough("key", function, record) == b"value"
+    assert cache.size_bytes == len(b"value")
+
+    # Values are served from memory even if redis lost the key.
+    redis_client.delete("test-local{key}")
+    assert cache.get_readthrough("key", function, record) == b"value"
+    assert function.call_count == 1
+    assert hit_types[-1] == RESULT_LOCAL_VALUE
+
+    # The local tier never outlives the redis expiry.
+    clock.sleep(10)
+    assert cache.get_readthrough("key", function, record) == b"value"
+    assert function.call_count == 2
+    assert hit_types[-1] != RESULT_LOCAL_VALUE
+
+
+@pytest.mark.redis_db
+def test_local_ttl_override() -> None:
+    set_config("local_cache.enabled", 1)
+    set_config("cache_expiry_sec", 10)
+    set_config("local_cache.ttl_sec", 1)
+    clock = TestingClock()
+    cache = build_cache(clock)
+    function = mock.MagicMock(return_value=b"value")
+    hit_types, record = recorder()
+
+    cache.get_readthrough("key", function, record)
+    clock.sleep(1)
+    cache.get_readthrough("key", function, record)
+    # Expired locally, but still in redis.
+    assert hit_types[-1] == RESULT_VALUE
+    assert function.call_count == 1
+
+
+@pytest.mark.redis_db
+def test_local_ttl_bounded_by_redis_ttl() -> None:
+    set_config("local_cache.enabled", 1)
+    set_config("cache_expiry_sec", 10)
+    clock = TestingClock()
+    cache = build_cache(clock)
+    function = mock.MagicMock(return_value=b"value")
+    hit_types, record = recorder()
+
+    # The value written to redis a while ago is about to expire there.
+    redis_client.set("test-local{key}", b"value", px=2000)
+    cache.get_readthrough("key", function, record)
+    assert hit_types[-1] == RESULT_VALUE
+    cache.get_readthrough("key", function, record)
+    assert hit_types[-1] == RESULT_LOCAL_VALUE
+
+    # It is not served locally past its expiry in redis.
+    clock.sleep(2)
+    cache.get_readthrough("key", function, record)
+    assert hit_types[-1] != RESULT_LOCAL_VALUE
+
+
+@pytest.mark.redis_db
+def test_size_bounds() -> None:
+    set_config("local_cache.enabled", 1)
+    set_config("cache_expiry_sec", 10)
+    cache = build_cache(TestingClock(), max_size_bytes=30)
+    values: Dict[str, Any] = {
+        "a": b"x" * 10,
+        "b": b"y" * 10,
+        "c": b"z" * 10,
+        "d": b"w" * 10,
+        "big": b"v" * 25,
+    }
+    _, record = recorder()
+
+    for key in ["a", "b", "c"]:
+        cache.get_readthrough(key, lambda: values[key], record)
+    assert cache.size_bytes == 30
+
+    # Touch "a" so that "b" is the least recently used entry.
+    cache.get_readthrough("a", mock.MagicMock(), record)
+    cache.get_readthrough("d", lambda: values["d"], record)
+    assert cache.size_bytes == 30
+
+    hit_types, record = recorder()
+    redis_client.flushdb()
+    set_config("local_cache.enabled", 1)
+    set_config("cache_expiry_sec", 10)
+    for key in ["a", "c", "d"]:
+        cache.get_readthrough(key, mock.MagicMock(), record)
+    assert hit_types == [RESULT_LOCAL_VALUE] * 3
+
+    function = mock.MagicMock(return_value=b"y" * 10)
+    cache.get_readthrough("b", function, record)
+    assert function.call_count == 1
+
+    # Entries larger than the entry limit are never stored locally.
+    size = cache.size_bytes
+    cache.get_readthrough("big", lambda: values["big"], record)
+    assert cache.size_bytes == size
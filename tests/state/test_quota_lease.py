@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from snuba.state.quota_lease import (
+    BudgetLeases,
+    LeasedSlots,
+    SlotLeases,
+    StartedRequests,
+)
+from snuba.utils.clock import TestingClock
+
+
+def test_slot_leases() -> None:
+    clock = TestingClock()
+    leases = SlotLeases(clock)
+    assert leases.acquire("bucket", "q1") is None
+
+    assert leases.add("bucket", ["s1", "s2"], 10, 3, 0.0, "zset") is None
+    assert leases.acquire("bucket", "q1") == 3
+    assert leases.acquire("bucket", "q2") == 3
+    # Every slot is in use.
+    assert leases.acquire("bucket", "q3") is None
+
+    # The slot goes back to the lease.
+    assert leases.release("q1") == ("bucket", None)
+    assert leases.acquire("bucket", "q3") == 3
+    assert leases.release("unknown") == (None, None)
+
+    # Once the lease expired, slots have to be given back to the shared quota.
+    clock.sleep(10)
+    assert leases.acquire("bucket", "q4") is None
+    bucket, released = leases.release("q2")
+    assert bucket == "bucket"
+    assert released is not None and released.slots[0] in ("s1", "s2")
+    assert released.started_at == 0.0 and released.backend == "zset"
+    assert leases.collect_expired() == []
+
+    leases.add("bucket", ["s3", "s4"], 10, 0, 10.0, "counter")
+    assert leases.acquire("bucket", "q5") == 0
+    clock.sleep(10)
+    assert leases.collect_expired() == [
+        ("bucket", LeasedSlots(["s3"], 10.0, "counter"))
+    ]
+
+
+def test_slot_leases_replaced() -> None:
+    leases = SlotLeases(TestingClock())
+    leases.add("bucket", ["s1", "s2"], 10, 0, 0.0, "zset")
+    assert leases.acquire("bucket", "q1") == 0
+    assert leases.add("bucket", ["s3"], 10, 1, 5.0, "zset") == LeasedSlots(
+        ["s1"], 0.0, "zset"
+    )
+    # The slot of a replaced lease is not reused, it is given back with the
+    # start of the lease it was registered with.
+    assert leases.release("q1") == ("bucket", LeasedSlots(["s2"], 0.0, "zset"))
+
+
+def test_started_requests() -> None:
+    clock = TestingClock()
+    requests = StartedRequests(clock)
+    requests.add("q1", 0.0, "counter", max_age=60)
+    clock.sleep(30)
+    requests.add("q2", 30.0, "zset", max_age=60)
+    assert requests.pop("q1") == (0.0, "counter")
+    assert requests.pop("q1") == (None, None)
+
+    # Queries that never finish are forgotten with the rate limit.
+    requests.add("q3", 30.0, "zset", max_age=60)
+    clock.sleep(60)
+    requests.add("q4", 90.0, "zset", max_age=60)
+    assert requests.pop("q2") == (None, None)
+    assert requests.pop("q4") == (90.0, "zset")
+
+
+def test_budget_leases() -> None:
+    clock = TestingClock()
+    leases = BudgetLeases(clock)
+    assert leases.admit("org") is None
+    assert not leases.consume("org", 10)
+
+    assert leases.grant("org", budget=100, ttl=10) == 0
+    assert leases.admit("org") == 100
+    assert leases.consume("org", 60)
+    assert leases.admit("org") == 40
+    assert leases.collect_pending() == []
+
+    # Used up, the usage is reported and the quota has to be checked again.
+    assert leases.consume("org", 60)
+    assert leases.admit("org") is None
+    assert leases.collect_pending() == [("org", 120)]
+    assert leases.collect_pending() == []
+
+    # Usage held back by an expired lease is reported.
+    leases.grant("org", budget=100, ttl=10)
+    leases.consume("org", 5)
+    clock.sleep(10)
+    assert leases.admit("org") is None
+    assert leases.collect_pending() == [("org", 5)]
+    assert not leases.consume("org", 5)
+
+    # Replacing a lease hands its unreported usage over.
+    leases.grant("org", budget=100, ttl=10)
+    leases.consume("org", 7)
+    assert leases.grant("org", budget=100, ttl=10) == 7
@@ -9,6 +9,7 @@ import pytest
 
 from snuba import state
 from snuba.redis import RedisClientKey, get_redis_client
+from snuba.state import rate_limit as rate_limit_module
 from snuba.state.rate_limit import (
     RateLimitAggregator,
     RateLimitExceeded,
@@ -261,6 +262,40 @@ def test_rate_limit_failures(
         assert count == 0
 
 
+@pytest.mark.redis_db
+def test_rate_limit_aggregator_round_trips(
+    rate_limit_shards: Any, use_transaction_pipe: Any
+) -> None:
+    params = [
+        RateLimitParameters("organization", "org-1", 100, 10),
+        RateLimitParameters("project", "project-1", 100, 10),
+        RateLimitParameters("referrer", "api", None, 10),
+    ]
+    pipeline = rate_limit_module.rds.pipeline
+    with patch.object(
+        rate_limit_module.rds, "pipeline", side_effect=pipeline
+    ) as mock_pipeline:
+        with RateLimitAggregator(params) as stats:
+            assert mock_pipeline.call_count == 1
+            for p in params:
+                assert stats.get_stats(p.rate_limit_name) == RateLimitStats(
+                    rate=0.0, concurrent=1
+                )
+        assert mock_pipeline.call_count == 2
+
+    now = time.time()
+    for p in params:
+        bucket = "{}{}".format(state.ratelimit_prefix, p.bucket)
+        shards = [bucket] + [
+            f"{bucket}:shard-{i}"
+            for i in range(1, state.get_int_config("rate_limit_shard_factor") or 1)
+        ]
+        rds = get_redis_client(RedisClientKey.RATE_LIMITER)
+        # The query was moved back to its start time.
+        assert sum(rds.zcount(b, now - 10, now) for b in shards) == 1
+        assert sum(rds.zcount(b, f"({now}", "+inf") for b in shards) == 0
+
+
 @pytest.mark.redis_db
 def test_rate_limit_interface() -> None:
     ps_key = "project_per_second_limit_36"
@@ -271,3 +306,138 @@ def test_rate_limit_interface() -> None:
 
     assert state.get_uncached_config(ps_key) == 23
     assert state.get_uncached_config(ct_key) == 46
+
+
+@pytest.mark.redis_db
+def test_counter_backend_concurrent_limit(use_transaction_pipe: Any) -> None:
+    state.set_config("rate_limit_backend_foo", rate_limit_module.COUNTER_BACKEND)
+    rate_limit_params = RateLimitParameters("foo", "bar", None, 1)
+
+    with rate_limit(rate_limit_params) as stats:
+        assert stats == RateLimitStats(rate=0.0, concurrent=1)
+        with pytest.raises(RateLimitExceeded):
+            with rate_limit(rate_limit_params):
+                pass
+
+    # Every lease was given back, including the one of the query that was
+    # rejected.
+    with rate_limit(rate_limit_params) as stats:
+        assert stats == RateLimitStats(rate=0.0, concurrent=1)
+
+    with pytest.raises(RateLimitExceeded):
+        with rate_limit(rate_limit_params):
+            raise RateLimitExceeded("stuff")  # simulate an inner rate limiter failing
+
+    with RateLimitAggregator([rate_limit_params]) as container:
+        assert container.get_stats("foo") == RateLimitStats(rate=0.0, concurrent=1)
+
+    # The sorted set is not used.
+    rds = get_redis_client(RedisClientKey.RATE_LIMITER)
+    assert rds.exists(f"{state.ratelimit_prefix}bar") == 0
+
+
+@pytest.mark.redis_db
+def test_counter_backend_per_second_limit() -> None:
+    state.set_config("rate_limit_backend_foo", rate_limit_module.COUNTER_BACKEND)
+    bucket = uuid.uuid4()
+    rate_limit_params = RateLimitParameters("foo", str(bucket), 1, None)
+    # The 60 seconds of the lookback window at 1 query per second allow for a
+    # burst of 60 queries.
+    with patch.object(state.time, "time", lambda: 0):  # type: ignore
+        for i in range(60):
+            with rate_limit(rate_limit_params) as stats:
+                assert stats is not None
+                assert stats.rate == pytest.approx((i + 1) / 60)
+
+        with pytest.raises(RateLimitExceeded):
+            with rate_limit(rate_limit_params):
+                pass
+
+    # The query that was rejected did not use any of the budget, which comes
+    # back at 1 query per second.
+    with patch.object(state.time, "time", lambda: 1):  # type: ignore
+        with rate_limit(rate_limit_params) as stats:
+            assert stats is not None
+            assert stats.rate == pytest.approx(1.0)
+
+        with pytest.raises(RateLimitExceeded):
+            with rate_limit(rate_limit_params):
+                pass
+
+
+@pytest.mark.redis_db
+@pytest.mark.parametrize(
+    "started_with, changed_to",
+    [
+        (rate_limit_module.COUNTER_BACKEND, rate_limit_module.ZSET_BACKEND),
+        (rate_limit_module.ZSET_BACKEND, rate_limit_module.COUNTER_BACKEND),
+    ],
+)
+def test_backend_changed_during_request(started_with: str, changed_to: str) -> None:
+    rate_limit_params = RateLimitParameters("foo", "bar", None, 1)
+    state.set_config("rate_limit_backend_foo", started_with)
+    with rate_limit(rate_limit_params):
+        state.set_config("rate_limit_backend_foo", changed_to)
+
+    state.set_config("rate_limit_backend_foo", started_with)
+    with RateLimitAggregator([rate_limit_params]):
+        state.set_config("rate_limit_backend_foo", changed_to)
+
+    # Requests are finished with the backend they were started with, so the
+    # queries are not counted as running anymore.
+    state.set_config("rate_limit_backend_foo", started_with)
+    with rate_limit(rate_limit_params) as stats:
+        assert stats == RateLimitStats(rate=0.0, concurrent=1)
+
+
+@pytest.mark.redis_db
+def test_counter_backend_leaked_lease() -> None:
+    state.set_config("rate_limit_backend_foo", rate_limit_module.COUNTER_BACKEND)
+    params = RateLimitParameters("foo", str(uuid.uuid4()), None, 10)
+
+    def start(now: float) -> RateLimitStats:
+        return rate_limit_module.rate_limit_start_request(
+            params, str(uuid.uuid4()), 3600, 1, "leaks:", 60, now
+        )
+
+    # A query that never finishes.
+    start(1020)
+    assert start(1030).concurrent == 2
+    # It is still counted in the next period.
+    assert start(1090).concurrent == 3
+    # But not after that. The query started at 1090 still is.
+    assert start(1150).concurrent == 2
+
+    # A query finishing in a later period gives back the lease of the period
+    # it started in.
+    rate_limit_module.rate_limit_finish_request(
+        params, "query", 1, False, "leaks:", 60, started_at=1090
+    )
+    assert start(1151).concurrent == 2
+
+
+@pytest.mark.redis_db
+def test_counter_backend_aggregator_round_trips(use_transaction_pipe: Any) -> None:
+    state.set_config(
+        "rate_limit_backend_organization", rate_limit_module.COUNTER_BACKEND
+    )
+    params = [
+        RateLimitParameters("organization", "org-1", 100, 10),
+        RateLimitParameters("project", "project-1", 100, 10),
+        RateLimitParameters("referrer", "api", None, 0),
+    ]
+    pipeline = rate_limit_module.rds.pipeline
+    with patch.object(
+        rate_limit_module.rds, "pipeline", side_effect=pipeline
+    ) as mock_pipeline:
+        with pytest.raises(RateLimitExceeded):
+            with RateLimitAggregator(params):
+                pass
+        assert mock_pipeline.call_count == 2
+
+    # The limits of both backends were rolled back.
+    with RateLimitAggregator(params[:2]) as stats:
+        assert stats.get_stats("organization") == RateLimitStats(
+            rate=pytest.approx(1 / 60), concurrent=1  # type: ignore
+        )
+        assert stats.get_stats("project") == RateLimitStats(rate=0.0, concurrent=1)
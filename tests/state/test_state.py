@@ -1,5 +1,3 @@
-import random
-import time
 from collections import ChainMap
 from functools import partial
 
@@ -97,36 +95,6 @@ class TestState:
         state.set_config("some_key", "some_value", force=True)
         assert state.get_config("some_key") == "some_value"
 
-    @pytest.mark.redis_db
-    def test_memoize(self) -> None:
-        @state.memoize(0.1)  # type: ignore
-        def rand(config_key: str = "test") -> float:
-            return random.random()
-
-        assert rand() == rand()
-        rand1 = rand()
-        assert rand1 == rand()
-        time.sleep(0.1)
-        assert rand1 != rand()
-
-    @pytest.mark.redis_db
-    def test_memoize_with_args(self) -> None:
-        @state.memoize(0.1)  # type: ignore
-        def rand(config_key: str = "test1") -> str:
-            return f"{random.random()}:{config_key}"
-
-        assert rand() == rand()
-        rand1 = rand()
-        assert rand1 == rand()
-        assert rand1 != rand("test2")
-        time.sleep(0.1)
-        assert rand1 != rand()
-
-        assert rand("test2") == rand("test2")
-        rand2 = rand("test2")
-        time.sleep(0.1)
-        assert rand2 != rand("test2")
-
 
 def test_safe_dumps() -> None:
     assert safe_dumps(ChainMap({"a": 1}, {"b": 2}), sort_keys=True,) == safe_dumps(
@@ -10,6 +10,7 @@ from snuba.query import SelectedExpression
 from snuba.query.composite import CompositeQuery
 from snuba.query.conditions import binary_condition
 from snuba.query.data_source.simple import Entity as QueryEntity
+from snuba.query.data_source.simple import LogicalDataSource
 from snuba.query.exceptions import InvalidQueryException
 from snuba.query.expressions import Column, FunctionCall, Literal
 from snuba.query.logical import Query
@@ -185,7 +186,7 @@ def test_entity_subscription_processors(
 @pytest.mark.parametrize("entity_key, query, metadata, exception, offset", TESTS)
 def test_entity_subscription_validators(
     entity_key: EntityKey,
-    query: Union[CompositeQuery[QueryEntity], Query],
+    query: Union[CompositeQuery[LogicalDataSource], Query],
     metadata: Mapping[str, Any],
     exception: Optional[Type[Exception]],
     offset: Optional[int],
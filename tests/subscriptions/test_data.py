@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional, Type, Union
 
 import pytest
@@ -6,8 +6,13 @@ import pytest
 from snuba.datasets.dataset import Dataset
 from snuba.datasets.entities.entity_key import EntityKey
 from snuba.datasets.entities.factory import get_entity
+from snuba.datasets.factory import get_dataset
 from snuba.query.exceptions import InvalidQueryException
-from snuba.subscriptions.data import SubscriptionData
+from snuba.subscriptions.data import (
+    PROJECT_ID_COLUMN,
+    SubscriptionData,
+    SubscriptionQueryTemplate,
+)
 from snuba.utils.metrics.timer import Timer
 from snuba.web.query import run_query
 from tests.subscriptions import BaseSubscriptionTest
@@ -124,3 +129,102 @@ class TestBuildRequest(BaseSubscriptionTest, TestBuildRequestBase):
         self, subscription: SubscriptionData, exception: Optional[Type[Exception]]
     ) -> None:
         self.compare_conditions(subscription, exception, "count", 10)
+
+    @pytest.mark.parametrize(
+        "subscription", [test.values[0] for test in TESTS if test.values[1] is None]
+    )
+    @pytest.mark.clickhouse_db
+    @pytest.mark.redis_db
+    def test_template_unchanged_by_execution(
+        self, subscription: SubscriptionData
+    ) -> None:
+        # The queries built from the template go through the whole query
+        # pipeline, which must leave the template as it was for the next
+        # executions.
+        template = SubscriptionQueryTemplate(subscription)
+        timestamp = datetime.utcnow()
+        for _ in range(2):
+            timer = Timer("test")
+            request = subscription.build_request(
+                self.dataset, timestamp, 100, timer, template=template
+            )
+            result = run_query(self.dataset, request, timer)
+            assert result.result["data"][0]["count"] == 10
+
+        expected = subscription.build_request(
+            self.dataset, timestamp, 100, Timer("test")
+        )
+        request = subscription.build_request(
+            self.dataset, timestamp, 100, Timer("test"), template=template
+        )
+        assert request.query == expected.query
+
+
+@pytest.mark.parametrize("subscription, exception", TESTS)
+@pytest.mark.redis_db
+def test_build_request_from_template(
+    subscription: SubscriptionData, exception: Optional[Type[Exception]]
+) -> None:
+    dataset = get_dataset("events")
+    template = SubscriptionQueryTemplate(subscription)
+    # The template is reused for executions with different time ranges and
+    # offsets, it must produce the same query as parsing the subscription.
+    for minutes in range(3):
+        timestamp = datetime(2024, 1, 1) + timedelta(minutes=minutes)
+        if exception is not None:
+            with pytest.raises(exception):
+                subscription.build_request(
+                    dataset, timestamp, minutes, Timer("test"), template=template
+                )
+            continue
+
+        expected = subscription.build_request(
+            dataset, timestamp, minutes, Timer("test")
+        )
+        request = subscription.build_request(
+            dataset, timestamp, minutes, Timer("test"), template=template
+        )
+        assert request.query == expected.query
+
+
+@pytest.mark.parametrize(
+    "query, can_group",
+    [
+        pytest.param("MATCH (events) SELECT count() AS count", True, id="count"),
+        pytest.param(
+            "MATCH (events) SELECT divide(uniq(user), count()) AS ratio",
+            True,
+            id="aggregations expression",
+        ),
+        pytest.param("MATCH (events) SELECT platform", False, id="not aggregated"),
+    ],
+)
+@pytest.mark.redis_db
+def test_build_request_grouped_by_project(query: str, can_group: bool) -> None:
+    subscription = SubscriptionData(
+        project_id=1,
+        query=query,
+        time_window_sec=60,
+        resolution_sec=60,
+        entity=get_entity(EntityKey.EVENTS),
+        metadata={},
+    )
+    template = SubscriptionQueryTemplate(subscription)
+    assert template.can_group_by_project() == can_group
+    if not can_group:
+        return
+
+    request = subscription.build_request(
+        get_dataset("events"),
+        datetime(2024, 1, 1),
+        None,
+        Timer("test"),
+        template=template,
+        project_ids=[1, 2],
+    )
+    query_ast = request.query
+    assert query_ast.get_limit() == 2
+    assert query_ast.get_selected_columns()[-1].name == PROJECT_ID_COLUMN
+    assert len(query_ast.get_groupby()) == 1
+    condition = "".join(repr(query_ast.get_condition()).split())
+    assert "in(project_id,tuple(1,2))" in condition
@@ -2,7 +2,7 @@ import json
 import time
 import uuid
 from datetime import datetime, timedelta
-from typing import Iterator, Mapping, Optional
+from typing import Iterator, Mapping, Optional, Sequence
 from unittest import mock
 
 import pytest
@@ -41,7 +41,7 @@ from snuba.utils.streams.configuration_builder import (
     get_default_kafka_configuration,
 )
 from snuba.utils.streams.topics import Topic as SnubaTopic
-from tests.backends.metrics import Increment, TestingMetricsBackend
+from tests.backends.metrics import Increment, TestingMetricsBackend, Timing
 
 
 @pytest.mark.ci_only
@@ -252,6 +252,118 @@ def test_execute_query_strategy() -> None:
     strategy.join()
 
 
+@pytest.mark.redis_db
+@pytest.mark.parametrize("fallback_fails", [False, True])
+def test_execute_query_strategy_grouped(fallback_fails: bool) -> None:
+    state.set_config("executor_batch_window_ms", 60000)
+    next_step = mock.Mock()
+    metrics = TestingMetricsBackend()
+
+    strategy = ExecuteQuery(
+        dataset=get_dataset("events"),
+        entity_names=["events"],
+        max_concurrent_queries=2,
+        stale_threshold_seconds=None,
+        metrics=metrics,
+        next_step=next_step,
+    )
+
+    codec = SubscriptionScheduledTaskEncoder()
+    entity = get_entity(EntityKey.EVENTS)
+    timestamp = datetime(1970, 1, 1)
+    messages = [
+        Message(
+            BrokerValue(
+                codec.encode(
+                    ScheduledSubscriptionTask(
+                        timestamp,
+                        SubscriptionWithMetadata(
+                            EntityKey.EVENTS,
+                            Subscription(
+                                SubscriptionIdentifier(PartitionId(1), uuid.uuid1()),
+                                SubscriptionData(
+                                    project_id=project_id,
+                                    time_window_sec=60,
+                                    resolution_sec=60,
+                                    query="MATCH (events) SELECT count()",
+                                    entity=entity,
+                                    metadata={},
+                                ),
+                            ),
+                            1,
+                        ),
+                    )
+                ),
+                Partition(Topic("test"), 0),
+                offset,
+                timestamp,
+            )
+        )
+        for offset, project_id in enumerate([1, 2, 3])
+    ]
+
+    def query_result(data: Sequence[Mapping[str, int]]) -> mock.Mock:
+        return mock.Mock(
+            result={"data": data, "meta": [{"name": "count()", "type": "UInt64"}]}
+        )
+
+    with mock.patch(
+        "snuba.subscriptions.executor_consumer.run_query",
+        side_effect=[
+            # Project 3 has no data, it is queried on its own.
+            query_result(
+                [
+                    {"count()": 5, "_subscription_project_id": 1},
+                    {"count()": 7, "_subscription_project_id": 2},
+                ]
+            ),
+            (
+                Exception("fallback failed")
+                if fallback_fails
+                else query_result([{"count()": 0}])
+            ),
+        ],
+    ) as run_query:
+        for message in messages:
+            strategy.submit(message)
+        strategy.poll()
+        assert next_step.submit.call_count == 0
+
+        strategy.close()
+        if fallback_fails:
+            # Only the project that needed the fallback query fails.
+            with pytest.raises(Exception, match="fallback failed"):
+                strategy.join()
+        else:
+            strategy.join()
+
+    assert run_query.call_count == 2
+    latencies = [
+        call
+        for call in metrics.calls
+        if isinstance(call, Timing) and call.name == "executor.latency"
+    ]
+    assert len(latencies) == 3
+    grouped_query = run_query.call_args_list[0][0][1].query
+    assert grouped_query.get_limit() == 3
+    assert len(grouped_query.get_groupby()) == 1
+
+    results = [
+        json.loads(call[0][0].payload.value)["payload"]["result"]
+        for call in next_step.submit.call_args_list
+    ]
+    expected = [[{"count()": 5}], [{"count()": 7}], [{"count()": 0}]]
+    if fallback_fails:
+        expected = expected[:2]
+    assert [call[0][0].committable for call in next_step.submit.call_args_list] == [
+        message.committable for message in messages[: len(expected)]
+    ]
+    assert [result["data"] for result in results] == expected
+    assert all(
+        result["meta"] == [{"name": "count()", "type": "UInt64"}] for result in results
+    )
+
+
 @pytest.mark.redis_db
 @pytest.mark.clickhouse_db
 def test_too_many_concurrent_queries() -> None:
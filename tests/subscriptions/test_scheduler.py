@@ -1,6 +1,7 @@
 import uuid
+from dataclasses import replace
 from datetime import datetime, timedelta
-from typing import Callable, Collection, Optional, Tuple
+from typing import Callable, Collection, Optional, Set, Tuple
 
 import pytest
 
@@ -16,7 +17,11 @@ from snuba.subscriptions.data import (
     SubscriptionIdentifier,
     SubscriptionWithMetadata,
 )
-from snuba.subscriptions.scheduler import SubscriptionScheduler
+from snuba.subscriptions.scheduler import (
+    JitteredTaskBuilder,
+    SubscriptionIndex,
+    SubscriptionScheduler,
+)
 from snuba.subscriptions.store import RedisSubscriptionDataStore
 from snuba.subscriptions.types import Interval
 from snuba.subscriptions.utils import Tick
@@ -260,3 +265,85 @@ class TestSubscriptionScheduler:
             ],
             entity_key=EntityKey.GENERIC_METRICS_GAUGES,
         )
+
+    @pytest.mark.redis_db
+    def test_refresh_updates_index(self) -> None:
+        state.set_config("subscription_primary_task_builder", "immediate")
+        subscription = self.build_subscription(timedelta(minutes=1))
+        other_subscription = self.build_subscription(timedelta(minutes=1))
+        store = RedisSubscriptionDataStore(
+            redis_client, EntityKey.EVENTS, self.partition_id
+        )
+        for s in (subscription, other_subscription):
+            store.create(s.identifier.uuid, s.data)
+
+        scheduler = SubscriptionScheduler(
+            EntityKey.EVENTS,
+            store,
+            self.partition_id,
+            timedelta(0),
+            DummyMetricsBackend(strict=True),
+        )
+
+        def find(start: timedelta, end: timedelta) -> Set[Tuple[datetime, uuid.UUID]]:
+            return {
+                self.sort_key(task)
+                for task in scheduler.find(self.build_tick(start, end))
+            }
+
+        assert find(timedelta(minutes=-2), timedelta(0)) == {
+            (self.now + timedelta(minutes=i), s.identifier.uuid)
+            for i in (-2, -1)
+            for s in (subscription, other_subscription)
+        }
+
+        # The index follows the changes of the store.
+        store.delete(other_subscription.identifier.uuid)
+        updated = Subscription(
+            subscription.identifier,
+            replace(subscription.data, resolution_sec=120),
+        )
+        store.create(updated.identifier.uuid, updated.data)
+        assert find(timedelta(minutes=-2), timedelta(0)) == {
+            (self.now + timedelta(minutes=-2), subscription.identifier.uuid)
+        }
+
+
+def test_subscription_index() -> None:
+    def build(resolution: int) -> Subscription:
+        return Subscription(
+            SubscriptionIdentifier(PartitionId(1), uuid.uuid4()),
+            SubscriptionData(
+                project_id=1,
+                query="MATCH (events) SELECT count() AS count",
+                time_window_sec=60,
+                resolution_sec=resolution,
+                entity=get_entity(EntityKey.EVENTS),
+                metadata={},
+            ),
+        )
+
+    builder = JitteredTaskBuilder()
+    index = SubscriptionIndex(builder.get_slot)
+    subscriptions = [build(resolution) for resolution in (10, 60, 60, 3600)]
+    for subscription in subscriptions:
+        index.add(subscription)
+    assert len(index) == 4
+
+    # The index returns the same subscriptions as asking the builder about
+    # every subscription.
+    for timestamp in range(7200):
+        due = {s.identifier.uuid for s in index.get_due(timestamp)}
+        assert due == {
+            s.identifier.uuid
+            for s in subscriptions
+            if builder.get_task(
+                SubscriptionWithMetadata(EntityKey.EVENTS, s, 0), timestamp
+            )
+            is not None
+        }
+
+    for subscription in subscriptions:
+        index.remove(subscription.identifier.uuid)
+    assert len(index) == 0
+    assert list(index.get_due(0)) == []
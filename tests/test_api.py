@@ -12,7 +12,7 @@ import simplejson as json
 from dateutil.parser import parse as parse_datetime
 from sentry_sdk import Client, Hub
 
-from snuba import settings, state
+from snuba import querylog, settings, state
 from snuba.clusters.cluster import ClickhouseClientSettings
 from snuba.consumers.types import KafkaMessageMetadata
 from snuba.datasets.entities.entity_key import EntityKey
@@ -2135,6 +2135,7 @@ class TestApi(SimpleAPITest):
             ).data
         )
 
+        querylog.flush_worker()
         assert len(result["data"]) == 5
         assert record_query_mock.call_count == 1
         metadata = record_query_mock.call_args[0][0]
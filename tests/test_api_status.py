@@ -6,6 +6,7 @@ import pytest
 import simplejson as json
 from clickhouse_driver.errors import ErrorCodes
 
+from snuba import querylog
 from snuba.clickhouse.errors import ClickhouseError
 from snuba.state.cache.abstract import ExecutionTimeoutError
 from snuba.state.rate_limit import (
@@ -117,6 +118,7 @@ class TestApiCodes(BaseApiTest):
         for exception, status, slo in tests:
             execute_mock.side_effect = exception
             self.post()
+            querylog.flush_worker()
 
             metadata = record_query.call_args[0][0]
             assert metadata["request_status"] == status, exception
@@ -9,7 +9,7 @@ from unittest.mock import MagicMock, patch
 import pytest
 import simplejson as json
 
-from snuba import state
+from snuba import querylog, state
 from snuba.datasets.entities.entity_key import EntityKey
 from snuba.datasets.entities.factory import get_entity
 from snuba.datasets.storages.factory import get_storage, get_writable_storage
@@ -169,6 +169,7 @@ class TestSnQLApi(BaseApiTest):
                 }
             ),
         )
+        querylog.flush_worker()
         assert response.status_code == 500
         mock_record_query.assert_called_once()
         metadata = mock_record_query.call_args.args[0]
@@ -346,6 +347,7 @@ class TestSnQLApi(BaseApiTest):
             ).data
         )
 
+        querylog.flush_worker()
         assert len(result["data"]) == 1
         assert record_query_mock.call_count == 1
         metadata = record_query_mock.call_args[0][0]
@@ -379,6 +381,7 @@ class TestSnQLApi(BaseApiTest):
             ),
         )
 
+        querylog.flush_worker()
         assert response.status_code == 500
         metadata = record_query_mock.call_args[0][0]
         assert metadata["query_list"][0]["stats"]["error_code"] == 1123
@@ -403,6 +406,7 @@ class TestSnQLApi(BaseApiTest):
                 ).data
             )
 
+            querylog.flush_worker()
             assert len(result["data"]) == 1
             assert record_cogs_mock.call_count == 1
             metadata = record_cogs_mock.call_args[0][1]
@@ -886,6 +890,7 @@ class TestSnQLApi(BaseApiTest):
                 }
             ),
         )
+        querylog.flush_worker()
         assert response.status_code == 200
         metric_calls = get_recorded_metric_calls("timing", "api.query")
         assert metric_calls is not None
@@ -0,0 +1,79 @@
+from snuba.utils.metrics.backends.aggregating import AggregatingMetricsBackend
+from tests.backends.metrics import (
+    Distribution,
+    Events,
+    Gauge,
+    Increment,
+    TestingMetricsBackend,
+    Timing,
+)
+
+
+def test_aggregation() -> None:
+    backend = TestingMetricsBackend()
+    metrics = AggregatingMetricsBackend(backend, 3600)
+
+    for i in range(3):
+        metrics.increment("calls", tags={"a": "1", "b": "2"})
+        metrics.increment("calls", 2, tags={"b": "2", "a": "1"})
+        metrics.increment("calls")
+        metrics.gauge("size", i, tags={"a": "1"})
+    metrics.events("title", "text", "info", "normal")
+    assert backend.calls == [Events("title", "text", "info", "normal", None)]
+
+    metrics.flush()
+    assert backend.calls[1:] == [
+        Increment("calls", 9, {"a": "1", "b": "2"}),
+        Increment("calls", 3, None),
+        Gauge("size", 2, {"a": "1"}),
+    ]
+
+    # Nothing was aggregated since the last flush.
+    backend.calls.clear()
+    metrics.flush()
+    assert backend.calls == []
+
+
+def test_timings_and_distributions_not_aggregated() -> None:
+    backend = TestingMetricsBackend()
+    metrics = AggregatingMetricsBackend(backend, 3600)
+
+    # Their percentiles are computed from every value, by the agent.
+    for i in range(3):
+        metrics.timing("latency", i, tags={"a": "1"})
+        metrics.distribution("size", i, unit="byte")
+    assert backend.calls == [
+        call
+        for i in range(3)
+        for call in (
+            Timing("latency", i, {"a": "1"}),
+            Distribution("size", i, None, "byte"),
+        )
+    ]
+
+    backend.calls.clear()
+    metrics.flush()
+    assert backend.calls == []
+
+
+def test_overflow() -> None:
+    backend = TestingMetricsBackend()
+    metrics = AggregatingMetricsBackend(backend, 3600, max_keys=2)
+
+    metrics.increment("a")
+    metrics.gauge("b", 1)
+    # Metrics already aggregated are still aggregated, others go through.
+    metrics.increment("a")
+    metrics.increment("c")
+    metrics.gauge("d", 5)
+    assert backend.calls == [Increment("c", 1, None), Gauge("d", 5, None)]
+
+    backend.calls.clear()
+    metrics.flush()
+    assert backend.calls[0] == Increment("a", 2, None)
+    assert backend.calls[-1] == Increment("metrics_aggregator.overflow", 2, None)
+
+    # The limit applies between two flushes.
+    backend.calls.clear()
+    metrics.increment("c")
+    assert backend.calls == []
@@ -0,0 +1,26 @@
+import pytest
+
+from snuba.redis import RedisClientKey, get_redis_client
+from snuba.web.rpc.v1alpha.timeseries.bucket_cache import KEY_PREFIX, BucketCache
+
+
+@pytest.mark.redis_db
+def test_bucket_cache() -> None:
+    cache = BucketCache()
+    assert cache.get_many("series", [0, 60], 60) == [None, None]
+
+    cache.set_many("series", [(0, [1, 2.5], 100)], 60)
+    assert cache.get_many("series", [0, 60], 60) == [[1, 2.5], None]
+    # Buckets are cached per series and per granularity.
+    assert cache.get_many("series", [0], 3600) == [None]
+    assert cache.get_many("other", [0], 60) == [None]
+
+
+@pytest.mark.redis_db
+def test_corrupt_bucket_is_a_miss() -> None:
+    cache = BucketCache()
+    cache.set_many("series", [(0, [1], 100)], 60)
+    get_redis_client(RedisClientKey.CACHE).set(
+        f"{KEY_PREFIX}{{series}}:60:60", b"not json"
+    )
+    assert cache.get_many("series", [0, 60], 60) == [None, None]
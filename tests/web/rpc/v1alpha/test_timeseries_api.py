@@ -13,6 +13,7 @@ from sentry_protos.snuba.v1alpha.endpoint_aggregate_bucket_pb2 import (
 from sentry_protos.snuba.v1alpha.request_common_pb2 import RequestMeta
 from sentry_protos.snuba.v1alpha.trace_item_attribute_pb2 import AttributeKey
 
+from snuba import state
 from snuba.datasets.storages.factory import get_storage
 from snuba.datasets.storages.storage_key import StorageKey
 from snuba.web.rpc.common.eap_execute import run_eap_query
@@ -420,3 +421,45 @@ class TestTimeSeriesApi(BaseApiTest):
             ) == [90 * 24 * 60 * 60] * (3 * 7)
 
             assert response.result == expected_result
+
+    def test_bucket_cache(self, setup_teardown: Any) -> None:
+        base_timestamp = int(BASE_TIME.replace(hour=0).timestamp())
+        message = AggregateBucketRequestProto(
+            meta=RequestMeta(
+                project_ids=[1, 2, 3],
+                organization_id=1,
+                cogs_category="something",
+                referrer="something",
+                start_timestamp=Timestamp(seconds=base_timestamp - 60 * 60 * 24),
+                end_timestamp=Timestamp(seconds=base_timestamp + 60 * 60 * 9),
+            ),
+            key=AttributeKey(name="eap.measurement", type=AttributeKey.TYPE_FLOAT),
+            aggregate=AggregateBucketRequestProto.FUNCTION_SUM,
+            granularity_secs=60 * 60 * 24,
+        )
+        state.set_config("timeseries_bucket_cache_enabled", 1)
+        with patch(
+            "snuba.web.rpc.v1alpha.timeseries.timeseries.run_eap_query",
+            side_effect=run_eap_query,
+        ) as mocked_run_query:
+            response = AggregateBucketRequest().execute(message)
+            # 3 8-hour buckets/day + 0:00-8:00 + 8:00-9:00
+            assert mocked_run_query.call_count == 3 + 2
+
+            # The same projects in another order get the same buckets, only
+            # the last one, which is not over, runs again.
+            mocked_run_query.reset_mock()
+            message.meta.project_ids[:] = [3, 2, 1, 1]
+            assert AggregateBucketRequest().execute(message) == response
+            assert mocked_run_query.call_count == 1
+
+            # Another aggregate does not share the buckets.
+            mocked_run_query.reset_mock()
+            message.aggregate = AggregateBucketRequestProto.FUNCTION_COUNT
+            AggregateBucketRequest().execute(message)
+            assert mocked_run_query.call_count == 3 + 2
+
+            mocked_run_query.reset_mock()
+            state.set_config("timeseries_bucket_cache_enabled", 0)
+            assert AggregateBucketRequest().execute(message).result
+            assert mocked_run_query.call_count == 3 + 2
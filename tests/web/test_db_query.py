@@ -1,13 +1,15 @@
 from __future__ import annotations
 
-from typing import Any, Mapping, MutableMapping, Optional
+from typing import Any, Iterator, Mapping, MutableMapping, Optional
 from unittest import mock
 
 import pytest
+from clickhouse_driver.errors import ErrorCodes
 
 from snuba import state
 from snuba.attribution.appid import AppID
 from snuba.attribution.attribution_info import AttributionInfo
+from snuba.clickhouse.errors import ClickhouseError
 from snuba.clickhouse.formatter.query import format_query
 from snuba.clickhouse.query import Query as ClickhouseQuery
 from snuba.datasets.storage import Storage
@@ -29,14 +31,16 @@ from snuba.query.data_source.simple import Table
 from snuba.query.parser.expressions import parse_clickhouse_function
 from snuba.query.query_settings import HTTPQuerySettings
 from snuba.querylog.query_metadata import ClickhouseQueryMetadata
+from snuba.reader import ResultStream, Row
 from snuba.state.quota import ResourceQuota
 from snuba.utils.metrics.backends.testing import get_recorded_metric_calls
 from snuba.utils.metrics.timer import Timer
-from snuba.web import QueryException
+from snuba.web import QueryException, StreamClosedException
 from snuba.web.db_query import (
     _apply_allocation_policies_quota,
     _get_query_settings_from_config,
     db_query,
+    db_query_stream,
 )
 
 test_data = [
@@ -1079,3 +1083,132 @@ def test_cache_metrics_with_simple_readthrough() -> None:
                 mock.call.increment("cache_hit_simple", tags={"dataset": "events"}),
             ]
         )
+
+
+@pytest.mark.redis_db
+@pytest.mark.parametrize("fail", [False, True])
+def test_db_query_stream(fail: bool) -> None:
+    query, _, attribution_info = _build_test_query("count(distinct(project_id))")
+    results: list[QueryResultOrError] = []
+
+    def rows() -> Iterator[Row]:
+        yield {"some_alias": 1}
+        if fail:
+            raise ClickhouseError("broken", code=ErrorCodes.MEMORY_LIMIT_EXCEEDED)
+        yield {"some_alias": 2}
+
+    reader = mock.Mock()
+    reader.execute_stream.return_value = ResultStream(
+        [{"name": "some_alias", "type": "UInt64"}],
+        rows(),
+        lambda: {"progress_bytes": 10},
+    )
+    query_metadata_list: list[ClickhouseQueryMetadata] = []
+    stats: dict[str, Any] = {}
+
+    with mock.patch(
+        "snuba.web.db_query._get_allocation_policies",
+        return_value=[PassthroughPolicy(StorageKey("errors_ro"), [], {})],
+    ), mock.patch.object(
+        PassthroughPolicy,
+        "_update_quota_balance",
+        lambda self, tenant_ids, query_id, result_or_error: results.append(
+            result_or_error
+        ),
+    ):
+        result = db_query_stream(
+            clickhouse_query=query,
+            query_settings=HTTPQuerySettings(),
+            attribution_info=attribution_info,
+            dataset_name="events",
+            query_metadata_list=query_metadata_list,
+            formatted_query=format_query(query),
+            reader=reader,
+            timer=Timer("foo"),
+            stats=stats,
+            trace_id="trace_id",
+        )
+
+        # Nothing is recorded until the rows are consumed.
+        assert result.rows is not None
+        assert result.result["meta"] == [{"name": "some_alias", "type": "UInt64"}]
+        assert query_metadata_list == []
+        assert results == []
+        assert "quota_allowance" in stats
+
+        if fail:
+            with pytest.raises(QueryException):
+                list(result.rows)
+            assert result.rows.error is not None
+            assert results[0].error is result.rows.error
+            assert (
+                query_metadata_list[0].request_status.status.value == "memory-exceeded"
+            )
+        else:
+            assert list(result.rows) == [{"some_alias": 1}, {"some_alias": 2}]
+            assert result.rows.error is None
+            assert results[0].query_result is result
+            assert query_metadata_list[0].status.value == "success"
+            assert stats["result_rows"] == 2
+            assert result.result["profile"] == {"progress_bytes": 10}
+            assert query_metadata_list[0].result_profile == {"progress_bytes": 10}
+        assert len(results) == 1
+
+
+@pytest.mark.redis_db
+def test_db_query_stream_response_dropped() -> None:
+    """
+    The client goes away before the first chunk of the response: the rows
+    are never iterated, but closing the response releases the connection
+    and finishes the allocation policies.
+    """
+    from snuba.web.views import _stream_query_result, application
+
+    query, _, attribution_info = _build_test_query("count(distinct(project_id))")
+    results: list[QueryResultOrError] = []
+    released = mock.Mock()
+
+    reader = mock.Mock()
+    reader.execute_stream.return_value = ResultStream(
+        [{"name": "some_alias", "type": "UInt64"}],
+        iter([{"some_alias": 1}]),
+        lambda: None,
+        released,
+    )
+    query_metadata_list: list[ClickhouseQueryMetadata] = []
+
+    with mock.patch(
+        "snuba.web.db_query._get_allocation_policies",
+        return_value=[PassthroughPolicy(StorageKey("errors_ro"), [], {})],
+    ), mock.patch.object(
+        PassthroughPolicy,
+        "_update_quota_balance",
+        lambda self, tenant_ids, query_id, result_or_error: results.append(
+            result_or_error
+        ),
+    ):
+        timer = Timer("foo")
+        result = db_query_stream(
+            clickhouse_query=query,
+            query_settings=HTTPQuerySettings(),
+            attribution_info=attribution_info,
+            dataset_name="events",
+            query_metadata_list=query_metadata_list,
+            formatted_query=format_query(query),
+            reader=reader,
+            timer=timer,
+            stats={},
+            trace_id="trace_id",
+        )
+        assert result.rows is not None
+
+        with application.test_request_context():
+            response = _stream_query_result(mock.Mock(), result, result.rows, timer)
+        response.close()
+
+    released.assert_called_once()
+    assert len(results) == 1
+    assert result.rows.error is not None
+    assert results[0].error is result.rows.error
+    assert isinstance(result.rows.error.__cause__, StreamClosedException)
+    assert len(query_metadata_list) == 1
@@ -0,0 +1,80 @@
+import threading
+import time
+from typing import Callable, List
+
+import pytest
+
+from snuba.web.parallel import ParallelQueriesTimeout, run_in_parallel
+
+
+@pytest.mark.redis_db
+def test_results_are_in_order() -> None:
+    def task(i: int) -> Callable[[], int]:
+        def run() -> int:
+            # The first tasks complete last.
+            time.sleep(0.01 * (5 - i))
+            return i
+
+        return run
+
+    assert run_in_parallel([task(i) for i in range(5)], timeout=5) == [
+        0,
+        1,
+        2,
+        3,
+        4,
+    ]
+    assert run_in_parallel([], timeout=5) == []
+
+
+def test_max_concurrency() -> None:
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    def task() -> None:
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+
+    run_in_parallel([task] * 10, timeout=5, max_concurrency=3)
+    assert max_running == 3
+
+    max_running = 0
+    run_in_parallel([task] * 3, timeout=5, max_concurrency=1)
+    assert max_running == 1
+
+
+def test_error_cancels_pending_tasks() -> None:
+    started: List[int] = []
+
+    def task(i: int) -> Callable[[], None]:
+        def run() -> None:
+            started.append(i)
+            if i == 0:
+                raise ValueError("failed")
+            time.sleep(0.05)
+
+        return run
+
+    with pytest.raises(ValueError):
+        run_in_parallel([task(i) for i in range(10)], timeout=5, max_concurrency=2)
+    time.sleep(0.1)
+    assert len(started) < 10
+
+
+def test_deadline_is_per_request() -> None:
+    # Each task completes within the timeout, all of them do not.
+    def task() -> None:
+        time.sleep(0.1)
+
+    start = time.monotonic()
+    with pytest.raises(ParallelQueriesTimeout):
+        run_in_parallel([task] * 4, timeout=0.25, max_concurrency=1)
+    assert time.monotonic() - start < 0.3
+
+    assert run_in_parallel([task] * 4, timeout=0.25, max_concurrency=4) == [None] * 4
@@ -1,7 +1,12 @@
+import zlib
+from typing import Optional
+
 import pytest
 
 from snuba.reader import Result
+from snuba.state import set_config
 from snuba.utils.serializable_exception import SerializableException
+from snuba.web import result_cache_codec
 from snuba.web.db_query import ResultCacheCodec
 
 
@@ -23,3 +28,88 @@ def test_encode_decode_exception() -> None:
     encoded_exception = codec.encode_exception(SomeException("some message"))
     with pytest.raises(SomeException):
         codec.decode(encoded_exception)
+
+
+COLUMNAR_PAYLOAD: Result = {
+    "meta": [
+        {"name": "count", "type": "UInt64"},
+        {"name": "project_id", "type": "Int32"},
+        {"name": "avg", "type": "Float64"},
+        {"name": "title", "type": "String"},
+        {"name": "maybe", "type": "Nullable(Int32)"},
+        {"name": "mixed", "type": "Float64"},
+    ],
+    "data": [
+        {
+            "count": 2**64 - 1,
+            "project_id": i,
+            "avg": i / 3,
+            "title": f"title {i}",
+            "maybe": None if i % 2 else i,
+            "mixed": 1 if i % 2 else 1.5,
+        }
+        for i in range(100)
+    ],
+    "totals": {"count": 1},
+    "profile": {"elapsed": 0.1},
+}
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        pytest.param(COLUMNAR_PAYLOAD, id="typed columns"),
+        pytest.param({"meta": [], "data": []}, id="empty"),
+        pytest.param(
+            {"meta": [{"name": "a", "type": "Int64"}], "data": [{"a": 1}, {"a": 2}]},
+            id="single column",
+        ),
+    ],
+)
+@pytest.mark.parametrize("compression_threshold", [None, 0])
+def test_columnar_encode_decode(
+    payload: Result, compression_threshold: Optional[int]
+) -> None:
+    encoded = result_cache_codec.encode(payload, compression_threshold)
+    assert encoded is not None
+    assert result_cache_codec.is_columnar(encoded)
+    assert result_cache_codec.decode(encoded) == payload
+
+
+def test_columnar_zlib_compressed() -> None:
+    # Values compressed with zlib before the codec moved to zstd.
+    encoded = result_cache_codec.encode(COLUMNAR_PAYLOAD)
+    assert encoded is not None
+    prefix = result_cache_codec.MAGIC + bytes(
+        [result_cache_codec.VERSION, result_cache_codec.COMPRESSION_ZLIB]
+    )
+    legacy = prefix + zlib.compress(encoded[len(prefix) :], 1)
+    assert result_cache_codec.decode(legacy) == COLUMNAR_PAYLOAD
+
+
+def test_columnar_is_smaller() -> None:
+    encoded = result_cache_codec.encode(COLUMNAR_PAYLOAD)
+    assert encoded is not None
+    assert len(encoded) < len(ResultCacheCodec().encode(COLUMNAR_PAYLOAD))
+
+
+def test_columnar_ragged_rows() -> None:
+    payload: Result = {"meta": [], "data": [{"a": 1}, {"b": 1}]}
+    assert result_cache_codec.encode(payload) is None
+    payload = {"meta": [], "data": [{"a": 1}, {"a": 1, "b": 1}]}
+    assert result_cache_codec.encode(payload) is None
+
+
+@pytest.mark.redis_db
+def test_codec_rollout() -> None:
+    codec = ResultCacheCodec()
+    legacy = codec.encode(COLUMNAR_PAYLOAD)
+    assert not result_cache_codec.is_columnar(legacy)
+
+    set_config("result_cache.columnar_codec", 1)
+    columnar = codec.encode(COLUMNAR_PAYLOAD)
+    assert result_cache_codec.is_columnar(columnar)
+
+    # Both encodings are readable regardless of the config.
+    assert codec.decode(legacy) == COLUMNAR_PAYLOAD
+    assert codec.decode(columnar) == COLUMNAR_PAYLOAD